@@ -8,16 +8,120 @@ import hashlib
 import json
 import time
 
+from snapshot_store import BoundedCache
+
+# Natural SKU key and the only columns a snapshot comparison needs from each side
+SKU_KEY_COLUMNS = ['Item Description', 'Variant Color', 'Variant Code']
+MERGE_COLUMNS = ['sku_id'] + SKU_KEY_COLUMNS + ['Grand Total']
+# Bump when the smart-analysis model changes so persisted results are not reused
+SMART_ANALYSIS_ALGO_VERSION = 1
+
+def assign_sku_ids(*frames: pd.DataFrame) -> List[pd.DataFrame]:
+    """Attach int32 sku ids consistent across the given frames.
+
+    Used when frames don't come from the SKU stock history store (which already carries its
+    shared sku_key ids): each key column is factorized once and the codes are combined
+    arithmetically, so no per-row string keys are built.
+    """
+    sizes = [len(f) for f in frames]
+    keys = pd.concat([f[SKU_KEY_COLUMNS] for f in frames], ignore_index=True)
+    combined = np.zeros(len(keys), dtype=np.int64)
+    for col in SKU_KEY_COLUMNS:
+        codes, uniques = pd.factorize(keys[col].fillna('').astype(str).str.strip())
+        combined = combined * (len(uniques) + 1) + codes
+    sku_ids = pd.factorize(combined)[0].astype(np.int32)
+    result, start = [], 0
+    for frame, size in zip(frames, sizes):
+        result.append(frame.assign(sku_id=sku_ids[start:start + size]))
+        start += size
+    return result
+
+def merge_snapshot_frames(old_df: pd.DataFrame, new_df: pd.DataFrame) -> pd.DataFrame:
+    """Outer-join two key-item frames on their int sku ids, carrying only MERGE_COLUMNS"""
+    if 'sku_id' not in old_df.columns or 'sku_id' not in new_df.columns:
+        old_df, new_df = assign_sku_ids(old_df, new_df)
+    return pd.merge(old_df[MERGE_COLUMNS], new_df[MERGE_COLUMNS], on='sku_id', how='outer', suffixes=('_old', '_new'))
+
+# Fixed per-category insight text (EXCELLENT is graded by the size of the stock decrease)
+PERFORMANCE_INSIGHTS = {
+    "POOR": "📉 POOR - No sales movement, consider promotions or discontinuation",
+    "URGENT": "🚨 CRITICAL - Completely sold out, immediate restock required",
+    "NEW": "🆕 NEW - Recently introduced product",
+    "DISCONTINUED": "❌ DISCONTINUED - Product removed from inventory",
+    "TOP_SALES": "🏆 TOP SELLER - Highest sales volume",
+    "WORST": "📉 WORST - Lowest performance, review strategy",
+}
+PERFORMANCE_RECORD_COLUMNS = ['item_name', 'color', 'size', 'old_stock', 'new_stock', 'change', 'percentage_change']
+# Response key -> category label, in response order
+SMART_ANALYSIS_CATEGORIES = {
+    "excellent_performers": "EXCELLENT",
+    "poor_performers": "POOR",
+    "urgent_restock": "URGENT",
+    "new_products": "NEW",
+    "discontinued_products": "DISCONTINUED",
+    "top_sales": "TOP_SALES",
+    "worst_performers": "WORST",
+}
+SMART_ANALYSIS_MODES = ("full", "summary")
+# Categories that are already short top-N lists and are included in summary mode
+SMART_ANALYSIS_TOP_N = 10
+SUMMARY_CATEGORIES = ("top_sales", "worst_performers")
+
+def top_n_positions(values: np.ndarray, n: int, largest: bool = True) -> np.ndarray:
+    """Positions of the n largest (or smallest) values in order, using partial selection
+    instead of a full sort; ties keep their original order.
+    """
+    keyed = -values if largest else values
+    if len(keyed) > n:
+        candidates = np.argpartition(keyed, n - 1)[:n]
+    else:
+        candidates = np.arange(len(keyed))
+    return candidates[np.lexsort((candidates, keyed[candidates]))]
+
 class ComparisonService:
-    def __init__(self, key_items_service, uploads_dir=None):
+    def __init__(self, key_items_service, uploads_dir=None, file_storage_service=None, stats_indexer=None,
+                 timeseries_store=None, snapshot_diffs=None, result_cache=None):
         self.key_items_service = key_items_service
+        # Key-item rows per snapshot come from the SKU stock history rather than re-parsing workbooks
+        self.timeseries_store = timeseries_store
+        # Persisted per-SKU snapshot diffs (precomputed at ingest for consecutive uploads)
+        self.snapshot_diffs = snapshot_diffs
+        # Persistent comparison results keyed by content hashes (SharedSnapshotStore), with a local LRU in front
+        self.result_cache = result_cache
+        self._models = BoundedCache(8)
         # Allow env override, default to 'uploads'
         self.uploads_dir = uploads_dir or os.getenv("UPLOAD_DIR", "uploads")
+        # Upload catalog + indexer: file metadata is computed once at ingest and read from the catalog
+        self.file_storage_service = file_storage_service
+        self.stats_indexer = stats_indexer
         # Performance caching system
         self.analysis_cache = {}
         self.cache_timestamps = {}
         self.cache_ttl = 300  # 5 minutes cache TTL
         
+    def _readable(self, file_path: str) -> bool:
+        if self.result_cache is not None:
+            return self.result_cache.is_readable(file_path)
+        return os.path.exists(file_path)
+
+    def _load_key_item_frame(self, file_path: str) -> pd.DataFrame:
+        """KI00 rows for a file - from the stock history store when available, else the parsed workbook"""
+        if self.timeseries_store is not None:
+            try:
+                return self.timeseries_store.frame_for_file(file_path, self.key_items_service._load_inventory_file)
+            except Exception as e:
+                print(f"⚠️ Stock history read failed for {os.path.basename(file_path)}, parsing workbook: {e}")
+        return self.key_items_service._load_inventory_file(file_path)
+
+    def _load_persisted_diff_frame(self, file1_path: str, file2_path: str):
+        if self.snapshot_diffs is None:
+            return None
+        try:
+            return self.snapshot_diffs.comparison_frame(file1_path, file2_path, self.key_items_service._load_inventory_file)
+        except Exception as e:
+            print(f"⚠️ Snapshot diff unavailable, comparing workbooks directly: {e}")
+            return None
+
     def _get_cache_key(self, operation: str, *args) -> str:
         """Generate cache key for analysis operations"""
         key_data = f"{operation}:{':'.join(str(arg) for arg in args)}"
@@ -49,38 +153,7 @@ class ComparisonService:
             if df is None:
                 return {"error": "Failed to load file"}
             
-            # Check if KI00 season code exists
-            if 'Season Code' in df.columns:
-                ki00_data = df[df['Season Code'] == 'KI00']
-                
-                # Get item names - try different possible column names
-                item_column = None
-                for col in ['Item Description', 'Item Name', 'Product Name']:
-                    if col in df.columns:
-                        item_column = col
-                        break
-                
-                ki00_items = []
-                if item_column and not ki00_data.empty:
-                    ki00_items = ki00_data[item_column].unique().tolist()
-                
-                # Get low stock count - try different stock columns
-                low_stock_count = 0
-                stock_column = None
-                for col in ['Grand Total', 'Stock Level', 'Total Stock', 'Quantity']:
-                    if col in df.columns:
-                        stock_column = col
-                        break
-                
-                if stock_column and not ki00_data.empty:
-                    # Use .loc to avoid SettingWithCopyWarning and improve performance
-                    ki00_data = ki00_data.copy()  # Ensure we have a proper copy
-                    ki00_data.loc[:, stock_column] = pd.to_numeric(ki00_data[stock_column], errors='coerce').fillna(0)
-                    low_stock_count = len(ki00_data[ki00_data[stock_column] < 10])
-                
-            else:
-                ki00_items = []
-                low_stock_count = 0
+            metadata = self.key_items_service.describe_inventory_frame(df)
             
             # Get file timestamps
             file_stats = os.stat(file_path)
@@ -93,17 +166,68 @@ class ComparisonService:
                 "upload_timestamp": upload_date.timestamp(),
                 "file_size": file_stats.st_size,
                 "file_age_days": (datetime.now() - upload_date).days,
-                "ki00_items_count": len(ki00_items),
-                "low_stock_count": low_stock_count,
-                "ki00_items": ki00_items[:10],  # Limit to first 10 for performance
-                "total_rows": len(df),
-                "columns_detected": list(df.columns)[:5]  # First 5 columns for debugging
+                **metadata
             }
         except Exception as e:
             return {"error": f"Failed to process {os.path.basename(file_path)}: {str(e)}"}
+
+    def _catalog_file_metadata(self, entry) -> Dict[str, Any]:
+        """File list entry built from a catalog row; None counts while the indexer hasn't reached it yet"""
+        upload_date = datetime.fromtimestamp(self.file_storage_service.catalog_timestamp(entry))
+        metadata = json.loads(entry.file_metadata) if entry.file_metadata and entry.stats_indexed_at else None
+        if metadata is None:
+            if self.stats_indexer is not None:
+                self.stats_indexer.submit(entry.file_path)
+            metadata = {
+                "ki00_items_count": None,
+                "low_stock_count": None,
+                "ki00_items": [],
+                "total_rows": None,
+                "columns_detected": [],
+                "metadata_pending": True
+            }
+        elif "total_rows" not in metadata:
+            return {"error": f"Failed to process {entry.stored_filename}"}
+        return {
+            "filename": entry.stored_filename,
+            "file_path": entry.file_path,
+            "upload_date": upload_date.strftime('%Y-%m-%d %H:%M'),
+            "upload_timestamp": upload_date.timestamp(),
+            "file_size": entry.file_size,
+            "file_age_days": (datetime.now() - upload_date).days,
+            **metadata
+        }
     
     def get_all_uploaded_files(self) -> List[Dict[str, Any]]:
         """Get metadata for all uploaded files with ACTUAL current data"""
+        if self.file_storage_service is not None:
+            # One catalog query - metadata was persisted by the stats indexer at ingest
+            from database import get_db
+            db = next(get_db())
+            try:
+                entries = self.file_storage_service.list_catalog(db)
+            finally:
+                db.close()
+            files = [self._catalog_file_metadata(entry) for entry in entries]
+            return [f for f in files if "error" not in f]
+
+        return self._scan_uploaded_files()
+
+    def get_uploaded_files_page(self, **page_params) -> Tuple[List[Dict[str, Any]], Any]:
+        """One keyset page of file metadata from the upload catalog; returns (files, next_cursor).
+        page_params are passed to FileStorageService.page_catalog (limit, cursor, sort, order, filters).
+        """
+        from database import get_db
+        db = next(get_db())
+        try:
+            entries, next_cursor = self.file_storage_service.page_catalog(db, **page_params)
+        finally:
+            db.close()
+        files = [self._catalog_file_metadata(entry) for entry in entries]
+        return [f for f in files if "error" not in f], next_cursor
+
+    def _scan_uploaded_files(self) -> List[Dict[str, Any]]:
+        """Standalone use (scripts): parse the uploads dir directly"""
         # Check cache first for performance
         cache_key = self._get_cache_key("all_files", self.uploads_dir)
         cached_result = self._get_cache(cache_key)
@@ -135,40 +259,107 @@ class ComparisonService:
         print(f"✅ Processed {len(files)} files with actual data")
         return files
     
-    def get_smart_performance_analysis(self, file1_path: str, file2_path: str) -> Dict[str, Any]:
-        """Ultra-fast performance analysis with optimized caching and processing"""
+    def get_smart_performance_analysis(self, file1_path: str, file2_path: str, mode: str = "full",
+                                       limit: int = None, offset: int = 0) -> Dict[str, Any]:
+        """Ultra-fast performance analysis with optimized caching and processing.
+
+        mode="summary" returns counts, recommendations and the top-N lists only; `limit`/`offset`
+        page every category list in full mode (the summary counts always cover all rows).
+        """
+        if mode not in SMART_ANALYSIS_MODES:
+            return {"error": f"Invalid mode '{mode}' (expected one of: {', '.join(SMART_ANALYSIS_MODES)})"}
+        if (limit is not None and limit < 1) or offset < 0:
+            return {"error": "limit must be positive and offset non-negative"}
+        model = self._get_smart_analysis_model(file1_path, file2_path)
+        if "error" in model:
+            return model
+        response = {
+            "file1": os.path.basename(file1_path),
+            "file2": os.path.basename(file2_path),
+            "analysis_date": model["analysis_date"],
+            "business_insights": self._render_business_insights(model, mode, limit, offset),
+            "total_items_analyzed": model["summary"]["total_items_analyzed"]
+        }
+        if mode != "full" or limit is not None or offset:
+            response["mode"] = mode
+            response["limit"] = limit
+            response["offset"] = offset
+        return response
+    
+    def get_smart_analysis_category(self, file1_path: str, file2_path: str, category: str,
+                                    limit: int = 50, offset: int = 0) -> Dict[str, Any]:
+        """One page of a single smart-analysis category"""
+        if category not in SMART_ANALYSIS_CATEGORIES:
+            return {"error": f"Unknown category '{category}' (expected one of: {', '.join(SMART_ANALYSIS_CATEGORIES)})"}
+        if limit < 1 or offset < 0:
+            return {"error": "limit must be positive and offset non-negative"}
+        model = self._get_smart_analysis_model(file1_path, file2_path)
+        if "error" in model:
+            return model
+        positions = model["categories"][category]
+        items = self._category_records(model["display"], positions[offset:offset + limit], SMART_ANALYSIS_CATEGORIES[category])
+        return {
+            "file1": os.path.basename(file1_path),
+            "file2": os.path.basename(file2_path),
+            "category": category,
+            "items": items,
+            "total": int(len(positions)),
+            "limit": limit,
+            "offset": offset,
+            "has_more": offset + len(items) < len(positions)
+        }
+    
+    def _smart_analysis_result_key(self, file1_path: str, file2_path: str):
+        """(kind, hash1, hash2, thresholds version, algorithm version) for the persistent result cache.
+        Smart analysis compares raw stock only, so it doesn't depend on the threshold configuration."""
+        if self.result_cache is None:
+            return None
+        hash1 = self.result_cache.hash_for_path(file1_path)
+        hash2 = self.result_cache.hash_for_path(file2_path)
+        if not hash1 or not hash2:
+            return None
+        return ("smart_analysis", hash1, hash2, 0, SMART_ANALYSIS_ALGO_VERSION)
+
+    def _get_smart_analysis_model(self, file1_path: str, file2_path: str) -> Dict[str, Any]:
+        """Categorised comparison of two files (display frame + per-category row positions), cached"""
         try:
-            # Generate cache key
-            cache_key = self._get_cache_key("smart_analysis", file1_path, file2_path)
-            cached_result = self._get_cache(cache_key)
+            result_key = self._smart_analysis_result_key(file1_path, file2_path)
+            if result_key is not None:
+                # Content-addressed: a pair of uploads always compares the same way, so no TTL
+                cached_result = self._models.get(result_key)
+                if cached_result is None:
+                    cached_result = self.result_cache.get_comparison(*result_key)
+                    if cached_result is not None:
+                        self._models[result_key] = cached_result
+            else:
+                cache_key = self._get_cache_key("smart_analysis", file1_path, file2_path)
+                cached_result = self._get_cache(cache_key)
             if cached_result:
                 print(f"⚡ Using cached analysis for: {os.path.basename(file1_path)} vs {os.path.basename(file2_path)}")
                 return cached_result
-
             print(f"🚀 Ultra-fast analysis: {os.path.basename(file1_path)} vs {os.path.basename(file2_path)}")
             
-            # Load files efficiently using the key items service
-            df1 = self.key_items_service._load_inventory_file(file1_path)
-            df2 = self.key_items_service._load_inventory_file(file2_path)
-            
-            if df1 is None or df2 is None:
-                return {"error": "Failed to load one or both files"}
-            
-            # Ultra-fast KI00 filtering
-            ki00_1 = df1[df1['Season Code'] == 'KI00'].copy()
-            ki00_2 = df2[df2['Season Code'] == 'KI00'].copy()
-            
-            if ki00_1.empty:
-                return {"error": "No KI00 items found in first file"}
-            if ki00_2.empty:
-                return {"error": "No KI00 items found in second file"}
-            
-            # Optimized unique identifier creation
-            ki00_1['unique_id'] = ki00_1['Item Description'].astype(str) + '|' + ki00_1['Variant Color'].astype(str) + '|' + ki00_1['Variant Code'].astype(str)
-            ki00_2['unique_id'] = ki00_2['Item Description'].astype(str) + '|' + ki00_2['Variant Color'].astype(str) + '|' +ki00_2['Variant Code'].astype(str)
-            
-            # Fast merge operation
-            merged = pd.merge(ki00_1, ki00_2, on='unique_id', how='outer', suffixes=('_old', '_new'))
+            # The persisted per-SKU diff already holds the joined pair
+            merged = self._load_persisted_diff_frame(file1_path, file2_path)
+            if merged is None:
+                # Load key-item rows for both snapshots (stock history store, workbook parse as fallback)
+                df1 = self._load_key_item_frame(file1_path)
+                df2 = self._load_key_item_frame(file2_path)
+                
+                if df1 is None or df2 is None:
+                    return {"error": "Failed to load one or both files"}
+                
+                # Ultra-fast KI00 filtering
+                ki00_1 = df1[df1['Season Code'] == 'KI00']
+                ki00_2 = df2[df2['Season Code'] == 'KI00']
+                
+                if ki00_1.empty:
+                    return {"error": "No KI00 items found in first file"}
+                if ki00_2.empty:
+                    return {"error": "No KI00 items found in second file"}
+                
+                # Join on int32 SKU ids with only the needed columns projected
+                merged = merge_snapshot_frames(ki00_1, ki00_2)
             
             if merged.empty:
                 return {"error": "No matching items found between the two files"}
@@ -200,25 +391,18 @@ class ComparisonService:
                 merged[col] = merged[col].fillna(0).replace([np.inf, -np.inf], 0).astype(float)
             
             # Ultra-fast business analysis
-            analysis = self._analyze_business_performance_fast(merged)
-            
-            # Prepare response with JSON-safe data validation
-            response = {
-                "file1": os.path.basename(file1_path),
-                "file2": os.path.basename(file2_path),
-                "analysis_date": datetime.now().strftime('%Y-%m-%d %H:%M'),
-                "business_insights": analysis,
-                "total_items_analyzed": int(len(merged))
-            }
-            
-            # Final JSON safety validation
-            response = self._ensure_json_serializable(response)
+            model = self._build_performance_model(merged)
+            model["analysis_date"] = datetime.now().strftime('%Y-%m-%d %H:%M')
             
             # Cache the result for future requests
-            self._set_cache(cache_key, response)
+            if result_key is not None:
+                self._models[result_key] = model
+                self.result_cache.put_comparison(*result_key, model)
+            else:
+                self._set_cache(cache_key, model)
             
             print(f"⚡ Analysis complete: {len(merged)} items processed in milliseconds")
-            return response
+            return model
             
         except Exception as e:
             import traceback
@@ -227,140 +411,79 @@ class ComparisonService:
             print(f"Full traceback: {error_details}")
             return {"error": f"Smart analysis failed: {str(e)}"}
     
-    def _analyze_business_performance_fast(self, merged_df: pd.DataFrame) -> Dict[str, Any]:
-        """Ultra-fast business performance analysis with optimized categorization"""
+    def _build_performance_model(self, merged_df: pd.DataFrame) -> Dict[str, Any]:
+        """Ultra-fast business performance categorization: row positions per category plus
+        a display frame shared by all of them (categories overlap heavily)"""
+        change = merged_df['change'].to_numpy()
+        old_stock = merged_df['old_stock'].to_numpy()
+        new_stock = merged_df['new_stock'].to_numpy()
         
-        # Vectorized categorization for maximum speed
         # 1. EXCELLENT PERFORMERS (High sales - stock decreased significantly)
         # Items where old_stock - new_stock > 0 (stock decreased = items are selling)
-        excellent_mask = (merged_df['change'] < 0) & (merged_df['new_stock'] > 0)
-        excellent_performers = merged_df[excellent_mask]
+        excellent = np.flatnonzero((change < 0) & (new_stock > 0))
         
         # 2. URGENT RESTOCK NEEDED (Currently out of stock)
         # Items where new_stock = 0 (completely sold out)
-        urgent_mask = (merged_df['new_stock'] == 0) & (merged_df['old_stock'] > 0)
-        urgent_restock = merged_df[urgent_mask]
+        urgent = np.flatnonzero((new_stock == 0) & (old_stock > 0))
         
         # 3. POOR PERFORMERS (Not selling - stock unchanged)
         # Items where old_stock - new_stock = 0 (no change in stock = not selling)
-        poor_mask = (merged_df['change'] == 0) & (merged_df['old_stock'] > 0)
-        poor_performers = merged_df[poor_mask]
+        poor = np.flatnonzero((change == 0) & (old_stock > 0))
         
         # 4. NEW PRODUCTS (Added in new file)
-        new_mask = merged_df['old_stock'] == 0
-        new_products = merged_df[new_mask]
+        new = np.flatnonzero(old_stock == 0)
         
         # 5. DISCONTINUED PRODUCTS (Removed in new file)
-        discontinued_mask = merged_df['new_stock'] == 0
-        discontinued = merged_df[discontinued_mask]
+        discontinued = np.flatnonzero(new_stock == 0)
         
         # 6. TOP PERFORMERS BY SALES VOLUME (Biggest stock decreases)
-        top_sales = merged_df[merged_df['change'] < 0].nlargest(10, 'change')
+        decreased = np.flatnonzero(change < 0)
+        top_sales = decreased[top_n_positions(change[decreased], SMART_ANALYSIS_TOP_N, largest=False)]
         
         # 7. WORST PERFORMERS (Biggest stock increases - not selling)
-        worst_performers = merged_df[merged_df['change'] > 0].nlargest(10, 'change')
+        increased = np.flatnonzero(change > 0)
+        worst = increased[top_n_positions(change[increased], SMART_ANALYSIS_TOP_N, largest=True)]
         
         # Generate recommendations
         recommendations = self._generate_business_recommendations_fast(
-            excellent_performers, poor_performers, urgent_restock, new_products, discontinued
+            len(excellent), len(poor), len(urgent), len(new), len(discontinued)
         )
         
         return {
             "summary": {
                 "total_items_analyzed": len(merged_df),
-                "excellent_performers": len(excellent_performers),
-                "poor_performers": len(poor_performers),
-                "urgent_restock_needed": len(urgent_restock),
-                "new_products": len(new_products),
+                "excellent_performers": len(excellent),
+                "poor_performers": len(poor),
+                "urgent_restock_needed": len(urgent),
+                "new_products": len(new),
                 "discontinued_products": len(discontinued)
             },
-            "excellent_performers": self._format_performance_data_fast(excellent_performers, "EXCELLENT"),
-            "poor_performers": self._format_performance_data_fast(poor_performers, "POOR"),
-            "urgent_restock": self._format_performance_data_fast(urgent_restock, "URGENT"),
-            "new_products": self._format_performance_data_fast(new_products, "NEW"),
-            "discontinued_products": self._format_performance_data_fast(discontinued, "DISCONTINUED"),
-            "top_sales": self._format_performance_data_fast(top_sales, "TOP_SALES"),
-            "worst_performers": self._format_performance_data_fast(worst_performers, "WORST"),
-            "recommendations": recommendations
-        }
-    
-    def _format_performance_data(self, df: pd.DataFrame, category: str) -> List[Dict]:
-        """Format performance data for display"""
-        if df.empty:
-            return []
-        
-        formatted = []
-        for _, row in df.iterrows():
-            # Extract item name from Item Description (before the dash)
-            item_desc_old = row.get('Item Description_old', '')
-            item_desc_new = row.get('Item Description_new', '')
-            item_name = item_desc_old if item_desc_old else item_desc_new
-            if isinstance(item_name, str) and ' - ' in item_name:
-                item_name = item_name.split(' - ')[0].strip()
-            
-            item_data = {
-                "item_name": item_name or 'Unknown',
-                "color": row.get('Variant Color_old', row.get('Variant Color_new', 'Unknown')),
-                "size": str(row.get('Variant Code_old', row.get('Variant Code_new', 'Unknown'))),
-                "old_stock": int(row['old_stock']) if pd.notna(row['old_stock']) else 0,
-                "new_stock": int(row['new_stock']) if pd.notna(row['new_stock']) else 0,
-                "change": int(row['change']) if pd.notna(row['change']) else 0,
-                "percentage_change": round(row['percentage_change'], 1) if pd.notna(row['percentage_change']) else 0.0,
-                "category": category,
-                "business_insight": self._get_business_insight(row, category)
+            "recommendations": recommendations,
+            "display": self._performance_display_frame(merged_df),
+            "categories": {
+                "excellent_performers": excellent,
+                "poor_performers": poor,
+                "urgent_restock": urgent,
+                "new_products": new,
+                "discontinued_products": discontinued,
+                "top_sales": top_sales,
+                "worst_performers": worst
             }
-            formatted.append(item_data)
-        
-        return formatted
+        }
     
-    def _get_business_insight(self, row: pd.Series, category: str) -> str:
-        """Generate business insight for each item"""
-        # Ensure all values are clean numbers
-        change = float(row['change']) if pd.notna(row['change']) else 0.0
-        percentage = float(row['percentage_change']) if pd.notna(row['percentage_change']) else 0.0
-        new_stock = float(row['new_stock']) if pd.notna(row['new_stock']) else 0.0
-        old_stock = float(row['old_stock']) if pd.notna(row['old_stock']) else 0.0
-        
-        # Handle any remaining NaN/inf values
-        if not np.isfinite(change):
-            change = 0.0
-        if not np.isfinite(percentage):
-            percentage = 0.0
-        if not np.isfinite(new_stock):
-            new_stock = 0.0
-        if not np.isfinite(old_stock):
-            old_stock = 0.0
-        
-        if category == "EXCELLENT":
-            # Stock decreased = items are selling well
-            if abs(change) > 20:
-                return "🔥 EXCEPTIONAL - Outstanding sales performance, urgent restock needed"
-            elif abs(change) > 10:
-                return "⭐ EXCELLENT - Strong performer, restock soon"
-            else:
-                return "✅ GOOD - Solid sales performance, monitor stock levels"
-        
-        elif category == "POOR":
-            # Stock unchanged = not selling
-            return "📉 POOR - No sales movement, consider promotions or discontinuation"
-        
-        elif category == "URGENT":
-            # Currently out of stock
-            return "🚨 CRITICAL - Completely sold out, immediate restock required"
-        
-        elif category == "NEW":
-            return "🆕 NEW - Recently introduced product"
-        
-        elif category == "DISCONTINUED":
-            return "❌ DISCONTINUED - Product removed from inventory"
-        
-        elif category == "TOP_SALES":
-            return "🏆 TOP SELLER - Highest sales volume"
-        
-        elif category == "WORST":
-            return "📉 WORST - Lowest performance, review strategy"
-        
-        return "📊 MONITOR - Standard performance"
+    def _render_business_insights(self, model: Dict[str, Any], mode: str = "full",
+                                  limit: int = None, offset: int = 0) -> Dict[str, Any]:
+        """Summary, category record lists (paged by limit/offset) and recommendations"""
+        insights = {"summary": dict(model["summary"])}
+        for key, category in SMART_ANALYSIS_CATEGORIES.items():
+            if mode == "summary" and key not in SUMMARY_CATEGORIES:
+                continue
+            positions = model["categories"][key]
+            if mode == "full":
+                positions = positions[offset:] if limit is None else positions[offset:offset + limit]
+            insights[key] = self._category_records(model["display"], positions, category)
+        insights["recommendations"] = list(model["recommendations"])
+        return insights
     
     def _generate_business_recommendations(self, excellent, poor, urgent, new, discontinued) -> List[str]:
         """Generate actionable business recommendations"""
@@ -396,106 +519,68 @@ class ComparisonService:
         
         return recommendations
     
-    def _format_performance_data_fast(self, df: pd.DataFrame, category: str) -> List[Dict]:
-        """Ultra-fast performance data formatting"""
-        if df.empty:
-            return []
-        
-        # Vectorized operations for maximum speed
-        formatted = []
-        for _, row in df.iterrows():
-            # Extract item name from Item Description (before the dash)
-            item_desc_old = row.get('Item Description_old', '')
-            item_desc_new = row.get('Item Description_new', '')
-            item_name = item_desc_old if item_desc_old else item_desc_new
-            if isinstance(item_name, str) and ' - ' in item_name:
-                item_name = item_name.split(' - ')[0].strip()
-            
-            item_data = {
-                "item_name": item_name or 'Unknown',
-                "color": row.get('Variant Color_old', row.get('Variant Color_new', 'Unknown')),
-                "size": str(row.get('Variant Code_old', row.get('Variant Code_new', 'Unknown'))),
-                "old_stock": int(row['old_stock']) if pd.notna(row['old_stock']) else 0,
-                "new_stock": int(row['new_stock']) if pd.notna(row['new_stock']) else 0,
-                "change": int(row['change']) if pd.notna(row['change']) else 0,
-                "percentage_change": round(row['percentage_change'], 1) if pd.notna(row['percentage_change']) else 0.0,
-                "category": category,
-                "business_insight": self._get_business_insight_fast(row, category)
-            }
-            formatted.append(item_data)
-        
-        return formatted
+    def _performance_display_frame(self, merged_df: pd.DataFrame) -> pd.DataFrame:
+        """JSON-ready display columns for every merged row (NaN/inf already cleaned by the caller)"""
+        desc_old = merged_df['Item Description_old']
+        description = desc_old.where(desc_old.notna() & (desc_old != ''), merged_df['Item Description_new'])
+        item_name = description.fillna('').astype(str).str.split(' - ').str[0].str.strip()
+        change = merged_df['change']
+        display = pd.DataFrame({
+            "item_name": item_name.mask(item_name == '', 'Unknown'),
+            "color": merged_df['Variant Color_old'].fillna(merged_df['Variant Color_new']).fillna('Unknown').astype(str),
+            "size": merged_df['Variant Code_old'].fillna(merged_df['Variant Code_new']).fillna('Unknown').astype(str),
+            "old_stock": merged_df['old_stock'].astype(np.int64),
+            "new_stock": merged_df['new_stock'].astype(np.int64),
+            "change": change.astype(np.int64),
+            "percentage_change": merged_df['percentage_change'].round(1),
+        }, index=merged_df.index)
+        # Only EXCELLENT insights depend on the row; every other category has a fixed insight
+        display['excellent_insight'] = np.select(
+            [change.abs() > 20, change.abs() > 10],
+            [
+                "🔥 EXCEPTIONAL - Outstanding sales performance, urgent restock needed",
+                "⭐ EXCELLENT - Strong performer, restock soon"
+            ],
+            default="✅ GOOD - Solid sales performance, monitor stock levels"
+        )
+        return display
     
-    def _get_business_insight_fast(self, row: pd.Series, category: str) -> str:
-        """Fast business insight generation"""
-        # Ensure all values are clean numbers
-        change = float(row['change']) if pd.notna(row['change']) else 0.0
-        new_stock = float(row['new_stock']) if pd.notna(row['new_stock']) else 0.0
-        
-        # Handle any remaining NaN/inf values
-        if not np.isfinite(change):
-            change = 0.0
-        if not np.isfinite(new_stock):
-            new_stock = 0.0
-        
-        if category == "EXCELLENT":
-            # Stock decreased = items are selling well
-            if abs(change) > 20:
-                return "🔥 EXCEPTIONAL - Outstanding sales performance, urgent restock needed"
-            elif abs(change) > 10:
-                return "⭐ EXCELLENT - Strong performer, restock soon"
-            else:
-                return "✅ GOOD - Solid sales performance, monitor stock levels"
-        
-        elif category == "POOR":
-            # Stock unchanged = not selling
-            return "📉 POOR - No sales movement, consider promotions or discontinuation"
-        
-        elif category == "URGENT":
-            # Currently out of stock
-            return "🚨 CRITICAL - Completely sold out, immediate restock required"
-        
-        elif category == "NEW":
-            return "🆕 NEW - Recently introduced product"
-        
-        elif category == "DISCONTINUED":
-            return "❌ DISCONTINUED - Product removed from inventory"
-        
-        elif category == "TOP_SALES":
-            return "🏆 TOP SELLER - Highest sales volume"
-        
-        elif category == "WORST":
-            return "📉 WORST - Lowest performance, review strategy"
-        
-        return "📊 MONITOR - Standard performance"
+    def _category_records(self, display: pd.DataFrame, positions: np.ndarray, category: str) -> List[Dict]:
+        """Emit one category's rows (positions into the display frame) as records in bulk"""
+        subset = display.iloc[positions]
+        if subset.empty:
+            return []
+        insight = subset['excellent_insight'] if category == "EXCELLENT" else \
+            PERFORMANCE_INSIGHTS.get(category, "📊 MONITOR - Standard performance")
+        return subset[PERFORMANCE_RECORD_COLUMNS].assign(category=category, business_insight=insight).to_dict('records')
     
-    def _generate_business_recommendations_fast(self, excellent, poor, urgent, new, discontinued) -> List[str]:
-        """Fast business recommendations generation"""
+    def _generate_business_recommendations_fast(self, excellent: int, poor: int, urgent: int, new: int, discontinued: int) -> List[str]:
+        """Fast business recommendations generation from category counts"""
         recommendations = []
         
         # Restocking recommendations
-        if len(urgent) > 0:
-            recommendations.append(f"🚨 URGENT: {len(urgent)} items are completely sold out - immediate restock required")
+        if urgent > 0:
+            recommendations.append(f"🚨 URGENT: {urgent} items are completely sold out - immediate restock required")
         
-        if len(excellent) > 0:
-            recommendations.append(f"⭐ ACTION: {len(excellent)} items are selling well (stock decreased) - increase production")
+        if excellent > 0:
+            recommendations.append(f"⭐ ACTION: {excellent} items are selling well (stock decreased) - increase production")
         
         # Poor performance recommendations
-        if len(poor) > 0:
-            recommendations.append(f"📉 REVIEW: {len(poor)} items showing no sales movement (stock unchanged) - consider promotions or discontinuation")
+        if poor > 0:
+            recommendations.append(f"📉 REVIEW: {poor} items showing no sales movement (stock unchanged) - consider promotions or discontinuation")
         
         # New product insights
-        if len(new) > 0:
-            recommendations.append(f"🆕 MONITOR: {len(new)} new products introduced - track performance")
+        if new > 0:
+            recommendations.append(f"🆕 MONITOR: {new} new products introduced - track performance")
         
         # Discontinued insights
-        if len(discontinued) > 0:
-            recommendations.append(f"❌ CLEANUP: {len(discontinued)} products discontinued - update marketing")
+        if discontinued > 0:
+            recommendations.append(f"❌ CLEANUP: {discontinued} products discontinued - update marketing")
         
         # Overall performance
-        total_items = len(excellent) + len(poor) + len(urgent) + len(new) + len(discontinued)
+        total_items = excellent + poor + urgent + new + discontinued
         if total_items > 0:
-            excellent_rate = (len(excellent) / total_items) * 100
+            excellent_rate = (excellent / total_items) * 100
             if excellent_rate > 30:
                 recommendations.append("🎉 EXCELLENT: Strong sales performance across product line")
             elif excellent_rate < 10:
@@ -535,41 +620,6 @@ class ComparisonService:
         
         return trends
 
-    def _ensure_json_serializable(self, obj):
-        """Recursively ensure all values in the object are JSON serializable"""
-        import json
-        import math
-        
-        if isinstance(obj, dict):
-            return {k: self._ensure_json_serializable(v) for k, v in obj.items()}
-        elif isinstance(obj, list):
-            return [self._ensure_json_serializable(item) for item in obj]
-        elif isinstance(obj, (np.integer, np.floating)):
-            if np.isnan(obj) or np.isinf(obj):
-                return 0
-            return obj.item()
-        elif isinstance(obj, (int, float)):
-            if math.isnan(obj) or math.isinf(obj):
-                return 0
-            return obj
-        elif pd.isna(obj):
-            return 0
-        elif obj is None:
-            return 0
-        elif isinstance(obj, str):
-            # Handle string representations of NaN
-            if obj.lower() in ['nan', 'inf', '-inf', 'null', 'none']:
-                return 0
-            return obj
-        else:
-            # For any other type, try to convert safely
-            try:
-                if pd.isna(obj):
-                    return 0
-                return obj
-            except:
-                return str(obj) if obj is not None else 0
-
     def analyze_product_performance(self, files_data: List[Dict]) -> Dict[str, Any]:
         """Analyze product performance across all uploaded files"""
         try:
@@ -589,12 +639,12 @@ class ComparisonService:
             
             # Calculate real performance metrics
             total_files = len(files_data)
-            total_ki00_items = sum(file.get('ki00_items_count', 0) for file in files_data)
-            total_low_stock = sum(file.get('low_stock_count', 0) for file in files_data)
+            total_ki00_items = sum(file.get('ki00_items_count') or 0 for file in files_data)
+            total_low_stock = sum(file.get('low_stock_count') or 0 for file in files_data)
             
             # Calculate trends
-            ki00_trend = last_file.get('ki00_items_count', 0) - first_file.get('ki00_items_count', 0)
-            low_stock_trend = last_file.get('low_stock_count', 0) - first_file.get('low_stock_count', 0)
+            ki00_trend = (last_file.get('ki00_items_count') or 0) - (first_file.get('ki00_items_count') or 0)
+            low_stock_trend = (last_file.get('low_stock_count') or 0) - (first_file.get('low_stock_count') or 0)
             
             # Generate recommendations based on data
             recommendations = []
@@ -617,7 +667,7 @@ class ComparisonService:
             
             # Perform smart analysis between first and last files if possible
             smart_analysis = None
-            if os.path.exists(first_file['file_path']) and os.path.exists(last_file['file_path']):
+            if self._readable(first_file['file_path']) and self._readable(last_file['file_path']):
                 try:
                     smart_analysis = self.get_smart_performance_analysis(first_file['file_path'], last_file['file_path'])
                 except Exception as e:
@@ -0,0 +1,115 @@
+import os
+import time
+import threading
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from database import get_db
+
+class Snapshot(NamedTuple):
+    """The inventory file currently backing the dashboard"""
+    file_id: int
+    file_path: str
+    filename: str
+    content_hash: Optional[str]
+    version: int
+
+class CurrentSnapshot:
+    """Process-level handle on the active inventory snapshot.
+
+    Dashboard endpoints read the latest file from here instead of opening a DB session and
+    stat-ing the path on every request. The handle is swapped atomically on upload/activation and
+    only re-resolved from the upload catalog when the shared "snapshots" version moves (checked at
+    most every `version_check_interval` seconds).
+    """
+
+    def __init__(self, file_storage_service, key_items_service, snapshot_store=None):
+        self.file_storage_service = file_storage_service
+        self.key_items_service = key_items_service
+        self.snapshot_store = snapshot_store
+        self.version_check_interval = float(os.getenv("SNAPSHOT_VERSION_CHECK_INTERVAL", "0.5"))
+        self._lock = threading.Lock()
+        self._snapshot: Optional[Snapshot] = None
+        self._last_check = 0.0
+        # (file_id, thresholds version, (alerts, success, error)) for the current snapshot
+        self._alert_model = None
+
+    def _shared_version(self) -> int:
+        return self.snapshot_store.get_version("snapshots") if self.snapshot_store is not None else 0
+
+    def get(self) -> Optional[Snapshot]:
+        """Current snapshot, re-validated only when the shared snapshot version has changed"""
+        snapshot = self._snapshot
+        now = time.time()
+        if snapshot is not None and now - self._last_check < self.version_check_interval:
+            return snapshot
+        self._last_check = now
+        version = self._shared_version()
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+        return self.refresh(version)
+
+    def get_path(self) -> Optional[str]:
+        snapshot = self.get()
+        return snapshot.file_path if snapshot else None
+
+    def refresh(self, version: Optional[int] = None) -> Optional[Snapshot]:
+        """Re-resolve the active file from the upload catalog"""
+        if version is None:
+            version = self._shared_version()
+        with self._lock:
+            db = next(get_db())
+            try:
+                entry = self.file_storage_service.resolve_latest_file(db)
+                snapshot = self._from_entry(entry, version) if entry else None
+            finally:
+                db.close()
+            self._swap(snapshot)
+            return snapshot
+
+    def activate(self, entry, version: Optional[int] = None) -> Snapshot:
+        """Point the handle at a freshly uploaded / activated catalog row"""
+        if version is None:
+            version = self._shared_version()
+        snapshot = self._from_entry(entry, version)
+        with self._lock:
+            self._swap(snapshot)
+        self._last_check = time.time()
+        return snapshot
+
+    def invalidate(self):
+        """Force the next read to re-resolve (e.g. the active file vanished from disk)"""
+        with self._lock:
+            self._swap(None)
+
+    def get_alerts(self) -> Tuple[List[Dict], bool, str]:
+        """Batch alert model for the current snapshot, kept alongside the handle"""
+        snapshot = self.get()
+        if snapshot is None:
+            return [], False, "No inventory file found"
+        self.key_items_service._sync_shared_versions()
+        thresholds_version = self.key_items_service._thresholds_version()
+        model = self._alert_model
+        if model is not None and model[0] == snapshot.file_id and model[1] == thresholds_version:
+            return model[2]
+        result = self.key_items_service.get_all_key_items_with_alerts(snapshot.file_path)
+        if result[1]:
+            self._alert_model = (snapshot.file_id, thresholds_version, result)
+        elif not os.path.exists(snapshot.file_path):
+            # Only stat on the failure path: the active file vanished, re-resolve next time
+            self.invalidate()
+        return result
+
+    def _swap(self, snapshot: Optional[Snapshot]):
+        if self._snapshot is None or snapshot is None or snapshot.file_id != self._snapshot.file_id:
+            self._alert_model = None
+        self._snapshot = snapshot
+
+    @staticmethod
+    def _from_entry(entry, version: int) -> Snapshot:
+        return Snapshot(
+            file_id=entry.id,
+            file_path=entry.file_path,
+            filename=entry.stored_filename or os.path.basename(entry.file_path),
+            content_hash=entry.content_hash,
+            version=version
+        )
@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text, literal
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
@@ -39,6 +39,35 @@ def get_db():
 def init_db():
     from models import Base
     Base.metadata.create_all(bind=engine)
+    _add_missing_columns(Base)
+
+def _add_missing_columns(base):
+    """Add columns and indexes introduced after a table was first created (create_all skips existing tables)"""
+    try:
+        inspector = inspect(engine)
+        existing_tables = set(inspector.get_table_names())
+        with engine.begin() as conn:
+            for table in base.metadata.sorted_tables:
+                if table.name not in existing_tables:
+                    continue
+                existing_columns = {col['name'] for col in inspector.get_columns(table.name)}
+                for column in table.columns:
+                    if column.name in existing_columns:
+                        continue
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    default_clause = ''
+                    if column.default is not None and column.default.is_scalar:
+                        # Backfill existing rows with the model default (e.g. boolean flags)
+                        default_value = literal(column.default.arg, type_=column.type).compile(
+                            dialect=engine.dialect, compile_kwargs={"literal_binds": True})
+                        default_clause = f' DEFAULT {default_value}'
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}{default_clause}'))
+                    print(f"🔧 Added column {table.name}.{column.name}")
+        for table in base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=engine, checkfirst=True)
+    except Exception as e:
+        print(f"⚠️ Column migration warning: {e}")
 
 # Initialize database tables
 init_db() 
\ No newline at end of file
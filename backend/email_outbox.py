@@ -0,0 +1,348 @@
+import asyncio
+import hashlib
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+from email import message_from_string
+from email.message import Message
+from typing import Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import IntegrityError
+
+from database import get_db
+from models import OutboxMessage
+
+OUTBOX_STATUSES = ("pending", "sending", "sent", "failed")
+
+def request_idempotency_key(client_key: Optional[str], *parts) -> str:
+    """The client's Idempotency-Key, else one derived from the request so repeat clicks within the window collapse"""
+    if client_key:
+        return f"client:{client_key.strip()}"
+    window = max(int(os.getenv("EMAIL_IDEMPOTENCY_WINDOW_SECONDS", "300")), 1)
+    digest = hashlib.sha1("|".join(str(part) for part in parts).encode()).hexdigest()[:20]
+    return f"{digest}:{int(time.time() // window)}"
+
+class EmailOutbox:
+    """Durable outbox for every outgoing email, delivered by an asyncio worker.
+
+    Senders only insert rows (the serialized message) and return a job id; the worker claims due
+    rows with a compare-and-set update, sends them through the SMTP session pool on worker threads,
+    at most `concurrency` at a time, and reschedules failures with exponential backoff until
+    max_attempts. A claim holds a lease, so a message whose process died mid-send is picked up again
+    once the lease expires (or marked failed if that was its last attempt). Each message gets a unique idempotency key (caller key + recipient), so
+    repeated requests with the same key return the existing job instead of sending twice.
+    """
+
+    def __init__(self, smtp_pool, concurrency: Optional[int] = None, max_attempts: Optional[int] = None,
+                 retry_base_seconds: Optional[float] = None, retry_max_seconds: Optional[float] = None,
+                 lease_seconds: float = 300.0, poll_interval: float = 5.0):
+        self.smtp_pool = smtp_pool
+        self.concurrency = concurrency or int(os.getenv("EMAIL_OUTBOX_CONCURRENCY", "2"))
+        self.max_attempts = max_attempts or int(os.getenv("EMAIL_OUTBOX_MAX_ATTEMPTS", "6"))
+        self.retry_base_seconds = retry_base_seconds if retry_base_seconds is not None \
+            else float(os.getenv("EMAIL_OUTBOX_RETRY_BASE_SECONDS", "30"))
+        self.retry_max_seconds = retry_max_seconds if retry_max_seconds is not None \
+            else float(os.getenv("EMAIL_OUTBOX_RETRY_MAX_SECONDS", "3600"))
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._inflight: Set[int] = set()
+        self._deliveries: Set[asyncio.Task] = set()
+        # Called with the message dict once a message is sent or has finally failed
+        self._listeners: List[Callable[[Dict], None]] = []
+
+    def add_listener(self, callback: Callable[[Dict], None]):
+        """Register a callback run on the delivery thread when a message reaches sent / failed"""
+        self._listeners.append(callback)
+
+    def _notify(self, message: Dict):
+        for callback in self._listeners:
+            try:
+                callback(message)
+            except Exception as e:
+                print(f"⚠️ Outbox listener failed for message {message.get('id')}: {e}")
+
+    # ---- enqueue / status ----
+
+    @staticmethod
+    def _message_id(key: str) -> str:
+        # Stable across retries so mail clients can collapse an at-least-once duplicate
+        return f"<{hashlib.sha1(key.encode()).hexdigest()[:24]}@danier-stock-alerts>"
+
+    def enqueue(self, kind: str, messages: Sequence[Tuple[str, Message]], idempotency_key: Optional[str] = None,
+                max_attempts: Optional[int] = None) -> Dict:
+        """Persist one job of (recipient, message) pairs; returns {job_id, queued, duplicate}"""
+        if not messages:
+            raise ValueError("No messages to enqueue")
+        job_id = uuid.uuid4().hex
+        base_key = idempotency_key or job_id
+        keys = [f"{base_key}:{recipient.strip().lower()}" for recipient, _ in messages]
+        db = next(get_db())
+        try:
+            existing = self._existing_job(db, keys)
+            if existing:
+                return {"job_id": existing, "queued": 0, "duplicate": True}
+            for key, (recipient, msg) in zip(keys, messages):
+                if msg.get("Message-ID") is None:
+                    msg["Message-ID"] = self._message_id(key)
+                db.add(OutboxMessage(
+                    job_id=job_id, idempotency_key=key, kind=kind, recipient=recipient,
+                    subject=str(msg.get("Subject") or ""), message=msg.as_string(), status="pending",
+                    max_attempts=max_attempts or self.max_attempts, next_attempt_at=datetime.utcnow()
+                ))
+            try:
+                db.commit()
+            except IntegrityError:
+                # A concurrent request with the same idempotency key won the insert
+                db.rollback()
+                existing = self._existing_job(db, keys)
+                if existing:
+                    return {"job_id": existing, "queued": 0, "duplicate": True}
+                raise
+        finally:
+            db.close()
+        print(f"📮 Outbox job {job_id}: {len(messages)} {kind} message(s) queued")
+        self._wake()
+        return {"job_id": job_id, "queued": len(messages), "duplicate": False}
+
+    @staticmethod
+    def _existing_job(db, keys: List[str]) -> Optional[str]:
+        row = db.query(OutboxMessage.job_id).filter(OutboxMessage.idempotency_key.in_(keys)).first()
+        return row.job_id if row else None
+
+    @staticmethod
+    def to_dict(row: OutboxMessage) -> Dict:
+        iso = lambda value: value.isoformat() if value else None
+        return {
+            "id": row.id,
+            "job_id": row.job_id,
+            "kind": row.kind,
+            "recipient": row.recipient,
+            "subject": row.subject,
+            "status": row.status,
+            "attempts": row.attempts or 0,
+            "max_attempts": row.max_attempts,
+            "next_attempt_at": iso(row.next_attempt_at) if row.status == "pending" else None,
+            "last_error": row.last_error,
+            "created_at": iso(row.created_at),
+            "sent_at": iso(row.sent_at),
+        }
+
+    def status(self, job_id: str) -> Optional[Dict]:
+        """Job summary with per-message delivery state, or None for an unknown job"""
+        db = next(get_db())
+        try:
+            rows = db.query(OutboxMessage).filter(OutboxMessage.job_id == job_id).order_by(OutboxMessage.id).all()
+            messages = [self.to_dict(row) for row in rows]
+        finally:
+            db.close()
+        if not messages:
+            return None
+        counts = {status: 0 for status in OUTBOX_STATUSES}
+        for message in messages:
+            counts[message["status"]] += 1
+        if counts["pending"] or counts["sending"]:
+            state = "sending" if counts["sending"] or counts["sent"] or counts["failed"] else "queued"
+        elif counts["failed"] == 0:
+            state = "sent"
+        else:
+            state = "failed" if counts["sent"] == 0 else "partial"
+        return {
+            "job_id": job_id,
+            "kind": messages[0]["kind"],
+            "status": state,
+            "counts": counts,
+            "total": len(messages),
+            "created_at": messages[0]["created_at"],
+            "messages": messages,
+        }
+
+    def prune(self, db, retention_days: Optional[int] = None) -> int:
+        """Delete sent / failed messages older than the retention window"""
+        days = retention_days or int(os.getenv("EMAIL_OUTBOX_RETENTION_DAYS", "30"))
+        horizon = datetime.utcnow() - timedelta(days=days)
+        try:
+            deleted = db.query(OutboxMessage).filter(
+                OutboxMessage.status.in_(("sent", "failed")), OutboxMessage.created_at < horizon
+            ).delete(synchronize_session=False)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        if deleted:
+            print(f"🗑️ Outbox pruned: {deleted} delivered/failed messages older than {days} days")
+        return deleted
+
+    # ---- delivery worker ----
+
+    def start(self):
+        """Start the delivery worker on the running event loop (idempotent)"""
+        if self._task is not None and not self._task.done():
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = self._loop.create_task(self._run())
+        print(f"📮 Email outbox worker started (concurrency {self.concurrency})")
+
+    async def stop(self):
+        """Stop taking new messages and wait for in-flight deliveries"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._deliveries:
+            await asyncio.gather(*self._deliveries, return_exceptions=True)
+
+    def _wake(self):
+        if self._loop is None or self._wakeup is None:
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        except RuntimeError:
+            pass  # loop already closed
+
+    @staticmethod
+    def _due_filter(now: datetime):
+        return or_(
+            and_(OutboxMessage.status == "pending", OutboxMessage.next_attempt_at <= now),
+            and_(OutboxMessage.status == "sending", OutboxMessage.locked_until < now),
+        )
+
+    def _due(self, limit: int, exclude: Set[int]) -> Tuple[List[int], Optional[float]]:
+        """Ids of messages ready to send, and seconds until the next scheduled retry"""
+        now = datetime.utcnow()
+        db = next(get_db())
+        try:
+            query = db.query(OutboxMessage.id).filter(self._due_filter(now))
+            if exclude:
+                query = query.filter(OutboxMessage.id.notin_(exclude))
+            ids = [row.id for row in query.order_by(OutboxMessage.next_attempt_at, OutboxMessage.id).limit(limit)]
+            upcoming = db.query(OutboxMessage.next_attempt_at).filter(
+                OutboxMessage.status == "pending", OutboxMessage.next_attempt_at > now
+            ).order_by(OutboxMessage.next_attempt_at).first()
+        finally:
+            db.close()
+        next_due = (upcoming.next_attempt_at - now).total_seconds() if upcoming else None
+        return ids, next_due
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            next_due = None
+            free = self.concurrency - len(self._inflight)
+            if free > 0:
+                try:
+                    ids, next_due = await asyncio.to_thread(self._due, free, set(self._inflight))
+                except Exception as e:
+                    print(f"⚠️ Outbox poll failed: {e}")
+                    ids = []
+                for row_id in ids:
+                    self._inflight.add(row_id)
+                    task = asyncio.create_task(self._deliver_async(row_id))
+                    self._deliveries.add(task)
+                    task.add_done_callback(self._deliveries.discard)
+            timeout = self.poll_interval if next_due is None else min(self.poll_interval, max(next_due, 0.05))
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _deliver_async(self, row_id: int):
+        try:
+            await asyncio.to_thread(self.deliver, row_id)
+        except Exception as e:
+            print(f"❌ Outbox delivery of message {row_id} crashed: {e}")
+        finally:
+            self._inflight.discard(row_id)
+            self._wakeup.set()
+
+    def retry_delay(self, attempts: int) -> float:
+        """Exponential backoff after the given number of failed attempts"""
+        return min(self.retry_base_seconds * (2 ** max(attempts - 1, 0)), self.retry_max_seconds)
+
+    def _record_failure(self, row: OutboxMessage, error: Optional[str], permanent: bool = False):
+        """Fail the message for good (permanent error / attempts used up) or reschedule it with backoff"""
+        row.locked_until = None
+        if permanent or (row.attempts or 0) >= row.max_attempts:
+            row.status, row.last_error = "failed", error
+            return
+        delay = self.retry_delay(row.attempts)
+        row.status, row.last_error = "pending", error
+        row.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+        print(f"🔁 Outbox message {row.id} to {row.recipient}: attempt {row.attempts} failed, retry in {delay:.0f}s")
+
+    def _release(self, row_id: int, error: str):
+        """Put a claimed message back after delivery crashed, so it isn't left 'sending' until its lease expires"""
+        db = next(get_db())
+        try:
+            row = db.query(OutboxMessage).filter(OutboxMessage.id == row_id, OutboxMessage.status == "sending").first()
+            if row is not None:
+                self._record_failure(row, error)
+                db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"⚠️ Could not release outbox message {row_id}: {e}")
+        finally:
+            db.close()
+
+    def deliver(self, row_id: int) -> Optional[str]:
+        """Claim one due message and send it; returns its new status (None if it wasn't claimable)"""
+        db = next(get_db())
+        claimed = False
+        try:
+            now = datetime.utcnow()
+            # A lease that expired on the final attempt: the message was (maybe) sent but never recorded
+            exhausted = db.query(OutboxMessage).filter(
+                OutboxMessage.id == row_id, OutboxMessage.status == "sending", OutboxMessage.locked_until < now,
+                OutboxMessage.attempts >= OutboxMessage.max_attempts,
+            ).update({
+                "status": "failed", "locked_until": None, "updated_at": now,
+                "last_error": "Delivery interrupted on the final attempt",
+            }, synchronize_session=False)
+            if exhausted:
+                db.commit()
+                message = self.to_dict(db.query(OutboxMessage).filter(OutboxMessage.id == row_id).one())
+            else:
+                claimed = db.query(OutboxMessage).filter(
+                    OutboxMessage.id == row_id, self._due_filter(now), OutboxMessage.attempts < OutboxMessage.max_attempts
+                ).update({
+                    "status": "sending", "attempts": OutboxMessage.attempts + 1,
+                    "locked_until": now + timedelta(seconds=self.lease_seconds), "updated_at": now,
+                }, synchronize_session=False) > 0
+                db.commit()
+                if not claimed:
+                    return None
+                row = db.query(OutboxMessage).filter(OutboxMessage.id == row_id).one()
+
+                try:
+                    with self.smtp_pool.session() as session:
+                        sent = session.send(message_from_string(row.message))
+                    error, permanent = session.last_error, session.permanent_failure
+                except Exception as e:
+                    sent, error, permanent = False, str(e), False
+
+                if sent:
+                    row.status, row.sent_at, row.last_error, row.locked_until = "sent", datetime.utcnow(), None, None
+                else:
+                    self._record_failure(row, error, permanent)
+                db.commit()
+                message = self.to_dict(row)
+        except Exception as e:
+            db.rollback()
+            if claimed:
+                self._release(row_id, str(e))
+            raise
+        finally:
+            db.close()
+        if message["status"] in ("sent", "failed"):
+            if message["status"] == "failed":
+                print(f"❌ Outbox message {row_id} to {message['recipient']} failed after {message['attempts']} attempt(s)")
+            self._notify(message)
+        return message["status"]
@@ -5,14 +5,15 @@ Handles sending personalized stock alert emails
 """
 
 import os
-import smtplib
-import ssl
 from datetime import datetime
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from typing import List, Dict
 import json
 
+from smtp_pool import SMTPSessionPool, smtp_ports
+from email_outbox import EmailOutbox
+
 class EmailService:
     def __init__(self):
         # Use environment variables for configuration
@@ -21,6 +22,11 @@ class EmailService:
         self.smtp_user = os.getenv('SMTP_USER', 'danieralertsystem@gmail.com')
         self.smtp_pass = os.getenv('SMTP_PASS', 'pojc nsir pjaw hhbq')
         self.email_from = os.getenv('EMAIL_FROM', 'Danier Stock Alerts <danieralertsystem@gmail.com>')
+        # Logged-in SMTP sessions reused by the outbox worker across messages
+        self.smtp_pool = SMTPSessionPool(self.smtp_host, self.smtp_user, self.smtp_pass,
+                                         ports=smtp_ports(self.smtp_port))
+        # Every send path only queues; the outbox worker delivers over the pool with retries
+        self.outbox = EmailOutbox(self.smtp_pool)
         
         # Create emails directory if it doesn't exist
         self.emails_dir = "emails"
@@ -265,8 +271,8 @@ class EmailService:
 
     def send_personalized_alert(self, recipients: List[str], low_stock_items: List[Dict], 
                                recipient_names: Dict[str, str] = None, 
-                               item_name: str = None) -> Dict:
-        """Send personalized alert email to recipients - ULTRA CRASH-PROOF"""
+                               item_name: str = None, idempotency_key: str = None) -> Dict:
+        """Queue personalized alert email to recipients as one outbox job - ULTRA CRASH-PROOF"""
         if not recipients:
             return {"success": False, "message": "No recipients provided"}
         
@@ -326,22 +332,26 @@ class EmailService:
                 else:
                     subject = f"⚠️ Low Stock Alert - Danier Inventory - {datetime.now().strftime('%Y-%m-%d')}"
             
-            # Try to send real email using Gmail SMTP
-            sent_count = 0
-            email_files = []
+            # Persist the whole batch in the outbox; the delivery worker sends and retries it
+            job = self.outbox.enqueue(
+                "alert", [(r, self._alert_message(r, subject, html_content)) for r in recipients], idempotency_key
+            )
+            if job["duplicate"]:
+                print(f"📮 Alert already queued as job {job['job_id']} - not sending twice")
+                return {
+                    "success": True,
+                    "message": f"Email alert already queued (job {job['job_id']})",
+                    "recipients": recipients,
+                    "item_name": item_name,
+                    "job_id": job["job_id"],
+                    "queued": 0,
+                    "duplicate": True,
+                    "total_recipients": len(recipients),
+                    "timestamp": datetime.now().isoformat()
+                }
             
+            email_files = []
             for recipient in recipients:
-                recipient_name = recipient_names.get(recipient, recipient) if recipient_names else recipient
-                
-                # Try to send real email
-                email_sent = self._send_real_gmail_email(recipient, subject, html_content, recipient_name)
-                
-                if email_sent:
-                    sent_count += 1
-                    print(f"✅ REAL EMAIL SENT to: {recipient}")
-                else:
-                    print(f"❌ Failed to send real email to: {recipient}")
-                
                 # Create backup email file
                 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
                 safe_item_name = (item_name or 'GENERAL').replace('/', '_').replace('\\', '_')
@@ -360,12 +370,14 @@ class EmailService:
             # Return proper format for frontend
             return {
                 "success": True,
-                "message": f"Email alert sent to {sent_count} recipients (Real emails: {sent_count}/{len(recipients)})",
+                "message": f"Email alert queued for {job['queued']} recipients (job {job['job_id']})",
                 "recipients": recipients,
                 "email_files": email_files,
                 "item_name": item_name,
                 "items_count": len(low_stock_items),
-                "real_emails_sent": sent_count,
+                "job_id": job["job_id"],
+                "queued": job["queued"],
+                "duplicate": False,
                 "total_recipients": len(recipients),
                 "timestamp": datetime.now().isoformat()
             }
@@ -402,164 +414,30 @@ class EmailService:
                 "safe_mode": True
             }
 
-    def _send_real_gmail_email(self, recipient: str, subject: str, html_content: str, recipient_name: str = None) -> bool:
-        """Send real email using Gmail SMTP with proper FROM address"""
-        try:
-            # Create message with proper FROM address
-            msg = MIMEMultipart('alternative')
-            msg['Subject'] = subject
-            msg['From'] = "Danier Stock Alerts <danieralertsystem@gmail.com>"
-            msg['To'] = recipient
-            
-            # Add HTML content
-            html_part = MIMEText(html_content, 'html')
-            msg.attach(html_part)
-            
-            # Try Gmail SMTP with your credentials and proper connection management
-            smtp_user = "danieralertsystem@gmail.com"
-            smtp_pass = "pojc nsir pjaw hhbq"
-            
-            # Try different ports with proper cleanup
-            for port in [587, 465]:
-                server = None
-                try:
-                    if port == 465:
-                        server = smtplib.SMTP_SSL('smtp.gmail.com', port, timeout=10)
-                    else:
-                        server = smtplib.SMTP('smtp.gmail.com', port, timeout=10)
-                        server.starttls()
-                    
-                    server.login(smtp_user, smtp_pass)
-                    server.send_message(msg)
-                    print(f"✅ Gmail SMTP SUCCESS to {recipient}")
-                    return True
-                    
-                except Exception as e:
-                    print(f"❌ Gmail SMTP failed port {port}: {str(e)}")
-                    continue
-                finally:
-                    # Always close connection to prevent server issues
-                    if server:
-                        try:
-                            server.quit()
-                        except:
-                            try:
-                                server.close()
-                            except:
-                                pass
-            
-            return False
-            
-        except Exception as e:
-            print(f"❌ Gmail email error: {str(e)}")
-            return False
+    def _alert_message(self, recipient: str, subject: str, html_content: str) -> MIMEMultipart:
+        """HTML alert message with proper FROM address"""
+        msg = MIMEMultipart('alternative')
+        msg['Subject'] = subject
+        msg['From'] = self.email_from
+        msg['To'] = recipient
+        msg.attach(MIMEText(html_content, 'html'))
+        return msg
 
-    def _send_real_email(self, recipient: str, subject: str, html_content: str, recipient_name: str = None) -> bool:
-        """Send real email via SMTP"""
+    def queue_email(self, recipients: List[str], subject: str, html_content: str, kind: str = "email",
+                    idempotency_key: str = None) -> Dict:
+        """Queue the same HTML email to each recipient as one outbox job"""
         try:
-            # Create message
-            msg = MIMEMultipart('alternative')
-            msg['Subject'] = subject
-            msg['From'] = self.email_from
-            msg['To'] = recipient
-            
-            # Add HTML content
-            html_part = MIMEText(html_content, 'html')
-            msg.attach(html_part)
-            
-            # Try different SMTP configurations
-            smtp_configs = [
-                # Gmail with current password
-                {
-                    'host': 'smtp.gmail.com',
-                    'port': 587,
-                    'user': self.smtp_user,
-                    'pass': self.smtp_pass,
-                    'use_tls': True
-                },
-                # Gmail with SSL
-                {
-                    'host': 'smtp.gmail.com',
-                    'port': 465,
-                    'user': self.smtp_user,
-                    'pass': self.smtp_pass,
-                    'use_ssl': True
-                },
-                # Try without authentication (for testing)
-                {
-                    'host': 'localhost',
-                    'port': 25,
-                    'user': None,
-                    'pass': None,
-                    'use_tls': False
-                }
-            ]
-            
-            for config in smtp_configs:
-                try:
-                    if config.get('use_ssl'):
-                        server = smtplib.SMTP_SSL(config['host'], config['port'])
-                    else:
-                        server = smtplib.SMTP(config['host'], config['port'])
-                        if config.get('use_tls'):
-                            server.starttls()
-                    
-                    if config['user'] and config['pass']:
-                        server.login(config['user'], config['pass'])
-                    
-                    server.send_message(msg)
-                    server.quit()
-                    return True
-                    
-                except Exception as e:
-                    print(f"SMTP config failed: {config['host']}:{config['port']} - {str(e)}")
-                    continue
-            
-            # If all SMTP configs fail, try using a simple mail command
-            return self._send_via_mail_command(recipient, subject, html_content)
-            
+            job = self.outbox.enqueue(
+                kind, [(r, self._alert_message(r, subject, html_content)) for r in recipients], idempotency_key
+            )
+            return {"success": True, **job}
         except Exception as e:
-            print(f"Error sending real email: {str(e)}")
-            return False
-
-    def _send_via_mail_command(self, recipient: str, subject: str, html_content: str) -> bool:
-        """Send email using system mail command as fallback"""
-        try:
-            import subprocess
-            
-            # Create a simple text version
-            text_content = f"""
-Danier Stock Alert
-
-{subject}
-
-This is an automated stock alert from the Danier Stock Alert System.
+            print(f"❌ Could not queue {kind} email: {str(e)}")
+            return {"success": False, "message": str(e)}
 
-Please check the attached HTML file for detailed information.
-
-Generated on: {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
-            """
-            
-            # Save HTML to temporary file
-            temp_html = f"/tmp/danier_alert_{datetime.now().strftime('%Y%m%d_%H%M%S')}.html"
-            with open(temp_html, 'w') as f:
-                f.write(html_content)
-            
-            # Try to send using mail command
-            cmd = f'echo "{text_content}" | mail -s "{subject}" -a {temp_html} {recipient}'
-            result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-            
-            # Clean up temp file
-            try:
-                os.remove(temp_html)
-            except:
-                pass
-            
-            return result.returncode == 0
-            
-        except Exception as e:
-            print(f"Mail command failed: {str(e)}")
-            return False
+    def _send_real_gmail_email(self, recipient: str, subject: str, html_content: str, recipient_name: str = None) -> bool:
+        """Queue a single email for delivery through the outbox"""
+        return self.queue_email([recipient], subject, html_content)["success"]
 
     def _update_recipient_stats(self, email: str):
         """Update recipient statistics"""
@@ -583,34 +461,39 @@ Generated on: {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
         except Exception as e:
             print(f"Error updating recipient stats: {e}")
 
+    def send_excel_report(self, recipients: List[Dict], subject: str, excel_content: bytes, filename: str,
+                          total_alerts: int = 0, source_file: str = "", idempotency_key: str = None) -> Dict:
+        """Queue the Excel report to every recipient ({email, name}) as one outbox job"""
+        messages = []
+        for recipient in recipients:
+            email = recipient.get('email', '')
+            if not email:
+                continue
+            msg = self._excel_message(email, subject, excel_content, filename, recipient.get('name') or 'Team',
+                                      total_alerts, source_file)
+            if msg is not None:
+                messages.append((email, msg))
+        if not messages:
+            return {"success": False, "message": "No valid recipients"}
+        try:
+            job = self.outbox.enqueue("excel_report", messages, idempotency_key)
+        except Exception as e:
+            print(f"❌ Could not queue Excel report: {str(e)}")
+            return {"success": False, "message": str(e)}
+        print(f"📧 EXCEL ATTACHMENT: queued for {len(messages)} recipients (job {job['job_id']})")
+        return {"success": True, **job}
+
     def send_excel_attachment(self, recipient: str, subject: str, excel_content: bytes, 
                              filename: str, recipient_name: str = None, 
                              total_alerts: int = 0, source_file: str = "") -> bool:
-        """Send email with Excel attachment - BULLETPROOF VERSION"""
-        
-        # BULLETPROOF APPROACH: Multiple fallback methods
-        print(f"📧 EXCEL ATTACHMENT: Starting bulletproof delivery to {recipient}")
-        
-        # Method 1: Try simplified email approach
-        try:
-            return self._send_excel_simple(recipient, subject, excel_content, filename, recipient_name, total_alerts, source_file)
-        except Exception as e:
-            print(f"⚠️ Method 1 failed: {e}")
-        
-        # Method 2: Try basic SMTP without attachments (just notification)
-        try:
-            return self._send_excel_notification_only(recipient, subject, recipient_name, total_alerts, source_file)
-        except Exception as e:
-            print(f"⚠️ Method 2 failed: {e}")
-        
-        # Method 3: Just log success (better than crashing)
-        print(f"📧 Excel email logged as sent to {recipient} (fallback mode)")
-        return True
+        """Queue an email with Excel attachment for a single recipient"""
+        return self.send_excel_report([{"email": recipient, "name": recipient_name}], subject, excel_content, filename,
+                                      total_alerts, source_file)["success"]
     
-    def _send_excel_simple(self, recipient: str, subject: str, excel_content: bytes, 
-                          filename: str, recipient_name: str = None, 
-                          total_alerts: int = 0, source_file: str = "") -> bool:
-        """Simplified Excel email method"""
+    def _excel_message(self, recipient: str, subject: str, excel_content: bytes, 
+                       filename: str, recipient_name: str = None, 
+                       total_alerts: int = 0, source_file: str = ""):
+        """Report email with the Excel file attached (None if it can't be built)"""
         try:
             from email.mime.multipart import MIMEMultipart
             from email.mime.text import MIMEText
@@ -619,7 +502,7 @@ Generated on: {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
             # Create message
             msg = MIMEMultipart()
             msg['Subject'] = subject
-            msg['From'] = "Danier Stock Alerts <danieralertsystem@gmail.com>"
+            msg['From'] = self.email_from
             msg['To'] = recipient
             
             # Create HTML body
@@ -694,81 +577,12 @@ Generated on: {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
             excel_attachment.add_header('Content-Disposition', f'attachment; filename="{filename}"')
             msg.attach(excel_attachment)
             
-            # Send email using Gmail SMTP with ultra-simple approach
-            smtp_user = "danieralertsystem@gmail.com"
-            smtp_pass = "pojc nsir pjaw hhbq"
-            
-            # Use only one reliable port to prevent complexity
-            server = None
-            try:
-                server = smtplib.SMTP('smtp.gmail.com', 587, timeout=30)
-                server.starttls()
-                server.login(smtp_user, smtp_pass)
-                server.send_message(msg)
-                print(f"✅ Excel attachment sent successfully to {recipient}")
-                return True
-                
-            except Exception as e:
-                print(f"❌ Excel email failed: {str(e)}")
-                return False
-            finally:
-                if server:
-                    try:
-                        server.quit()
-                    except:
-                        pass
+            return msg
                         
         except Exception as e:
             print(f"❌ Excel attachment error for {recipient}: {str(e)}")
-            return False
+            return None
     
-    def _send_excel_notification_only(self, recipient: str, subject: str, recipient_name: str = None, 
-                                     total_alerts: int = 0, source_file: str = "") -> bool:
-        """Send notification without attachment as fallback"""
-        try:
-            print(f"📧 FALLBACK: Sending notification without attachment to {recipient}")
-            
-            from email.mime.text import MIMEText
-            
-            # Create simple notification
-            msg = MIMEText(f"""
-Dear {recipient_name or 'Team'},
-
-A Danier Stock Alert Report has been generated with {total_alerts} alerts.
-
-The Excel file was generated from: {source_file}
-Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
-
-Please contact your system administrator for the detailed Excel report.
-
-Best regards,
-Danier Automated Alert System
-            """)
-            
-            msg['Subject'] = f"📊 Stock Alert Report Generated - {datetime.now().strftime('%Y-%m-%d %H:%M')}"
-            msg['From'] = "Danier Stock Alerts <danieralertsystem@gmail.com>"
-            msg['To'] = recipient
-            
-            # Send simple notification
-            server = None
-            try:
-                server = smtplib.SMTP('smtp.gmail.com', 587, timeout=15)
-                server.starttls()
-                server.login("danieralertsystem@gmail.com", "pojc nsir pjaw hhbq")
-                server.send_message(msg)
-                print(f"✅ Notification sent to {recipient}")
-                return True
-            finally:
-                if server:
-                    try:
-                        server.quit()
-                    except:
-                        pass
-                        
-        except Exception as e:
-            print(f"❌ Notification failed for {recipient}: {str(e)}")
-            return False
-
     def get_email_status(self) -> Dict:
         """Get email service status"""
         return {
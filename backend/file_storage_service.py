@@ -1,10 +1,31 @@
 import os
+import json
+import base64
 import shutil
+import hashlib
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import or_, and_, func
 from sqlalchemy.orm import Session
 from models import UploadedFile
 
+# Sortable catalog columns for paged listings (each is backed by an index on the catalog)
+CATALOG_SORT_COLUMNS = {
+    "upload_date": UploadedFile.upload_date,
+    "low_stock_count": UploadedFile.low_stock_count,
+    "file_size": UploadedFile.file_size,
+}
+CATALOG_DEFAULT_PAGE_SIZE = 100
+CATALOG_MAX_PAGE_SIZE = 500
+
+def compute_file_hash(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Return the SHA-256 hex digest of a file's content"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
 class FileStorageService:
     def __init__(self, upload_dir: Optional[str] = None):
         # Allow override via environment variable, fallback to 'uploads'
@@ -36,17 +57,7 @@ class FileStorageService:
             # Get file size
             file_size = os.path.getsize(permanent_path)
             
-            # Deactivate all previous files
-            db.query(UploadedFile).update({"is_active": False})
-            
-            # Create new uploaded file record
-            uploaded_file = UploadedFile(
-                filename=original_filename,
-                file_path=permanent_path,
-                file_size=file_size,
-                is_active=True
-            )
-            db.add(uploaded_file)
+            self.register_upload(db, permanent_path, original_filename, file_size=file_size)
             db.flush()  # Get the ID
             
             return permanent_path
@@ -55,35 +66,328 @@ class FileStorageService:
             print(f"Error saving uploaded file: {str(e)}")
             return None
     
+    # --- upload catalog ---
+    @staticmethod
+    def _present():
+        """Filter for catalog rows whose content is still readable: the raw file in the uploads dir,
+        or (once retention removed the raw file) its snapshot in the stock history"""
+        return UploadedFile.is_present == True
+
+    @classmethod
+    def _raw_present(cls):
+        """Filter for catalog rows whose raw workbook is still in the uploads dir"""
+        return and_(cls._present(), UploadedFile.raw_deleted_at.is_(None))
+
+    @staticmethod
+    def catalog_timestamp(entry: UploadedFile) -> float:
+        """Upload time of a catalog row as epoch seconds (upload_date is stored as naive UTC)"""
+        if entry.upload_date is None:
+            return 0.0
+        return (entry.upload_date - datetime(1970, 1, 1)).total_seconds()
+
+    def register_upload(self, db: Session, file_path: str, original_filename: str, file_size: Optional[int] = None,
+                        content_hash: Optional[str] = None, activate: bool = True,
+                        upload_date: Optional[datetime] = None) -> UploadedFile:
+        """Add (or refresh) the catalog row for a stored upload. Caller commits."""
+        stored_filename = os.path.basename(file_path)
+        if file_size is None:
+            file_size = os.path.getsize(file_path)
+        if activate:
+            db.query(UploadedFile).filter(UploadedFile.is_active == True).update({"is_active": False})
+
+        entry = db.query(UploadedFile).filter(UploadedFile.stored_filename == stored_filename).first()
+        if entry is None:
+            entry = UploadedFile(filename=original_filename, file_path=file_path, stored_filename=stored_filename,
+                                 total_items=0, low_stock_count=0)
+            db.add(entry)
+        elif entry.file_size != file_size or (content_hash and entry.content_hash != content_hash):
+            # Same name, different bytes - previous stats no longer apply
+            entry.stats_indexed_at = None
+        entry.file_path = file_path
+        entry.file_size = file_size
+        entry.upload_date = upload_date or datetime.utcnow()
+        entry.is_present = True
+        entry.is_active = activate
+        if content_hash:
+            entry.content_hash = content_hash
+        return entry
+
+    def reconcile_catalog(self, db: Session) -> Dict[str, int]:
+        """One-shot scan of the uploads dir at boot: register files the catalog doesn't know about,
+        flag rows whose file has gone, fold duplicate rows and make sure exactly one file is active.
+        """
+        on_disk = {}
+        with os.scandir(self.upload_dir) as entries:
+            for item in entries:
+                if item.is_file() and item.name.endswith('.xlsx'):
+                    on_disk[item.name] = item.stat()
+
+        added = missing = merged = 0
+        by_name = {}
+        for entry in db.query(UploadedFile).order_by(UploadedFile.id.desc()).all():
+            name = entry.stored_filename or os.path.basename(entry.file_path)
+            if name in by_name:
+                # Older duplicate of a file already catalogued (legacy self-healing registrations)
+                keeper = by_name[name]
+                keeper.is_active = bool(keeper.is_active or entry.is_active)
+                if keeper.stats_indexed_at is None and entry.stats_indexed_at is not None:
+                    keeper.content_hash = entry.content_hash
+                    keeper.total_items = entry.total_items
+                    keeper.low_stock_count = entry.low_stock_count
+                    keeper.stats_indexed_at = entry.stats_indexed_at
+                db.delete(entry)
+                merged += 1
+                continue
+            by_name[name] = entry
+            entry.stored_filename = name
+            # Retired raw files are expected to be gone: the row is served from the stock history
+            present = name in on_disk or entry.raw_deleted_at is not None
+            if not present and entry.is_present is not False:
+                missing += 1
+            entry.is_present = present
+            if name in on_disk:
+                entry.file_path = os.path.join(self.upload_dir, name)
+                entry.raw_deleted_at = None
+            else:
+                entry.is_active = False
+
+        for name, stat in on_disk.items():
+            if name in by_name:
+                continue
+            db.add(UploadedFile(
+                filename=name,
+                file_path=os.path.join(self.upload_dir, name),
+                stored_filename=name,
+                file_size=stat.st_size,
+                upload_date=datetime.utcfromtimestamp(stat.st_mtime),
+                is_active=False,
+                is_present=True,
+                total_items=0,
+                low_stock_count=0
+            ))
+            added += 1
+        db.flush()
+
+        # Exactly one active file: keep the newest active one, else promote the newest upload
+        active = db.query(UploadedFile).filter(UploadedFile.is_active == True, self._present()) \
+            .order_by(UploadedFile.upload_date.desc(), UploadedFile.id.desc()).all()
+        if active:
+            for extra in active[1:]:
+                extra.is_active = False
+        else:
+            newest = self.list_catalog(db, limit=1, raw_only=True)
+            if newest:
+                newest[0].is_active = True
+        db.commit()
+        return {"files_on_disk": len(on_disk), "added": added, "missing": missing, "merged": merged}
+
+    def list_catalog(self, db: Session, limit: Optional[int] = None, raw_only: bool = False) -> List[UploadedFile]:
+        """Readable catalogued uploads, newest first (single indexed query); raw_only skips retired raw files"""
+        query = db.query(UploadedFile).filter(self._raw_present() if raw_only else self._present()) \
+            .order_by(UploadedFile.upload_date.desc(), UploadedFile.id.desc())
+        if limit:
+            query = query.limit(limit)
+        return query.all()
+
+    @staticmethod
+    def _encode_cursor(value, row_id: int) -> str:
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        return base64.urlsafe_b64encode(json.dumps([value, row_id]).encode()).decode()
+
+    @staticmethod
+    def _decode_cursor(cursor: str, sort: str):
+        value, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        if sort == "upload_date" and value is not None:
+            value = datetime.fromisoformat(value)
+        return value, int(row_id)
+
+    def _filter_catalog(self, query, date_from: Optional[datetime] = None, date_to: Optional[datetime] = None,
+                        min_alerts: Optional[int] = None):
+        """Present uploads narrowed by the catalog listing filters"""
+        query = query.filter(self._present())
+        if date_from is not None:
+            query = query.filter(UploadedFile.upload_date >= date_from)
+        if date_to is not None:
+            query = query.filter(UploadedFile.upload_date <= date_to)
+        if min_alerts is not None:
+            query = query.filter(UploadedFile.stats_indexed_at.isnot(None), UploadedFile.low_stock_count >= min_alerts)
+        return query
+
+    def page_catalog(self, db: Session, limit: Optional[int] = None, cursor: Optional[str] = None,
+                     sort: str = "upload_date", order: str = "desc",
+                     date_from: Optional[datetime] = None, date_to: Optional[datetime] = None,
+                     min_alerts: Optional[int] = None) -> Tuple[List[UploadedFile], Optional[str]]:
+        """One page of the catalog using keyset pagination on (sort column, id).
+
+        Returns (rows, next_cursor); next_cursor is None on the last page. Without a limit or cursor
+        the whole filtered catalog comes back in one page (callers that predate paging rely on it).
+        Raises ValueError on a bad sort/order/cursor so endpoints can answer 400.
+        """
+        if sort not in CATALOG_SORT_COLUMNS:
+            raise ValueError(f"sort must be one of: {', '.join(CATALOG_SORT_COLUMNS)}")
+        if order not in ("asc", "desc"):
+            raise ValueError("order must be 'asc' or 'desc'")
+        unbounded = limit is None and not cursor
+        if not unbounded:
+            limit = max(1, min(int(limit or CATALOG_DEFAULT_PAGE_SIZE), CATALOG_MAX_PAGE_SIZE))
+        column = CATALOG_SORT_COLUMNS[sort]
+
+        query = self._filter_catalog(db.query(UploadedFile), date_from, date_to, min_alerts)
+        if cursor:
+            try:
+                value, row_id = self._decode_cursor(cursor, sort)
+            except Exception:
+                raise ValueError("invalid cursor")
+            if order == "desc":
+                query = query.filter(or_(column < value, and_(column == value, UploadedFile.id < row_id)))
+            else:
+                query = query.filter(or_(column > value, and_(column == value, UploadedFile.id > row_id)))
+
+        if order == "desc":
+            query = query.order_by(column.desc(), UploadedFile.id.desc())
+        else:
+            query = query.order_by(column.asc(), UploadedFile.id.asc())
+        if unbounded:
+            return query.all(), None
+        rows = query.limit(limit + 1).all()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_cursor = self._encode_cursor(getattr(last, column.key), last.id)
+        return rows, next_cursor
+
+    def catalog_totals(self, db: Session, date_from: Optional[datetime] = None, date_to: Optional[datetime] = None,
+                       min_alerts: Optional[int] = None) -> Tuple[int, int]:
+        """(file count, total bytes) for catalogued uploads still on disk, with the same filters as page_catalog"""
+        count, total_size = self._filter_catalog(
+            db.query(func.count(UploadedFile.id), func.coalesce(func.sum(UploadedFile.file_size), 0)),
+            date_from, date_to, min_alerts
+        ).one()
+        return int(count), int(total_size)
+
+    def get_catalog_entry(self, db: Session, stored_filename: str) -> Optional[UploadedFile]:
+        return db.query(UploadedFile).filter(UploadedFile.stored_filename == stored_filename).first()
+
+    def archived_hash(self, db: Session, file_path: str) -> Optional[str]:
+        """Content hash of an upload whose raw file retention removed (None for anything else)"""
+        row = db.query(UploadedFile.content_hash).filter(
+            UploadedFile.stored_filename == os.path.basename(file_path),
+            self._present(), UploadedFile.raw_deleted_at.isnot(None)
+        ).first()
+        return row.content_hash if row else None
+
+    def catalog_neighbours(self, db: Session, entry: UploadedFile) -> Tuple[Optional[UploadedFile], Optional[UploadedFile]]:
+        """(previous, next) readable uploads around a catalog row in upload order (two indexed lookups)"""
+        before = or_(UploadedFile.upload_date < entry.upload_date,
+                     and_(UploadedFile.upload_date == entry.upload_date, UploadedFile.id < entry.id))
+        after = or_(UploadedFile.upload_date > entry.upload_date,
+                    and_(UploadedFile.upload_date == entry.upload_date, UploadedFile.id > entry.id))
+        previous = db.query(UploadedFile).filter(self._present(), before) \
+            .order_by(UploadedFile.upload_date.desc(), UploadedFile.id.desc()).first()
+        following = db.query(UploadedFile).filter(self._present(), after) \
+            .order_by(UploadedFile.upload_date.asc(), UploadedFile.id.asc()).first()
+        return previous, following
+
     def get_latest_active_file(self, db: Session) -> Optional[UploadedFile]:
         """Get the most recent active uploaded file"""
-        return db.query(UploadedFile).filter(UploadedFile.is_active == True).first()
+        return db.query(UploadedFile).filter(UploadedFile.is_active == True, self._present()) \
+            .order_by(UploadedFile.upload_date.desc(), UploadedFile.id.desc()).first()
     
     def get_latest_file_path(self, db: Session) -> Optional[str]:
         """Get the file path of the latest active uploaded file"""
         latest_file = self.get_latest_active_file(db)
         return latest_file.file_path if latest_file else None
+
+    def resolve_latest_file(self, db: Session) -> Optional[UploadedFile]:
+        """Active file if it is still on disk, otherwise the newest catalogued upload (which becomes active)"""
+        latest_file = self.get_latest_active_file(db)
+        if latest_file and os.path.exists(latest_file.file_path):
+            return latest_file
+        if latest_file:
+            print(f"🔄 Active file missing on disk: {latest_file.file_path}")
+            latest_file.is_present = False
+            latest_file.is_active = False
+        for entry in self.list_catalog(db, raw_only=True):
+            if os.path.exists(entry.file_path):
+                entry.is_active = True
+                db.commit()
+                print(f"✅ Catalog: promoted {entry.stored_filename} to active file")
+                return entry
+            entry.is_present = False
+        db.commit()
+        return None
+
+    def resolve_latest_file_path(self, db: Session) -> Optional[str]:
+        latest_file = self.resolve_latest_file(db)
+        return latest_file.file_path if latest_file else None
     
-    def cleanup_old_files(self, db: Session, keep_days: int = 30):
-        """Clean up old uploaded files"""
-        try:
-            cutoff_date = datetime.now() - timedelta(days=keep_days)
-            old_files = db.query(UploadedFile).filter(
-                UploadedFile.upload_date < cutoff_date,
-                UploadedFile.is_active == False
-            ).all()
-            
-            for old_file in old_files:
-                # Delete physical file
-                if os.path.exists(old_file.file_path):
-                    os.remove(old_file.file_path)
-                
-                # Delete database record
-                db.delete(old_file)
-            
-            db.commit()
-            print(f"Cleaned up {len(old_files)} old files")
-            
-        except Exception as e:
-            print(f"Error cleaning up old files: {str(e)}")
-            db.rollback() 
\ No newline at end of file
+    def cleanup_old_files(self, db: Session, timeseries_store, frame_loader, hot_days: Optional[int] = None,
+                          keep_days: Optional[int] = None) -> Dict[str, int]:
+        """Tiered retention for uploads.
+
+        - hot (newer than hot_days): raw xlsx + parsed snapshot, untouched
+        - warm: key-item rows archived into the SKU stock history (once per content hash)
+        - cold (older than keep_days): raw xlsx deleted once its snapshot reads back from the stock
+          history; the catalog row stays listed and readers are served from that snapshot
+        The active file is never touched. frame_loader(path) must return the parsed workbook.
+        """
+        hot_days = hot_days if hot_days is not None else int(os.getenv("RETENTION_HOT_DAYS", "14"))
+        keep_days = keep_days if keep_days is not None else int(os.getenv("RETENTION_RAW_DAYS", "90"))
+        now = datetime.utcnow()
+        summary = {"archived": 0, "deduplicated": 0, "raw_deleted": 0, "bytes_freed": 0, "errors": 0}
+
+        # Warm tier: make sure everything past the hot window is in the stock history
+        to_archive = db.query(UploadedFile).filter(
+            self._raw_present(),
+            UploadedFile.archived_at.is_(None),
+            UploadedFile.upload_date < now - timedelta(days=hot_days)
+        ).order_by(UploadedFile.upload_date.asc()).all()
+        for entry in to_archive:
+            try:
+                content_hash = entry.content_hash or compute_file_hash(entry.file_path)
+                if timeseries_store.has_snapshot(content_hash):
+                    summary["deduplicated"] += 1
+                else:
+                    df = frame_loader(entry.file_path)
+                    if df is None:
+                        raise ValueError("could not parse workbook")
+                    timeseries_store.ingest(content_hash, entry.upload_date, df)
+                    summary["archived"] += 1
+                entry.content_hash = content_hash
+                entry.archived_at = now
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                summary["errors"] += 1
+                print(f"⚠️ Retention: could not archive {entry.stored_filename}: {e}")
+
+        # Cold tier: raw blobs past the retention window are deleted once their snapshot is readable
+        expired = db.query(UploadedFile).filter(
+            self._raw_present(),
+            UploadedFile.is_active == False,
+            UploadedFile.archived_at.isnot(None),
+            UploadedFile.upload_date < now - timedelta(days=keep_days)
+        ).all()
+        for entry in expired:
+            try:
+                snapshot_id = timeseries_store.snapshot_id_for_hash(entry.content_hash)
+                if snapshot_id is None:
+                    raise ValueError("snapshot missing from the stock history")
+                # Must read back before the only other copy goes
+                timeseries_store.snapshot_frame(snapshot_id)
+                if os.path.exists(entry.file_path):
+                    summary["bytes_freed"] += os.path.getsize(entry.file_path)
+                    os.remove(entry.file_path)
+                entry.raw_deleted_at = now
+                db.commit()
+                summary["raw_deleted"] += 1
+            except Exception as e:
+                db.rollback()
+                summary["errors"] += 1
+                print(f"⚠️ Retention: kept raw file {entry.stored_filename}: {e}")
+
+        print(f"🗄️ Retention complete: {summary}")
+        return summary
@@ -1,5 +1,6 @@
 import pandas as pd
-from typing import List, Dict, Tuple
+import numpy as np
+from typing import List, Dict, Tuple, Optional
 import os
 from dotenv import load_dotenv
 import hashlib
@@ -7,13 +8,22 @@ import time
 from datetime import datetime
 import re
 
+from snapshot_store import BoundedCache
+
 load_dotenv()
 
 # Resolve uploads directory once
 UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
 
+# Product-group size rules seeded into the product_group_rules table on first run
+# Women's: product group starts with '10'; Men's: product group starts with '20'
+DEFAULT_PRODUCT_GROUP_RULES = {
+    "10": {"3XS": 5, "2XS": 15, "XS": 30, "S": 40, "M": 40, "L": 30, "XL": 15},
+    "20": {"XS": 5, "S": 20, "M": 50, "L": 50, "XL": 50, "2XL": 20, "3XL": 10},
+}
+
 class KeyItemsService:
-    def __init__(self):
+    def __init__(self, snapshot_store=None):
         # Default threshold for each size (can be configured per item later)
         self.default_size_threshold = int(os.getenv("SIZE_THRESHOLD", "30"))
         
@@ -22,7 +32,14 @@ class KeyItemsService:
         self.global_key_items = set()  # Union of all KI00 items across files
         
         # Caching for performance optimization
-        self.file_cache = {}  # Cache processed data for each file
+        # Parsed DataFrames are shared across workers via the snapshot store; each worker only
+        # keeps a few hot ones locally so memory doesn't multiply with the worker count
+        self.snapshot_store = snapshot_store
+        # path -> key-item frame for uploads whose raw workbook retention removed (rebuilt from the stock history)
+        self.archive_loader = None
+        # Called with the change name ("thresholds", "snapshots") after this worker publishes a change
+        self._change_listeners = []
+        self.file_cache = BoundedCache(int(os.getenv("SNAPSHOT_LOCAL_CACHE_SIZE", "4")))
         self.low_stock_cache = {}  # Cache low stock results for each file
         
         # Performance cache
@@ -46,28 +63,148 @@ class KeyItemsService:
         # Custom thresholds for specific items (in-memory, loaded from DB)
         self.custom_thresholds = {}
 
-        # Load persisted overrides from DB at startup
+        # Shared version counters last seen by this worker (see _sync_shared_versions)
+        self._seen_versions = {}
+        self._last_version_check = 0.0
+        self.version_check_interval = float(os.getenv("SNAPSHOT_VERSION_CHECK_INTERVAL", "0.5"))
+        # Persisted thresholds fingerprint, dropped whenever a threshold change is published or seen;
+        # the generation guards against caching a value read before a concurrent change
+        self._fingerprint = None
+        self._fingerprint_generation = 0
+
+        # Product-group rules compiled to {size: [(prefix, threshold), ...]} (best match first)
+        self.product_group_rules = []
+        self._group_rule_lookup = {}
+
+        # Load persisted overrides and product-group rules from DB at startup
+        self._load_threshold_overrides()
+        self._load_product_group_rules()
+
+    def _load_threshold_overrides(self):
+        """(Re)load persisted threshold overrides from the DB into memory"""
         try:
             from database import get_db
             from models import ThresholdOverride
             db = next(get_db())
             try:
                 rows = db.query(ThresholdOverride).all()
-                for row in rows:
-                    key = f"{row.item_name}|{row.size}|{row.color}"
-                    self.custom_thresholds[key] = int(row.threshold)
+                self.custom_thresholds = {
+                    f"{row.item_name}|{row.size}|{row.color}": int(row.threshold) for row in rows
+                }
                 print(f"💾 Loaded {len(self.custom_thresholds)} persisted threshold overrides from DB")
             finally:
                 db.close()
         except Exception as e:
             print(f"⚠️ Could not load threshold overrides from DB: {e}")
             # continue without persistence if DB not ready
+
+    def _sync_shared_versions(self):
+        """Drop worker-local caches when another worker has published a new upload or threshold change"""
+        if self.snapshot_store is None:
+            return
+        now = time.time()
+        if now - self._last_version_check < self.version_check_interval:
+            return
+        self._last_version_check = now
+        current = {
+            "snapshots": self.snapshot_store.get_version("snapshots"),
+            "thresholds": self.snapshot_store.get_version("thresholds"),
+        }
+        previous = self._seen_versions
+        self._seen_versions = current
+        if not previous:
+            return
+        if current["thresholds"] != previous.get("thresholds"):
+            print("🔄 Threshold version changed in another worker - reloading overrides")
+            self._forget_fingerprint()
+            self._load_threshold_overrides()
+            self._load_product_group_rules()
+            self.cache.clear()
+            self.cache_timestamps.clear()
+            self.low_stock_cache.clear()
+        if current["snapshots"] != previous.get("snapshots"):
+            print("🔄 Snapshot version changed in another worker - dropping local caches")
+            self.clear_all_caches()
+
+    def add_listener(self, callback):
+        """Register a callback run with the change name after each publish_change"""
+        self._change_listeners.append(callback)
+
+    def publish_change(self, name: str) -> int:
+        """Bump a shared version counter after a local change so other workers invalidate too"""
+        if name == "thresholds":
+            self._forget_fingerprint()
+        version = 0
+        if self.snapshot_store is not None:
+            version = self.snapshot_store.bump_version(name)
+            if self._seen_versions:
+                self._seen_versions[name] = version
+        for callback in self._change_listeners:
+            try:
+                callback(name)
+            except Exception as e:
+                print(f"⚠️ Change listener failed for {name}: {e}")
+        return version
+
+    def _thresholds_version(self) -> int:
+        return self._seen_versions.get("thresholds", 0)
+
+    def _thresholds_fingerprint(self, overrides: Dict[str, int], rules: list) -> str:
+        payload = "\n".join(
+            [str(self.default_size_threshold)]
+            + sorted(f"o|{key}|{int(value)}" for key, value in overrides.items())
+            + sorted(f"r|{r['group_prefix']}|{r['size']}|{int(r['threshold'])}|{int(r['priority'])}" for r in rules)
+        )
+        return hashlib.sha1(payload.encode()).hexdigest()
+
+    def persisted_thresholds_fingerprint(self) -> str:
+        """Hash of the threshold configuration in the main DB (overrides + product-group rules)"""
+        from database import get_db
+        from models import ThresholdOverride, ProductGroupRule
+        db = next(get_db())
+        try:
+            overrides = {
+                f"{row.item_name}|{row.size}|{row.color}": row.threshold
+                for row in db.query(ThresholdOverride.item_name, ThresholdOverride.size, ThresholdOverride.color,
+                                    ThresholdOverride.threshold)
+            }
+            rules = [
+                {"group_prefix": r.group_prefix, "size": r.size, "threshold": r.threshold, "priority": r.priority or 0}
+                for r in db.query(ProductGroupRule.group_prefix, ProductGroupRule.size, ProductGroupRule.threshold,
+                                  ProductGroupRule.priority)
+            ]
+        finally:
+            db.close()
+        return self._thresholds_fingerprint(overrides, rules)
+
+    def _forget_fingerprint(self):
+        self._fingerprint = None
+        self._fingerprint_generation += 1
+
+    def thresholds_fingerprint(self) -> str:
+        """Persisted threshold fingerprint, reloading the in-memory thresholds first if they don't match it.
+        Read from the DB once per threshold change (this worker's or, via the version counter, another's)."""
+        self._sync_shared_versions()
+        cached = self._fingerprint
+        if cached is not None:
+            return cached
+        generation = self._fingerprint_generation
+        persisted = self.persisted_thresholds_fingerprint()
+        if self._thresholds_fingerprint(self.custom_thresholds, self.product_group_rules) != persisted:
+            print("🔄 In-memory thresholds differ from the DB - reloading overrides and product group rules")
+            self._load_threshold_overrides()
+            self._load_product_group_rules()
+            persisted = self.persisted_thresholds_fingerprint()
+        if generation == self._fingerprint_generation:
+            self._fingerprint = persisted
+        return persisted
     
     def _get_cache_key(self, operation: str, file_path: str) -> str:
         """Generate cache key for operations"""
         file_mtime = os.path.getmtime(file_path) if os.path.exists(file_path) else 0
         key_data = f"{operation}:{file_path}:{file_mtime}"
-        return hashlib.md5(key_data.encode()).hexdigest()
+        # Operation stays readable so threshold changes can drop just the affected entries
+        return f"{operation}:{hashlib.md5(key_data.encode()).hexdigest()}"
     
     def _is_cache_valid(self, cache_key: str) -> bool:
         """Check if cached result is still valid"""
@@ -80,6 +217,20 @@ class KeyItemsService:
         self.cache[cache_key] = data
         self.cache_timestamps[cache_key] = time.time()
     
+    def _invalidate_threshold_caches(self, item_names) -> int:
+        """Drop cached results a threshold change for these items affects: their per-item alerts and the
+        whole-inventory alert lists. Other items' alerts and parsed files stay cached."""
+        item_ops = {f"alerts_{name}".upper() for name in item_names}
+        keys_to_delete = [
+            k for k in list(self.cache.keys())
+            if k.split(":", 1)[0].upper() in item_ops or k.startswith("all_key_items_with_alerts")
+        ]
+        for k in keys_to_delete:
+            self.cache.pop(k, None)
+            self.cache_timestamps.pop(k, None)
+        self.low_stock_cache.clear()  # per-file low-stock lists span every item
+        return len(keys_to_delete)
+
     def _get_cache(self, cache_key: str):
         """Get data from cache if valid"""
         if self._is_cache_valid(cache_key):
@@ -132,11 +283,30 @@ class KeyItemsService:
         """Get all KI00 items ever detected across all files"""
         return sorted(list(self.global_key_items))
     
-    def _load_inventory_file(self, file_path: str) -> pd.DataFrame:
+    def _load_inventory_file(self, file_path: str, use_cache: bool = True) -> pd.DataFrame:
         """Load inventory file with flexible column detection and aggressive caching"""
         try:
-            if file_path in self.file_cache:
-                return self.file_cache[file_path]
+            content_hash = None
+            if use_cache:
+                self._sync_shared_versions()
+                cached_df = self.file_cache.get(file_path)
+                if cached_df is not None:
+                    return cached_df
+                # Another worker may already have parsed this exact workbook
+                if self.snapshot_store is not None:
+                    content_hash = self.snapshot_store.hash_for_path(file_path)
+                    shared_df = self.snapshot_store.get_frame(content_hash) if content_hash else None
+                    if shared_df is not None:
+                        self.file_cache[file_path] = shared_df
+                        print(f"⚡ Loaded {len(shared_df)} rows from shared snapshot store")
+                        return shared_df
+
+            if self.archive_loader is not None and not os.path.exists(file_path):
+                archived_df = self.archive_loader(file_path)
+                if archived_df is not None:
+                    if use_cache:
+                        self.file_cache[file_path] = archived_df
+                    return archived_df
 
             t0 = time.time()
             excel_file = pd.ExcelFile(file_path, engine='openpyxl')
@@ -158,7 +328,8 @@ class KeyItemsService:
                         )
 
                         if all(col in df.columns for col in required_columns):
-                            self.file_cache[file_path] = df
+                            if use_cache:
+                                self._publish_frame(file_path, content_hash, df)
                             print(f"⚡ Loaded {len(df)} rows in {time.time()-t0:.2f}s (sheet={sheet_name}, hdr={header_row})")
                             return df
 
@@ -171,7 +342,8 @@ class KeyItemsService:
 
                         if len(column_mapping) == len(required_columns):
                             df = df.rename(columns=column_mapping)
-                            self.file_cache[file_path] = df
+                            if use_cache:
+                                self._publish_frame(file_path, content_hash, df)
                             print(f"⚡ Loaded {len(df)} rows in {time.time()-t0:.2f}s (sheet={sheet_name}, hdr={header_row}, mapped)")
                             return df
                     except Exception:
@@ -183,6 +355,12 @@ class KeyItemsService:
             print(f"❌ Error loading file: {e}")
             return None
     
+    def _publish_frame(self, file_path: str, content_hash: str, df: pd.DataFrame):
+        """Cache a freshly parsed DataFrame locally and in the shared snapshot store"""
+        self.file_cache[file_path] = df
+        if self.snapshot_store is not None and content_hash:
+            self.snapshot_store.put_frame(content_hash, df)
+
     def extract_size_from_variant(self, variant_code: str) -> str:
         """Extract size from variant code with improved pattern matching"""
         if pd.isna(variant_code) or not isinstance(variant_code, str):
@@ -310,15 +488,9 @@ class KeyItemsService:
                         # Extract size from variant code
                         size = self.extract_size_from_variant(variant_code)
                         
-                        # Get custom threshold for this item, size, and color, or use default
-                        threshold_from_custom = self.get_custom_threshold(item_name, size, color)
-                        # Try deriving by product group (women/men) if no explicit custom override exists
-                        try:
-                            product_group_code = row['Item Product Group Code'] if 'Item Product Group Code' in row.index else None
-                        except Exception:
-                            product_group_code = None
-                        derived_threshold = None if self._has_custom_threshold(item_name, size, color) else self._threshold_by_product_group_and_size(product_group_code, size)
-                        threshold = derived_threshold if derived_threshold is not None else threshold_from_custom
+                        # Custom override, else product group rule, else default
+                        product_group_code = row['Item Product Group Code'] if 'Item Product Group Code' in row.index else None
+                        threshold = self._resolve_row_threshold(item_name, size, color, product_group_code)
                         
                         # Check if stock is below threshold
                         if pd.notna(current_stock) and current_stock < threshold:
@@ -448,21 +620,12 @@ class KeyItemsService:
             print(f"❌ Error in batch processing: {str(e)}")
             return False, [], str(e)
     
-    def get_item_alerts_cached(self, item_name: str) -> List[Dict]:
-        """Get alerts for specific item with aggressive caching"""
+    def get_item_alerts_cached(self, item_name: str, latest_file: Optional[str]) -> List[Dict]:
+        """Get alerts for specific item with aggressive caching (latest_file comes from the upload catalog)"""
         try:
-            # Find latest file
-            uploads_dir = UPLOAD_DIR
-            if not os.path.exists(uploads_dir):
-                return []
-            
-            files = [f for f in os.listdir(uploads_dir) if f.endswith('.xlsx')]
-            if not files:
+            if not latest_file or not os.path.exists(latest_file):
                 return []
             
-            files.sort(key=lambda x: os.path.getmtime(os.path.join(uploads_dir, x)), reverse=True)
-            latest_file = os.path.join(uploads_dir, files[0])
-            
             # Check cache
             cache_key = self._get_cache_key(f"alerts_{item_name}", latest_file)
             cached_result = self._get_cache(cache_key)
@@ -664,6 +827,7 @@ class KeyItemsService:
     def get_all_key_items_with_alerts(self, file_path: str) -> Tuple[List[Dict], bool, str]:
         """Get all key items with their alerts in a single ultra-fast batch operation"""
         try:
+            self._sync_shared_versions()
             # Check cache first
             cache_key = self._get_cache_key("all_key_items_with_alerts_v2", file_path)
             cached_result = self._get_cache(cache_key)
@@ -680,6 +844,15 @@ class KeyItemsService:
                 print(f"⚡ Using cached batch alerts for: {os.path.basename(file_path)}")
                 return cached_result
 
+            # Shared alert model computed by another worker for the same content + thresholds
+            content_hash = self.snapshot_store.hash_for_path(file_path) if self.snapshot_store is not None else None
+            if content_hash:
+                shared_result = self.snapshot_store.get_alert_model(content_hash, self._thresholds_version())
+                if shared_result is not None:
+                    self._set_cache(cache_key, shared_result)
+                    print(f"⚡ Using shared batch alerts for: {os.path.basename(file_path)}")
+                    return shared_result
+
             print(f"🚀 Ultra-fast batch processing all alerts: {os.path.basename(file_path)}")
             
             # Load file once
@@ -717,6 +890,15 @@ class KeyItemsService:
             if reorder_column and reorder_column in ki00_data.columns:
                 ki00_data[reorder_column] = pd.to_numeric(ki00_data[reorder_column], errors='coerce').fillna(0).astype(int)
             
+            # Size and threshold of every row in one vectorized step (override, product-group rule, default)
+            ki00_data['_size'] = (ki00_data['Variant Code'].astype(str) if 'Variant Code' in ki00_data.columns
+                                  else pd.Series('', index=ki00_data.index)).map(self.extract_size_from_variant)
+            ki00_data['_threshold'] = self.resolve_thresholds(
+                ki00_data['item_base'], ki00_data['_size'],
+                ki00_data['Variant Color'].astype(str) if 'Variant Color' in ki00_data.columns else [''] * len(ki00_data),
+                ki00_data['Item Product Group Code'] if 'Item Product Group Code' in ki00_data.columns else None
+            )
+            
             # Get unique items
             unique_items = ki00_data['item_base'].unique()
             unique_items = [item for item in unique_items if item and str(item) != 'nan']
@@ -751,21 +933,9 @@ class KeyItemsService:
                 alerts = []
                 for _, row in item_data.iterrows():
                     color = str(row.get('Variant Color', ''))
-                    variant_code = str(row.get('Variant Code', ''))
                     stock_level = int(row[stock_column])
-                    
-                    # Extract size from variant code (consistent with process_key_items_inventory)
-                    size = self.extract_size_from_variant(variant_code)
-                    
-                    # Get custom threshold for this item, size, and color
-                    threshold_from_custom = self.get_custom_threshold(item_name, size, color)
-                    # Try deriving by product group (women/men) if no explicit custom override exists
-                    try:
-                        product_group_code = row['Item Product Group Code'] if 'Item Product Group Code' in row.index else None
-                    except Exception:
-                        product_group_code = None
-                    derived_threshold = None if self._has_custom_threshold(item_name, size, color) else self._threshold_by_product_group_and_size(product_group_code, size)
-                    threshold = derived_threshold if derived_threshold is not None else threshold_from_custom
+                    size = row['_size']
+                    threshold = int(row['_threshold'])
                     
                     # Additional optional fields
                     item_number_value = None
@@ -819,6 +989,8 @@ class KeyItemsService:
             # Return in the documented order: (List[Dict], bool, str)
             result = (all_alerts, True, "")
             self._set_cache(cache_key, result)
+            if content_hash:
+                self.snapshot_store.put_alert_model(content_hash, self._thresholds_version(), result)
             
             print(f"⚡ Processed {len(unique_items)} items with {sum(len(item['alerts']) for item in all_alerts)} total alerts in batch mode")
             return result
@@ -827,6 +999,73 @@ class KeyItemsService:
             print(f"❌ Error in batch alerts processing: {str(e)}")
             return [], False, str(e) 
 
+    def compute_file_stats(self, file_path: str, df: Optional[pd.DataFrame] = None) -> Dict:
+        """Compute key-item and low-stock alert counts for a file without touching the shared caches.
+        Used by the background stats indexer so historical files don't pile up in file_cache.
+        Pass an already-parsed `df` to avoid reading the workbook again.
+        """
+        if df is None:
+            df = self._load_inventory_file(file_path, use_cache=False)
+        if df is None:
+            return {"key_items_count": 0, "low_stock_count": 0, "processed_successfully": False}
+
+        metadata = self.describe_inventory_frame(df)
+        item_column = self._detect_item_column(df.columns)
+        stock_column = self._detect_stock_column(df.columns)
+        if 'Season Code' not in df.columns or not item_column or not stock_column:
+            return {"key_items_count": 0, "low_stock_count": 0, "processed_successfully": False, "metadata": metadata}
+
+        season_norm = df['Season Code'].astype(str).str.strip().str.upper()
+        ki00_data = df[season_norm == 'KI00'].copy()
+        ki00_data['item_base'] = ki00_data[item_column].str.split(' - ').str[0].str.strip()
+        ki00_data = ki00_data[ki00_data['item_base'].notna() & (ki00_data['item_base'] != '')]
+        stock = pd.to_numeric(ki00_data[stock_column], errors='coerce').fillna(0).astype(int)
+
+        sizes = ki00_data['Variant Code'].astype(str).map(self.extract_size_from_variant)
+        thresholds = self.resolve_thresholds(
+            ki00_data['item_base'], sizes, ki00_data['Variant Color'].astype(str),
+            ki00_data['Item Product Group Code'] if 'Item Product Group Code' in ki00_data.columns else None
+        )
+        low_stock_count = int((stock.to_numpy() < thresholds).sum())
+
+        return {
+            "key_items_count": int(ki00_data['item_base'].nunique()),
+            "low_stock_count": low_stock_count,
+            "processed_successfully": True,
+            "metadata": metadata
+        }
+
+    def describe_inventory_frame(self, df: pd.DataFrame) -> Dict:
+        """Workbook metadata shown in the file lists (KI00 descriptions, raw low-stock count, shape).
+        Computed once per file at ingest and persisted in the upload catalog.
+        """
+        ki00_items = []
+        low_stock_count = 0
+        if 'Season Code' in df.columns:
+            ki00_data = df[df['Season Code'] == 'KI00']
+            item_column = next((c for c in ['Item Description', 'Item Name', 'Product Name'] if c in df.columns), None)
+            if item_column and not ki00_data.empty:
+                ki00_items = ki00_data[item_column].unique().tolist()
+            stock_column = next((c for c in ['Grand Total', 'Stock Level', 'Total Stock', 'Quantity'] if c in df.columns), None)
+            if stock_column and not ki00_data.empty:
+                stock = pd.to_numeric(ki00_data[stock_column], errors='coerce').fillna(0)
+                low_stock_count = int((stock < 10).sum())
+        return {
+            "ki00_items_count": len(ki00_items),
+            "low_stock_count": low_stock_count,
+            "ki00_items": [str(item) for item in ki00_items[:10]],  # Limit to first 10 for performance
+            "total_rows": int(len(df)),
+            "columns_detected": [str(col) for col in list(df.columns)[:5]]  # First 5 columns for debugging
+        }
+
+    def _resolve_row_threshold(self, item_name: str, size: str, color: str, product_group_code=None) -> int:
+        """Threshold for one variant row: explicit override wins, then product group rule, then default"""
+        if not self._has_custom_threshold(item_name, size, color):
+            derived_threshold = self._threshold_by_product_group_and_size(product_group_code, size)
+            if derived_threshold is not None:
+                return derived_threshold
+        return self.get_custom_threshold(item_name, size, color)
+
     def clear_all_caches(self):
         """Clear all caches when new file is uploaded"""
         print("🧹 Clearing all KeyItemsService caches...")
@@ -839,8 +1078,7 @@ class KeyItemsService:
     
     def clear_file_specific_cache(self, file_path: str):
         """Clear cache for a specific file"""
-        if file_path in self.file_cache:
-            del self.file_cache[file_path]
+        self.file_cache.pop(file_path, None)
         if file_path in self.low_stock_cache:
             del self.low_stock_cache[file_path]
         if file_path in self.dynamic_key_items:
@@ -897,15 +1135,9 @@ class KeyItemsService:
                         # Extract size from variant code
                         size = self.extract_size_from_variant(variant_code)
                         
-                        # Get custom threshold for this item, size, and color, or use default
-                        threshold_from_custom = self.get_custom_threshold(item_name, size, color)
-                        # Try deriving by product group (women/men) if no explicit custom override exists
-                        try:
-                            product_group_code = row['Item Product Group Code'] if 'Item Product Group Code' in row.index else None
-                        except Exception:
-                            product_group_code = None
-                        derived_threshold = None if self._has_custom_threshold(item_name, size, color) else self._threshold_by_product_group_and_size(product_group_code, size)
-                        threshold = derived_threshold if derived_threshold is not None else threshold_from_custom
+                        # Custom override, else product group rule, else default
+                        product_group_code = row['Item Product Group Code'] if 'Item Product Group Code' in row.index else None
+                        threshold = self._resolve_row_threshold(item_name, size, color, product_group_code)
                         
                         # Check if stock is below threshold
                         if pd.notna(current_stock) and current_stock < threshold:
@@ -956,10 +1188,10 @@ class KeyItemsService:
         """
         Check if a file is new (not in cache or recently uploaded)
         """
-        if file_path not in self.file_cache:
+        cache_entry = self.file_cache.get(file_path)
+        if cache_entry is None:
             return True
         
-        cache_entry = self.file_cache[file_path]
         if 'processed_at' not in cache_entry:
             return True
         
@@ -1044,20 +1276,73 @@ class KeyItemsService:
         except Exception as e:
             print(f"⚠️ Persistence unavailable: {e}")
         # Targeted cache invalidation for faster UX
-        keys_to_delete = []
-        for k in list(self.cache.keys()):
-            if item_name.upper() in k.upper() or "all_key_items_with_alerts" in k:
-                keys_to_delete.append(k)
-        for k in keys_to_delete:
-            try:
-                del self.cache[k]
-                if k in self.cache_timestamps:
-                    del self.cache_timestamps[k]
-            except Exception:
-                pass
-        print(f"🧹 Cleared {len(keys_to_delete)} cache entries related to {item_name}")
+        cleared = self._invalidate_threshold_caches([item_name])
+        print(f"🧹 Cleared {cleared} cache entries related to {item_name}")
+        self.publish_change("thresholds")
         return True
     
+    def set_custom_thresholds_bulk(self, rows: list, note: str = "bulk set") -> dict:
+        """
+        Set many (item, size, color) thresholds at once: upserts and history rows go in one
+        transaction (all or nothing), followed by a single cache invalidation and version bump.
+        """
+        # Last row wins for a repeated key
+        updates = {}
+        for row in rows:
+            updates[(row["item_name"], row["size"], row["color"])] = int(row["threshold"])
+        if not updates:
+            return {"created": 0, "updated": 0, "unchanged": 0}
+
+        from database import get_db
+        from models import ThresholdOverride, ThresholdHistory
+        db = next(get_db())
+        try:
+            existing = {
+                (row.item_name, row.size, row.color): row
+                for row in db.query(ThresholdOverride).filter(
+                    ThresholdOverride.item_name.in_({key[0] for key in updates}))
+            }
+            now = datetime.utcnow()
+            new_rows, history = [], []
+            created = updated = unchanged = 0
+            for (item_name, size, color), threshold in updates.items():
+                row = existing.get((item_name, size, color))
+                if row is not None and int(row.threshold) == threshold:
+                    unchanged += 1
+                    continue
+                if row is None:
+                    new_rows.append({"item_name": item_name, "size": size, "color": color,
+                                     "threshold": threshold, "updated_at": now})
+                    created += 1
+                else:
+                    old_value = int(row.threshold)
+                    row.threshold = threshold
+                    updated += 1
+                history.append({
+                    "item_name": item_name, "size": size, "color": color,
+                    "old_threshold": None if row is None else old_value,
+                    "new_threshold": threshold, "changed_at": now, "note": note
+                })
+            if new_rows:
+                db.execute(ThresholdOverride.__table__.insert(), new_rows)
+            if history:
+                db.execute(ThresholdHistory.__table__.insert(), history)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+        for (item_name, size, color), threshold in updates.items():
+            self.custom_thresholds[f"{item_name}|{size}|{color}"] = threshold
+        if created or updated:
+            # One invalidation for the whole batch, limited to the items it touched (parsed files stay cached)
+            self._invalidate_threshold_caches({item_name for item_name, _, _ in updates})
+            self.publish_change("thresholds")
+        print(f"🔧 Bulk thresholds: {created} created, {updated} updated, {unchanged} unchanged")
+        return {"created": created, "updated": updated, "unchanged": unchanged}
+    
     def get_custom_threshold(self, item_name: str, size: str = None, color: str = None) -> int:
         """
         Get custom threshold for a specific key item, size, and color, or default if not set
@@ -1105,8 +1390,21 @@ class KeyItemsService:
         except Exception:
             return False
 
+    @staticmethod
+    def normalize_rule_size(size: str) -> str:
+        """Size as used by the product group rules (upper case, XXS-style synonyms folded)"""
+        size_norm_raw = (size or "").upper()
+        # Normalize common synonyms
+        size_aliases = {
+            'XXXS': '3XS',
+            'XXS': '2XS',
+            'XXL': '2XL',
+            'XXXL': '3XL',
+        }
+        return size_aliases.get(size_norm_raw, size_norm_raw)
+
     # NEW: helper to derive threshold from Item Product Group Code and size
-    def _threshold_by_product_group_and_size(self, product_group_code: str, size: str):
+    def _threshold_by_product_group_and_size(self, product_group_code: str, size: str, lookup: Optional[dict] = None):
         if product_group_code is None:
             return None
         try:
@@ -1115,81 +1413,169 @@ class KeyItemsService:
             return None
         if not code:
             return None
-        size_norm_raw = (size or "").upper()
-        # Normalize common synonyms
-        size_aliases = {
-            'XXXS': '3XS',
-            'XXS': '2XS',
-            'XXL': '2XL',
-            'XXXL': '3XL',
-        }
-        size_norm = size_aliases.get(size_norm_raw, size_norm_raw)
-        # Women's: product group starts with '10'
-        if code.startswith('10'):
-            womens_map = {
-                '3XS': 5,
-                '2XS': 15,
-                'XS': 30,
-                'S': 40,
-                'M': 40,
-                'L': 30,
-                'XL': 15,
-            }
-            return womens_map.get(size_norm)
-        # Men's: product group starts with '20'
-        if code.startswith('20'):
-            mens_map = {
-                'XS': 5,
-                'S': 20,
-                'M': 50,
-                'L': 50,
-                'XL': 50,
-                '2XL': 20,
-                '3XL': 10,
-            }
-            return mens_map.get(size_norm)
+        lookup = self._group_rule_lookup if lookup is None else lookup
+        for prefix, threshold in lookup.get(self.normalize_rule_size(size), ()):
+            if code.startswith(prefix):
+                return threshold
         return None
-    
-    def search_article_alerts(self, search_term: str, file_path: str = None) -> list:
-        """
-        Search for specific article alerts by name or partial match
-        """
-        print(f"🔍 Searching for article: {search_term}")
-        
-        if not file_path:
-            # Use latest file
-            from main import file_storage_service
+
+    def product_group_thresholds(self, group_codes, sizes, lookup: Optional[dict] = None) -> np.ndarray:
+        """Product-group rule threshold per row (NaN where no rule applies), resolved once per
+        distinct (group code, size) pair and broadcast back with an array lookup.
+        `lookup` swaps in another compiled rule set (see group_rule_lookup)"""
+        codes = pd.Series(group_codes, dtype=object).fillna('').astype(str).str.strip()
+        code_ids, code_values = pd.factorize(codes)
+        size_ids, size_values = pd.factorize(pd.Series(sizes, dtype=object).fillna('').astype(str))
+        pair_ids = code_ids.astype(np.int64) * max(len(size_values), 1) + size_ids
+        unique_pairs, inverse = np.unique(pair_ids, return_inverse=True)
+        table = np.full(len(unique_pairs), np.nan)
+        for i, pair in enumerate(unique_pairs):
+            code, size = code_values[pair // max(len(size_values), 1)], size_values[pair % max(len(size_values), 1)]
+            threshold = self._threshold_by_product_group_and_size(code, size, lookup)
+            if threshold is not None:
+                table[i] = threshold
+        return table[inverse]
+
+    def resolve_thresholds(self, item_names, sizes, colors, group_codes=None) -> np.ndarray:
+        """Vectorized _resolve_row_threshold: override, else product-group rule, else default"""
+        items = pd.Series(item_names, dtype=object).fillna('').astype(str).reset_index(drop=True)
+        size_s = pd.Series(sizes, dtype=object).fillna('').astype(str).reset_index(drop=True)
+        color_s = pd.Series(colors, dtype=object).fillna('').astype(str).reset_index(drop=True)
+        if len(items) == 0:
+            return np.zeros(0, dtype=np.int64)
+        if group_codes is None:
+            group_codes = [None] * len(items)
+
+        # Exact override key first, then the case-insensitive match get_custom_threshold falls back to
+        keys = items + '|' + size_s + '|' + color_s
+        override = keys.map(self.custom_thresholds)
+        folded = {}
+        for stored_key, value in self.custom_thresholds.items():
+            if len(stored_key.split('|')) == 3:
+                folded.setdefault(stored_key.upper(), value)
+        override = override.fillna(keys.str.upper().map(folded))
+
+        group = self.product_group_thresholds(group_codes, size_s)
+        thresholds = np.where(override.notna(), override.to_numpy(dtype=float),
+                              np.where(np.isnan(group), self.default_size_threshold, group)).astype(np.int64)
+
+        # Rows without a size or colour take get_custom_threshold's partial-key paths
+        partial = np.flatnonzero(((size_s == '') | (color_s == '')).to_numpy())
+        if len(partial):
+            group_list = list(group_codes)
+            for i in partial:
+                thresholds[i] = self._resolve_row_threshold(items[i], size_s[i], color_s[i], group_list[i])
+        return thresholds
+
+    # --- product-group rule table ---
+    def _load_product_group_rules(self):
+        """(Re)load product-group rules from the DB (seeding the defaults on first run) and compile them"""
+        rules = None
+        try:
             from database import get_db
+            from models import ProductGroupRule, ProductGroupRuleHistory
             db = next(get_db())
-            file_path = file_storage_service.get_latest_file_path(db)
-        
-        if not file_path:
-            return []
-        
-        # Get all low stock items
-        low_stock_items, success, _ = self.process_key_items_inventory(file_path)
-        
-        if not success:
-            return []
-        
-        # Filter by search term (case insensitive)
-        search_term_lower = search_term.lower()
-        filtered_items = []
-        
-        for item in low_stock_items:
-            item_name_lower = item.get('item_name', '').lower()
-            variant_code_lower = item.get('variant_code', '').lower()
-            color_lower = item.get('color', '').lower()
-            item_description_lower = item.get('item_description', '').lower()
-            
-            if (search_term_lower in item_name_lower or 
-                search_term_lower in variant_code_lower or 
-                search_term_lower in color_lower or
-                search_term_lower in item_description_lower):
-                filtered_items.append(item)
-        
-        print(f"🔍 Found {len(filtered_items)} items matching '{search_term}'")
-        return filtered_items
+            try:
+                rows = db.query(ProductGroupRule).all()
+                # Seed only on first run (an emptied rule table with history stays empty)
+                if not rows and db.query(ProductGroupRuleHistory).count() == 0:
+                    seeded = [
+                        {"group_prefix": prefix, "size": size, "threshold": threshold, "priority": 0}
+                        for prefix, size_map in DEFAULT_PRODUCT_GROUP_RULES.items()
+                        for size, threshold in size_map.items()
+                    ]
+                    db.execute(ProductGroupRule.__table__.insert(), seeded)
+                    db.execute(ProductGroupRuleHistory.__table__.insert(), [
+                        {"group_prefix": r["group_prefix"], "size": r["size"], "old_threshold": None,
+                         "new_threshold": r["threshold"], "changed_at": datetime.utcnow(), "note": "seeded defaults"}
+                        for r in seeded
+                    ])
+                    db.commit()
+                    rows = db.query(ProductGroupRule).all()
+                rules = [
+                    {"group_prefix": r.group_prefix, "size": r.size, "threshold": int(r.threshold), "priority": int(r.priority or 0)}
+                    for r in rows
+                ]
+            finally:
+                db.close()
+        except Exception as e:
+            print(f"⚠️ Could not load product group rules from DB, using defaults: {e}")
+        if rules is None:
+            rules = [
+                {"group_prefix": prefix, "size": size, "threshold": threshold, "priority": 0}
+                for prefix, size_map in DEFAULT_PRODUCT_GROUP_RULES.items()
+                for size, threshold in size_map.items()
+            ]
+        self._compile_product_group_rules(rules)
+
+    def group_rule_lookup(self, rules: list) -> dict:
+        """size -> [(prefix, threshold)] ordered by priority, then longest prefix, so the first
+        prefix a group code starts with is the rule that applies"""
+        lookup = {}
+        for rule in sorted(rules, key=lambda r: (-r["priority"], -len(r["group_prefix"]), r["group_prefix"])):
+            lookup.setdefault(self.normalize_rule_size(rule["size"]), []).append((rule["group_prefix"], rule["threshold"]))
+        return lookup
+
+    def _compile_product_group_rules(self, rules: list):
+        self.product_group_rules = rules
+        self._group_rule_lookup = self.group_rule_lookup(rules)
+        print(f"💾 Compiled {len(rules)} product group rules")
+
+    def set_product_group_rule(self, group_prefix: str, size: str, threshold: int, priority: int = 0,
+                               note: str = "manual set") -> dict:
+        """Create or update one product-group rule (with history) and re-apply thresholds"""
+        from database import get_db
+        from models import ProductGroupRule, ProductGroupRuleHistory
+        size = self.normalize_rule_size(size)
+        db = next(get_db())
+        try:
+            row = db.query(ProductGroupRule).filter_by(group_prefix=group_prefix, size=size).first()
+            old_value = int(row.threshold) if row else None
+            if row:
+                row.threshold = int(threshold)
+                row.priority = int(priority)
+            else:
+                db.add(ProductGroupRule(group_prefix=group_prefix, size=size, threshold=int(threshold), priority=int(priority)))
+            db.add(ProductGroupRuleHistory(group_prefix=group_prefix, size=size, old_threshold=old_value,
+                                           new_threshold=int(threshold), note=note))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        self._product_group_rules_changed()
+        return {"group_prefix": group_prefix, "size": size, "threshold": int(threshold),
+                "priority": int(priority), "old_threshold": old_value}
+
+    def delete_product_group_rule(self, group_prefix: str, size: str, note: str = "deleted") -> bool:
+        from database import get_db
+        from models import ProductGroupRule, ProductGroupRuleHistory
+        size = self.normalize_rule_size(size)
+        db = next(get_db())
+        try:
+            row = db.query(ProductGroupRule).filter_by(group_prefix=group_prefix, size=size).first()
+            if row is None:
+                return False
+            db.add(ProductGroupRuleHistory(group_prefix=group_prefix, size=size, old_threshold=int(row.threshold),
+                                           new_threshold=None, note=note))
+            db.delete(row)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        self._product_group_rules_changed()
+        return True
+
+    def _product_group_rules_changed(self):
+        """Recompile rules and invalidate threshold-dependent results (here and, via the version bump, everywhere)"""
+        self._load_product_group_rules()
+        self.cache.clear()
+        self.cache_timestamps.clear()
+        self.low_stock_cache.clear()
+        self.publish_change("thresholds")
     
     def get_all_custom_thresholds(self) -> dict:
         """
@@ -1232,5 +1618,6 @@ class KeyItemsService:
         except Exception as e:
             print(f"⚠️ Persistence unavailable: {e}")
         self.clear_all_caches()
+        self.publish_change("thresholds")
         print(f"🔄 Reset threshold for {item_name} ({size}, {color}) to default")
         return True 
\ No newline at end of file
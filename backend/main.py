@@ -6,6 +6,7 @@ from sqlalchemy.orm import Session
 import tempfile
 import os
 import gc
+import time
 import asyncio
 import psutil
 from datetime import datetime, timedelta
@@ -13,15 +14,28 @@ import pandas as pd
 import threading
 import secrets
 import hashlib
+import json
+from typing import Optional
 
 from database import get_db, engine, init_db
 from models import Base, Recipient, UploadedFile, ThresholdOverride, ThresholdHistory
 from key_items_service import KeyItemsService
 from email_service import EmailService
+from email_outbox import request_idempotency_key
 from file_storage_service import FileStorageService
 from comparison_service import ComparisonService
 from recipients_storage import recipients_storage
 from threshold_analysis_service import ThresholdAnalysisService
+from search_index import ArticleSearchService, HistorySearchService, SEARCH_DEFAULT_LIMIT, SUGGEST_DEFAULT_LIMIT, \
+    HISTORY_SEARCH_DEFAULT_LIMIT
+from stats_indexer import StatsIndexer
+from snapshot_store import SharedSnapshotStore
+from current_snapshot import CurrentSnapshot
+from sku_timeseries import SkuTimeSeriesStore
+from snapshot_diff import SnapshotDiffService, DIFF_STATUSES
+from velocity_engine import VelocityEngine
+from threshold_simulator import ThresholdSimulator
+from threshold_history import ThresholdHistoryStore, expand_bulk_threshold_rows
 
 # Initialize database
 init_db()
@@ -44,11 +58,90 @@ app.add_middleware(
 )
 
 # Initialize services
-key_items_service = KeyItemsService()
+# Parsed snapshots / alert models are shared by every uvicorn worker on this host
+snapshot_store = SharedSnapshotStore()
+key_items_service = KeyItemsService(snapshot_store=snapshot_store)
 email_service = EmailService()
 file_storage_service = FileStorageService()
-comparison_service = ComparisonService(key_items_service)
-threshold_analysis_service = ThresholdAnalysisService()
+
+def _catalog_upload_date(file_path: str) -> Optional[datetime]:
+    """Upload date the catalog recorded for a stored file (None if it isn't catalogued)"""
+    db = next(get_db())
+    try:
+        entry = file_storage_service.get_catalog_entry(db, os.path.basename(file_path))
+        return entry.upload_date if entry is not None else None
+    finally:
+        db.close()
+
+# Long-format SKU stock history, appended once per distinct workbook by the stats indexer
+sku_timeseries = SkuTimeSeriesStore(size_fn=key_items_service.extract_size_from_variant, hash_fn=snapshot_store.hash_for_path,
+                                    date_fn=_catalog_upload_date)
+# Each new snapshot is diffed against its neighbours as soon as it lands in the stock history
+snapshot_diffs = SnapshotDiffService(sku_timeseries, key_items_service)
+sku_timeseries.add_listener(snapshot_diffs.on_snapshot_ingested)
+# Per-SKU sell-through velocity / days of cover, refreshed when a snapshot lands
+velocity_engine = VelocityEngine(sku_timeseries)
+threshold_simulator = ThresholdSimulator(sku_timeseries, key_items_service)
+threshold_history = ThresholdHistoryStore()
+sku_timeseries.add_listener(velocity_engine.on_snapshot_ingested)
+# Trigram / item-number search index per snapshot, built when the newest snapshot lands
+article_search = ArticleSearchService(sku_timeseries, key_items_service)
+sku_timeseries.add_listener(article_search.on_snapshot_ingested)
+# Search over every snapshot: SKU index + per-SKU (snapshot, stock) postings, extended as snapshots land
+history_search = HistorySearchService(sku_timeseries, key_items_service)
+sku_timeseries.add_listener(history_search.on_snapshot_ingested)
+stats_indexer = StatsIndexer(key_items_service, timeseries_store=sku_timeseries)
+comparison_service = ComparisonService(key_items_service, file_storage_service=file_storage_service, stats_indexer=stats_indexer,
+                                       timeseries_store=sku_timeseries, snapshot_diffs=snapshot_diffs,
+                                       result_cache=snapshot_store)
+threshold_analysis_service = ThresholdAnalysisService(key_items_service=key_items_service, timeseries_store=sku_timeseries,
+                                                      result_cache=snapshot_store, file_storage_service=file_storage_service)
+# Each indexed upload's threshold analysis (vs the upload before it) is stored before anyone asks
+stats_indexer.add_listener(threshold_analysis_service.on_file_indexed)
+
+def _on_key_items_change(name: str):
+    # Persisted alert counts were taken under the old thresholds
+    if name == "thresholds":
+        stats_indexer.requeue_stale()
+
+key_items_service.add_listener(_on_key_items_change)
+# Active inventory file + its alert model, re-validated only when the snapshot version changes
+current_snapshot = CurrentSnapshot(file_storage_service, key_items_service, snapshot_store)
+
+def _archived_upload_hash(file_path: str) -> Optional[str]:
+    """Catalogued content hash of an upload whose raw file retention removed"""
+    db = next(get_db())
+    try:
+        return file_storage_service.archived_hash(db, file_path)
+    finally:
+        db.close()
+
+def _archived_upload_frame(file_path: str) -> Optional[pd.DataFrame]:
+    """Key-item rows (with store quantities) of a retired upload, rebuilt from its stock-history snapshot"""
+    snapshot_id = sku_timeseries.snapshot_id_for_hash(_archived_upload_hash(file_path))
+    if snapshot_id is None:
+        return None
+    return sku_timeseries.snapshot_frame(snapshot_id, with_locations=True).copy()
+
+# Uploads past RETENTION_RAW_DAYS only live in the stock history: hashes come from the catalog
+# and every reader that loads a workbook gets the archived snapshot instead
+snapshot_store.archived_hash = _archived_upload_hash
+key_items_service.archive_loader = _archived_upload_frame
+
+def _upload_path(filename: str) -> Optional[str]:
+    """Path of a readable upload (raw file on disk, or archived into the stock history), else None"""
+    file_path = os.path.join(UPLOAD_DIR, filename)
+    if os.path.exists(file_path) or _archived_upload_hash(file_path):
+        return file_path
+    return None
+
+def _record_report_delivery(message):
+    """Delivered Excel reports count towards the recipient's sent stats"""
+    if message["kind"] == "excel_report" and message["status"] == "sent":
+        recipients_storage.record_email_sent(message["recipient"])
+
+# Every email goes through the durable outbox; its asyncio worker starts with the app
+email_service.outbox.add_listener(_record_report_delivery)
 
 # --- Simple credential utilities ---
 from models import UserCredential  # type: ignore
@@ -194,11 +287,7 @@ async def request_password_reset(username: str = Form(...)):
                     recipient_list.append(user.email)
                 if not recipient_list:
                     recipient_list = [os.getenv('RESET_FALLBACK_EMAIL', 'danieralertsystem@gmail.com')]
-                for rcpt in recipient_list:
-                    try:
-                        email_service._send_real_gmail_email(rcpt, subject, html, rcpt)
-                    except Exception:
-                        continue
+                email_service.queue_email(recipient_list, subject, html, kind="password_reset")
             except Exception:
                 pass
             return {"success": True, "message": "If the user exists, a reset code has been sent to active recipients."}
@@ -278,6 +367,76 @@ def cleanup_memory():
     except:
         print("🧹 Memory cleanup failed")
 
+def _resolve_latest_file_path():
+    """Latest inventory file from the in-memory snapshot handle (no DB session or stat on the hot path)"""
+    return current_snapshot.get_path()
+
+def _list_catalog():
+    """Readable catalogued uploads (including retired raw files), newest first"""
+    db = next(get_db())
+    try:
+        return file_storage_service.list_catalog(db)
+    finally:
+        db.close()
+
+def _parse_date_param(value: Optional[str], end_of_day: bool = False) -> Optional[datetime]:
+    """Parse a date / datetime query param (ISO format); bare dates on date_to cover the whole day"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", ""))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid date: {value} (use YYYY-MM-DD)")
+    if end_of_day and len(value) <= 10:
+        parsed = parsed + timedelta(days=1) - timedelta(microseconds=1)
+    return parsed
+
+def _catalog_page_params(limit, cursor, sort, order, date_from, date_to, min_alerts) -> dict:
+    """Shared query params for the paged file listings"""
+    return {
+        "limit": limit,
+        "cursor": cursor,
+        "sort": sort,
+        "order": order,
+        "date_from": _parse_date_param(date_from),
+        "date_to": _parse_date_param(date_to, end_of_day=True),
+        "min_alerts": min_alerts,
+    }
+
+def _page_catalog(page_params: dict):
+    """(rows, next_cursor, total files) for one page of the upload catalog"""
+    db = next(get_db())
+    try:
+        try:
+            rows, next_cursor = file_storage_service.page_catalog(db, **page_params)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        # Count what the filters match, not the whole catalog
+        total_files, _ = file_storage_service.catalog_totals(
+            db, page_params["date_from"], page_params["date_to"], page_params["min_alerts"]
+        )
+        return rows, next_cursor, total_files
+    finally:
+        db.close()
+
+def _catalog_totals(page_params: Optional[dict] = None):
+    """(file count, total bytes) of the catalog, narrowed by the listing's filters when given"""
+    filters = page_params or {}
+    db = next(get_db())
+    try:
+        return file_storage_service.catalog_totals(
+            db, filters.get("date_from"), filters.get("date_to"), filters.get("min_alerts")
+        )
+    finally:
+        db.close()
+
+def _select_fields(items: list, fields: Optional[str]) -> list:
+    """Project list items down to the comma-separated ?fields= selection"""
+    if not fields:
+        return items
+    wanted = [f.strip() for f in fields.split(",") if f.strip()]
+    return [{k: item[k] for k in wanted if k in item} for item in items]
+
 @app.get("/")
 async def root():
     return {"message": "Danier Key Items Stock Alert System API"}
@@ -288,10 +447,12 @@ async def get_recipients():
     try:
         # Use cached results if available
         cache_key = "recipients_cache"
+        recipients_version = snapshot_store.get_version("recipients")
         if hasattr(key_items_service, '_cache') and cache_key in key_items_service._cache:
-            cached_data = key_items_service._cache[cache_key]
-            print("⚡ Using cached recipients data")
-            return cached_data
+            cached_version, cached_data = key_items_service._cache[cache_key]
+            if cached_version == recipients_version:
+                print("⚡ Using cached recipients data")
+                return cached_data
         
         # Get fresh data (ACTIVE ONLY)
         recipients = recipients_storage.get_active_recipients()
@@ -305,7 +466,7 @@ async def get_recipients():
         # Cache the results
         if not hasattr(key_items_service, '_cache'):
             key_items_service._cache = {}
-        key_items_service._cache[cache_key] = result
+        key_items_service._cache[cache_key] = (recipients_version, result)
         
         return result
         
@@ -330,10 +491,11 @@ async def add_recipient(
 ):
     """Add a new email recipient"""
     result = recipients_storage.add_recipient(email, name, department)
-    # Invalidate recipients cache
+    # Invalidate recipients cache (in every worker)
     try:
         if hasattr(key_items_service, '_cache'):
             key_items_service._cache.pop('recipients_cache', None)
+        snapshot_store.bump_version("recipients")
     except Exception:
         pass
     return result
@@ -342,10 +504,11 @@ async def add_recipient(
 async def delete_recipient(email: str):
     """Delete a recipient email"""
     result = recipients_storage.delete_recipient(email)
-    # Invalidate recipients cache
+    # Invalidate recipients cache (in every worker)
     try:
         if hasattr(key_items_service, '_cache'):
             key_items_service._cache.pop('recipients_cache', None)
+        snapshot_store.bump_version("recipients")
     except Exception:
         pass
     return result
@@ -358,10 +521,11 @@ async def update_recipient(
 ):
     """Update recipient information"""
     result = recipients_storage.update_recipient(email, name, department)
-    # Invalidate recipients cache
+    # Invalidate recipients cache (in every worker)
     try:
         if hasattr(key_items_service, '_cache'):
             key_items_service._cache.pop('recipients_cache', None)
+        snapshot_store.bump_version("recipients")
     except Exception:
         pass
     return result
@@ -440,23 +604,19 @@ async def upload_report(file: UploadFile = File(...)):
         # Database operations - LIGHTWEIGHT
         db = next(get_db())
         try:
-            # Deactivate all previous files
-            deactivated_count = db.query(UploadedFile).update({"is_active": False})
-            print(f"📊 Deactivated {deactivated_count} previous files")
-            
-            # Create new uploaded file record - NO HEAVY PROCESSING
-            uploaded_file = UploadedFile(
-                filename=file.filename,
-                file_path=permanent_path,
+            # Register in the upload catalog as the active file - NO HEAVY PROCESSING
+            # (stats are filled in by the background indexer)
+            uploaded_file = file_storage_service.register_upload(
+                db,
+                permanent_path,
+                file.filename,
                 file_size=len(content),
-                is_active=True,
-                total_items=0,  # Will be calculated later
-                low_stock_count=0  # Will be calculated later
+                content_hash=hashlib.sha256(content).hexdigest()
             )
-            
-            db.add(uploaded_file)
             db.commit()
             print(f"✅ File registered in database: {uploaded_file.filename}")
+            # Tell the other workers a new snapshot is live and swap this worker's handle
+            current_snapshot.activate(uploaded_file, key_items_service.publish_change("snapshots"))
             
         except Exception as db_error:
             print(f"❌ Database error: {db_error}")
@@ -488,9 +648,12 @@ async def upload_report(file: UploadFile = File(...)):
         except Exception:
             pass
 
+        # Index key-item / low-stock counts for the upload history ahead of any backlog
+        stats_indexer.submit_urgent(permanent_path)
+
         # Trigger background cache warm to speed up first dashboard load (non-blocking)
         try:
-            asyncio.create_task(asyncio.to_thread(key_items_service.get_all_key_items_with_alerts, permanent_path))
+            asyncio.create_task(asyncio.to_thread(current_snapshot.get_alerts))
             print("🔥 Scheduled background warm of batch alerts after upload")
         except Exception as _:
             pass
@@ -523,26 +686,12 @@ async def get_key_items_alerts():
     try:
         print("🔍 DASHBOARD REQUEST: Getting key items alerts...")
         
-        # Get the latest uploaded file path with DB cleanup
-        db = next(get_db())
-        try:
-            latest_file_path = file_storage_service.get_latest_file_path(db)
-        finally:
-            db.close()
+        # Get the latest uploaded file path from the upload catalog
+        latest_file_path = _resolve_latest_file_path()
         
         print(f"📁 Latest file path: {latest_file_path}")
         
-        # If no file in database, try to find the most recent file in uploads directory
         if not latest_file_path:
-            uploads_dir = UPLOAD_DIR
-            if os.path.exists(uploads_dir):
-                files = [f for f in os.listdir(uploads_dir) if f.endswith('.xlsx')]
-                if files:
-                    # Sort by modification time, get the most recent
-                    files.sort(key=lambda x: os.path.getmtime(os.path.join(uploads_dir, x)), reverse=True)
-                    latest_file_path = os.path.join(uploads_dir, files[0])
-        
-        if not latest_file_path or not os.path.exists(latest_file_path):
             return {
                 "key_items_tracked": [],
                 "threshold": key_items_service.default_size_threshold,
@@ -552,7 +701,7 @@ async def get_key_items_alerts():
         
         # Use CACHED batch processing for speed - this prevents memory issues
         print("⚡ DASHBOARD: Using ultra-fast cached batch processing...")
-        all_alerts, success, error_message = key_items_service.get_all_key_items_with_alerts(latest_file_path)
+        all_alerts, success, error_message = current_snapshot.get_alerts()
         
         if not success:
             # Only fallback to fresh processing if cache completely fails
@@ -615,65 +764,45 @@ async def get_key_items_alerts():
         raise HTTPException(status_code=500, detail=f"Error retrieving alerts: {str(e)}")
 
 @app.get("/inventory-files")
-async def get_inventory_files():
-    """Get all uploaded inventory files with their key items - OPTIMIZED"""
+async def get_inventory_files(limit: Optional[int] = None, cursor: Optional[str] = None, sort: str = "upload_date",
+                              order: str = "desc", date_from: Optional[str] = None, date_to: Optional[str] = None,
+                              min_alerts: Optional[int] = None, fields: Optional[str] = None):
+    """Get uploaded inventory files with their key items - one cursor page at a time"""
     try:
-        uploads_dir = UPLOAD_DIR
-        if not os.path.exists(uploads_dir):
-            return {"files": []}
-        
-        files = [f for f in os.listdir(uploads_dir) if f.endswith('.xlsx')]
-        files.sort(key=lambda x: os.path.getmtime(os.path.join(uploads_dir, x)), reverse=True)
+        page_params = _catalog_page_params(limit, cursor, sort, order, date_from, date_to, min_alerts)
+        files, next_cursor, total_files = _page_catalog(page_params)
+        # Key items need the parsed workbook - skip that work when the caller didn't ask for them
+        want_key_items = not fields or any(f.strip() in ("key_items", "key_items_count") for f in fields.split(","))
         
-        # Use cached results if available
-        cache_key = "inventory_files_cache"
-        if hasattr(key_items_service, '_cache') and cache_key in key_items_service._cache:
-            cached_files = key_items_service._cache[cache_key]
-            if len(cached_files) == len(files):
-                print("⚡ Using cached inventory files")
-                return {
-                    "files": cached_files,
-                    "total_files": len(cached_files),
-                    "all_key_items": key_items_service.get_all_key_items()
-                }
-        
-        print(f"📁 Processing {len(files)} files for inventory list...")
+        print(f"📁 Listing {len(files)} files for inventory list...")
         file_info = []
-        
-        # Process files in batches
-        batch_size = 3
-        for i in range(0, len(files), batch_size):
-            batch_files = files[i:i + batch_size]
-            print(f"📦 Processing batch {i//batch_size + 1}/{(len(files) + batch_size - 1)//batch_size}")
-            
-            for filename in batch_files:
-                file_path = os.path.join(uploads_dir, filename)
-                try:
-                    file_key_items = key_items_service.get_file_key_items(file_path)
-                    stat = os.stat(file_path)
-                    file_info.append({
-                        "filename": filename,
-                        "upload_date": stat.st_mtime,
-                        "file_size": stat.st_size,
-                        "key_items_count": len(file_key_items),
-                        "key_items": file_key_items,
-                        "file_path": file_path
-                    })
-                except Exception as e:
-                    print(f"Error processing file {filename}: {e}")
-                    continue
-        
-        # Cache the results
-        if not hasattr(key_items_service, '_cache'):
-            key_items_service._cache = {}
-        key_items_service._cache[cache_key] = file_info
+        for entry in files:
+            try:
+                info = {
+                    "filename": entry.stored_filename,
+                    "upload_date": file_storage_service.catalog_timestamp(entry),
+                    "file_size": entry.file_size,
+                    "file_path": entry.file_path
+                }
+                if want_key_items:
+                    file_key_items = key_items_service.get_file_key_items(entry.file_path)
+                    info["key_items_count"] = len(file_key_items)
+                    info["key_items"] = file_key_items
+                file_info.append(info)
+            except Exception as e:
+                print(f"Error processing file {entry.stored_filename}: {e}")
+                continue
         
         return {
-            "files": file_info,
-            "total_files": len(file_info),
+            "files": _select_fields(file_info, fields),
+            "total_files": total_files,
+            "next_cursor": next_cursor,
+            "has_more": next_cursor is not None,
             "all_key_items": key_items_service.get_all_key_items()
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error retrieving inventory files: {str(e)}")
 
@@ -681,8 +810,8 @@ async def get_inventory_files():
 async def get_file_alerts(filename: str):
     """Get alerts for a specific inventory file"""
     try:
-        file_path = os.path.join(UPLOAD_DIR, filename)
-        if not os.path.exists(file_path):
+        file_path = _upload_path(filename)
+        if file_path is None:
             raise HTTPException(status_code=404, detail="File not found")
         
         low_stock_items, success, error_message = key_items_service.process_key_items_inventory(file_path)
@@ -741,7 +870,7 @@ async def get_key_item_alerts(item_name: str):
     """Get alerts for specific key item with lightning-fast caching"""
     try:
         # Use service-level caching for instant response
-        alerts = key_items_service.get_item_alerts_cached(item_name)
+        alerts = key_items_service.get_item_alerts_cached(item_name, _resolve_latest_file_path())
         
         return {
             "item_name": item_name,
@@ -754,23 +883,46 @@ async def get_key_item_alerts(item_name: str):
         print(f"⚠️  Error getting alerts for {item_name}: {str(e)}")
         return {"alerts": [], "error": str(e)}
 
+@app.get("/key-items/{item_name}/history")
+async def get_key_item_history(item_name: str, color: Optional[str] = None, size: Optional[str] = None):
+    """Stock of each variant of a key item across every ingested snapshot"""
+    try:
+        skus = sku_timeseries.find_skus(item_base=item_name, color=color, size=size)
+        if skus.empty:
+            return {"item_name": item_name, "variants": [], "count": 0}
+        panel = sku_timeseries.stock_panel(sku_ids=skus["sku_id"].tolist())
+        series_by_sku = {
+            int(sku_id): [
+                {"snapshot_id": int(snapshot_id), "date": upload_date.isoformat() if pd.notna(upload_date) else None, "stock": int(stock)}
+                for snapshot_id, upload_date, stock in zip(group["snapshot_id"], group["upload_date"], group["stock"])
+            ]
+            for sku_id, group in panel.groupby("sku_id", sort=False)
+        }
+        variants = [
+            {
+                "sku_id": int(sku_id),
+                "item_description": desc,
+                "color": sku_color,
+                "variant_code": variant,
+                "size": sku_size,
+                "history": series_by_sku.get(int(sku_id), [])
+            }
+            for sku_id, desc, sku_color, variant, sku_size in zip(
+                skus["sku_id"], skus["item_description"], skus["color"], skus["variant_code"], skus["size"])
+        ]
+        return {"item_name": item_name, "variants": variants, "count": len(variants)}
+    except Exception as e:
+        print(f"⚠️  Error getting stock history for {item_name}: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/test")
 async def test_system():
     """Test endpoint to verify system is working with the latest uploaded file"""
     try:
         # Get the latest uploaded file path
-        db = next(get_db())
-        latest_file_path = file_storage_service.get_latest_file_path(db)
+        latest_file_path = _resolve_latest_file_path()
         
         if not latest_file_path:
-            uploads_dir = UPLOAD_DIR
-            if os.path.exists(uploads_dir):
-                files = [f for f in os.listdir(uploads_dir) if f.endswith('.xlsx')]
-                if files:
-                    files.sort(key=lambda x: os.path.getmtime(os.path.join(uploads_dir, x)), reverse=True)
-                    latest_file_path = os.path.join(uploads_dir, files[0])
-        
-        if not latest_file_path or not os.path.exists(latest_file_path):
             return {
                 "status": "no_file",
                 "message": "No inventory file found. Please upload a file first.",
@@ -804,107 +956,68 @@ async def test_system():
         }
 
 @app.get("/upload-history")
-async def get_upload_history():
-    """Get upload history - OPTIMIZED for speed with signature-based cache validation"""
+async def get_upload_history(limit: Optional[int] = None, cursor: Optional[str] = None, sort: str = "upload_date",
+                             order: str = "desc", date_from: Optional[str] = None, date_to: Optional[str] = None,
+                             min_alerts: Optional[int] = None, fields: Optional[str] = None):
+    """Get upload history - one indexed catalog page, stats filled in by the background indexer"""
     try:
-        uploads_dir = UPLOAD_DIR
-        if not os.path.exists(uploads_dir):
-            return {"uploads": []}
-        
-        files = [f for f in os.listdir(uploads_dir) if f.endswith('.xlsx')]
-        files.sort(key=lambda x: os.path.getmtime(os.path.join(uploads_dir, x)), reverse=True)
-        
-        # Build a signature from filenames + mtimes to detect any change
-        current_signature = [
-            (fname, os.path.getmtime(os.path.join(uploads_dir, fname))) for fname in files
-        ]
-        
-        # Use cached results if available and signature matches
-        cache_key = "upload_history_cache"
-        signature_key = "upload_history_signature"
-        if hasattr(key_items_service, '_cache') and cache_key in key_items_service._cache and signature_key in key_items_service._cache:
-            cached_history = key_items_service._cache[cache_key]
-            cached_signature = key_items_service._cache[signature_key]
-            if cached_signature == current_signature:
-                print("⚡ Using cached upload history (signature matched)")
-                return {"uploads": cached_history, "total_uploads": len(cached_history)}
-        
-        print(f"📊 Fast processing {len(files)} files for upload history...")
+        page_params = _catalog_page_params(limit, cursor, sort, order, date_from, date_to, min_alerts)
+        files, next_cursor, total_files = _page_catalog(page_params)
         history = []
+        for entry in files:
+            indexed = entry.stats_indexed_at is not None
+            if not indexed:
+                # Not indexed yet - queue it and report unknown counts rather than guessing
+                stats_indexer.submit(entry.file_path)
+            history.append({
+                "filename": entry.stored_filename,
+                "upload_date": file_storage_service.catalog_timestamp(entry),
+                "file_size": entry.file_size,
+                "key_items_detected": entry.total_items if indexed else None,
+                "low_stock_alerts": entry.low_stock_count if indexed else None,
+                "processed_successfully": indexed,
+                "stats_pending": not indexed
+            })
         
-        # FAST: Use file metadata only, don't process each file individually
-        for filename in files:
-            file_path = os.path.join(uploads_dir, filename)
-            try:
-                stat = os.stat(file_path)
-                
-                # Use cached data if available for this file
-                file_cache_key = f"file_stats_{filename}"
-                if hasattr(key_items_service, '_cache') and file_cache_key in key_items_service._cache:
-                    cached_stats = key_items_service._cache[file_cache_key]
-                    history.append({
-                        "filename": filename,
-                        "upload_date": stat.st_mtime,
-                        "file_size": stat.st_size,
-                        "key_items_detected": cached_stats.get('key_items_count', 0),
-                        "low_stock_alerts": cached_stats.get('low_stock_count', 0),
-                        "processed_successfully": True
-                    })
-                else:
-                    # Quick estimation based on file size (much faster than processing)
-                    estimated_items = max(1, int(stat.st_size / 1000))  # Rough estimate
-                    history.append({
-                        "filename": filename,
-                        "upload_date": stat.st_mtime,
-                        "file_size": stat.st_size,
-                        "key_items_detected": estimated_items,
-                        "low_stock_alerts": estimated_items // 2,  # Rough estimate
-                        "processed_successfully": True
-                    })
-                    
-            except Exception as e:
-                print(f"Error processing file {filename}: {e}")
-                history.append({
-                    "filename": filename,
-                    "upload_date": stat.st_mtime if 'stat' in locals() else 0,
-                    "file_size": stat.st_size if 'stat' in locals() else 0,
-                    "key_items_detected": 0,
-                    "low_stock_alerts": 0,
-                    "processed_successfully": False
-                })
-                continue
-        
-        # Cache the results with signature
-        if not hasattr(key_items_service, '_cache'):
-            key_items_service._cache = {}
-        key_items_service._cache[cache_key] = history
-        key_items_service._cache[signature_key] = current_signature
-        
-        print(f"✅ Fast upload history: {len(history)} files processed")
-        return {"uploads": history, "total_uploads": len(history)}
+        print(f"✅ Upload history: {len(history)} files from catalog")
+        return {
+            "uploads": _select_fields(history, fields),
+            "total_uploads": total_files,
+            "next_cursor": next_cursor,
+            "has_more": next_cursor is not None
+        }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error retrieving upload history: {str(e)}")
 
 @app.get("/files/smart-analysis/{file1}/{file2}")
-async def get_smart_performance_analysis(file1: str, file2: str):
-    """Get intelligent performance analysis between two inventory files"""
+async def get_smart_performance_analysis(file1: str, file2: str, mode: str = "full",
+                                         limit: Optional[int] = None, offset: int = 0):
+    """Get intelligent performance analysis between two inventory files.
+    mode=summary returns counts, recommendations and top-N lists only; limit/offset page each category.
+    """
     try:
         file1_path = os.path.join(UPLOAD_DIR, file1)
         file2_path = os.path.join(UPLOAD_DIR, file2)
         
-        if not os.path.exists(file1_path):
+        if _upload_path(file1) is None:
             raise HTTPException(status_code=404, detail=f"File {file1} not found")
-        if not os.path.exists(file2_path):
+        if _upload_path(file2) is None:
             raise HTTPException(status_code=404, detail=f"File {file2} not found")
         
-        analysis_result = comparison_service.get_smart_performance_analysis(file1_path, file2_path)
+        analysis_result = comparison_service.get_smart_performance_analysis(
+            file1_path, file2_path, mode=mode, limit=limit, offset=offset
+        )
         
         if "error" in analysis_result:
             raise HTTPException(status_code=400, detail=analysis_result["error"])
         
         return analysis_result
         
+    except HTTPException:
+        raise
     except Exception as e:
         import traceback
         error_details = traceback.format_exc()
@@ -912,6 +1025,69 @@ async def get_smart_performance_analysis(file1: str, file2: str):
         print(f"Full traceback: {error_details}")
         raise HTTPException(status_code=500, detail=f"Error analyzing files: {str(e)}")
 
+@app.get("/files/smart-analysis/{file1}/{file2}/category/{category}")
+async def get_smart_analysis_category(file1: str, file2: str, category: str, limit: int = 50, offset: int = 0):
+    """Page through one smart-analysis category (e.g. new_products) without fetching the rest"""
+    try:
+        file1_path = os.path.join(UPLOAD_DIR, file1)
+        file2_path = os.path.join(UPLOAD_DIR, file2)
+        
+        if _upload_path(file1) is None:
+            raise HTTPException(status_code=404, detail=f"File {file1} not found")
+        if _upload_path(file2) is None:
+            raise HTTPException(status_code=404, detail=f"File {file2} not found")
+        
+        page = comparison_service.get_smart_analysis_category(file1_path, file2_path, category, limit=limit, offset=offset)
+        if "error" in page:
+            raise HTTPException(status_code=400, detail=page["error"])
+        return page
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Smart analysis category error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error analyzing files: {str(e)}")
+
+@app.get("/files/diff/{file1}/{file2}")
+async def get_snapshot_diff(file1: str, file2: str, status: Optional[str] = None, limit: int = 100, offset: int = 0):
+    """Persisted per-SKU diff from file1 (older) to file2 (newer); `status` filters the items
+    (changed, new, discontinued, newly_below, improved, worsened)"""
+    try:
+        if status is not None and status not in DIFF_STATUSES:
+            raise HTTPException(status_code=400, detail=f"Invalid status '{status}' (expected one of: {', '.join(DIFF_STATUSES)})")
+        if limit < 1 or offset < 0:
+            raise HTTPException(status_code=400, detail="limit must be positive and offset non-negative")
+        file1_path = os.path.join(UPLOAD_DIR, file1)
+        file2_path = os.path.join(UPLOAD_DIR, file2)
+        for name in (file1, file2):
+            if _upload_path(name) is None:
+                raise HTTPException(status_code=404, detail=f"File {name} not found")
+
+        result = snapshot_diffs.get_diff_for_files(file1_path, file2_path, key_items_service._load_inventory_file)
+        if result is None:
+            raise HTTPException(status_code=400, detail="Failed to load one or both files")
+        summary, items = result
+        if status is not None:
+            items = items[SnapshotDiffService.status_mask(items, status)]
+        page = items.iloc[offset:offset + limit]
+        page = page.astype(object).where(page.notna(), None)
+        return {
+            "file1": file1,
+            "file2": file2,
+            "summary": summary,
+            "status": status,
+            "items": page.to_dict('records'),
+            "total": int(len(items)),
+            "limit": limit,
+            "offset": offset,
+            "has_more": offset + len(page) < len(items)
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Snapshot diff error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error diffing files: {str(e)}")
+
 @app.get("/files/smart-analysis-simple/{file1}/{file2}")
 async def get_smart_performance_analysis_simple(file1: str, file2: str):
     """Get simple smart performance analysis between two inventory files"""
@@ -919,9 +1095,9 @@ async def get_smart_performance_analysis_simple(file1: str, file2: str):
         file1_path = os.path.join(UPLOAD_DIR, file1)
         file2_path = os.path.join(UPLOAD_DIR, file2)
         
-        if not os.path.exists(file1_path):
+        if _upload_path(file1) is None:
             return {"error": f"File {file1} not found"}
-        if not os.path.exists(file2_path):
+        if _upload_path(file2) is None:
             return {"error": f"File {file2} not found"}
         
         # Load files using key items service
@@ -983,27 +1159,73 @@ async def get_performance_analysis():
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error performing analysis: {str(e)}")
 
+@app.get("/analytics/velocity")
+async def get_sku_velocity(window_days: Optional[int] = None, sort: str = "velocity", order: str = "desc",
+                           limit: int = 100, offset: int = 0, item: Optional[str] = None):
+    """Per-SKU stock drawdown per day, days of cover and trend slope across every snapshot in the window"""
+    try:
+        if window_days is not None and window_days < 1:
+            raise HTTPException(status_code=400, detail="window_days must be positive")
+        try:
+            rows, total = velocity_engine.page(window_days, sort=sort, order=order, limit=limit, offset=offset, item=item)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return {
+            "window_days": window_days or velocity_engine.window_days,
+            "sort": sort,
+            "order": order,
+            "items": rows,
+            "total": total,
+            "limit": limit,
+            "offset": offset,
+            "has_more": offset + len(rows) < total
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Velocity analytics error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error computing velocity: {str(e)}")
+
 @app.get("/files/enhanced-list")
-async def get_enhanced_inventory_files():
-    """Get enhanced list of inventory files with detailed metadata"""
+async def get_enhanced_inventory_files(limit: Optional[int] = None, cursor: Optional[str] = None,
+                                       sort: str = "upload_date", order: str = "desc",
+                                       date_from: Optional[str] = None, date_to: Optional[str] = None,
+                                       min_alerts: Optional[int] = None, fields: Optional[str] = None):
+    """Get enhanced list of inventory files with detailed metadata (cursor paged)"""
     try:
-        files_data = comparison_service.get_all_uploaded_files()
+        page_params = _catalog_page_params(limit, cursor, sort, order, date_from, date_to, min_alerts)
+        try:
+            files_data, next_cursor = comparison_service.get_uploaded_files_page(**page_params)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        total_files, _ = _catalog_totals(page_params)
         
         return {
-            "files": files_data,
-            "total_files": len(files_data),
-            "analysis_ready": len(files_data) >= 2,
+            "files": _select_fields(files_data, fields),
+            "total_files": total_files,
+            "next_cursor": next_cursor,
+            "has_more": next_cursor is not None,
+            "analysis_ready": total_files >= 2,
             "all_key_items": key_items_service.get_all_key_items()
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error retrieving enhanced file list: {str(e)}")
 
 @app.get("/files/archive")
-async def get_file_archive():
-    """Get comprehensive file archive with categorization and search"""
+async def get_file_archive(limit: Optional[int] = None, cursor: Optional[str] = None, sort: str = "upload_date",
+                           order: str = "desc", date_from: Optional[str] = None, date_to: Optional[str] = None,
+                           min_alerts: Optional[int] = None, fields: Optional[str] = None):
+    """Get comprehensive file archive with categorization and search (cursor paged)"""
     try:
-        files_data = comparison_service.get_all_uploaded_files()
+        page_params = _catalog_page_params(limit, cursor, sort, order, date_from, date_to, min_alerts)
+        try:
+            files_data, next_cursor = comparison_service.get_uploaded_files_page(**page_params)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        total_files, total_size = _catalog_totals(page_params)
         
         # Categorize files by age and status
         recent_files = []
@@ -1017,22 +1239,23 @@ async def get_file_archive():
                 else:
                     archive_files.append(file)
         
-        # Sort by date
-        recent_files.sort(key=lambda x: x.get('upload_timestamp', 0), reverse=True)
-        archive_files.sort(key=lambda x: x.get('upload_timestamp', 0), reverse=True)
-        
+        # Page order (server-side sort) is preserved within each group
         return {
-            "recent_files": recent_files,
-            "archive_files": archive_files,
-            "total_files": len(files_data),
+            "recent_files": _select_fields(recent_files, fields),
+            "archive_files": _select_fields(archive_files, fields),
+            "total_files": total_files,
             "recent_count": len(recent_files),
             "archive_count": len(archive_files),
+            "next_cursor": next_cursor,
+            "has_more": next_cursor is not None,
             "storage_info": {
                 "upload_directory": UPLOAD_DIR,
-                "total_size_mb": sum(f.get("file_size", 0) for f in files_data if "error" not in f) / (1024 * 1024)
+                "total_size_mb": total_size / (1024 * 1024)
             }
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error retrieving file archive: {str(e)}")
 
@@ -1041,15 +1264,28 @@ async def download_archive_file(filename: str):
     """Download a file from the archive"""
     try:
         file_path = os.path.join(UPLOAD_DIR, filename)
-        if not os.path.exists(file_path):
+        if os.path.exists(file_path):
+            return FileResponse(
+                file_path,
+                media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+                filename=filename
+            )
+
+        # Raw workbook retired by retention: export its key-item rows from the stock history
+        df = _archived_upload_frame(file_path)
+        if df is None:
             raise HTTPException(status_code=404, detail="File not found")
-        
-        return FileResponse(
-            file_path,
+        import io
+        output = io.BytesIO()
+        df.drop(columns=["sku_id", "item_base", "size"]).to_excel(output, index=False, engine="openpyxl")
+        return Response(
+            content=output.getvalue(),
             media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            filename=filename
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'}
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error downloading file: {str(e)}")
 
@@ -1059,52 +1295,8 @@ async def get_all_key_items_with_alerts():
     try:
         print("⚡ BATCH ALERTS: Starting request...")
         
-        # Use DB to get latest active file path with immediate cleanup
-        db = next(get_db())
-        try:
-            latest_file_path = file_storage_service.get_latest_file_path(db)
-        finally:
-            db.close()
-        
-        # Self-healing: If no file in DB OR path missing, try to find files in uploads directory
-        if not latest_file_path or not os.path.exists(latest_file_path):
-            if latest_file_path and not os.path.exists(latest_file_path):
-                print(f"🔄 Self-healing: DB path missing on disk: {latest_file_path}")
-            else:
-                print("🔄 Self-healing: No file in database, searching uploads directory...")
-            uploads_dir = UPLOAD_DIR
-            if os.path.exists(uploads_dir):
-                files = [f for f in os.listdir(uploads_dir) if f.endswith('.xlsx')]
-                if files:
-                    # Sort by modification time, get the most recent
-                    files.sort(key=lambda x: os.path.getmtime(os.path.join(uploads_dir, x)), reverse=True)
-                    latest_file_path = os.path.join(uploads_dir, files[0])
-                    print(f"✅ Self-healing: Using latest file {files[0]} in uploads directory")
-                    
-                    # Register this file in the database with error handling
-                    try:
-                        db = next(get_db())
-                        try:
-                            # Deactivate all previous files
-                            db.query(UploadedFile).update({"is_active": False})
-                            
-                            # Create new uploaded file record
-                            file_size = os.path.getsize(latest_file_path)
-                            uploaded_file = UploadedFile(
-                                filename=files[0],
-                                file_path=latest_file_path,
-                                file_size=file_size,
-                                is_active=True,
-                                total_items=0,
-                                low_stock_count=0
-                            )
-                            db.add(uploaded_file)
-                            db.commit()
-                            print(f"✅ Self-healing: Registered {files[0]} in database")
-                        finally:
-                            db.close()
-                    except Exception as e:
-                        print(f"⚠️ Self-healing database registration failed: {e}")
+        # Self-healing: the catalog falls back to the newest upload if the active file is gone
+        latest_file_path = _resolve_latest_file_path()
         
         if not latest_file_path:
             return {
@@ -1123,7 +1315,7 @@ async def get_all_key_items_with_alerts():
         
         # Use ultra-fast batch processing with memory management
         print("⚡ BATCH ALERTS: Using cached batch processing...")
-        all_alerts, success, error = key_items_service.get_all_key_items_with_alerts(latest_file_path)
+        all_alerts, success, error = current_snapshot.get_alerts()
         
         if not success:
             print(f"❌ BATCH ALERTS: Cache failed, error: {error}")
@@ -1151,20 +1343,71 @@ async def get_all_key_items_with_alerts():
         cleanup_memory()
         return {"key_items": [], "error": str(e)}
 
+@app.get("/search/suggest")
+async def search_suggest(q: str = "", limit: int = SUGGEST_DEFAULT_LIMIT):
+    """Typeahead: styles, item numbers and item/colour/size variants starting with q,
+    ranked by current alert severity then stock (prefix index built once per snapshot)"""
+    try:
+        latest_file_path = _resolve_latest_file_path()
+        suggestions = article_search.suggest(q, latest_file_path, limit=limit) if latest_file_path and q.strip() else []
+        return {"query": q, "suggestions": suggestions, "count": len(suggestions)}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        print(f"❌ Suggest error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Suggest failed: {str(e)}")
+
+@app.get("/search/history")
+async def search_history(q: str, limit: int = HISTORY_SEARCH_DEFAULT_LIMIT, offset: int = 0):
+    """Search every uploaded snapshot: matching SKUs with their per-snapshot stock timeline
+    (served from the stock history - no workbook is opened)"""
+    try:
+        if not q.strip():
+            raise HTTPException(status_code=400, detail="q is required")
+        results, total, snapshot_count = history_search.search(q, limit=limit, offset=offset)
+        return {
+            "query": q,
+            "results": results,
+            "count": len(results),
+            "total": total,
+            "snapshot_count": snapshot_count,
+            "limit": limit,
+            "offset": offset
+        }
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        print(f"❌ History search error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"History search failed: {str(e)}")
+
 @app.get("/search/article/{search_term}")
-async def search_article_alerts(search_term: str):
-    """Search for specific article alerts"""
+async def search_article_alerts(search_term: str, scope: str = "alerts", limit: int = SEARCH_DEFAULT_LIMIT,
+                                offset: int = 0):
+    """Search the latest snapshot by item name, description, variant code, colour or item number.
+    scope=alerts (default) returns only items below threshold; scope=all searches the whole catalogue."""
     try:
         print(f"🔍 API: Searching for article '{search_term}'")
-        results = key_items_service.search_article_alerts(search_term)
+        latest_file_path = _resolve_latest_file_path()
+        if not latest_file_path:
+            results, total = [], 0
+        else:
+            results, total = article_search.search(search_term, latest_file_path, scope=scope, limit=limit, offset=offset)
         
         return {
             "search_term": search_term,
             "results": results,
             "count": len(results),
+            "total": total,
+            "scope": scope,
+            "limit": limit,
+            "offset": offset,
             "timestamp": datetime.now().isoformat()
         }
         
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         print(f"❌ Search error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
@@ -1179,7 +1422,7 @@ async def set_custom_threshold(
     """Set custom threshold and recalculate alerts from the Excel sheet"""
     try:
         if threshold < 0:
-            raise HTTPException(status_code=400, detail="Threshold must be positive")
+            raise HTTPException(status_code=400, detail="Threshold cannot be negative")
 
         success = key_items_service.set_custom_threshold(item_name, size, color, threshold)
 
@@ -1189,11 +1432,7 @@ async def set_custom_threshold(
         # Recalculate: check Excel for new/resolved shortages with the updated threshold
         new_alerts = []
         try:
-            db = next(get_db())
-            try:
-                fp = file_storage_service.get_latest_file_path(db)
-            finally:
-                db.close()
+            fp = _resolve_latest_file_path()
             if fp:
                 df = key_items_service._load_inventory_file(fp)
                 if df is not None and 'Season Code' in df.columns:
@@ -1231,6 +1470,107 @@ async def set_custom_threshold(
         print(f"❌ Set threshold error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to set threshold: {str(e)}")
 
+@app.get("/thresholds/product-group-rules")
+async def get_product_group_rules():
+    """Product-group size rules applied to variants without a per-item override"""
+    try:
+        size_order = {size: i for i, size in enumerate(key_items_service.size_mapping)}
+        rules = sorted(key_items_service.product_group_rules,
+                       key=lambda r: (r["group_prefix"], size_order.get(r["size"], len(size_order)), r["size"]))
+        return {"rules": rules, "count": len(rules), "default_threshold": key_items_service.default_size_threshold}
+    except Exception as e:
+        print(f"❌ Get product group rules error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to get product group rules: {str(e)}")
+
+@app.post("/thresholds/product-group-rules")
+async def set_product_group_rule(
+    group_prefix: str = Form(...),
+    size: str = Form(...),
+    threshold: int = Form(...),
+    priority: int = Form(0)
+):
+    """Create or update a product-group size rule; takes effect without a redeploy"""
+    try:
+        group_prefix = group_prefix.strip()
+        if not group_prefix or not size.strip():
+            raise HTTPException(status_code=400, detail="group_prefix and size are required")
+        if threshold < 0:
+            raise HTTPException(status_code=400, detail="Threshold cannot be negative")
+        rule = key_items_service.set_product_group_rule(group_prefix, size.strip(), threshold, priority)
+        _all_options_cache["data"] = None
+        return {"success": True, "rule": rule}
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"❌ Set product group rule error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to set product group rule: {str(e)}")
+
+@app.delete("/thresholds/product-group-rules/{group_prefix}/{size}")
+async def delete_product_group_rule(group_prefix: str, size: str):
+    try:
+        if not key_items_service.delete_product_group_rule(group_prefix, size):
+            raise HTTPException(status_code=404, detail="Rule not found")
+        _all_options_cache["data"] = None
+        return {"success": True, "group_prefix": group_prefix, "size": size}
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"❌ Delete product group rule error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to delete product group rule: {str(e)}")
+
+@app.post("/thresholds/bulk")
+async def set_custom_thresholds_bulk(
+    rows: str = Form(...),
+    note: str = Form("bulk set")
+):
+    """Set many thresholds in one transaction. rows is a JSON list of {item_name, size, color, threshold};
+    size and/or color may be "*" (or omitted) for every known variant of the item."""
+    try:
+        try:
+            parsed_rows = json.loads(rows)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="rows must be valid JSON")
+        try:
+            concrete, unmatched = expand_bulk_threshold_rows(parsed_rows, sku_timeseries)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        result = key_items_service.set_custom_thresholds_bulk(concrete, note=note)
+        _all_options_cache["data"] = None
+
+        # One pass over the latest snapshot for every affected item
+        recalculated = []
+        try:
+            fp = _resolve_latest_file_path()
+            affected_items = {row["item_name"] for row in concrete}
+            if fp and affected_items:
+                df = sku_timeseries.frame_for_file(fp, key_items_service._load_inventory_file)
+                sub = df[df["item_base"].isin(affected_items)]
+                sizes = sub["size"].fillna("")
+                thresholds = key_items_service.resolve_thresholds(sub["item_base"], sizes, sub["Variant Color"],
+                                                                  sub["Item Product Group Code"])
+                for item_base, size, color, qty, t in zip(sub["item_base"], sizes, sub["Variant Color"],
+                                                          sub["Grand Total"], thresholds):
+                    recalculated.append({"item_name": item_base, "size": size, "color": color, "stock": int(qty),
+                                         "threshold": int(t), "is_low": int(qty) < int(t)})
+        except Exception as recalc_err:
+            print(f"⚠️ Bulk threshold recalc warning: {recalc_err}")
+
+        return {
+            "success": True,
+            **result,
+            "applied": len(concrete),
+            "unmatched": unmatched,
+            "recalculated_alerts": recalculated,
+            "new_low_stock_count": sum(1 for a in recalculated if a["is_low"]),
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"❌ Bulk threshold error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to set thresholds: {str(e)}")
+
 @app.get("/thresholds/get/{item_name}/{size}/{color}")
 async def get_custom_threshold(item_name: str, size: str, color: str):
     """Get custom threshold for a specific key item, size, and color combination"""
@@ -1252,6 +1592,30 @@ async def get_custom_threshold(item_name: str, size: str, color: str):
         print(f"❌ Get threshold error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to get threshold: {str(e)}")
 
+@app.post("/thresholds/simulate")
+async def simulate_thresholds(
+    rules: str = Form(...),
+    snapshots: int = Form(10),
+    limit: int = Form(100)
+):
+    """What-if: alerts the candidate thresholds would have raised over the last N snapshots.
+    rules is a JSON list of {item_name, size, [color], threshold} and/or {product_group, size, threshold}.
+    Nothing is saved."""
+    try:
+        try:
+            parsed_rules = json.loads(rules)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="rules must be valid JSON")
+        try:
+            return threshold_simulator.simulate(parsed_rules, snapshots=snapshots, limit=limit)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"❌ Threshold simulation error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Threshold simulation failed: {str(e)}")
+
 @app.get("/thresholds/all")
 async def get_all_custom_thresholds():
     """Get all custom thresholds"""
@@ -1322,11 +1686,7 @@ async def warm_cache():
         print("🔥 WARMING CACHE: Starting cache warm-up...")
         
         # Get latest file
-        db = next(get_db())
-        try:
-            latest_file_path = file_storage_service.get_latest_file_path(db)
-        finally:
-            db.close()
+        latest_file_path = _resolve_latest_file_path()
             
         if not latest_file_path:
             return {"success": False, "message": "No file to warm cache for"}
@@ -1335,7 +1695,7 @@ async def warm_cache():
         def warm_cache_background():
             try:
                 print("🔥 BACKGROUND WARM: Starting cache warming...")
-                key_items_service.get_all_key_items_with_alerts(latest_file_path)
+                current_snapshot.get_alerts()
                 print("✅ BACKGROUND WARM: Cache warmed successfully")
             except Exception as e:
                 print(f"❌ BACKGROUND WARM: Cache warming failed: {e}")
@@ -1361,23 +1721,20 @@ async def clear_all_caches_api():
 # Email Alert Endpoints
 @app.post("/email/send-alert")
 async def send_email_alert(
-    item_name: str = Form(None)
+    item_name: str = Form(None),
+    idempotency_key: Optional[str] = Form(None)
 ):
-    """Send personalized email alert to all active recipients - NON-BLOCKING (ultra-light latest file lookup)"""
+    """Queue personalized email alert to all active recipients in the outbox - NON-BLOCKING (track via /email/jobs/{job_id})"""
     try:
         print(f"📧 EMAIL REQUEST: Starting email alert for item: {item_name or 'ALL'}")
         
         # Lightweight: get latest file path from DB (no full scan)
-        db = next(get_db())
-        try:
-            latest_file_path = file_storage_service.get_latest_file_path(db)
-        finally:
-            db.close()
-        if not latest_file_path or not os.path.exists(latest_file_path):
+        latest_file_path = _resolve_latest_file_path()
+        if not latest_file_path:
             raise HTTPException(status_code=400, detail="No inventory file found")
         
         # Get all items with alerts (cached and fast)
-        all_alerts, success, error = key_items_service.get_all_key_items_with_alerts(latest_file_path)
+        all_alerts, success, error = current_snapshot.get_alerts()
         if not success:
             raise HTTPException(status_code=400, detail=error)
         
@@ -1399,35 +1756,39 @@ async def send_email_alert(
             recipients = [r['email'] for r in active_recipients if r.get('active', True)]
             recipient_names = {r['email']: r.get('name') for r in active_recipients}
         
-        print(f"📧 Preparing background email to {len(recipients)} recipients | items: {len(low_stock_items)} | item={item_name or 'ALL'}")
-        
-        # Background send for speed and stability
-        def _send_background():
-            try:
-                email_service.send_personalized_alert(
-                    recipients=recipients,
-                    low_stock_items=low_stock_items,
-                    recipient_names=recipient_names,
-                    item_name=item_name or None
-                )
-            except Exception as e:
-                print(f"❌ BACKGROUND EMAIL ERROR: {e}")
-        
-        threading.Thread(target=_send_background, daemon=True).start()
+        print(f"📧 Queueing email to {len(recipients)} recipients | items: {len(low_stock_items)} | item={item_name or 'ALL'}")
+        
+        # Durable outbox job: the delivery worker sends it with retries, repeat clicks collapse into it
+        key = request_idempotency_key(idempotency_key, "alert", item_name or "ALL", os.path.basename(latest_file_path),
+                                      len(low_stock_items), ",".join(sorted(recipients)))
+        result = await asyncio.to_thread(
+            email_service.send_personalized_alert,
+            recipients=recipients,
+            low_stock_items=low_stock_items,
+            recipient_names=recipient_names,
+            item_name=item_name or None,
+            idempotency_key=key
+        )
+        if not result.get("success"):
+            raise HTTPException(status_code=500, detail=result.get("message", "Could not queue email alert"))
         
         # Return immediately
         return {
             "success": True,
             "message": (
-                f"Email alert for {item_name} is being sent to {len(recipients)} recipients in the background"
-                if item_name else f"General email alert is being sent to {len(recipients)} recipients in the background"
+                f"Email alert for {item_name} is queued for {len(recipients)} recipients"
+                if item_name else f"General email alert is queued for {len(recipients)} recipients"
             ),
             "recipients": recipients,
             "items_count": len(low_stock_items),
             "item_name": item_name,
-            "processing_status": "background"
+            "job_id": result["job_id"],
+            "duplicate": result.get("duplicate", False),
+            "processing_status": "queued"
         }
             
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"❌ EMAIL REQUEST ERROR: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -1444,27 +1805,25 @@ async def get_email_status():
         "status": "Ready" if smtp_configured else "Not configured"
     }
 
+@app.get("/email/jobs/{job_id}")
+async def get_email_job(job_id: str):
+    """Delivery status of a queued email job (send-alert, download-all report, ...)"""
+    try:
+        job = await asyncio.to_thread(email_service.outbox.status, job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail=f"Email job {job_id} not found")
+        return job
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/threshold-analysis")
 async def get_threshold_analysis():
     """Get threshold change analysis between latest and previous file uploads"""
     try:
-        # Get all uploaded files
-        files = comparison_service.get_all_uploaded_files()
-        if not files:
-            return {"error": "No files uploaded yet"}
-        
-        if len(files) < 2:
-            # Only one file - initial analysis
-            current_file = files[0]
-            analysis = threshold_analysis_service.analyze_threshold_changes(current_file['file_path'])
-        else:
-            # Compare latest with previous
-            current_file = files[0]  # Most recent
-            previous_file = files[1]  # Second most recent
-            analysis = threshold_analysis_service.analyze_threshold_changes(
-                current_file['file_path'], 
-                previous_file['file_path']
-            )
+        # Stored per (file, predecessor) pair at ingest; computed once here if missing or thresholds changed
+        analysis = threshold_analysis_service.analysis_for_file()
         
         # Add summary
         analysis['summary_text'] = threshold_analysis_service.get_threshold_alert_summary(analysis)
@@ -1478,41 +1837,8 @@ async def get_threshold_analysis():
 async def get_threshold_analysis_for_file(filename: str):
     """Get threshold analysis for a specific file compared to its previous upload"""
     try:
-        # Get all uploaded files
-        files = comparison_service.get_all_uploaded_files()
-        if not files:
-            return {"error": "No files uploaded yet"}
-        
-        # Find the specified file
-        target_file = None
-        target_index = -1
-        
-        for i, file in enumerate(files):
-            if file['filename'] == filename:
-                target_file = file
-                target_index = i
-                break
-        
-        if not target_file:
-            return {"error": f"File {filename} not found"}
-        
-        if target_index == 0:
-            # Latest file - compare with previous
-            if len(files) < 2:
-                analysis = threshold_analysis_service.analyze_threshold_changes(target_file['file_path'])
-            else:
-                previous_file = files[1]
-                analysis = threshold_analysis_service.analyze_threshold_changes(
-                    target_file['file_path'], 
-                    previous_file['file_path']
-                )
-        else:
-            # Compare with the file before it
-            previous_file = files[target_index + 1]
-            analysis = threshold_analysis_service.analyze_threshold_changes(
-                target_file['file_path'], 
-                previous_file['file_path']
-            )
+        # The oldest upload gets the initial (baseline) analysis
+        analysis = threshold_analysis_service.analysis_for_file(filename)
         
         # Add summary
         analysis['summary_text'] = threshold_analysis_service.get_threshold_alert_summary(analysis)
@@ -1526,48 +1852,8 @@ async def get_threshold_analysis_for_file(filename: str):
 async def get_key_items_summary():
     """Ultra-fast summary of key items with self-healing file detection"""
     try:
-        db = next(get_db())
-        try:
-            latest_file_path = file_storage_service.get_latest_file_path(db)
-        finally:
-            db.close()
-        
-        # Self-healing: If no file in DB, try to find files in uploads directory
-        if not latest_file_path:
-            print("🔄 Self-healing: No file in database, searching uploads directory...")
-            uploads_dir = UPLOAD_DIR
-            if os.path.exists(uploads_dir):
-                files = [f for f in os.listdir(uploads_dir) if f.endswith('.xlsx')]
-                if files:
-                    # Sort by modification time, get the most recent
-                    files.sort(key=lambda x: os.path.getmtime(os.path.join(uploads_dir, x)), reverse=True)
-                    latest_file_path = os.path.join(uploads_dir, files[0])
-                    print(f"✅ Self-healing: Found file {files[0]} in uploads directory")
-                    
-                    # Register this file in the database
-                    try:
-                        db = next(get_db())
-                        try:
-                            # Deactivate all previous files
-                            db.query(UploadedFile).update({"is_active": False})
-                            
-                            # Create new uploaded file record
-                            file_size = os.path.getsize(latest_file_path)
-                            uploaded_file = UploadedFile(
-                                filename=files[0],
-                                file_path=latest_file_path,
-                                file_size=file_size,
-                                is_active=True,
-                                total_items=0,
-                                low_stock_count=0
-                            )
-                            db.add(uploaded_file)
-                            db.commit()
-                            print(f"✅ Self-healing: Registered {files[0]} in database")
-                        finally:
-                            db.close()
-                    except Exception as e:
-                        print(f"⚠️ Self-healing database registration failed: {e}")
+        # Self-healing: the catalog falls back to the newest upload if the active file is gone
+        latest_file_path = _resolve_latest_file_path()
         
         if not latest_file_path:
             return {
@@ -1585,7 +1871,7 @@ async def get_key_items_summary():
             }
         
         # Use ultra-fast batch processing with caching
-        all_alerts, success, error = key_items_service.get_all_key_items_with_alerts(latest_file_path)
+        all_alerts, success, error = current_snapshot.get_alerts()
         
         if not success:
             # Only fallback to fresh processing if batch fails completely
@@ -1623,11 +1909,7 @@ _all_options_cache = {"data": None, "file": None}
 
 def _build_all_item_options():
     """Build options for ALL key items in one pass. Result is cached."""
-    db = next(get_db())
-    try:
-        latest_file_path = file_storage_service.get_latest_file_path(db)
-    finally:
-        db.close()
+    latest_file_path = _resolve_latest_file_path()
     if not latest_file_path:
         return {}
     if _all_options_cache["data"] and _all_options_cache["file"] == latest_file_path:
@@ -1674,23 +1956,19 @@ async def get_all_item_options():
         return {"items": {}, "count": 0, "error": str(e)}
 
 @app.post("/alerts/download-all")
-async def download_all_alerts():
+async def download_all_alerts(idempotency_key: Optional[str] = Form(None)):
     """Generate Excel report of all alerts and send email notification - ULTRA STABLE"""
     try:
         print("📊 Starting download all alerts - non-blocking mode")
         
         # Get the latest file path with error handling
-        db = next(get_db())
-        try:
-            latest_file_path = file_storage_service.get_latest_file_path(db)
-        finally:
-            db.close()
+        latest_file_path = _resolve_latest_file_path()
             
-        if not latest_file_path or not os.path.exists(latest_file_path):
+        if not latest_file_path:
             raise HTTPException(status_code=404, detail="No inventory file found")
         
         # Get all alerts using CACHED data (no heavy processing)
-        all_alerts, success, error = key_items_service.get_all_key_items_with_alerts(latest_file_path)
+        all_alerts, success, error = current_snapshot.get_alerts()
         
         if not success:
             raise HTTPException(status_code=400, detail=error)
@@ -1774,106 +2052,39 @@ async def download_all_alerts():
         
         print(f"✅ Excel generated with {total_alerts} alerts")
         
-        # PERMANENT SOLUTION: Email Excel file with bulletproof error handling
-        def send_excel_email_safe():
-            try:
-                print("📧 DOWNLOAD EMAIL: Starting bulletproof Excel email delivery...")
-                recipients = recipients_storage.get_active_recipients()
-                if not recipients:
-                    print("⚠️ No active recipients found for Excel email")
-                    return
-                
+        # Email the Excel file through the durable outbox (non-critical: the download never waits on SMTP)
+        email_job_id = None
+        try:
+            recipients = recipients_storage.get_active_recipients()
+            if recipients:
                 timestamp = datetime.now().strftime("%Y-%m-%d %H:%M")
-                subject = f"📊 Danier Stock Alert Report - {timestamp}"
-                
-                # Use ultra-simple email approach to prevent crashes
-                import subprocess
-                import tempfile
-                import os
-                
-                # Save Excel to temp file
-                temp_dir = tempfile.mkdtemp()
                 excel_filename = f"danier_alerts_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-                excel_path = os.path.join(temp_dir, excel_filename)
-                
-                with open(excel_path, 'wb') as f:
-                    f.write(output.getvalue())
-                
-                success_count = 0
-                for recipient in recipients:
-                    try:
-                        recipient_email = recipient.get('email', '')
-                        recipient_name = recipient.get('name', 'Team')
-                        
-                        # Create simple email body
-                        email_body = f"""
-Subject: {subject}
-To: {recipient_email}
-From: Danier Stock Alerts <danieralertsystem@gmail.com>
-
-Dear {recipient_name},
-
-Please find attached the Danier Stock Alert Report generated on {timestamp}.
-
-Report Details:
-- Total Alerts: {total_alerts}
-- File: {excel_filename}
-- Generated: {timestamp}
-
-The Excel file contains all current low stock alerts with priority color coding.
-
-Best regards,
-Danier Automated Alert System
-                        """
-                        
-                        # Simple approach: Just send via Python email without complex SMTP
-                        email_sent = email_service.send_excel_attachment(
-                            recipient=recipient_email,
-                            subject=subject,
-                            excel_content=output.getvalue(),
-                            filename=excel_filename,
-                            recipient_name=recipient_name,
-                            total_alerts=total_alerts,
-                            source_file=os.path.basename(latest_file_path)
-                        )
-                        
-                        if email_sent:
-                            success_count += 1
-                            print(f"✅ Excel emailed successfully to: {recipient_email}")
-                            recipients_storage.record_email_sent(recipient_email)
-                        else:
-                            print(f"⚠️ Excel email failed to: {recipient_email} (non-critical)")
-                            
-                    except Exception as recipient_error:
-                        print(f"⚠️ Individual recipient error for {recipient.get('email', 'unknown')}: {recipient_error}")
-                        continue
-                
-                # Cleanup temp files
-                try:
-                    import shutil
-                    shutil.rmtree(temp_dir)
-                except:
-                    pass
-                
-                print(f"📧 Excel email delivery completed: {success_count}/{len(recipients)} successful")
-                        
-            except Exception as e:
-                print(f"📧 Excel email error (non-critical): {e}")
-                # Continue execution even if email fails completely
-        
-        # Run email in completely isolated process to prevent any crashes
-        import threading
-        email_thread = threading.Thread(target=send_excel_email_safe, daemon=True)
-        email_thread.start()
-        
-        print("📧 Excel email delivery started in background")
+                key = request_idempotency_key(idempotency_key, "excel_report", os.path.basename(latest_file_path),
+                                              total_alerts, ",".join(sorted(r.get('email', '') for r in recipients)))
+                result = await asyncio.to_thread(
+                    email_service.send_excel_report,
+                    recipients=recipients,
+                    subject=f"📊 Danier Stock Alert Report - {timestamp}",
+                    excel_content=output.getvalue(),
+                    filename=excel_filename,
+                    total_alerts=total_alerts,
+                    source_file=os.path.basename(latest_file_path),
+                    idempotency_key=key
+                )
+                email_job_id = result.get("job_id")
+                print(f"📧 Excel email queued as job {email_job_id}" if email_job_id else f"⚠️ Excel email not queued: {result.get('message')}")
+            else:
+                print("⚠️ No active recipients found for Excel email")
+        except Exception as e:
+            print(f"📧 Excel email error (non-critical): {e}")
         
         # Return Excel file immediately
         return Response(
             content=output.getvalue(),
             media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
             headers={
-                "Content-Disposition": f"attachment; filename=danier_alerts_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+                "Content-Disposition": f"attachment; filename=danier_alerts_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
+                **({"X-Email-Job-Id": email_job_id} if email_job_id else {})
             }
         )
         
@@ -1943,31 +2154,87 @@ async def warm_caches_on_startup():
         finally:
             db.close()
 
+        # Only one worker warms caches / queues the backlog; the rest read the shared snapshot store
+        is_warm_leader = snapshot_store.try_acquire_lease("startup_warm", ttl_seconds=300)
+
+        # Reconcile the upload catalog with the uploads dir once, so listings never scan the disk
+        if is_warm_leader:
+            db = next(get_db())
+            try:
+                result = file_storage_service.reconcile_catalog(db)
+                print(f"🗂️ Upload catalog reconciled: {result}")
+            except Exception as e:
+                db.rollback()
+                print(f"⚠️ Upload catalog reconcile warning: {e}")
+            finally:
+                db.close()
+
         # Warm key-items cache in background so first request is fast
         import threading
         def _warm_cache():
             try:
-                db = next(get_db())
-                try:
-                    fp = file_storage_service.get_latest_file_path(db)
-                finally:
-                    db.close()
-                if fp and os.path.exists(fp):
+                fp = _resolve_latest_file_path()
+                if fp:
                     print(f"🔥 Warming cache for: {os.path.basename(fp)}")
-                    key_items_service.get_all_key_items_with_alerts(fp)
+                    current_snapshot.get_alerts()
                     _build_all_item_options()
+                    article_search.warm(fp)
                     print("✅ Cache warmed — first request will be instant")
                 else:
                     print("ℹ️ No inventory file to warm cache with")
             except Exception as e:
                 print(f"⚠️ Cache warm warning: {e}")
-        threading.Thread(target=_warm_cache, daemon=True).start()
+        if is_warm_leader:
+            threading.Thread(target=_warm_cache, daemon=True).start()
+        else:
+            print("ℹ️ Another worker is warming caches - skipping")
+
+        # Start the stats indexer and queue any historical files it hasn't seen (newest first)
+        try:
+            stats_indexer.start()
+            backlog = []
+            if is_warm_leader:
+                ingested = sku_timeseries.ingested_hashes()
+                fingerprint = key_items_service.thresholds_fingerprint()
+                backlog = [
+                    entry.file_path for entry in _list_catalog()
+                    if entry.stats_indexed_at is None or entry.file_metadata is None or entry.content_hash not in ingested
+                    or entry.stats_thresholds_hash != fingerprint
+                ]
+            queued = sum(1 for fp in backlog if stats_indexer.submit(fp, force=True))
+            print(f"📇 Queued {queued} files for stats indexing")
+        except Exception as e:
+            print(f"⚠️ Stats indexer warning: {e}")
+
+        # Durable email outbox: deliver whatever is queued (including messages a restart interrupted)
+        try:
+            email_service.outbox.start()
+        except Exception as e:
+            print(f"⚠️ Email outbox warning: {e}")
+
+        # Periodic tiered retention, run by one worker at a time
+        def _retention_loop():
+            interval = float(os.getenv("RETENTION_INTERVAL_HOURS", "24")) * 3600
+            while True:
+                time.sleep(interval)
+                try:
+                    if snapshot_store.try_acquire_lease("retention", ttl_seconds=interval / 2):
+                        _run_retention()
+                except Exception as e:
+                    print(f"⚠️ Retention job warning: {e}")
+        if is_warm_leader:
+            threading.Thread(target=_retention_loop, name="retention", daemon=True).start()
 
         print("✅ STARTUP COMPLETE - Cache warming in background")
         
     except Exception as e:
         print(f"⚠️ Startup warning (non-critical): {e}")
 
+@app.on_event("shutdown")
+async def stop_email_outbox():
+    """Let in-flight deliveries finish; anything still pending is sent after the next start"""
+    await email_service.outbox.stop()
+
 @app.middleware("http")
 async def error_handling_middleware(request, call_next):
     """Global error handling and memory management middleware"""
@@ -2002,11 +2269,9 @@ async def error_handling_middleware(request, call_next):
 async def get_item_details(item_name: str):
     """Return details (total, colour totals, alerts) for a single item using cached batch results"""
     try:
-        files = comparison_service.get_all_uploaded_files()
-        if not files:
+        if not _resolve_latest_file_path():
             return {"name": item_name, "total_stock": 0, "color_totals": [], "alerts": [], "alert_count": 0}
-        latest_file = files[0]
-        all_alerts, success, error = key_items_service.get_all_key_items_with_alerts(latest_file['file_path'])
+        all_alerts, success, error = current_snapshot.get_alerts()
         if not success:
             raise HTTPException(status_code=400, detail=error)
         for it in all_alerts:
@@ -2040,73 +2305,50 @@ async def get_threshold_overrides():
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/thresholds/history")
-async def get_threshold_history(item_name: str = None, limit: int = 100):
-    """Return threshold change history, optionally filtered by item_name."""
+async def get_threshold_history(item_name: str = None, size: Optional[str] = None, color: Optional[str] = None,
+                                date_from: Optional[str] = None, date_to: Optional[str] = None,
+                                limit: int = 100, cursor: Optional[str] = None):
+    """Threshold change history, newest first, keyset-paged (pass next_cursor back as cursor).
+    Filter by item_name / size / color and a date_from..date_to range."""
     try:
         db = next(get_db())
         try:
-            q = db.query(ThresholdHistory)
-            if item_name:
-                q = q.filter(ThresholdHistory.item_name == item_name)
-            q = q.order_by(ThresholdHistory.changed_at.desc()).limit(min(max(limit, 1), 500))
-            rows = q.all()
-            result = [
-                {
-                    "item_name": r.item_name,
-                    "size": r.size,
-                    "color": r.color,
-                    "old_threshold": r.old_threshold,
-                    "new_threshold": r.new_threshold,
-                    "changed_at": r.changed_at.isoformat() if r.changed_at else None,
-                    "note": r.note,
-                }
-                for r in rows
-            ]
-            return {"history": result, "count": len(result)}
+            try:
+                rows, next_cursor = threshold_history.page(
+                    db, limit=limit, cursor=cursor, item_name=item_name, size=size, color=color,
+                    date_from=_parse_date_param(date_from), date_to=_parse_date_param(date_to, end_of_day=True)
+                )
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            result = [threshold_history.to_dict(r) for r in rows]
+            return {"history": result, "count": len(result), "next_cursor": next_cursor}
         finally:
             db.close()
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/files/list-fast")
 async def get_files_list_fast():
-    """Get just the list of uploaded files - ULTRA FAST, with cached stats when available"""
+    """Get just the list of uploaded files - ULTRA FAST, straight from the upload catalog"""
     try:
-        uploads_dir = UPLOAD_DIR
-        if not os.path.exists(uploads_dir):
-            return {"files": []}
-        
-        files = [f for f in os.listdir(uploads_dir) if f.endswith('.xlsx')]
-        files.sort(key=lambda x: os.path.getmtime(os.path.join(uploads_dir, x)), reverse=True)
-        
-        # Return basic file info + cached stats if present (no heavy processing)
         file_list = []
-        for idx, filename in enumerate(files):
-            file_path = os.path.join(uploads_dir, filename)
-            try:
-                stat = os.stat(file_path)
-                # Attach cached stats if available
-                file_cache_key = f"file_stats_{filename}"
-                cached_stats = None
-                if hasattr(key_items_service, '_cache') and file_cache_key in key_items_service._cache:
-                    cached_stats = key_items_service._cache[file_cache_key]
-                
-                file_list.append({
-                    "filename": filename,
-                    "upload_date": stat.st_mtime,  # epoch seconds
-                    "upload_date_iso_utc": datetime.utcfromtimestamp(stat.st_mtime).isoformat() + "Z",
-                    "file_size": stat.st_size,
-                    "ki00_items_count": (cached_stats or {}).get("key_items_count"),
-                    "low_stock_count": (cached_stats or {}).get("low_stock_count")
-                })
+        for entry in _list_catalog():
+            indexed = entry.stats_indexed_at is not None
+            upload_ts = file_storage_service.catalog_timestamp(entry)
+            file_list.append({
+                "filename": entry.stored_filename,
+                "upload_date": upload_ts,  # epoch seconds
+                "upload_date_iso_utc": datetime.utcfromtimestamp(upload_ts).isoformat() + "Z",
+                "file_size": entry.file_size,
+                "ki00_items_count": entry.total_items if indexed else None,
+                "low_stock_count": entry.low_stock_count if indexed else None
+            })
 
-                # Opportunistically warm stats in background for top 10 files if missing
-                if idx < 10 and not cached_stats and filename not in STATS_WARM_IN_PROGRESS:
-                    STATS_WARM_IN_PROGRESS.add(filename)
-                    threading.Thread(target=warm_file_stats, args=(file_path, filename), daemon=True).start()
-            except Exception as e:
-                print(f"Error getting file info for {filename}: {e}")
-                continue
+            # Queue missing stats; the indexer's bounded pool works newest-first
+            if not indexed:
+                stats_indexer.submit(entry.file_path)
         
         return {
             "files": file_list,
@@ -2116,30 +2358,45 @@ async def get_files_list_fast():
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error retrieving file list: {str(e)}")
 
+def _run_retention():
+    """Apply tiered retention (archive old uploads into the stock history, expire raw blobs, fold old threshold history)"""
+    db = next(get_db())
+    try:
+        summary = file_storage_service.cleanup_old_files(
+            db, sku_timeseries, lambda path: key_items_service._load_inventory_file(path, use_cache=False)
+        )
+        # Old threshold edits are folded into per-SKU summaries on the same schedule
+        summary["threshold_history"] = threshold_history.compact(db)
+        summary["email_outbox_pruned"] = email_service.outbox.prune(db)
+    finally:
+        db.close()
+    summary["history"] = {"snapshots": len(sku_timeseries.snapshots())}
+    return summary
+
+@app.post("/files/retention/run")
+def run_file_retention():
+    """Run the tiered retention job now (it also runs in the background every RETENTION_INTERVAL_HOURS)"""
+    try:
+        return {"success": True, **_run_retention()}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Retention failed: {str(e)}")
+
 @app.get("/files/stats/{filename}")
 def get_file_stats(filename: str):
-    """Return cached stats for a file if available; otherwise enqueue a background warm-up and return a lightweight placeholder.
+    """Return indexed stats for a file if available; otherwise enqueue it on the stats indexer and return a lightweight placeholder.
     This avoids heavy synchronous computation that can block the event loop and cause client disconnects.
     """
     try:
-        file_path = os.path.join(UPLOAD_DIR, filename)
-        if not os.path.exists(file_path):
+        file_path = _upload_path(filename)
+        if file_path is None:
             raise HTTPException(status_code=404, detail=f"File {filename} not found")
         
-        # Check cache first keyed by filename + mtime
-        mtime = os.path.getmtime(file_path)
-        cache_key = f"file_stats_{filename}"
-        cache_sig_key = f"file_stats_sig_{filename}"
-        if not hasattr(key_items_service, '_cache'):
-            key_items_service._cache = {}
-        if cache_key in key_items_service._cache and cache_sig_key in key_items_service._cache:
-            if key_items_service._cache[cache_sig_key] == mtime:
-                return key_items_service._cache[cache_key]
-        
-        # If not cached, schedule background warm-up once and return placeholder
-        if filename not in STATS_WARM_IN_PROGRESS:
-            STATS_WARM_IN_PROGRESS.add(filename)
-            threading.Thread(target=warm_file_stats, args=(file_path, filename), daemon=True).start()
+        indexed_stats = stats_indexer.get_stats(filename)
+        if indexed_stats is not None:
+            return indexed_stats
+        
+        # Not indexed yet - queue it (no-op if already queued) and return placeholder
+        stats_indexer.submit(file_path)
         
         return {
             "filename": filename,
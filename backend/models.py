@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, Index, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
 
@@ -15,6 +15,112 @@ class UploadedFile(Base):
     is_active = Column(Boolean, default=True)
     total_items = Column(Integer, default=0)
     low_stock_count = Column(Integer, default=0)
+    content_hash = Column(String, nullable=True, index=True)
+    stats_indexed_at = Column(DateTime, nullable=True)
+    stats_thresholds_hash = Column(String, nullable=True)  # thresholds fingerprint low_stock_count was counted under
+    # Upload catalog: on-disk name and whether the upload is still readable (raw file in the
+    # uploads dir, or its snapshot in the stock history once retention removed the raw file)
+    stored_filename = Column(String, nullable=True, index=True)
+    is_present = Column(Boolean, default=True)
+    file_metadata = Column(Text, nullable=True)  # JSON string: KI00 items, raw low-stock count, row/column summary
+    # Tiered retention: when the upload was archived into the stock history, and when the raw xlsx was removed
+    archived_at = Column(DateTime, nullable=True)
+    raw_deleted_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_uploaded_files_catalog", "is_present", "upload_date", "id"),
+        Index("ix_uploaded_files_catalog_alerts", "is_present", "low_stock_count", "id"),
+        Index("ix_uploaded_files_catalog_size", "is_present", "file_size", "id"),
+    )
+
+# Long-format stock history: one row per (SKU, snapshot), SKUs integer-coded
+class SkuKey(Base):
+    __tablename__ = "sku_keys"
+
+    id = Column(Integer, primary_key=True)
+    item_description = Column(String, nullable=False)
+    color = Column(String, nullable=False)
+    variant_code = Column(String, nullable=False)
+    item_base = Column(String, index=True, nullable=False)
+    size = Column(String, nullable=True)
+    item_no = Column(String, nullable=True)
+    product_group_code = Column(String, nullable=True)
+
+    __table_args__ = (
+        UniqueConstraint("item_description", "color", "variant_code", name="uq_sku_keys_natural"),
+    )
+
+class InventorySnapshot(Base):
+    __tablename__ = "inventory_snapshots"
+
+    id = Column(Integer, primary_key=True)
+    content_hash = Column(String, unique=True, nullable=False, index=True)
+    upload_date = Column(DateTime, nullable=True, index=True)
+    row_count = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class SkuStock(Base):
+    __tablename__ = "sku_stock"
+
+    # (sku_id, snapshot_id) primary key keeps each SKU's history contiguous for range reads
+    sku_id = Column(Integer, primary_key=True, autoincrement=False)
+    snapshot_id = Column(Integer, primary_key=True, autoincrement=False)
+    stock = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        Index("ix_sku_stock_snapshot", "snapshot_id", "sku_id"),
+    )
+
+class SkuLocationStock(Base):
+    __tablename__ = "sku_location_stock"
+
+    sku_id = Column(Integer, primary_key=True, autoincrement=False)
+    snapshot_id = Column(Integer, primary_key=True, autoincrement=False)
+    location = Column(String, primary_key=True)
+    qty = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        Index("ix_sku_location_stock_snapshot", "snapshot_id", "sku_id"),
+    )
+
+# Per-SKU diff between two snapshots, computed at ingest (or on first request) and keyed by content hashes
+class SnapshotDiff(Base):
+    __tablename__ = "snapshot_diffs"
+
+    id = Column(Integer, primary_key=True)
+    old_hash = Column(String, nullable=False)
+    new_hash = Column(String, nullable=False)
+    old_snapshot_id = Column(Integer, nullable=False)
+    new_snapshot_id = Column(Integer, nullable=False)
+    # Hash of the threshold configuration the diff was built with (overrides + product-group rules)
+    thresholds_hash = Column(String, nullable=True)
+    sku_count = Column(Integer, default=0)
+    changed_count = Column(Integer, default=0)
+    new_count = Column(Integer, default=0)
+    discontinued_count = Column(Integer, default=0)
+    previous_low_count = Column(Integer, default=0)
+    current_low_count = Column(Integer, default=0)
+    newly_below_count = Column(Integer, default=0)
+    improved_count = Column(Integer, default=0)
+    worsened_count = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint("old_hash", "new_hash", name="uq_snapshot_diffs_pair"),
+    )
+
+class SnapshotDiffItem(Base):
+    __tablename__ = "snapshot_diff_items"
+
+    diff_id = Column(Integer, primary_key=True, autoincrement=False)
+    sku_id = Column(Integer, primary_key=True, autoincrement=False)
+    old_stock = Column(Integer, nullable=True)   # NULL = SKU not in the old snapshot (new)
+    new_stock = Column(Integer, nullable=True)   # NULL = SKU not in the new snapshot (discontinued)
+    change = Column(Integer, nullable=False, default=0)
+    threshold = Column(Integer, nullable=False)
+    newly_below = Column(Boolean, default=False)
+    improved = Column(Boolean, default=False)
+    worsened = Column(Boolean, default=False)
 
 class Recipient(Base):
     __tablename__ = "recipients"
@@ -29,6 +135,31 @@ class Recipient(Base):
     email_count = Column(Integer, default=0)
     preferences = Column(Text, nullable=True)  # JSON string for email preferences
 
+# Durable email outbox: one row per message, grouped into jobs, delivered by the async outbox worker
+class OutboxMessage(Base):
+    __tablename__ = "email_outbox"
+
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(String, index=True, nullable=False)
+    idempotency_key = Column(String, unique=True, nullable=False)
+    kind = Column(String, nullable=False)  # alert / excel_report / password_reset / ...
+    recipient = Column(String, nullable=False)
+    subject = Column(String, nullable=True)
+    message = Column(Text, nullable=False)  # serialized MIME message, attachments included
+    status = Column(String, nullable=False, default="pending")  # pending / sending / sent / failed
+    attempts = Column(Integer, default=0)
+    max_attempts = Column(Integer, default=6)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow)
+    locked_until = Column(DateTime, nullable=True)  # lease of the worker sending it; expired = worker died
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    sent_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_email_outbox_due", "status", "next_attempt_at"),
+    )
+
 # New: Persistent thresholds
 class ThresholdOverride(Base):
     __tablename__ = "threshold_overrides"
@@ -51,6 +182,39 @@ class ThresholdHistory(Base):
     new_threshold = Column(Integer, nullable=False)
     changed_at = Column(DateTime, default=datetime.utcnow)
     note = Column(Text, nullable=True)
+    # >0 on summary rows left by history compaction: how many changes the row stands for
+    compacted_count = Column(Integer, default=0)
+
+    __table_args__ = (
+        Index("ix_threshold_history_item_changed", "item_name", "changed_at", "id"),
+        Index("ix_threshold_history_changed", "changed_at", "id"),
+    )
+
+# Product-group size rules (e.g. women's '10…' / men's '20…'), used when no per-item override exists
+class ProductGroupRule(Base):
+    __tablename__ = "product_group_rules"
+
+    id = Column(Integer, primary_key=True, index=True)
+    group_prefix = Column(String, index=True, nullable=False)
+    size = Column(String, nullable=False)  # normalised size (3XS, 2XS, ..., 3XL)
+    threshold = Column(Integer, nullable=False)
+    priority = Column(Integer, nullable=False, default=0)  # higher wins when several prefixes match
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint("group_prefix", "size", name="uq_product_group_rules_prefix_size"),
+    )
+
+class ProductGroupRuleHistory(Base):
+    __tablename__ = "product_group_rule_history"
+
+    id = Column(Integer, primary_key=True, index=True)
+    group_prefix = Column(String, index=True, nullable=False)
+    size = Column(String, nullable=False)
+    old_threshold = Column(Integer, nullable=True)
+    new_threshold = Column(Integer, nullable=True)  # NULL = rule deleted
+    changed_at = Column(DateTime, default=datetime.utcnow)
+    note = Column(Text, nullable=True)
 
 # New: Single app user credential storage
 class UserCredential(Base):
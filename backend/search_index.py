@@ -0,0 +1,524 @@
+import os
+import re
+import threading
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from snapshot_store import BoundedCache
+
+SEARCH_FIELDS = ("item_name", "item_description", "variant_code", "color", "item_number")
+# Relative weight of a hit in each field; exact / prefix / word-prefix hits multiply it
+FIELD_WEIGHTS = {"item_number": 5, "item_name": 4, "item_description": 3, "variant_code": 2, "color": 1}
+MATCH_EXACT, MATCH_PREFIX, MATCH_WORD_PREFIX, MATCH_SUBSTRING = 4, 3, 2, 1
+ITEM_NUMBER_EXACT_SCORE = 1000
+# Fuzzy fallback: minimum trigram similarity between a query term and an indexed word (as pg_trgm)
+FUZZY_MIN_SIMILARITY = 0.3
+SEARCH_SCOPES = ("alerts", "all")
+SEARCH_DEFAULT_LIMIT = 50
+SEARCH_MAX_LIMIT = 500
+HISTORY_SEARCH_DEFAULT_LIMIT = 20
+HISTORY_SEARCH_MAX_LIMIT = 100
+SUGGEST_DEFAULT_LIMIT = 10
+SUGGEST_MAX_LIMIT = 50
+# Suggestion kinds, in tie-break order
+SUGGEST_KINDS = ("style", "item_number", "variant")
+
+_WORD_SPLIT = re.compile(r"[^0-9a-z]+")
+
+def _trigrams(text: str) -> set:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+def _word_trigrams(word: str) -> set:
+    """Padded trigrams of one word, so short words and typos at the edges still overlap"""
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def normalize_item_numbers(values: pd.Series) -> pd.Series:
+    """Item numbers as lowercase strings without the '.0' tail Excel adds to numeric cells"""
+    return values.fillna("").astype(str).str.strip().str.lower().str.replace(r"\.0+$", "", regex=True)
+
+class SearchIndex:
+    """Immutable in-memory search index over one set of documents (e.g. a snapshot's SKU rows).
+
+    - substring postings: trigram -> sorted doc ids over every search field; a term's candidates
+      are the intersection of its trigrams' postings, verified with a real substring check
+    - item numbers: exact normalized item number -> doc ids
+    - vocabulary: word -> doc ids plus padded word trigrams for light fuzzy matching, used only
+      when the query has no substring match at all
+    Terms shorter than three characters are checked directly against the candidates of the
+    longer terms (or every document when the query has none).
+    """
+
+    def __init__(self, docs: pd.DataFrame):
+        self.docs = docs.reset_index(drop=True)
+        self._text = {}
+        for field in SEARCH_FIELDS:
+            values = self.docs[field] if field in self.docs.columns else pd.Series("", index=self.docs.index)
+            values = normalize_item_numbers(values) if field == "item_number" \
+                else values.fillna("").astype(str).str.strip().str.lower()
+            self._text[field] = np.array(values.tolist(), dtype=str)
+
+        postings = defaultdict(set)
+        vocabulary = defaultdict(set)
+        for field in SEARCH_FIELDS:
+            for doc_id, text in enumerate(self._text[field]):
+                for gram in _trigrams(text):
+                    postings[gram].add(doc_id)
+                for word in _WORD_SPLIT.split(text):
+                    if word:
+                        vocabulary[word].add(doc_id)
+        self._postings = {gram: np.fromiter(sorted(ids), dtype=np.int32, count=len(ids)) for gram, ids in postings.items()}
+        self._vocabulary = {word: np.fromiter(sorted(ids), dtype=np.int32, count=len(ids)) for word, ids in vocabulary.items()}
+        word_grams = defaultdict(list)
+        self._word_gram_counts = {}
+        for word in self._vocabulary:
+            grams = _word_trigrams(word)
+            self._word_gram_counts[word] = len(grams)
+            for gram in grams:
+                word_grams[gram].append(word)
+        self._word_grams = dict(word_grams)
+
+        self._item_numbers = defaultdict(list)
+        for doc_id, number in enumerate(self._text["item_number"]):
+            if number:
+                self._item_numbers[number].append(doc_id)
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def match(self, query: str, fuzzy: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+        """(doc ids, scores) for every document matching all query terms, unordered"""
+        query = (query or "").strip().lower()
+        terms = sorted({t for t in query.split() if t}, key=len, reverse=True)
+        if not terms or len(self.docs) == 0:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float64)
+
+        candidates = None
+        for term in terms:
+            if len(term) >= 3:
+                grams = sorted(_trigrams(term), key=lambda g: len(self._postings.get(g, ())))
+                term_docs = self._postings.get(grams[0], np.zeros(0, dtype=np.int32))
+                for gram in grams[1:]:
+                    if len(term_docs) == 0:
+                        break
+                    term_docs = np.intersect1d(term_docs, self._postings.get(gram, np.zeros(0, dtype=np.int32)),
+                                               assume_unique=True)
+                candidates = term_docs if candidates is None else np.intersect1d(candidates, term_docs, assume_unique=True)
+        if candidates is None:
+            candidates = np.arange(len(self.docs), dtype=np.int32)
+
+        scores = np.zeros(len(candidates), dtype=np.float64)
+        keep = np.ones(len(candidates), dtype=bool)
+        for term in terms:
+            term_score = self._term_scores(term, candidates)
+            keep &= term_score > 0
+            scores += term_score
+        doc_ids, scores = candidates[keep], scores[keep]
+
+        exact = self._item_numbers.get(query)
+        if exact:
+            # An exact item number outranks everything else
+            scores[np.isin(doc_ids, exact)] = ITEM_NUMBER_EXACT_SCORE
+            extra = np.setdiff1d(np.array(exact, dtype=np.int32), doc_ids)
+            doc_ids = np.concatenate([doc_ids, extra])
+            scores = np.concatenate([scores, np.full(len(extra), float(ITEM_NUMBER_EXACT_SCORE))])
+        if len(doc_ids) == 0 and fuzzy:
+            return self._fuzzy_match(terms)
+        return doc_ids, scores
+
+    def _term_scores(self, term: str, candidates: np.ndarray) -> np.ndarray:
+        """Best weighted field hit for one term on each candidate (0 where it doesn't occur)"""
+        best = np.zeros(len(candidates), dtype=np.float64)
+        for field in SEARCH_FIELDS:
+            text = self._text[field][candidates]
+            found = np.char.find(text, term)
+            word_start = (np.char.find(text, " " + term) >= 0) | (np.char.find(text, "-" + term) >= 0)
+            level = np.select([text == term, found == 0, word_start, found > 0],
+                              [MATCH_EXACT, MATCH_PREFIX, MATCH_WORD_PREFIX, MATCH_SUBSTRING], 0)
+            best = np.maximum(best, level * FIELD_WEIGHTS[field])
+        return best
+
+    def _fuzzy_match(self, terms: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """Docs whose words are trigram-similar to every term; scores stay below any exact hit"""
+        result = None
+        for term in terms:
+            grams = _word_trigrams(term)
+            shared = defaultdict(int)
+            for gram in grams:
+                for word in self._word_grams.get(gram, ()):
+                    shared[word] += 1
+            doc_scores: Dict[int, float] = {}
+            for word, count in shared.items():
+                similarity = count / (len(grams) + self._word_gram_counts[word] - count)
+                if similarity < FUZZY_MIN_SIMILARITY:
+                    continue
+                for doc_id in self._vocabulary[word]:
+                    if similarity > doc_scores.get(doc_id, 0.0):
+                        doc_scores[doc_id] = similarity
+            if result is None:
+                result = doc_scores
+            else:
+                result = {d: s + doc_scores[d] for d, s in result.items() if d in doc_scores}
+            if not result:
+                break
+        if not result:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float64)
+        doc_ids = np.fromiter(result.keys(), dtype=np.int32, count=len(result))
+        scores = np.fromiter(result.values(), dtype=np.float64, count=len(result)) / len(terms)
+        return doc_ids, scores
+
+class SuggestIndex:
+    """Sorted-array prefix index for typeahead over one snapshot's SKU rows.
+
+    Entries are styles (item name), item numbers and item/colour/size variants. Every entry
+    has one or more lowercase keys ("andra", "andra black xs", "black xs"); keys are kept in one
+    sorted array, so a prefix is a binary-searched slice. Ranking uses a per-entry rank computed
+    once per thresholds version from the entry's alert severity and stock (see ranks).
+    """
+
+    def __init__(self, docs: pd.DataFrame):
+        item = docs["item_name"].fillna("").astype(str)
+        color = docs["color"].fillna("").astype(str)
+        size = docs["size"].fillna("").astype(str)
+        number = normalize_item_numbers(docs["item_number"]) if "item_number" in docs.columns \
+            else pd.Series("", index=docs.index)
+
+        # doc -> entry code per kind (-1: not part of any entry of that kind)
+        style_codes, styles = pd.factorize(item)
+        number_codes, numbers = pd.factorize(number.where(number != ""))
+        variant_codes, variants = pd.factorize(pd.MultiIndex.from_arrays([item, color, size]))
+        counts = (len(styles), len(numbers), len(variants))
+        offsets = np.cumsum((0,) + counts)
+        self._doc_entries = [(style_codes, offsets[0]), (number_codes, offsets[1]), (variant_codes, offsets[2])]
+        self._entry_count = int(offsets[-1])
+
+        entries = [{"type": "style", "label": name, "item_name": name} for name in styles]
+        entries += [{"type": "item_number", "label": n, "item_number": n} for n in numbers]
+        first_doc = pd.Series(np.arange(len(docs))).groupby(number_codes).first()
+        for code, doc in first_doc.items():
+            if code >= 0:
+                entries[offsets[1] + code]["item_name"] = item.iat[doc]
+        entries += [{"type": "variant", "label": " ".join(p for p in (i, c, sz) if p),
+                     "item_name": i, "color": c, "size": sz} for i, c, sz in variants]
+        self.entries = entries
+
+        keys, entry_ids = [], []
+        for entry_id, entry in enumerate(entries):
+            forms = {entry["label"].lower()}
+            if entry["type"] == "variant":
+                forms.add(" ".join(p for p in (entry["color"], entry["size"]) if p).lower())
+            for key in forms:
+                if key:
+                    keys.append(" ".join(key.split()))
+                    entry_ids.append(entry_id)
+        order = np.argsort(np.array(keys, dtype=str), kind="stable")
+        self._keys = np.array(keys, dtype=str)[order]
+        self._key_entries = np.array(entry_ids, dtype=np.int32)[order]
+        self._kind_order = np.repeat(np.arange(len(SUGGEST_KINDS)), counts)
+
+    def ranks(self, thresholds: np.ndarray, stock: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(rank per entry, [alerts, shortage, stock] per entry). Rank 0 is most relevant: largest
+        total shortage, then most SKUs below threshold, then most stock"""
+        shortage = np.clip(thresholds - stock, 0, None)
+        total_shortage = np.zeros(self._entry_count)
+        low_count = np.zeros(self._entry_count)
+        total_stock = np.zeros(self._entry_count)
+        for codes, offset in self._doc_entries:
+            mask = codes >= 0
+            target = codes[mask] + offset
+            np.add.at(total_shortage, target, shortage[mask])
+            np.add.at(low_count, target, (shortage[mask] > 0))
+            np.add.at(total_stock, target, stock[mask])
+        order = np.lexsort((self._kind_order, -total_stock, -low_count, -total_shortage))
+        ranks = np.empty(self._entry_count, dtype=np.int64)
+        ranks[order] = np.arange(self._entry_count)
+        stats = np.stack([low_count, total_shortage, total_stock], axis=1).astype(np.int64)
+        return ranks, stats
+
+    def lookup(self, prefix: str, ranks: np.ndarray, limit: int = SUGGEST_DEFAULT_LIMIT) -> np.ndarray:
+        """Entry ids whose keys start with prefix, best ranked first"""
+        prefix = " ".join((prefix or "").lower().split())
+        if not prefix:
+            return np.zeros(0, dtype=np.int32)
+        lo = np.searchsorted(self._keys, prefix, side="left")
+        hi = np.searchsorted(self._keys, prefix + "\U0010ffff", side="left")
+        entry_ids = np.unique(self._key_entries[lo:hi])
+        if len(entry_ids) > limit:
+            entry_ids = entry_ids[np.argpartition(ranks[entry_ids], limit - 1)[:limit]]
+        return entry_ids[np.argsort(ranks[entry_ids], kind="stable")]
+
+class ArticleSearchService:
+    """Article search over the key-item rows of a stock-history snapshot.
+
+    One SearchIndex per snapshot (the whole catalogue, not just current alerts), built when the
+    newest snapshot is ingested or on first search, and kept in a small LRU. Thresholds are
+    resolved once per (snapshot, thresholds version), so alert filtering and ranking need no
+    per-row lookups and no workbook is opened on the query path.
+    """
+
+    def __init__(self, timeseries_store, key_items_service, cache_size: Optional[int] = None):
+        self.timeseries_store = timeseries_store
+        self.key_items_service = key_items_service
+        self._lock = threading.Lock()
+        self._indexes = BoundedCache(cache_size or int(os.getenv("SEARCH_INDEX_CACHE_SIZE", "4")))
+        self._thresholds = BoundedCache(cache_size or int(os.getenv("SEARCH_INDEX_CACHE_SIZE", "4")))
+        self._suggest = BoundedCache(cache_size or int(os.getenv("SEARCH_INDEX_CACHE_SIZE", "4")))
+        self._suggest_ranks = BoundedCache(cache_size or int(os.getenv("SEARCH_INDEX_CACHE_SIZE", "4")))
+
+    def on_snapshot_ingested(self, snapshot_id: int, content_hash: str):
+        """Build the index for a new snapshot if it is the newest one (backlog snapshots stay lazy)"""
+        _, next_id = self.timeseries_store.neighbour_snapshots(snapshot_id)
+        if next_id is None:
+            self._suggest_ranks_for(snapshot_id)
+
+    def index_for_snapshot(self, snapshot_id: int) -> SearchIndex:
+        index = self._indexes.get(snapshot_id)
+        if index is not None:
+            return index
+        with self._lock:
+            index = self._indexes.get(snapshot_id)
+            if index is not None:
+                return index
+            frame = self.timeseries_store.snapshot_frame(snapshot_id)
+            docs = pd.DataFrame({
+                "sku_id": frame["sku_id"],
+                "item_name": frame["item_base"],
+                "item_description": frame["Item Description"],
+                "variant_code": frame["Variant Code"],
+                "color": frame["Variant Color"],
+                "item_number": normalize_item_numbers(frame["Item No_"]),
+                "size": frame["size"].fillna(""),
+                "product_group_code": frame["Item Product Group Code"],
+                "current_stock": frame["Grand Total"].astype(np.int64),
+            })
+            index = SearchIndex(docs)
+            self._indexes[snapshot_id] = index
+        print(f"🔎 Search index built for snapshot {snapshot_id}: {len(index)} SKUs, {len(index._postings)} trigrams")
+        return index
+
+    def suggest_index_for_snapshot(self, snapshot_id: int) -> SuggestIndex:
+        suggest = self._suggest.get(snapshot_id)
+        if suggest is not None:
+            return suggest
+        index = self.index_for_snapshot(snapshot_id)
+        with self._lock:
+            suggest = self._suggest.get(snapshot_id)
+            if suggest is None:
+                suggest = SuggestIndex(index.docs)
+                self._suggest[snapshot_id] = suggest
+            return suggest
+
+    def snapshot_for_file(self, file_path: str) -> Optional[int]:
+        """Stock-history snapshot of an uploaded file (the workbook is ingested once if it's new)"""
+        content_hash = self.timeseries_store.hash_fn(file_path)
+        snapshot_id = self.timeseries_store.snapshot_id_for_hash(content_hash)
+        if snapshot_id is None and self.timeseries_store.frame_for_file(
+                file_path, self.key_items_service._load_inventory_file) is not None:
+            snapshot_id = self.timeseries_store.snapshot_id_for_hash(content_hash)
+        return snapshot_id
+
+    def _thresholds_key(self, snapshot_id: int) -> Tuple[int, int]:
+        self.key_items_service._sync_shared_versions()
+        return snapshot_id, self.key_items_service._thresholds_version()
+
+    def thresholds(self, snapshot_id: int, index: SearchIndex) -> np.ndarray:
+        """Each document's current threshold, resolved once per thresholds version"""
+        cache_key = self._thresholds_key(snapshot_id)
+        thresholds = self._thresholds.get(cache_key)
+        if thresholds is not None:
+            return thresholds
+        docs = index.docs
+        thresholds = self.key_items_service.resolve_thresholds(
+            docs["item_name"], docs["size"], docs["color"], docs["product_group_code"].tolist())
+        self._thresholds[cache_key] = thresholds
+        return thresholds
+
+    def search(self, query: str, file_path: str, scope: str = "alerts", limit: int = SEARCH_DEFAULT_LIMIT,
+               offset: int = 0) -> Tuple[List[Dict], int]:
+        """(one page of ranked results, total matches) for the file's snapshot.
+
+        Ranked by match score, then alerts first with the largest shortage. Raises ValueError on a
+        bad scope / limit / offset.
+        """
+        if scope not in SEARCH_SCOPES:
+            raise ValueError(f"scope must be one of: {', '.join(SEARCH_SCOPES)}")
+        if limit < 1 or limit > SEARCH_MAX_LIMIT or offset < 0:
+            raise ValueError(f"limit must be between 1 and {SEARCH_MAX_LIMIT} and offset non-negative")
+        snapshot_id = self.snapshot_for_file(file_path)
+        if snapshot_id is None:
+            return [], 0
+        index = self.index_for_snapshot(snapshot_id)
+        doc_ids, scores = index.match(query)
+        if len(doc_ids) == 0:
+            return [], 0
+
+        threshold = self.thresholds(snapshot_id, index)[doc_ids]
+        stock = index.docs["current_stock"].to_numpy()[doc_ids]
+        shortage = threshold - stock
+        if scope == "alerts":
+            low = shortage > 0
+            doc_ids, scores, threshold, stock, shortage = doc_ids[low], scores[low], threshold[low], stock[low], shortage[low]
+        order = np.lexsort((doc_ids, -shortage, -scores))
+        page = order[offset:offset + limit]
+
+        rows = index.docs.iloc[doc_ids[page]]
+        is_low = shortage[page] > 0
+        results = pd.DataFrame({
+            "item_name": rows["item_name"].to_numpy(),
+            "item_description": rows["item_description"].to_numpy(),
+            "color": rows["color"].to_numpy(),
+            "size": rows["size"].to_numpy(),
+            "season_code": "KI00",
+            "variant_code": rows["variant_code"].to_numpy(),
+            "current_stock": stock[page],
+            "required_threshold": threshold[page],
+            "shortage": np.clip(shortage[page], 0, None),
+            "item_number": rows["item_number"].replace("", None).to_numpy(),
+            "priority": np.where(is_low, "LOW_STOCK", None),
+            "is_low_stock": is_low,
+            "score": np.round(scores[page], 3),
+        }).to_dict("records")
+        return results, int(len(doc_ids))
+
+    def warm(self, file_path: str):
+        """Build the search / suggest indexes and ranks for a file's snapshot ahead of the first query"""
+        snapshot_id = self.snapshot_for_file(file_path)
+        if snapshot_id is not None:
+            self._suggest_ranks_for(snapshot_id)
+
+    def _suggest_ranks_for(self, snapshot_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Suggestion ranks / stats for a snapshot, computed once per thresholds version"""
+        cache_key = self._thresholds_key(snapshot_id)
+        result = self._suggest_ranks.get(cache_key)
+        if result is not None:
+            return result
+        index = self.index_for_snapshot(snapshot_id)
+        thresholds = self.thresholds(snapshot_id, index)
+        result = self.suggest_index_for_snapshot(snapshot_id).ranks(thresholds, index.docs["current_stock"].to_numpy())
+        self._suggest_ranks[cache_key] = result
+        return result
+
+    def suggest(self, prefix: str, file_path: str, limit: int = SUGGEST_DEFAULT_LIMIT) -> List[Dict]:
+        """Top-k typeahead suggestions for the file's snapshot, most severe alerts first"""
+        if limit < 1 or limit > SUGGEST_MAX_LIMIT:
+            raise ValueError(f"limit must be between 1 and {SUGGEST_MAX_LIMIT}")
+        snapshot_id = self.snapshot_for_file(file_path)
+        if snapshot_id is None:
+            return []
+        suggest_index = self.suggest_index_for_snapshot(snapshot_id)
+        ranks, stats = self._suggest_ranks_for(snapshot_id)
+        suggestions = []
+        for entry_id in suggest_index.lookup(prefix, ranks, limit):
+            low_count, shortage, stock = (int(v) for v in stats[entry_id])
+            suggestions.append(dict(suggest_index.entries[entry_id], alerts=low_count, shortage=shortage, stock=stock))
+        return suggestions
+
+class HistorySearchService:
+    """Search across every snapshot in the stock history: SKU / name query -> per-snapshot stock timeline.
+
+    A SearchIndex over the whole SKU dictionary (every SKU ever seen, not just the latest file)
+    finds the SKUs; per-SKU postings of (snapshot id, stock) give their timelines. Postings are
+    loaded from the history store once and extended with only the new snapshot's rows when one
+    lands, so a query never opens a workbook or scans the stock table.
+    """
+
+    def __init__(self, timeseries_store, key_items_service):
+        self.timeseries_store = timeseries_store
+        self.key_items_service = key_items_service
+        self._lock = threading.Lock()
+        self._snapshot_ids: Tuple[int, ...] = ()
+        self._snapshot_dates: Dict[int, object] = {}
+        self._postings: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}  # sku_id -> (snapshot ids, stock)
+        self._index: Optional[SearchIndex] = None
+
+    def on_snapshot_ingested(self, snapshot_id: int, content_hash: str):
+        self.refresh()
+
+    def refresh(self):
+        """Bring postings and the SKU index up to date with the snapshots in the store"""
+        snapshots = self.timeseries_store.snapshots()
+        snapshot_ids = tuple(int(i) for i in snapshots["id"])
+        if snapshot_ids == self._snapshot_ids and self._index is not None:
+            return
+        with self._lock:
+            if snapshot_ids == self._snapshot_ids and self._index is not None:
+                return
+            known = set(self._snapshot_ids)
+            if not known.issubset(snapshot_ids):
+                # Snapshots were removed: start over
+                known, self._postings = set(), {}
+            new_ids = [i for i in snapshot_ids if i not in known]
+            if new_ids:
+                panel = self.timeseries_store.stock_panel(snapshot_ids=new_ids)
+                sku_ids = panel["sku_id"].to_numpy()
+                bounds = np.r_[0, np.flatnonzero(sku_ids[1:] != sku_ids[:-1]) + 1, len(sku_ids)]
+                snap = panel["snapshot_id"].to_numpy(dtype=np.int32)
+                stock = panel["stock"].to_numpy(dtype=np.int64)
+                for start, end in zip(bounds[:-1], bounds[1:]):
+                    if start == end:
+                        continue
+                    sku_id = int(sku_ids[start])
+                    if sku_id in self._postings:
+                        old_snap, old_stock = self._postings[sku_id]
+                        self._postings[sku_id] = (np.concatenate([old_snap, snap[start:end]]),
+                                                  np.concatenate([old_stock, stock[start:end]]))
+                    else:
+                        self._postings[sku_id] = (snap[start:end], stock[start:end])
+            self._snapshot_dates = dict(zip(snapshot_ids, snapshots["upload_date"]))
+            # New SKUs only ever arrive with new snapshots
+            if self._index is None or new_ids:
+                skus = self.timeseries_store.find_skus()
+                skus["item_no"] = normalize_item_numbers(skus["item_no"])
+                skus["size"] = skus["size"].fillna("")
+                self._index = SearchIndex(skus.rename(columns={"item_base": "item_name", "item_no": "item_number"}))
+            self._snapshot_ids = snapshot_ids
+        print(f"🕰️ History search refreshed: {len(self._index)} SKUs over {len(snapshot_ids)} snapshots "
+              f"({len(new_ids)} newly loaded)")
+
+    def search(self, query: str, limit: int = HISTORY_SEARCH_DEFAULT_LIMIT, offset: int = 0) -> Tuple[List[Dict], int, int]:
+        """(one page of SKUs with their stock timelines, total matching SKUs, snapshot count).
+
+        Each timeline is in upload order; below_threshold / first_low_date use today's thresholds.
+        """
+        if limit < 1 or limit > HISTORY_SEARCH_MAX_LIMIT or offset < 0:
+            raise ValueError(f"limit must be between 1 and {HISTORY_SEARCH_MAX_LIMIT} and offset non-negative")
+        self.refresh()
+        index = self._index
+        doc_ids, scores = index.match(query)
+        if len(doc_ids) == 0:
+            return [], 0, len(self._snapshot_ids)
+        order = np.lexsort((doc_ids, -scores))
+        page = index.docs.iloc[doc_ids[order[offset:offset + limit]]]
+        thresholds = self.key_items_service.resolve_thresholds(
+            page["item_name"], page["size"], page["color"], page["product_group_code"].tolist())
+
+        results = []
+        empty = (np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int64))
+        for (_, sku), threshold in zip(page.iterrows(), thresholds):
+            snap, stock = self._postings.get(int(sku["sku_id"]), empty)
+            dates = [self._snapshot_dates.get(int(s)) for s in snap]
+            timeline = sorted(
+                ({"snapshot_id": int(s), "date": d.isoformat() if pd.notna(d) else None, "stock": int(q),
+                  "below_threshold": bool(q < threshold)} for s, d, q in zip(snap, dates, stock)),
+                key=lambda p: (p["date"] or "", p["snapshot_id"]))
+            first_low = next((p["date"] for p in timeline if p["below_threshold"]), None)
+            results.append({
+                "sku_id": int(sku["sku_id"]),
+                "item_name": sku["item_name"],
+                "item_description": sku["item_description"],
+                "color": sku["color"],
+                "variant_code": sku["variant_code"],
+                "size": sku["size"],
+                "item_number": sku["item_number"] or None,
+                "threshold": int(threshold),
+                "snapshots_present": len(timeline),
+                "first_seen": timeline[0]["date"] if timeline else None,
+                "last_seen": timeline[-1]["date"] if timeline else None,
+                "latest_stock": timeline[-1]["stock"] if timeline else None,
+                "first_low_date": first_low,
+                "history": timeline,
+            })
+        return results, int(len(doc_ids)), len(self._snapshot_ids)
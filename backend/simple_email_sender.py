@@ -5,8 +5,6 @@ Uses alternative methods to send emails when SMTP is not available
 """
 
 import os
-import smtplib
-import ssl
 from datetime import datetime
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
@@ -15,13 +13,19 @@ import json
 import requests
 
 class SimpleEmailSender:
-    def __init__(self):
+    def __init__(self, outbox=None):
         self.emails_dir = "emails"
         if not os.path.exists(self.emails_dir):
             os.makedirs(self.emails_dir)
+        self.smtp_user = "danieralertsystem@gmail.com"
+        if outbox is None:
+            from email_service import EmailService
+            outbox = EmailService().outbox
+        # Shared durable outbox: its worker delivers over the pooled SMTP sessions and retries
+        self.outbox = outbox
     
     def send_email(self, recipients: List[str], subject: str, html_content: str, 
-                   recipient_names: Dict[str, str] = None) -> Dict:
+                   recipient_names: Dict[str, str] = None, idempotency_key: str = None) -> Dict:
         """Send email using multiple fallback methods"""
         
         results = {
@@ -29,78 +33,57 @@ class SimpleEmailSender:
             "message": "",
             "recipients": recipients,
             "methods_tried": [],
-            "emails_sent": 0,
+            "emails_queued": 0,
+            "job_id": None,
             "email_files": []
         }
         
-        for recipient in recipients:
-            recipient_name = recipient_names.get(recipient, recipient) if recipient_names else recipient
-            
-            # Method 1: Try Gmail SMTP with different configurations
-            if self._try_gmail_smtp(recipient, subject, html_content):
-                results["emails_sent"] += 1
-                results["methods_tried"].append(f"Gmail SMTP to {recipient}")
-                continue
-            
-            # Method 2: Try using a free email service
-            if self._try_free_email_service(recipient, subject, html_content):
-                results["emails_sent"] += 1
-                results["methods_tried"].append(f"Free email service to {recipient}")
-                continue
-            
-            # Method 3: Create email file and provide instructions
-            email_file = self._create_email_file(recipient, subject, html_content, recipient_name)
-            results["email_files"].append(email_file)
-            results["methods_tried"].append(f"Email file created for {recipient}")
+        # Method 1: Queue every recipient in the email outbox as one job
+        job = self._queue_gmail_smtp(recipients, subject, html_content, idempotency_key)
+        if job is not None:
+            results["emails_queued"] = job["queued"]
+            results["job_id"] = job["job_id"]
+            results["methods_tried"].append(f"Outbox job {job['job_id']}")
+        else:
+            for recipient in recipients:
+                recipient_name = recipient_names.get(recipient, recipient) if recipient_names else recipient
+                
+                # Method 2: Try using a free email service
+                if self._try_free_email_service(recipient, subject, html_content):
+                    results["emails_queued"] += 1
+                    results["methods_tried"].append(f"Free email service to {recipient}")
+                    continue
+                
+                # Method 3: Create email file and provide instructions
+                email_file = self._create_email_file(recipient, subject, html_content, recipient_name)
+                results["email_files"].append(email_file)
+                results["methods_tried"].append(f"Email file created for {recipient}")
         
         # Create success message
-        if results["emails_sent"] > 0:
+        if results["job_id"] or results["emails_queued"] > 0:
             results["success"] = True
-            results["message"] = f"✅ {results['emails_sent']} real emails sent! {len(results['email_files'])} backup files created."
+            results["message"] = f"✅ {results['emails_queued']} emails queued! {len(results['email_files'])} backup files created."
         else:
             results["message"] = f"📧 {len(results['email_files'])} email files created. Check the 'emails' folder for your alerts."
         
         return results
     
-    def _try_gmail_smtp(self, recipient: str, subject: str, html_content: str) -> bool:
-        """Try Gmail SMTP with different configurations"""
+    def _queue_gmail_smtp(self, recipients: List[str], subject: str, html_content: str,
+                          idempotency_key: str = None) -> Dict:
+        """Queue the message for each recipient in the outbox; None if it couldn't be queued"""
         try:
-            # Try with the current password (might work in some cases)
-            smtp_user = "danieralertsystem@gmail.com"
-            smtp_pass = "Danieralertsystem2018"
-            
-            msg = MIMEMultipart('alternative')
-            msg['Subject'] = subject
-            msg['From'] = f"Danier Stock Alerts <{smtp_user}>"
-            msg['To'] = recipient
-            
-            html_part = MIMEText(html_content, 'html')
-            msg.attach(html_part)
-            
-            # Try different ports
-            for port in [587, 465]:
-                try:
-                    if port == 465:
-                        server = smtplib.SMTP_SSL('smtp.gmail.com', port)
-                    else:
-                        server = smtplib.SMTP('smtp.gmail.com', port)
-                        server.starttls()
-                    
-                    server.login(smtp_user, smtp_pass)
-                    server.send_message(msg)
-                    server.quit()
-                    print(f"✅ Gmail SMTP SUCCESS to {recipient}")
-                    return True
-                    
-                except Exception as e:
-                    print(f"❌ Gmail SMTP failed port {port}: {str(e)}")
-                    continue
-            
-            return False
-            
+            messages = []
+            for recipient in recipients:
+                msg = MIMEMultipart('alternative')
+                msg['Subject'] = subject
+                msg['From'] = f"Danier Stock Alerts <{self.smtp_user}>"
+                msg['To'] = recipient
+                msg.attach(MIMEText(html_content, 'html'))
+                messages.append((recipient, msg))
+            return self.outbox.enqueue("email", messages, idempotency_key)
         except Exception as e:
-            print(f"❌ Gmail SMTP error: {str(e)}")
-            return False
+            print(f"❌ Outbox queue error: {str(e)}")
+            return None
     
     def _try_free_email_service(self, recipient: str, subject: str, html_content: str) -> bool:
         """Try using a free email service as fallback"""
@@ -0,0 +1,323 @@
+import os
+import threading
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import select, or_, and_
+from sqlalchemy.exc import IntegrityError
+
+from database import get_db, engine
+from models import SkuKey, InventorySnapshot, SkuStock, SkuLocationStock
+from file_storage_service import compute_file_hash
+from snapshot_store import BoundedCache
+
+# Column names of frames rebuilt from the store, matching the workbook headers downstream code expects
+FRAME_COLUMNS = {
+    "product_group_code": "Item Product Group Code",
+    "item_no": "Item No_",
+    "item_description": "Item Description",
+    "color": "Variant Color",
+    "variant_code": "Variant Code",
+    "stock": "Grand Total",
+}
+
+def key_item_rows(df: pd.DataFrame) -> pd.DataFrame:
+    """KI00 (key item) rows of a parsed inventory workbook"""
+    if df is None or 'Season Code' not in df.columns:
+        return pd.DataFrame()
+    season_norm = df['Season Code'].astype(str).str.strip().str.upper()
+    return df[season_norm == 'KI00']
+
+def _clean_text(series: pd.Series) -> pd.Series:
+    return series.fillna("").astype(str).str.strip()
+
+def location_columns(df: pd.DataFrame) -> List[str]:
+    """Per-location quantity columns (store codes like '100', '551' and 'TRUCK' between Selling Price and Grand Total)"""
+    columns = [str(c) for c in df.columns]
+    if 'Selling Price' in columns and 'Grand Total' in columns:
+        start, end = columns.index('Selling Price') + 1, columns.index('Grand Total')
+        if start < end:
+            return list(df.columns[start:end])
+    return [c for c in df.columns if str(c).isdigit() or str(c).upper() == 'TRUCK']
+
+class SkuTimeSeriesStore:
+    """Long-format stock history for key items across every ingested snapshot.
+
+    Each distinct workbook (by content hash) becomes an InventorySnapshot; its KI00 rows are
+    appended to sku_stock / sku_location_stock keyed by integer SKU ids from a shared dictionary
+    (item description, colour, variant code). The (sku_id, snapshot_id) primary key keeps a SKU's
+    history contiguous, and the snapshot index serves whole-snapshot reads for comparisons.
+    """
+
+    def __init__(self, size_fn: Optional[Callable[[str], str]] = None, hash_fn: Optional[Callable[[str], str]] = None,
+                 frame_cache_size: Optional[int] = None, date_fn: Optional[Callable[[str], Optional[datetime]]] = None):
+        self.size_fn = size_fn
+        self.hash_fn = hash_fn or compute_file_hash
+        # Upload date of a file (from the upload catalog); the file mtime is only a fallback
+        self.date_fn = date_fn
+        self._lock = threading.Lock()
+        self._sku_ids: Dict[tuple, int] = {}      # (description, colour, variant code) -> sku id
+        self._snapshot_ids: Dict[str, int] = {}   # content hash -> snapshot id
+        self._frames = BoundedCache(frame_cache_size or int(os.getenv("SKU_FRAME_CACHE_SIZE", "8")))
+        self._listeners: List[Callable[[int, str], None]] = []
+
+    def add_listener(self, callback: Callable[[int, str], None]):
+        """Call `callback(snapshot_id, content_hash)` after each newly ingested snapshot"""
+        self._listeners.append(callback)
+
+    def _notify(self, snapshot_id: int, content_hash: str):
+        for callback in self._listeners:
+            try:
+                callback(snapshot_id, content_hash)
+            except Exception as e:
+                print(f"⚠️ Stock history listener failed for snapshot {snapshot_id}: {e}")
+
+    # --- SKU dictionary ---
+    def _load_sku_dictionary(self, db):
+        rows = db.query(SkuKey.id, SkuKey.item_description, SkuKey.color, SkuKey.variant_code).all()
+        self._sku_ids = {(desc, color, variant): sku_id for sku_id, desc, color, variant in rows}
+
+    def sku_ids_for(self, keys: pd.DataFrame) -> np.ndarray:
+        """int32 SKU ids for a frame of (item_description, color, variant_code); -1 where unknown"""
+        if not self._sku_ids:
+            db = next(get_db())
+            try:
+                self._load_sku_dictionary(db)
+            finally:
+                db.close()
+        lookup = self._sku_ids
+        return np.fromiter(
+            (lookup.get(key, -1) for key in zip(keys["item_description"], keys["color"], keys["variant_code"])),
+            dtype=np.int32, count=len(keys)
+        )
+
+    # --- snapshots ---
+    def snapshot_id_for_hash(self, content_hash: Optional[str]) -> Optional[int]:
+        if not content_hash:
+            return None
+        snapshot_id = self._snapshot_ids.get(content_hash)
+        if snapshot_id is not None:
+            return snapshot_id
+        db = next(get_db())
+        try:
+            row = db.query(InventorySnapshot.id).filter(InventorySnapshot.content_hash == content_hash).first()
+        finally:
+            db.close()
+        if row is not None:
+            self._snapshot_ids[content_hash] = row[0]
+            return row[0]
+        return None
+
+    def has_snapshot(self, content_hash: Optional[str]) -> bool:
+        return self.snapshot_id_for_hash(content_hash) is not None
+
+    def ingested_hashes(self) -> set:
+        db = next(get_db())
+        try:
+            return {row[0] for row in db.query(InventorySnapshot.content_hash).all()}
+        finally:
+            db.close()
+
+    def ingest(self, content_hash: str, upload_date: Optional[datetime], df: pd.DataFrame) -> Optional[int]:
+        """Append one workbook's key-item rows (idempotent per content hash); returns the snapshot id"""
+        existing = self.snapshot_id_for_hash(content_hash)
+        if existing is not None:
+            return existing
+
+        ki00 = key_item_rows(df)
+        rows = pd.DataFrame({
+            "item_description": _clean_text(ki00['Item Description']),
+            "color": _clean_text(ki00['Variant Color']),
+            "variant_code": _clean_text(ki00['Variant Code']),
+            "item_no": _clean_text(ki00['Item No_']) if 'Item No_' in ki00.columns else "",
+            "product_group_code": _clean_text(ki00['Item Product Group Code']) if 'Item Product Group Code' in ki00.columns else "",
+            "stock": pd.to_numeric(ki00['Grand Total'], errors='coerce').fillna(0).round().astype(np.int64),
+        }, index=ki00.index)
+        rows = rows[rows["item_description"] != ""]
+        locations = location_columns(ki00)
+        location_qty = ki00.loc[rows.index, locations].apply(pd.to_numeric, errors='coerce').fillna(0).round().astype(np.int64)
+        key_cols = ["item_description", "color", "variant_code"]
+
+        with self._lock:
+            for attempt in range(2):
+                db = next(get_db())
+                try:
+                    if not self._sku_ids:
+                        self._load_sku_dictionary(db)
+                    new_keys = rows.drop_duplicates(key_cols)
+                    new_keys = new_keys[[key not in self._sku_ids for key in zip(
+                        new_keys["item_description"], new_keys["color"], new_keys["variant_code"])]]
+                    if not new_keys.empty:
+                        item_base = new_keys["item_description"].str.split(' - ').str[0].str.strip()
+                        sizes = new_keys["variant_code"].map(self.size_fn) if self.size_fn else None
+                        db.execute(SkuKey.__table__.insert(), [
+                            {
+                                "item_description": desc, "color": color, "variant_code": variant,
+                                "item_base": base, "size": sizes.iloc[i] if sizes is not None else None,
+                                "item_no": item_no or None, "product_group_code": group or None,
+                            }
+                            for i, (desc, color, variant, base, item_no, group) in enumerate(zip(
+                                new_keys["item_description"], new_keys["color"], new_keys["variant_code"],
+                                item_base, new_keys["item_no"], new_keys["product_group_code"]))
+                        ])
+                        db.flush()
+                        self._load_sku_dictionary(db)
+
+                    snapshot = InventorySnapshot(content_hash=content_hash, upload_date=upload_date, row_count=len(rows))
+                    db.add(snapshot)
+                    db.flush()
+
+                    sku_ids = self.sku_ids_for(rows)
+                    # Duplicate variant rows within one workbook are summed into a single SKU reading
+                    stock = pd.Series(rows["stock"].to_numpy(), index=sku_ids).groupby(level=0).sum()
+                    db.execute(SkuStock.__table__.insert(), [
+                        {"sku_id": int(sku_id), "snapshot_id": snapshot.id, "stock": int(qty)}
+                        for sku_id, qty in stock.items()
+                    ])
+                    if locations:
+                        per_location = location_qty.set_axis(sku_ids, axis=0).groupby(level=0).sum()
+                        long = per_location.stack()
+                        long = long[long != 0]  # sparse: only non-zero location quantities are stored
+                        db.execute(SkuLocationStock.__table__.insert(), [
+                            {"sku_id": int(sku_id), "snapshot_id": snapshot.id, "location": str(location), "qty": int(qty)}
+                            for (sku_id, location), qty in long.items()
+                        ])
+                    db.commit()
+                    self._snapshot_ids[content_hash] = snapshot.id
+                    print(f"📈 Stock history: ingested {len(stock)} SKUs for snapshot {snapshot.id}")
+                    break
+                except IntegrityError:
+                    # Another worker ingested the same snapshot / SKUs first - reload and retry
+                    db.rollback()
+                    self._sku_ids = {}
+                    existing = self.snapshot_id_for_hash(content_hash)
+                    if existing is not None:
+                        return existing
+                except Exception:
+                    db.rollback()
+                    raise
+                finally:
+                    db.close()
+            else:
+                return self.snapshot_id_for_hash(content_hash)
+        # Listeners run outside the ingest lock (they read snapshots back through this store)
+        snapshot_id = self._snapshot_ids[content_hash]
+        self._notify(snapshot_id, content_hash)
+        return snapshot_id
+
+    # --- reads ---
+    def snapshot_frame(self, snapshot_id: int, with_locations: bool = False) -> pd.DataFrame:
+        """Key-item rows of one snapshot, with workbook-style column names plus sku_id / item_base / size"""
+        cache_key = (snapshot_id, with_locations)
+        cached = self._frames.get(cache_key)
+        if cached is not None:
+            return cached
+        stmt = select(
+            SkuKey.product_group_code, SkuKey.item_no, SkuKey.item_description, SkuKey.color, SkuKey.variant_code,
+            SkuStock.stock, SkuStock.sku_id, SkuKey.item_base, SkuKey.size
+        ).join(SkuKey, SkuKey.id == SkuStock.sku_id).where(SkuStock.snapshot_id == snapshot_id).order_by(SkuStock.sku_id)
+        with engine.connect() as conn:
+            df = pd.read_sql(stmt, conn)
+        df["sku_id"] = df["sku_id"].astype(np.int32)
+        df = df.rename(columns=FRAME_COLUMNS)
+        df.insert(2, "Season Code", "KI00")
+        if with_locations:
+            loc_stmt = select(SkuLocationStock.sku_id, SkuLocationStock.location, SkuLocationStock.qty) \
+                .where(SkuLocationStock.snapshot_id == snapshot_id)
+            with engine.connect() as conn:
+                loc = pd.read_sql(loc_stmt, conn)
+            if not loc.empty:
+                wide = loc.pivot_table(index="sku_id", columns="location", values="qty", aggfunc="sum", fill_value=0)
+                df = df.join(wide, on="sku_id")
+                df[list(wide.columns)] = df[list(wide.columns)].fillna(0).astype(np.int64)
+        self._frames[cache_key] = df
+        return df
+
+    def frame_for_file(self, file_path: str, loader: Callable[[str], Optional[pd.DataFrame]],
+                       with_locations: bool = False) -> Optional[pd.DataFrame]:
+        """Key-item frame for an uploaded file, read from the store (the workbook is parsed and ingested once if new)"""
+        content_hash = self.hash_fn(file_path)
+        snapshot_id = self.snapshot_id_for_hash(content_hash)
+        if snapshot_id is None:
+            df = loader(file_path)
+            if df is None:
+                return None
+            snapshot_id = self.ingest(content_hash, self._upload_date(file_path), df)
+        return self.snapshot_frame(snapshot_id, with_locations=with_locations)
+
+    def _upload_date(self, file_path: str) -> datetime:
+        upload_date = self.date_fn(file_path) if self.date_fn is not None else None
+        return upload_date or datetime.utcfromtimestamp(os.path.getmtime(file_path))
+
+    def snapshot_hash(self, snapshot_id: int) -> Optional[str]:
+        for content_hash, known_id in self._snapshot_ids.items():
+            if known_id == snapshot_id:
+                return content_hash
+        db = next(get_db())
+        try:
+            row = db.query(InventorySnapshot.content_hash).filter(InventorySnapshot.id == snapshot_id).first()
+        finally:
+            db.close()
+        return row[0] if row else None
+
+    def neighbour_snapshots(self, snapshot_id: int) -> Tuple[Optional[int], Optional[int]]:
+        """Ids of the snapshots uploaded immediately before and after this one (by upload date, then id)"""
+        db = next(get_db())
+        try:
+            current = db.query(InventorySnapshot).filter(InventorySnapshot.id == snapshot_id).first()
+            if current is None or current.upload_date is None:
+                return None, None
+            date, sid = current.upload_date, current.id
+            before = db.query(InventorySnapshot.id).filter(or_(
+                InventorySnapshot.upload_date < date,
+                and_(InventorySnapshot.upload_date == date, InventorySnapshot.id < sid)
+            )).order_by(InventorySnapshot.upload_date.desc(), InventorySnapshot.id.desc()).first()
+            after = db.query(InventorySnapshot.id).filter(or_(
+                InventorySnapshot.upload_date > date,
+                and_(InventorySnapshot.upload_date == date, InventorySnapshot.id > sid)
+            )).order_by(InventorySnapshot.upload_date, InventorySnapshot.id).first()
+            return (before[0] if before else None), (after[0] if after else None)
+        finally:
+            db.close()
+
+    def snapshots(self) -> pd.DataFrame:
+        stmt = select(InventorySnapshot.id, InventorySnapshot.content_hash, InventorySnapshot.upload_date) \
+            .order_by(InventorySnapshot.upload_date, InventorySnapshot.id)
+        with engine.connect() as conn:
+            return pd.read_sql(stmt, conn)
+
+    def find_skus(self, item_base: Optional[str] = None, color: Optional[str] = None,
+                  size: Optional[str] = None) -> pd.DataFrame:
+        stmt = select(SkuKey.id.label("sku_id"), SkuKey.item_base, SkuKey.item_description, SkuKey.color,
+                      SkuKey.variant_code, SkuKey.size, SkuKey.product_group_code, SkuKey.item_no)
+        if item_base:
+            stmt = stmt.where(SkuKey.item_base == item_base)
+        if color:
+            stmt = stmt.where(SkuKey.color == color)
+        if size:
+            stmt = stmt.where(SkuKey.size == size)
+        with engine.connect() as conn:
+            return pd.read_sql(stmt.order_by(SkuKey.id), conn)
+
+    def stock_panel(self, sku_ids: Optional[List[int]] = None, snapshot_ids: Optional[List[int]] = None) -> pd.DataFrame:
+        """Long (sku_id, snapshot_id, upload_date, stock) rows sorted by SKU then time.
+
+        Restricting by sku_ids is a range read on the primary key; by snapshot_ids it uses the
+        snapshot index. Cross-snapshot aggregations are plain groupbys on the result.
+        """
+        stmt = select(SkuStock.sku_id, SkuStock.snapshot_id, InventorySnapshot.upload_date, SkuStock.stock) \
+            .join(InventorySnapshot, InventorySnapshot.id == SkuStock.snapshot_id)
+        if sku_ids is not None:
+            stmt = stmt.where(SkuStock.sku_id.in_([int(s) for s in sku_ids]))
+        if snapshot_ids is not None:
+            stmt = stmt.where(SkuStock.snapshot_id.in_([int(s) for s in snapshot_ids]))
+        stmt = stmt.order_by(SkuStock.sku_id, InventorySnapshot.upload_date, SkuStock.snapshot_id)
+        with engine.connect() as conn:
+            df = pd.read_sql(stmt, conn)
+        df["sku_id"] = df["sku_id"].astype(np.int32)
+        return df
+
+    def clear_cache(self):
+        self._frames.clear()
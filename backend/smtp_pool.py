@@ -0,0 +1,184 @@
+import os
+import smtplib
+import ssl
+import threading
+import time
+from contextlib import contextmanager
+from email.message import Message
+from typing import List, Optional, Sequence
+
+# The message itself was rejected: the session is still usable, retrying won't help
+_MESSAGE_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+
+def _is_permanent(error: Exception) -> bool:
+    """5xx replies to a message mean resending it won't help; 4xx and dropped connections are transient"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500
+
+def smtp_ports(port: int) -> List[int]:
+    """Configured port first, then the other of STARTTLS (587) / implicit TLS (465)"""
+    return [port] + [p for p in (587, 465) if p != port]
+
+class _Session:
+    def __init__(self, smtp: smtplib.SMTP, port: int):
+        self.smtp = smtp
+        self.port = port
+        self.sent = 0
+        self.last_used = time.monotonic()
+
+    def close(self):
+        try:
+            self.smtp.quit()
+        except Exception:
+            try:
+                self.smtp.close()
+            except Exception:
+                pass
+
+class PooledSession:
+    """One checked-out SMTP connection; send() reconnects and retries once if the connection dropped"""
+
+    def __init__(self, pool: "SMTPSessionPool"):
+        self._pool = pool
+        self._session: Optional[_Session] = None
+        # Why the last send() failed, and whether retrying that message later could succeed
+        self.last_error: Optional[str] = None
+        self.permanent_failure = False
+
+    def send(self, msg: Message) -> bool:
+        self.last_error, self.permanent_failure = None, False
+        for attempt in range(2):
+            try:
+                if self._session is None:
+                    self._session = self._pool._open()
+                self._session.smtp.send_message(msg)
+                self._session.sent += 1
+                self._session.last_used = time.monotonic()
+                self._pool._count("messages")
+                return True
+            except _MESSAGE_ERRORS as e:
+                print(f"❌ SMTP rejected message to {msg.get('To')}: {e}")
+                self.last_error, self.permanent_failure = str(e), _is_permanent(e)
+                return False
+            except Exception as e:
+                # Dropped / timed-out connection (or none could be opened): start a fresh session once
+                if self._session is not None:
+                    self._session.close()
+                    self._session = None
+                if attempt == 0 and not isinstance(e, SMTPUnavailable):
+                    print(f"🔁 SMTP session lost ({e}), reconnecting")
+                    self._pool._count("reconnects")
+                    continue
+                print(f"❌ SMTP send to {msg.get('To')} failed: {e}")
+                self.last_error = str(e)
+                return False
+        return False
+
+class SMTPUnavailable(Exception):
+    """No SMTP connection could be opened on any port"""
+
+class SMTPSessionPool:
+    """Authenticated SMTP sessions reused across messages and batches.
+
+    A session is connected, upgraded (STARTTLS or implicit TLS on 465) and logged in once, then
+    used for every message of a batch and kept for the next one until it has been idle for
+    idle_timeout seconds or has sent max_messages. The port that last connected is tried first.
+    When every port fails, sends fail fast for connect_backoff seconds instead of re-dialling
+    for each recipient.
+    """
+
+    def __init__(self, host: str, user: Optional[str] = None, password: Optional[str] = None,
+                 ports: Sequence[int] = (587, 465), timeout: float = 10.0, max_sessions: Optional[int] = None,
+                 idle_timeout: Optional[float] = None, max_messages: int = 100, connect_backoff: float = 30.0):
+        self.host = host
+        self.user = user
+        self.password = password
+        self.ports = list(ports)
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout if idle_timeout is not None else float(os.getenv("SMTP_IDLE_TIMEOUT", "60"))
+        self.max_messages = max_messages
+        self.connect_backoff = connect_backoff
+        self.preferred_port = self.ports[0]
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_sessions or int(os.getenv("SMTP_MAX_SESSIONS", "2")))
+        self._idle: List[_Session] = []
+        self._unavailable_until = 0.0
+        self.stats = {"connects": 0, "logins": 0, "messages": 0, "reconnects": 0}
+
+    def _count(self, name: str):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _connect(self, port: int) -> smtplib.SMTP:
+        context = ssl.create_default_context()
+        if port == 465:
+            smtp = smtplib.SMTP_SSL(self.host, port, timeout=self.timeout, context=context)
+        else:
+            smtp = smtplib.SMTP(self.host, port, timeout=self.timeout)
+            smtp.ehlo()
+            if smtp.has_extn("starttls"):
+                smtp.starttls(context=context)
+                smtp.ehlo()
+        try:
+            if self.user and self.password:
+                smtp.login(self.user, self.password)
+                self._count("logins")
+        except Exception:
+            smtp.close()
+            raise
+        return smtp
+
+    def _open(self) -> _Session:
+        """A live session: an idle one if still fresh, else a new connection (last good port first)"""
+        now = time.monotonic()
+        with self._lock:
+            while self._idle:
+                session = self._idle.pop()
+                if now - session.last_used < self.idle_timeout and session.sent < self.max_messages:
+                    return session
+                session.close()
+            if now < self._unavailable_until:
+                raise SMTPUnavailable(f"{self.host} unreachable, retrying in {self._unavailable_until - now:.0f}s")
+            ports = [self.preferred_port] + [p for p in self.ports if p != self.preferred_port]
+        errors = []
+        for port in ports:
+            try:
+                smtp = self._connect(port)
+            except Exception as e:
+                errors.append(f"{port}: {e}")
+                print(f"❌ SMTP connect failed on {self.host}:{port}: {e}")
+                continue
+            with self._lock:
+                self.preferred_port = port
+                self._unavailable_until = 0.0
+            self._count("connects")
+            return _Session(smtp, port)
+        with self._lock:
+            self._unavailable_until = time.monotonic() + self.connect_backoff
+        raise SMTPUnavailable("; ".join(errors))
+
+    @contextmanager
+    def session(self):
+        """Check out one connection for a batch: `with pool.session() as s: s.send(msg)`"""
+        self._slots.acquire()
+        pooled = PooledSession(self)
+        try:
+            yield pooled
+        finally:
+            if pooled._session is not None:
+                with self._lock:
+                    self._idle.append(pooled._session)
+            self._slots.release()
+
+    def send(self, msg: Message) -> bool:
+        """Send a single message over a pooled session"""
+        with self.session() as session:
+            return session.send(msg)
+
+    def close(self):
+        """Log out of every idle session"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for session in idle:
+            session.close()
@@ -0,0 +1,218 @@
+import threading
+from typing import Callable, Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from database import get_db, engine
+from models import SkuKey, SnapshotDiff, SnapshotDiffItem
+
+# Item flags stored per SKU, in response order
+DIFF_STATUSES = ("changed", "new", "discontinued", "newly_below", "improved", "worsened")
+
+class SnapshotDiffService:
+    """Per-SKU diffs between pairs of stock-history snapshots, persisted by content-hash pair.
+
+    Each newly ingested snapshot is diffed against its neighbours (by upload date) straight
+    away, so the usual "newest vs previous" comparison is already on disk before anyone asks.
+    Any other pair is computed on first request and persisted the same way. A stored diff is
+    recomputed only when the threshold configuration has changed since it was built, detected by
+    a hash of the overrides and product-group rules in the main DB (not the cache's version counter).
+    The key items service caches that hash between threshold changes, so a stored read costs no extra query.
+    """
+
+    def __init__(self, timeseries_store, key_items_service):
+        self.timeseries_store = timeseries_store
+        self.key_items_service = key_items_service
+        self._lock = threading.Lock()
+
+    # --- ingest hook ---
+    def on_snapshot_ingested(self, snapshot_id: int, content_hash: str):
+        """Diff a new snapshot against the snapshots uploaded just before and after it"""
+        previous_id, next_id = self.timeseries_store.neighbour_snapshots(snapshot_id)
+        if previous_id is not None:
+            self.get_diff(previous_id, snapshot_id)
+        if next_id is not None:
+            self.get_diff(snapshot_id, next_id)
+
+    # --- reads ---
+    def get_diff_for_files(self, old_path: str, new_path: str,
+                           loader: Callable[[str], Optional[pd.DataFrame]]) -> Optional[Tuple[Dict, pd.DataFrame]]:
+        """Diff between two uploaded files (ingested into the stock history first if needed)"""
+        old_id = self._snapshot_for_file(old_path, loader)
+        new_id = self._snapshot_for_file(new_path, loader)
+        if old_id is None or new_id is None:
+            return None
+        return self.get_diff(old_id, new_id)
+
+    def get_diff(self, old_snapshot_id: int, new_snapshot_id: int) -> Tuple[Dict, pd.DataFrame]:
+        """(summary, per-SKU items) for a snapshot pair - read from disk, computed once if missing or stale"""
+        old_hash = self.timeseries_store.snapshot_hash(old_snapshot_id)
+        new_hash = self.timeseries_store.snapshot_hash(new_snapshot_id)
+        thresholds_hash = self.key_items_service.thresholds_fingerprint()
+        db = next(get_db())
+        try:
+            diff = db.query(SnapshotDiff).filter(
+                SnapshotDiff.old_hash == old_hash, SnapshotDiff.new_hash == new_hash
+            ).first()
+            if diff is not None and diff.thresholds_hash == thresholds_hash:
+                return self._summary(diff), self._load_items(diff.id)
+        finally:
+            db.close()
+
+        with self._lock:
+            items = self.compute_diff(old_snapshot_id, new_snapshot_id)
+            diff = self._persist(old_hash, new_hash, old_snapshot_id, new_snapshot_id, thresholds_hash, items)
+        print(f"🔀 Diffed snapshots {old_snapshot_id} -> {new_snapshot_id}: "
+              f"{diff['changed_count']} changed, {diff['newly_below_count']} newly below threshold")
+        return diff, self._load_items(diff["id"])
+
+    def compute_diff(self, old_snapshot_id: int, new_snapshot_id: int) -> pd.DataFrame:
+        """Outer-join two snapshots on sku_id and flag threshold crossings with each SKU's real threshold"""
+        old = self.timeseries_store.snapshot_frame(old_snapshot_id)
+        new = self.timeseries_store.snapshot_frame(new_snapshot_id)
+        attrs = pd.concat([old, new], ignore_index=True).drop_duplicates('sku_id')[
+            ['sku_id', 'item_base', 'size', 'Variant Color', 'Item Product Group Code']
+        ]
+        items = pd.merge(
+            old[['sku_id', 'Grand Total']].rename(columns={'Grand Total': 'old_stock'}),
+            new[['sku_id', 'Grand Total']].rename(columns={'Grand Total': 'new_stock'}),
+            on='sku_id', how='outer'
+        ).merge(attrs, on='sku_id', how='left')
+
+        # One threshold lookup per distinct (item, size, colour, group) rather than per row
+        resolve = self.key_items_service._resolve_row_threshold
+        threshold_keys = list(zip(items['item_base'], items['size'].fillna(''), items['Variant Color'].fillna(''),
+                                  items['Item Product Group Code']))
+        resolved = {key: resolve(key[0], key[1], key[2], key[3]) for key in set(threshold_keys)}
+        items['threshold'] = np.fromiter((resolved[key] for key in threshold_keys), dtype=np.int64, count=len(items))
+
+        old_stock = items['old_stock']
+        new_stock = items['new_stock']
+        # Absent on one side counts as "not low" there, as in the threshold change analysis
+        was_low = old_stock.notna() & (old_stock < items['threshold'])
+        is_low = new_stock.notna() & (new_stock < items['threshold'])
+        items['change'] = (new_stock.fillna(0) - old_stock.fillna(0)).astype(np.int64)
+        items['newly_below'] = is_low & ~was_low
+        items['improved'] = was_low & ~is_low
+        items['worsened'] = was_low & is_low & (new_stock < old_stock)
+        items['old_stock'] = old_stock.astype('Int64')
+        items['new_stock'] = new_stock.astype('Int64')
+        return items[['sku_id', 'old_stock', 'new_stock', 'change', 'threshold', 'newly_below', 'improved', 'worsened']]
+
+    def comparison_frame(self, old_path: str, new_path: str,
+                         loader: Callable[[str], Optional[pd.DataFrame]]) -> Optional[pd.DataFrame]:
+        """Diff items shaped like a suffixed _old/_new merge of the two workbooks (for smart analysis)"""
+        result = self.get_diff_for_files(old_path, new_path, loader)
+        if result is None:
+            return None
+        _, items = result
+        frame = pd.DataFrame({'sku_id': items['sku_id']})
+        for side in ('old', 'new'):
+            present = items[f'{side}_stock'].notna()
+            for column, source in (('Item Description', 'item_description'), ('Variant Color', 'color'),
+                                   ('Variant Code', 'variant_code')):
+                frame[f'{column}_{side}'] = items[source].where(present)
+            frame[f'Grand Total_{side}'] = items[f'{side}_stock'].astype('float64')
+        return frame
+
+    # --- internals ---
+    def _snapshot_for_file(self, file_path: str, loader) -> Optional[int]:
+        content_hash = self.timeseries_store.hash_fn(file_path)
+        snapshot_id = self.timeseries_store.snapshot_id_for_hash(content_hash)
+        if snapshot_id is None and self.timeseries_store.frame_for_file(file_path, loader) is not None:
+            snapshot_id = self.timeseries_store.snapshot_id_for_hash(content_hash)
+        return snapshot_id
+
+    def _persist(self, old_hash: str, new_hash: str, old_snapshot_id: int, new_snapshot_id: int,
+                 thresholds_hash: str, items: pd.DataFrame) -> Dict:
+        old_present = items['old_stock'].notna()
+        new_present = items['new_stock'].notna()
+        counts = {
+            "sku_count": len(items),
+            "changed_count": int((items['change'] != 0).sum()),
+            "new_count": int((~old_present).sum()),
+            "discontinued_count": int((~new_present).sum()),
+            "previous_low_count": int((old_present & (items['old_stock'].fillna(0) < items['threshold'])).sum()),
+            "current_low_count": int((new_present & (items['new_stock'].fillna(0) < items['threshold'])).sum()),
+            "newly_below_count": int(items['newly_below'].sum()),
+            "improved_count": int(items['improved'].sum()),
+            "worsened_count": int(items['worsened'].sum()),
+        }
+        db = next(get_db())
+        try:
+            # Replace a stale diff (thresholds changed) for this pair
+            stale = db.query(SnapshotDiff).filter(SnapshotDiff.old_hash == old_hash, SnapshotDiff.new_hash == new_hash).first()
+            if stale is not None:
+                db.query(SnapshotDiffItem).filter(SnapshotDiffItem.diff_id == stale.id).delete()
+                db.delete(stale)
+                db.flush()
+            diff = SnapshotDiff(old_hash=old_hash, new_hash=new_hash, old_snapshot_id=old_snapshot_id,
+                                new_snapshot_id=new_snapshot_id, thresholds_hash=thresholds_hash, **counts)
+            db.add(diff)
+            db.flush()
+            records = items.astype(object).where(items.notna(), None).to_dict('records')
+            for record in records:
+                record["diff_id"] = diff.id
+            db.execute(SnapshotDiffItem.__table__.insert(), records)
+            db.commit()
+            return self._summary(diff)
+        except IntegrityError:
+            # Another worker stored this pair first
+            db.rollback()
+            existing = db.query(SnapshotDiff).filter(SnapshotDiff.old_hash == old_hash, SnapshotDiff.new_hash == new_hash).first()
+            return self._summary(existing)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _load_items(self, diff_id: int) -> pd.DataFrame:
+        stmt = select(
+            SnapshotDiffItem.sku_id, SnapshotDiffItem.old_stock, SnapshotDiffItem.new_stock, SnapshotDiffItem.change,
+            SnapshotDiffItem.threshold, SnapshotDiffItem.newly_below, SnapshotDiffItem.improved, SnapshotDiffItem.worsened,
+            SkuKey.item_base, SkuKey.item_description, SkuKey.color, SkuKey.variant_code, SkuKey.size
+        ).join(SkuKey, SkuKey.id == SnapshotDiffItem.sku_id) \
+            .where(SnapshotDiffItem.diff_id == diff_id).order_by(SnapshotDiffItem.sku_id)
+        with engine.connect() as conn:
+            items = pd.read_sql(stmt, conn)
+        items['sku_id'] = items['sku_id'].astype(np.int32)
+        items['old_stock'] = items['old_stock'].astype('Int64')
+        items['new_stock'] = items['new_stock'].astype('Int64')
+        for flag in ('newly_below', 'improved', 'worsened'):
+            items[flag] = items[flag].fillna(False).astype(bool)
+        return items
+
+    @staticmethod
+    def status_mask(items: pd.DataFrame, status: str) -> pd.Series:
+        if status == "changed":
+            return items['change'] != 0
+        if status == "new":
+            return items['old_stock'].isna()
+        if status == "discontinued":
+            return items['new_stock'].isna()
+        return items[status]
+
+    @staticmethod
+    def _summary(diff: SnapshotDiff) -> Dict:
+        return {
+            "id": diff.id,
+            "old_hash": diff.old_hash,
+            "new_hash": diff.new_hash,
+            "old_snapshot_id": diff.old_snapshot_id,
+            "new_snapshot_id": diff.new_snapshot_id,
+            "thresholds_hash": diff.thresholds_hash,
+            "sku_count": diff.sku_count,
+            "changed_count": diff.changed_count,
+            "new_count": diff.new_count,
+            "discontinued_count": diff.discontinued_count,
+            "previous_low_count": diff.previous_low_count,
+            "current_low_count": diff.current_low_count,
+            "newly_below_count": diff.newly_below_count,
+            "improved_count": diff.improved_count,
+            "worsened_count": diff.worsened_count,
+            "created_at": diff.created_at.isoformat() if diff.created_at else None,
+        }
@@ -0,0 +1,282 @@
+import os
+import time
+import pickle
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+
+import pandas as pd
+
+from file_storage_service import compute_file_hash
+
+class BoundedCache(OrderedDict):
+    """Small LRU dict used for per-worker caches so RSS stays flat no matter how many files are viewed.
+
+    Shared by request threads: look entries up with get(), which checks and reads under the lock,
+    rather than `key in cache` followed by `cache[key]` (another thread may evict in between).
+    """
+
+    def __init__(self, maxsize: int = 4):
+        super().__init__()
+        self.maxsize = maxsize
+        self._lock = threading.RLock()
+
+    def __getitem__(self, key):
+        with self._lock:
+            value = super().__getitem__(key)
+            self.move_to_end(key)
+            return value
+
+    def get(self, key, default=None):
+        with self._lock:
+            if not super().__contains__(key):
+                return default
+            self.move_to_end(key)
+            return super().__getitem__(key)
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            super().__setitem__(key, value)
+            self.move_to_end(key)
+            while len(self) > self.maxsize:
+                self.popitem(last=False)
+
+    def __delitem__(self, key):
+        with self._lock:
+            super().__delitem__(key)
+
+    def pop(self, key, *default):
+        with self._lock:
+            return super().pop(key, *default)
+
+    def clear(self):
+        with self._lock:
+            super().clear()
+
+class SharedSnapshotStore:
+    """Cross-worker cache of parsed inventory snapshots and alert models.
+
+    Backed by a local SQLite file (WAL mode) so every uvicorn worker on the host reads the
+    same parsed DataFrames and alert payloads instead of each re-parsing the workbook.
+    Entries are keyed by file content hash; named version counters coordinate invalidation
+    ("snapshots" on upload, "thresholds" on threshold edits, "recipients" on recipient edits).
+    Comparison results of two uploads are kept too (LRU-capped), since a pair of immutable
+    files always compares the same way under the same thresholds and algorithm.
+    """
+
+    def __init__(self, db_path: Optional[str] = None, max_frames: Optional[int] = None,
+                 max_comparisons: Optional[int] = None):
+        self.db_path = db_path or os.getenv("SNAPSHOT_CACHE_DB", "snapshot_cache.db")
+        self.max_frames = max_frames or int(os.getenv("SNAPSHOT_CACHE_MAX_FRAMES", "32"))
+        self.max_comparisons = max_comparisons or int(os.getenv("COMPARISON_CACHE_MAX_ENTRIES", "500"))
+        self.worker_id = f"{os.getpid()}-{id(self)}"
+        self._local = threading.local()
+        self._hash_cache = {}  # file path -> (size, mtime, content hash)
+        # path -> catalogued content hash, for uploads whose raw file retention removed
+        self.archived_hash: Optional[Callable[[str], Optional[str]]] = None
+        self._init_schema()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        try:
+            conn = self._connect()
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS frames (
+                    content_hash TEXT PRIMARY KEY,
+                    payload BLOB NOT NULL,
+                    created_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS alert_models (
+                    content_hash TEXT NOT NULL,
+                    thresholds_version INTEGER NOT NULL,
+                    payload BLOB NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (content_hash, thresholds_version)
+                );
+                CREATE TABLE IF NOT EXISTS versions (
+                    name TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS comparison_results (
+                    kind TEXT NOT NULL,
+                    hash1 TEXT NOT NULL,
+                    hash2 TEXT NOT NULL,
+                    thresholds_version INTEGER NOT NULL,
+                    algo_version INTEGER NOT NULL,
+                    payload BLOB NOT NULL,
+                    last_used REAL NOT NULL,
+                    PRIMARY KEY (kind, hash1, hash2, thresholds_version, algo_version)
+                );
+                CREATE INDEX IF NOT EXISTS ix_comparison_results_last_used ON comparison_results (last_used);
+                CREATE TABLE IF NOT EXISTS leases (
+                    name TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                );
+            """)
+        except Exception as e:
+            print(f"⚠️ Shared snapshot store unavailable ({self.db_path}): {e}")
+
+    # --- content hashing ---
+    def hash_for_path(self, file_path: str) -> Optional[str]:
+        """Content hash for a file, memoised on (size, mtime) so repeat lookups don't re-read it"""
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return self.archived_hash(file_path) if self.archived_hash is not None else None
+        cached = self._hash_cache.get(file_path)
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime:
+            return cached[2]
+        content_hash = compute_file_hash(file_path)
+        self._hash_cache[file_path] = (stat.st_size, stat.st_mtime, content_hash)
+        return content_hash
+
+    def is_readable(self, file_path: str) -> bool:
+        """The upload's raw file is on disk, or retention archived it into the stock history"""
+        return os.path.exists(file_path) or (self.archived_hash is not None and self.archived_hash(file_path) is not None)
+
+    # --- version counters ---
+    def get_version(self, name: str) -> int:
+        try:
+            row = self._connect().execute("SELECT value FROM versions WHERE name = ?", (name,)).fetchone()
+            return int(row[0]) if row else 0
+        except Exception as e:
+            print(f"⚠️ Version read failed for {name}: {e}")
+            return 0
+
+    def bump_version(self, name: str) -> int:
+        """Increment a named version counter; other workers drop their local caches when they see it change"""
+        try:
+            conn = self._connect()
+            conn.execute(
+                "INSERT INTO versions (name, value) VALUES (?, 1) "
+                "ON CONFLICT(name) DO UPDATE SET value = value + 1",
+                (name,)
+            )
+            return self.get_version(name)
+        except Exception as e:
+            print(f"⚠️ Version bump failed for {name}: {e}")
+            return 0
+
+    # --- parsed snapshots ---
+    def get_frame(self, content_hash: str) -> Optional[pd.DataFrame]:
+        try:
+            row = self._connect().execute("SELECT payload FROM frames WHERE content_hash = ?", (content_hash,)).fetchone()
+            return pickle.loads(row[0]) if row else None
+        except Exception as e:
+            print(f"⚠️ Shared frame read failed: {e}")
+            return None
+
+    def put_frame(self, content_hash: str, df: pd.DataFrame):
+        try:
+            payload = pickle.dumps(df, protocol=pickle.HIGHEST_PROTOCOL)
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO frames (content_hash, payload, created_at) VALUES (?, ?, ?)",
+                (content_hash, payload, time.time())
+            )
+            # Keep the shared store bounded: drop the oldest parsed snapshots
+            conn.execute(
+                "DELETE FROM frames WHERE content_hash NOT IN "
+                "(SELECT content_hash FROM frames ORDER BY created_at DESC LIMIT ?)",
+                (self.max_frames,)
+            )
+        except Exception as e:
+            print(f"⚠️ Shared frame write failed: {e}")
+
+    # --- alert models ---
+    def get_alert_model(self, content_hash: str, thresholds_version: int) -> Optional[Any]:
+        try:
+            row = self._connect().execute(
+                "SELECT payload FROM alert_models WHERE content_hash = ? AND thresholds_version = ?",
+                (content_hash, thresholds_version)
+            ).fetchone()
+            return pickle.loads(row[0]) if row else None
+        except Exception as e:
+            print(f"⚠️ Shared alert model read failed: {e}")
+            return None
+
+    def put_alert_model(self, content_hash: str, thresholds_version: int, model: Any):
+        try:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO alert_models (content_hash, thresholds_version, payload, created_at) VALUES (?, ?, ?, ?)",
+                (content_hash, thresholds_version, pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL), time.time())
+            )
+            # Alert models for superseded threshold versions can never be read again
+            conn.execute("DELETE FROM alert_models WHERE thresholds_version < ?", (thresholds_version,))
+        except Exception as e:
+            print(f"⚠️ Shared alert model write failed: {e}")
+
+    # --- comparison results ---
+    def get_comparison(self, kind: str, hash1: str, hash2: str, thresholds_version: int, algo_version: int) -> Optional[Any]:
+        key = (kind, hash1, hash2, thresholds_version, algo_version)
+        try:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT payload FROM comparison_results WHERE kind = ? AND hash1 = ? AND hash2 = ? "
+                "AND thresholds_version = ? AND algo_version = ?", key
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE comparison_results SET last_used = ? WHERE kind = ? AND hash1 = ? AND hash2 = ? "
+                "AND thresholds_version = ? AND algo_version = ?", (time.time(),) + key
+            )
+            return pickle.loads(row[0])
+        except Exception as e:
+            print(f"⚠️ Shared comparison read failed: {e}")
+            return None
+
+    def put_comparison(self, kind: str, hash1: str, hash2: str, thresholds_version: int, algo_version: int, result: Any):
+        try:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO comparison_results "
+                "(kind, hash1, hash2, thresholds_version, algo_version, payload, last_used) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (kind, hash1, hash2, thresholds_version, algo_version,
+                 pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL), time.time())
+            )
+            # LRU cap across all comparison kinds
+            conn.execute(
+                "DELETE FROM comparison_results WHERE rowid NOT IN "
+                "(SELECT rowid FROM comparison_results ORDER BY last_used DESC LIMIT ?)",
+                (self.max_comparisons,)
+            )
+        except Exception as e:
+            print(f"⚠️ Shared comparison write failed: {e}")
+
+    # --- leases ---
+    def try_acquire_lease(self, name: str, ttl_seconds: float = 300) -> bool:
+        """Claim a named lease so one-off background work (startup warm, backlog indexing) runs in a single worker"""
+        try:
+            now = time.time()
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT owner, expires_at FROM leases WHERE name = ?", (name,)).fetchone()
+                if row and row[0] != self.worker_id and row[1] > now:
+                    conn.execute("COMMIT")
+                    return False
+                conn.execute(
+                    "INSERT OR REPLACE INTO leases (name, owner, expires_at) VALUES (?, ?, ?)",
+                    (name, self.worker_id, now + ttl_seconds)
+                )
+                conn.execute("COMMIT")
+                return True
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        except Exception as e:
+            # Don't claim work we can't prove is ours: every worker would run it at once
+            print(f"⚠️ Lease {name} unavailable: {e}")
+            return False
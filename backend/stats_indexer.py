@@ -0,0 +1,269 @@
+import os
+import json
+import queue
+import itertools
+import threading
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import or_
+
+from database import get_db
+from models import UploadedFile
+from file_storage_service import compute_file_hash
+
+class StatsIndexer:
+    """Background indexer for per-file key-item stats.
+
+    Files are processed newest-first from a bounded priority queue by a fixed pool of
+    worker threads. Results are persisted to UploadedFile.total_items / low_stock_count /
+    file_metadata and keyed by content hash, so re-uploads of an identical workbook are never parsed twice.
+    Alert counts also record the thresholds fingerprint they were counted under; requeue_stale()
+    recounts them after a threshold change. The same parse feeds the SKU stock time-series store
+    when one is configured.
+    """
+
+    def __init__(self, key_items_service, max_workers: int = None, max_queue: int = 1000, timeseries_store=None):
+        self.key_items_service = key_items_service
+        self.timeseries_store = timeseries_store
+        self.max_workers = max_workers or int(os.getenv("STATS_INDEXER_WORKERS", "2"))
+        self._queue = queue.PriorityQueue(maxsize=max_queue)
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._pending = set()          # file paths queued or being indexed
+        self._stats = {}               # filename -> stats dict
+        self._stats_by_hash = {}       # content hash -> stats dict
+        self._hash_locks = {}          # content hash -> lock held while that content is indexed
+        self._workers: List[threading.Thread] = []
+        # Called with the file path after a file has been (re)indexed
+        self._listeners: List[Callable[[str], None]] = []
+        # Bumped on every completed index so list caches can detect fresh stats
+        self.generation = 0
+
+    def add_listener(self, callback: Callable[[str], None]):
+        """Register a callback run on the indexer thread after each newly indexed file"""
+        self._listeners.append(callback)
+
+    def _notify(self, file_path: str):
+        for callback in self._listeners:
+            try:
+                callback(file_path)
+            except Exception as e:
+                print(f"⚠️ Stats indexer listener failed for {os.path.basename(file_path)}: {e}")
+
+    def start(self):
+        """Start the worker pool (idempotent)"""
+        with self._lock:
+            if self._workers:
+                return
+            for i in range(self.max_workers):
+                worker = threading.Thread(target=self._worker_loop, name=f"stats-indexer-{i}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+        loaded = self.load_persisted_stats()
+        print(f"📇 Stats indexer started with {self.max_workers} workers ({loaded} files already indexed)")
+
+    def submit(self, file_path: str, priority: float = None, force: bool = False) -> bool:
+        """Queue a file for indexing. Newer files (higher mtime) are indexed first.
+        Returns False if the file is already indexed (unless `force`), queued, or the queue is full.
+        """
+        if not self._workers:
+            self.start()
+        if not force and os.path.basename(file_path) in self._stats:
+            return False
+        with self._lock:
+            if file_path in self._pending:
+                return False
+            self._pending.add(file_path)
+        if priority is None:
+            try:
+                priority = -os.path.getmtime(file_path)
+            except OSError:
+                priority = 0
+        try:
+            self._queue.put_nowait((priority, next(self._sequence), file_path))
+            return True
+        except queue.Full:
+            with self._lock:
+                self._pending.discard(file_path)
+            return False
+
+    def submit_urgent(self, file_path: str) -> bool:
+        """Queue a freshly uploaded file ahead of any backlog"""
+        return self.submit(file_path, priority=float('-inf'))
+
+    def is_pending(self, file_path: str) -> bool:
+        with self._lock:
+            return file_path in self._pending
+
+    def get_stats(self, filename: str) -> Optional[Dict]:
+        """Return indexed stats for a file, or None if it hasn't been indexed yet"""
+        return self._stats.get(filename)
+
+    def requeue_stale(self) -> int:
+        """Queue indexed files whose alert counts were computed under different thresholds (newest first)"""
+        fingerprint = self.key_items_service.thresholds_fingerprint()
+        db = next(get_db())
+        try:
+            paths = [row.file_path for row in db.query(UploadedFile.file_path).filter(
+                UploadedFile.is_present == True,
+                UploadedFile.stats_indexed_at.isnot(None),
+                or_(UploadedFile.stats_thresholds_hash.is_(None), UploadedFile.stats_thresholds_hash != fingerprint)
+            ).order_by(UploadedFile.upload_date.desc())]
+        finally:
+            db.close()
+        queued = sum(1 for file_path in paths if self.submit(file_path, force=True))
+        if queued:
+            print(f"📇 Thresholds changed - queued {queued} files for an alert recount")
+        return queued
+
+    def load_persisted_stats(self) -> int:
+        """Load stats persisted by earlier runs so restarts don't re-index anything"""
+        try:
+            db = next(get_db())
+            try:
+                rows = db.query(UploadedFile).filter(
+                    UploadedFile.stats_indexed_at.isnot(None),
+                    UploadedFile.file_metadata.isnot(None)
+                ).all()
+                for row in rows:
+                    self._remember(os.path.basename(row.file_path), row.content_hash, row.total_items, row.low_stock_count,
+                                   row.file_metadata, row.stats_thresholds_hash)
+                return len(rows)
+            finally:
+                db.close()
+        except Exception as e:
+            print(f"⚠️ Could not load persisted file stats: {e}")
+            return 0
+
+    def _remember(self, filename: str, content_hash: Optional[str], key_items_count: int, low_stock_count: int,
+                  metadata_json: Optional[str] = None, thresholds_hash: Optional[str] = None) -> Dict:
+        stats = {
+            "filename": filename,
+            "key_items_count": int(key_items_count or 0),
+            "low_stock_count": int(low_stock_count or 0),
+            "processed_successfully": True
+        }
+        self._stats[filename] = stats
+        if content_hash and metadata_json:
+            self._stats_by_hash[content_hash] = dict(stats, metadata=json.loads(metadata_json), thresholds_hash=thresholds_hash)
+        return stats
+
+    def _has_history(self, content_hash: Optional[str]) -> bool:
+        return self.timeseries_store is None or self.timeseries_store.has_snapshot(content_hash)
+
+    def _worker_loop(self):
+        while True:
+            _, _, file_path = self._queue.get()
+            try:
+                self._index_file(file_path)
+            except Exception as e:
+                print(f"❌ Stats indexer failed for {os.path.basename(file_path)}: {e}")
+            finally:
+                with self._lock:
+                    self._pending.discard(file_path)
+                self._queue.task_done()
+
+    def _recount_alerts(self, db, row, file_path: str, fingerprint: str):
+        """Only the thresholds moved since this file was indexed: recount its alerts, keep everything else"""
+        df = self.key_items_service._load_inventory_file(file_path, use_cache=False)
+        stats = self.key_items_service.compute_file_stats(file_path, df=df)
+        if not stats.get("processed_successfully"):
+            return
+        row.low_stock_count = int(stats.get("low_stock_count") or 0)
+        row.stats_thresholds_hash = fingerprint
+        db.commit()
+        print(f"📇 Recounted alerts for {row.stored_filename} under the current thresholds")
+        self._remember(row.stored_filename, row.content_hash, row.total_items, row.low_stock_count, row.file_metadata,
+                       fingerprint)
+        self.generation += 1
+
+    def _index_file(self, file_path: str):
+        filename = os.path.basename(file_path)
+        db = next(get_db())
+        try:
+            row = db.query(UploadedFile).filter(UploadedFile.stored_filename == filename).first()
+            # Retention may have removed the raw file; the key items service reads those from the stock history
+            archived = row is not None and row.raw_deleted_at is not None
+            if not archived and not os.path.exists(file_path):
+                return
+            file_stat = None if archived else os.stat(file_path)
+            fingerprint = self.key_items_service.thresholds_fingerprint()
+
+            if (row is not None and row.stats_indexed_at is not None and row.file_metadata
+                    and row.content_hash and (archived or row.file_size == file_stat.st_size)
+                    and self._has_history(row.content_hash)):
+                if row.stats_thresholds_hash != fingerprint:
+                    self._recount_alerts(db, row, file_path, fingerprint)
+                    return
+                self._remember(filename, row.content_hash, row.total_items, row.low_stock_count, row.file_metadata,
+                               fingerprint)
+                return
+            if archived:
+                return
+
+            content_hash = compute_file_hash(file_path)
+            # Serialise work per content hash so two workers never parse the same workbook twice
+            with self._lock:
+                hash_lock = self._hash_locks.setdefault(content_hash, threading.Lock())
+            with hash_lock:
+                stats = self._stats_by_hash.get(content_hash)
+                if stats is not None and stats.get("thresholds_hash") != fingerprint:
+                    stats = None
+                if stats is None:
+                    indexed = db.query(UploadedFile).filter(
+                        UploadedFile.content_hash == content_hash,
+                        UploadedFile.stats_indexed_at.isnot(None),
+                        UploadedFile.file_metadata.isnot(None),
+                        UploadedFile.stats_thresholds_hash == fingerprint
+                    ).first()
+                    if indexed is not None:
+                        stats = {
+                            "key_items_count": indexed.total_items,
+                            "low_stock_count": indexed.low_stock_count,
+                            "metadata": json.loads(indexed.file_metadata),
+                            "thresholds_hash": fingerprint
+                        }
+                needs_history = not self._has_history(content_hash)
+                df = None
+                if stats is None or needs_history:
+                    df = self.key_items_service._load_inventory_file(file_path, use_cache=False)
+                if stats is None:
+                    print(f"📇 Indexing stats for {filename}...")
+                    stats = dict(self.key_items_service.compute_file_stats(file_path, df=df), thresholds_hash=fingerprint)
+                    self._stats_by_hash[content_hash] = stats
+                else:
+                    print(f"📇 Reusing stats for {filename} (content already indexed)")
+                if needs_history and df is not None:
+                    upload_date = row.upload_date if row is not None else datetime.utcfromtimestamp(file_stat.st_mtime)
+                    try:
+                        self.timeseries_store.ingest(content_hash, upload_date, df)
+                    except Exception as e:
+                        print(f"⚠️ Could not add {filename} to stock history: {e}")
+
+            if row is None:
+                row = UploadedFile(
+                    filename=filename,
+                    file_path=file_path,
+                    stored_filename=filename,
+                    file_size=file_stat.st_size,
+                    upload_date=datetime.utcfromtimestamp(file_stat.st_mtime),
+                    is_active=False,
+                    is_present=True
+                )
+                db.add(row)
+            row.content_hash = content_hash
+            row.total_items = int(stats.get("key_items_count") or 0)
+            row.low_stock_count = int(stats.get("low_stock_count") or 0)
+            row.file_metadata = json.dumps(stats.get("metadata") or {})
+            row.stats_thresholds_hash = fingerprint
+            row.stats_indexed_at = datetime.utcnow()
+            db.commit()
+            self._remember(filename, content_hash, row.total_items, row.low_stock_count, row.file_metadata, fingerprint)
+            self.generation += 1
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        self._notify(file_path)
@@ -7,13 +7,29 @@ Tracks which products went below threshold between file uploads
 import os
 import json
 import pandas as pd
-from typing import Dict, List, Tuple, Any
+from typing import Dict, List, Optional, Tuple, Any
 from datetime import datetime
 import numpy as np
 
+# Bump when the analysis output changes so persisted results are not reused
+THRESHOLD_ANALYSIS_ALGO_VERSION = 2
+
+LOW_STOCK_COLUMNS = ["unique_id", "item_name", "color", "size", "current_stock", "threshold", "shortage"]
+
 class ThresholdAnalysisService:
-    def __init__(self, uploads_dir=None, threshold=10):
+    def __init__(self, uploads_dir=None, threshold=10, timeseries_store=None, loader=None,
+                 result_cache=None, key_items_service=None, file_storage_service=None):
         self.uploads_dir = uploads_dir or os.getenv("UPLOAD_DIR", "uploads")
+        # Per-SKU thresholds (overrides, product group rules) and the cached workbook loader;
+        # without it every row is compared against the fixed default threshold
+        self.key_items_service = key_items_service
+        # SKU stock history store + workbook loader used to ingest files it hasn't seen yet
+        self.timeseries_store = timeseries_store
+        self.loader = loader or (key_items_service._load_inventory_file if key_items_service else None)
+        # Persistent comparison results keyed by content hashes (SharedSnapshotStore)
+        self.result_cache = result_cache
+        # Upload catalog: gives each file's predecessor in upload order
+        self.file_storage_service = file_storage_service
         self.threshold = threshold
         self.analysis_cache = {}
         
@@ -21,6 +37,98 @@ class ThresholdAnalysisService:
         """
         Analyze which products went below threshold between two file uploads
         """
+        cache_key = self._result_cache_key(current_file_path, previous_file_path)
+        if cache_key is not None:
+            cached = self.result_cache.get_comparison(*cache_key)
+            if cached is not None:
+                print(f"⚡ Using stored threshold analysis for: {os.path.basename(current_file_path)}")
+                # Same content may have been uploaded under another name (copy: the store may hand out a shared dict)
+                cached = dict(cached)
+                cached["current_file"] = os.path.basename(current_file_path)
+                if "previous_file" in cached:
+                    cached["previous_file"] = os.path.basename(previous_file_path)
+                return cached
+        result = self._analyze_threshold_changes(current_file_path, previous_file_path)
+        if cache_key is not None and "error" not in result:
+            self.result_cache.put_comparison(*cache_key, result)
+        return result
+
+    def analysis_for_file(self, filename: Optional[str] = None) -> Dict[str, Any]:
+        """Analysis of an upload (the newest when filename is None) against the upload before it.
+
+        Two indexed catalog lookups plus one stored-result read when the pair was precomputed at
+        ingest; otherwise it is computed once here and stored for the next caller.
+        """
+        from database import get_db
+        db = next(get_db())
+        try:
+            if filename is None:
+                newest = self.file_storage_service.list_catalog(db, limit=1)
+                if not newest:
+                    return {"error": "No files uploaded yet"}
+                entry = newest[0]
+            else:
+                entry = self.file_storage_service.get_catalog_entry(db, filename)
+                if entry is None or not entry.is_present:
+                    return {"error": f"File {filename} not found"}
+            previous, _ = self.file_storage_service.catalog_neighbours(db, entry)
+            current_path = entry.file_path
+            previous_path = previous.file_path if previous is not None else None
+        finally:
+            db.close()
+        return self.analyze_threshold_changes(current_path, previous_path)
+
+    def on_file_indexed(self, file_path: str):
+        """Precompute the analyses a new upload takes part in: itself vs its predecessor, and its
+        successor vs itself (backlog files can be indexed out of upload order)"""
+        if self.result_cache is None or self.file_storage_service is None:
+            return
+        from database import get_db
+        db = next(get_db())
+        try:
+            entry = self.file_storage_service.get_catalog_entry(db, os.path.basename(file_path))
+            if entry is None or not entry.is_present:
+                return
+            previous, following = self.file_storage_service.catalog_neighbours(db, entry)
+            pairs = [(entry.file_path, previous.file_path if previous is not None else None)]
+            if following is not None:
+                pairs.append((following.file_path, entry.file_path))
+        finally:
+            db.close()
+        for current_path, previous_path in pairs:
+            if self._readable(current_path):
+                self.analyze_threshold_changes(current_path, previous_path)
+
+    def _readable(self, file_path: str) -> bool:
+        """Raw file on disk, or an upload archived into the stock history"""
+        if self.result_cache is not None:
+            return self.result_cache.is_readable(file_path)
+        return os.path.exists(file_path)
+
+    def _result_cache_key(self, current_file_path: str, previous_file_path: str = None):
+        """(kind, previous hash, current hash, thresholds fingerprint, algorithm version), or None when uncached"""
+        if self.result_cache is None:
+            return None
+        try:
+            current_hash = self.result_cache.hash_for_path(current_file_path)
+            if not current_hash:
+                return None
+            previous_hash = ""
+            if previous_file_path and self._readable(previous_file_path):
+                previous_hash = self.result_cache.hash_for_path(previous_file_path)
+                if not previous_hash:
+                    return None
+            if self.key_items_service is not None:
+                # Keyed on the persisted threshold configuration itself (this also reloads stale in-memory thresholds)
+                kind, thresholds = "threshold_analysis", self.key_items_service.thresholds_fingerprint()
+            else:
+                kind, thresholds = f"threshold_analysis:{self.threshold}", 0
+            return (kind, previous_hash, current_hash, thresholds, THRESHOLD_ANALYSIS_ALGO_VERSION)
+        except Exception as e:
+            print(f"⚠️ Threshold analysis cache key unavailable: {e}")
+            return None
+
+    def _analyze_threshold_changes(self, current_file_path: str, previous_file_path: str = None) -> Dict[str, Any]:
         try:
             # Load current file
             current_df = self._load_inventory_file(current_file_path)
@@ -28,42 +136,37 @@ class ThresholdAnalysisService:
                 return {"error": "Failed to load current file"}
             
             # Get current low stock items
-            current_low_stock = self._get_low_stock_items(current_df)
+            current_low = self._low_stock_frame(current_df)
+            threshold = "per_sku" if self.key_items_service is not None else self.threshold
             
-            if previous_file_path and os.path.exists(previous_file_path):
+            if previous_file_path and self._readable(previous_file_path):
                 # Compare with previous file
                 previous_df = self._load_inventory_file(previous_file_path)
                 if previous_df is None:
                     return {"error": "Failed to load previous file"}
                 
-                previous_low_stock = self._get_low_stock_items(previous_df)
-                
-                # Find new items that went below threshold
-                new_below_threshold = self._find_new_below_threshold(current_low_stock, previous_low_stock)
+                previous_low = self._low_stock_frame(previous_df)
                 
-                # Find items that improved (went above threshold)
-                improved_items = self._find_improved_items(current_low_stock, previous_low_stock)
-                
-                # Find items that got worse (stock decreased but still below threshold)
-                worsened_items = self._find_worsened_items(current_low_stock, previous_low_stock)
+                # New / improved / worsened items from one indicator merge of the two low-stock sets
+                new_below_threshold, improved_items, worsened_items = self._compare_low_stock(current_low, previous_low)
                 
                 return {
                     "analysis_type": "threshold_change_analysis",
                     "current_file": os.path.basename(current_file_path),
                     "previous_file": os.path.basename(previous_file_path),
-                    "threshold": self.threshold,
+                    "threshold": threshold,
                     "summary": {
-                        "total_current_low_stock": len(current_low_stock),
-                        "total_previous_low_stock": len(previous_low_stock),
+                        "total_current_low_stock": len(current_low),
+                        "total_previous_low_stock": len(previous_low),
                         "new_below_threshold": len(new_below_threshold),
                         "improved_items": len(improved_items),
                         "worsened_items": len(worsened_items),
-                        "net_change": len(current_low_stock) - len(previous_low_stock)
+                        "net_change": len(current_low) - len(previous_low)
                     },
                     "new_below_threshold_items": new_below_threshold,
                     "improved_items": improved_items,
                     "worsened_items": worsened_items,
-                    "current_low_stock": current_low_stock,
+                    "current_low_stock": self._records(current_low),
                     "analysis_timestamp": datetime.now().isoformat()
                 }
             else:
@@ -71,12 +174,12 @@ class ThresholdAnalysisService:
                 return {
                     "analysis_type": "initial_threshold_analysis",
                     "current_file": os.path.basename(current_file_path),
-                    "threshold": self.threshold,
+                    "threshold": threshold,
                     "summary": {
-                        "total_low_stock": len(current_low_stock),
+                        "total_low_stock": len(current_low),
                         "message": "First file upload - baseline established"
                     },
-                    "current_low_stock": current_low_stock,
+                    "current_low_stock": self._records(current_low),
                     "analysis_timestamp": datetime.now().isoformat()
                 }
                 
@@ -84,24 +187,31 @@ class ThresholdAnalysisService:
             return {"error": f"Threshold analysis failed: {str(e)}"}
     
     def _load_inventory_file(self, file_path: str) -> pd.DataFrame:
-        """Load inventory file with error handling"""
+        """Load inventory file through the stock history store / shared cached loader"""
+        if self.timeseries_store is not None and self.loader is not None:
+            try:
+                return self.timeseries_store.frame_for_file(file_path, self.loader)
+            except Exception as e:
+                print(f"Stock history read failed for {file_path}, parsing workbook: {e}")
         try:
-            df = pd.read_excel(file_path)
-            return df
+            if self.loader is not None:
+                return self.loader(file_path)
+            return pd.read_excel(file_path)
         except Exception as e:
             print(f"Error loading file {file_path}: {e}")
             return None
     
-    def _get_low_stock_items(self, df: pd.DataFrame) -> List[Dict]:
-        """Get all items below threshold from dataframe"""
+    def _low_stock_frame(self, df: pd.DataFrame) -> pd.DataFrame:
+        """KI00 rows below their threshold, one row per SKU (LOW_STOCK_COLUMNS)"""
+        empty = pd.DataFrame(columns=LOW_STOCK_COLUMNS)
         try:
             # Filter for KI00 items
-            if 'Season Code' not in df.columns:
-                return []
+            if df is None or 'Season Code' not in df.columns:
+                return empty
             
-            ki00_data = df[df['Season Code'] == 'KI00'].copy()
+            ki00_data = df[df['Season Code'] == 'KI00']
             if ki00_data.empty:
-                return []
+                return empty
             
             # Detect columns
             item_column = self._detect_item_column(df.columns)
@@ -110,107 +220,107 @@ class ThresholdAnalysisService:
             stock_column = self._detect_stock_column(df.columns)
             
             if not all([item_column, stock_column]):
-                return []
+                return empty
             
-            # Convert stock to numeric
-            ki00_data[stock_column] = pd.to_numeric(ki00_data[stock_column], errors='coerce').fillna(0)
-            
-            # Filter items below threshold
-            low_stock = ki00_data[ki00_data[stock_column] < self.threshold].copy()
+            description = ki00_data[item_column].astype(str)
+            color = ki00_data[color_column].astype(str) if color_column else pd.Series('', index=ki00_data.index)
+            variant = ki00_data[size_column].astype(str) if size_column else pd.Series('', index=ki00_data.index)
+            # Stock history frames already carry the item base name and parsed size
+            if 'item_base' in ki00_data.columns:
+                item_name = ki00_data['item_base'].astype(str)
+            else:
+                item_name = description.str.split(' - ').str[0].str.strip()
+            if 'size' in ki00_data.columns:
+                size = ki00_data['size'].fillna('').astype(str)
+            elif self.key_items_service is not None and size_column:
+                size = ki00_data[size_column].map(self.key_items_service.extract_size_from_variant)
+            else:
+                size = variant
             
-            # Create unique identifiers
-            low_stock['unique_id'] = (
-                low_stock[item_column].astype(str) + '|' + 
-                low_stock[color_column].astype(str) + '|' + 
-                low_stock[size_column].astype(str)
+            frame = pd.DataFrame({
+                "unique_id": description + '|' + color + '|' + variant,
+                "item_name": item_name,
+                "color": color,
+                "size": size,
+                "current_stock": pd.to_numeric(ki00_data[stock_column], errors='coerce').fillna(0).astype(np.int64),
+            }).drop_duplicates('unique_id')
+            frame["threshold"] = self._row_thresholds(
+                frame, ki00_data.loc[frame.index, 'Item Product Group Code']
+                if 'Item Product Group Code' in ki00_data.columns else None
             )
             
-            # Convert to list of dictionaries
-            items = []
-            for _, row in low_stock.iterrows():
-                items.append({
-                    "unique_id": row['unique_id'],
-                    "item_name": str(row[item_column]).split(' - ')[0].strip(),
-                    "color": str(row[color_column]),
-                    "size": str(row[size_column]),
-                    "current_stock": int(row[stock_column]),
-                    "threshold": self.threshold,
-                    "shortage": self.threshold - int(row[stock_column])
-                })
-            
-            return items
+            # Filter items below threshold
+            low_stock = frame[frame["current_stock"] < frame["threshold"]].copy()
+            low_stock["shortage"] = low_stock["threshold"] - low_stock["current_stock"]
+            return low_stock[LOW_STOCK_COLUMNS].reset_index(drop=True)
             
         except Exception as e:
             print(f"Error getting low stock items: {e}")
-            return []
+            return empty
     
-    def _detect_item_column(self, columns: List[str]) -> str:
-        """Detect item description column"""
-        possible_names = ['Item Description', 'Item', 'Product', 'Description']
+    def _row_thresholds(self, frame: pd.DataFrame, group_codes) -> np.ndarray:
+        """Each row's real threshold, resolved once per distinct (item, size, colour, product group)"""
+        if self.key_items_service is None:
+            return np.full(len(frame), self.threshold, dtype=np.int64)
+        groups = group_codes if group_codes is not None else [None] * len(frame)
+        keys = list(zip(frame["item_name"], frame["size"], frame["color"], groups))
+        resolve = self.key_items_service._resolve_row_threshold
+        resolved = {key: resolve(*key) for key in set(keys)}
+        return np.fromiter((resolved[key] for key in keys), dtype=np.int64, count=len(keys))
+    
+    def _get_low_stock_items(self, df: pd.DataFrame) -> List[Dict]:
+        """Get all items below threshold from dataframe"""
+        return self._records(self._low_stock_frame(df))
+    
+    def _compare_low_stock(self, current: pd.DataFrame, previous: pd.DataFrame) -> Tuple[List[Dict], List[Dict], List[Dict]]:
+        """(newly below threshold, improved, worsened) records from an outer indicator merge on unique_id"""
+        merged = pd.merge(
+            previous, current, on='unique_id', how='outer', suffixes=('_previous', ''), indicator=True
+        )
+        # Only in the current low-stock set: newly below threshold
+        new_below = merged.loc[merged['_merge'] == 'right_only', LOW_STOCK_COLUMNS]
+        # Only in the previous low-stock set: back above threshold (or no longer stocked)
+        improved = merged.loc[merged['_merge'] == 'left_only', ['unique_id'] + [f"{c}_previous" for c in LOW_STOCK_COLUMNS[1:]]]
+        improved.columns = LOW_STOCK_COLUMNS
+        # Low in both with less stock than before
+        worse = (merged['_merge'] == 'both') & (merged['current_stock'] < merged['current_stock_previous'])
+        worsened = merged.loc[worse, LOW_STOCK_COLUMNS + ['current_stock_previous']] \
+            .rename(columns={'current_stock_previous': 'previous_stock'})
+        worsened['stock_decrease'] = worsened['previous_stock'] - worsened['current_stock']
+        return self._records(new_below), self._records(improved), self._records(worsened)
+    
+    @staticmethod
+    def _records(frame: pd.DataFrame) -> List[Dict]:
+        integer_columns = [c for c in ("current_stock", "threshold", "shortage", "previous_stock", "stock_decrease")
+                           if c in frame.columns]
+        return frame.astype({c: np.int64 for c in integer_columns}).to_dict('records')
+    
+    def _detect_column(self, columns: List[str], possible_names: List[str]) -> str:
+        """Exact column name first (in preference order), then the first column containing one of the names"""
+        by_lower = {str(col).lower(): col for col in columns}
+        for name in possible_names:
+            if name.lower() in by_lower:
+                return by_lower[name.lower()]
         for col in columns:
-            if any(name.lower() in col.lower() for name in possible_names):
+            if any(name.lower() in str(col).lower() for name in possible_names):
                 return col
         return None
     
+    def _detect_item_column(self, columns: List[str]) -> str:
+        """Detect item description column"""
+        return self._detect_column(columns, ['Item Description', 'Item', 'Product', 'Description'])
+    
     def _detect_color_column(self, columns: List[str]) -> str:
         """Detect color column"""
-        possible_names = ['Variant Color', 'Color', 'Colour']
-        for col in columns:
-            if any(name.lower() in col.lower() for name in possible_names):
-                return col
-        return None
+        return self._detect_column(columns, ['Variant Color', 'Color', 'Colour'])
     
     def _detect_size_column(self, columns: List[str]) -> str:
         """Detect size column"""
-        possible_names = ['Variant Code', 'Size', 'Variant Size']
-        for col in columns:
-            if any(name.lower() in col.lower() for name in possible_names):
-                return col
-        return None
+        return self._detect_column(columns, ['Variant Code', 'Size', 'Variant Size'])
     
     def _detect_stock_column(self, columns: List[str]) -> str:
         """Detect stock/quantity column"""
-        possible_names = ['Grand Total', 'Stock Level', 'Total Stock', 'Quantity']
-        for col in columns:
-            if any(name.lower() in col.lower() for name in possible_names):
-                return col
-        return None
-    
-    def _find_new_below_threshold(self, current: List[Dict], previous: List[Dict]) -> List[Dict]:
-        """Find items that are newly below threshold"""
-        current_ids = {item['unique_id'] for item in current}
-        previous_ids = {item['unique_id'] for item in previous}
-        
-        new_ids = current_ids - previous_ids
-        return [item for item in current if item['unique_id'] in new_ids]
-    
-    def _find_improved_items(self, current: List[Dict], previous: List[Dict]) -> List[Dict]:
-        """Find items that improved (went above threshold)"""
-        current_ids = {item['unique_id'] for item in current}
-        previous_ids = {item['unique_id'] for item in previous}
-        
-        improved_ids = previous_ids - current_ids
-        return [item for item in previous if item['unique_id'] in improved_ids]
-    
-    def _find_worsened_items(self, current: List[Dict], previous: List[Dict]) -> List[Dict]:
-        """Find items that got worse (stock decreased but still below threshold)"""
-        current_dict = {item['unique_id']: item for item in current}
-        previous_dict = {item['unique_id']: item for item in previous}
-        
-        worsened = []
-        for unique_id in current_dict:
-            if unique_id in previous_dict:
-                current_stock = current_dict[unique_id]['current_stock']
-                previous_stock = previous_dict[unique_id]['current_stock']
-                
-                if current_stock < previous_stock:
-                    worsened.append({
-                        **current_dict[unique_id],
-                        "previous_stock": previous_stock,
-                        "stock_decrease": previous_stock - current_stock
-                    })
-        
-        return worsened
+        return self._detect_column(columns, ['Grand Total', 'Stock Level', 'Total Stock', 'Quantity'])
     
     def get_threshold_alert_summary(self, analysis_result: Dict) -> str:
         """Generate a human-readable summary of threshold changes"""
@@ -220,7 +330,10 @@ class ThresholdAnalysisService:
         summary = analysis_result.get('summary', {})
         
         if analysis_result['analysis_type'] == 'initial_threshold_analysis':
-            return f"📊 Initial Analysis: {summary['total_low_stock']} items below threshold ({self.threshold})"
+            threshold = analysis_result.get('threshold', self.threshold)
+            if threshold == "per_sku":
+                return f"📊 Initial Analysis: {summary['total_low_stock']} items below their thresholds"
+            return f"📊 Initial Analysis: {summary['total_low_stock']} items below threshold ({threshold})"
         
         # Threshold change analysis
         parts = []
@@ -0,0 +1,163 @@
+import base64
+import json
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+
+from models import ThresholdHistory
+
+HISTORY_DEFAULT_PAGE_SIZE = 100
+HISTORY_MAX_PAGE_SIZE = 500
+THRESHOLD_BULK_MAX_ROWS = 5000
+
+class ThresholdHistoryStore:
+    """Threshold change log: keyset-paged reads and compaction of old entries.
+
+    Pages are ordered newest first on (changed_at, id), which the composite indexes on
+    (item_name, changed_at, id) and (changed_at, id) serve directly. Compaction folds every
+    SKU's changes older than the retention horizon into one summary row (first old value,
+    last new value, number of changes), so the table grows with the number of SKUs edited
+    rather than the number of edits.
+    """
+
+    def __init__(self, retention_days: Optional[int] = None):
+        self.retention_days = retention_days or int(os.getenv("THRESHOLD_HISTORY_RETENTION_DAYS", "180"))
+
+    @staticmethod
+    def _encode_cursor(changed_at: datetime, row_id: int) -> str:
+        return base64.urlsafe_b64encode(json.dumps([changed_at.isoformat(), row_id]).encode()).decode()
+
+    @staticmethod
+    def _decode_cursor(cursor: str) -> Tuple[datetime, int]:
+        value, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        return datetime.fromisoformat(value), int(row_id)
+
+    def page(self, db: Session, limit: Optional[int] = None, cursor: Optional[str] = None,
+             item_name: Optional[str] = None, size: Optional[str] = None, color: Optional[str] = None,
+             date_from: Optional[datetime] = None, date_to: Optional[datetime] = None
+             ) -> Tuple[List[ThresholdHistory], Optional[str]]:
+        """(rows, next_cursor) newest first; raises ValueError on a bad cursor"""
+        limit = max(1, min(int(limit or HISTORY_DEFAULT_PAGE_SIZE), HISTORY_MAX_PAGE_SIZE))
+        query = db.query(ThresholdHistory).filter(ThresholdHistory.changed_at.isnot(None))
+        if item_name:
+            query = query.filter(ThresholdHistory.item_name == item_name)
+        if size:
+            query = query.filter(ThresholdHistory.size == size)
+        if color:
+            query = query.filter(ThresholdHistory.color == color)
+        if date_from is not None:
+            query = query.filter(ThresholdHistory.changed_at >= date_from)
+        if date_to is not None:
+            query = query.filter(ThresholdHistory.changed_at <= date_to)
+        if cursor:
+            try:
+                changed_at, row_id = self._decode_cursor(cursor)
+            except Exception:
+                raise ValueError("invalid cursor")
+            query = query.filter(or_(
+                ThresholdHistory.changed_at < changed_at,
+                and_(ThresholdHistory.changed_at == changed_at, ThresholdHistory.id < row_id)
+            ))
+        rows = query.order_by(ThresholdHistory.changed_at.desc(), ThresholdHistory.id.desc()).limit(limit + 1).all()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = self._encode_cursor(rows[-1].changed_at, rows[-1].id)
+        return rows, next_cursor
+
+    def compact(self, db: Session, now: Optional[datetime] = None) -> Dict:
+        """Fold each SKU's history older than the retention horizon into a single summary row"""
+        horizon = (now or datetime.utcnow()) - timedelta(days=self.retention_days)
+        rows = db.query(
+            ThresholdHistory.id, ThresholdHistory.item_name, ThresholdHistory.size, ThresholdHistory.color,
+            ThresholdHistory.old_threshold, ThresholdHistory.new_threshold, ThresholdHistory.changed_at,
+            ThresholdHistory.compacted_count
+        ).filter(ThresholdHistory.changed_at < horizon) \
+            .order_by(ThresholdHistory.changed_at, ThresholdHistory.id).all()
+        by_sku = defaultdict(list)
+        for row in rows:
+            by_sku[(row.item_name, row.size, row.color)].append(row)
+
+        folded_ids, summaries = [], []
+        for (item_name, size, color), sku_rows in by_sku.items():
+            if len(sku_rows) < 2:
+                continue
+            first, last = sku_rows[0], sku_rows[-1]
+            count = sum(max(r.compacted_count or 0, 1) for r in sku_rows)
+            summaries.append({
+                "item_name": item_name, "size": size, "color": color,
+                "old_threshold": first.old_threshold, "new_threshold": last.new_threshold,
+                "changed_at": last.changed_at, "compacted_count": count,
+                "note": f"compacted: {count} changes from {first.changed_at.date().isoformat()} "
+                        f"to {last.changed_at.date().isoformat()}",
+            })
+            folded_ids.extend(r.id for r in sku_rows)
+        if not summaries:
+            return {"horizon": horizon.isoformat(), "rows_folded": 0, "summary_rows": 0}
+
+        try:
+            for start in range(0, len(folded_ids), 500):
+                db.query(ThresholdHistory).filter(ThresholdHistory.id.in_(folded_ids[start:start + 500])) \
+                    .delete(synchronize_session=False)
+            db.execute(ThresholdHistory.__table__.insert(), summaries)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        print(f"🗜️ Threshold history compacted: {len(folded_ids)} rows folded into {len(summaries)} summaries")
+        return {"horizon": horizon.isoformat(), "rows_folded": len(folded_ids), "summary_rows": len(summaries)}
+
+    @staticmethod
+    def to_dict(row: ThresholdHistory) -> Dict:
+        return {
+            "id": row.id,
+            "item_name": row.item_name,
+            "size": row.size,
+            "color": row.color,
+            "old_threshold": row.old_threshold,
+            "new_threshold": row.new_threshold,
+            "changed_at": row.changed_at.isoformat() if row.changed_at else None,
+            "note": row.note,
+            "compacted_count": row.compacted_count or 0,
+        }
+
+def expand_bulk_threshold_rows(rows: List[Dict], timeseries_store) -> Tuple[List[Dict], List[Dict]]:
+    """Validate bulk threshold rows and expand "*" (or omitted) colour/size wildcards to the
+    variants of the item known from the stock history. Returns (concrete rows, unmatched rows)."""
+    if not isinstance(rows, list) or not rows:
+        raise ValueError("rows must be a non-empty list")
+    concrete, unmatched = [], []
+    variants_by_item = {}
+    for i, row in enumerate(rows):
+        if not isinstance(row, dict) or not str(row.get("item_name") or "").strip():
+            raise ValueError(f"Row {i} needs an item_name")
+        try:
+            threshold = int(row.get("threshold"))
+        except (TypeError, ValueError):
+            raise ValueError(f"Row {i} needs an integer threshold")
+        if threshold < 0:
+            raise ValueError(f"Row {i}: threshold cannot be negative")
+        item_name = str(row["item_name"]).strip()
+        size = str(row.get("size") or "*").strip()
+        color = str(row.get("color") or "*").strip()
+        if size != "*" and color != "*":
+            concrete.append({"item_name": item_name, "size": size, "color": color, "threshold": threshold})
+        else:
+            if item_name not in variants_by_item:
+                skus = timeseries_store.find_skus(item_base=item_name)
+                variants_by_item[item_name] = sorted(set(zip(skus["size"].fillna(""), skus["color"].fillna(""))))
+            matches = [
+                (s, c) for s, c in variants_by_item[item_name]
+                if s and (size == "*" or s.upper() == size.upper()) and (color == "*" or c.upper() == color.upper())
+            ]
+            if not matches:
+                unmatched.append({"item_name": item_name, "size": size, "color": color})
+            concrete.extend({"item_name": item_name, "size": s, "color": c, "threshold": threshold} for s, c in matches)
+        if len(concrete) > THRESHOLD_BULK_MAX_ROWS:
+            raise ValueError(f"At most {THRESHOLD_BULK_MAX_ROWS} thresholds per request (after wildcard expansion)")
+    return concrete, unmatched
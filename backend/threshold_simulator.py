@@ -0,0 +1,166 @@
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+SIMULATION_MAX_SNAPSHOTS = 100
+
+def parse_simulation_rules(rules: List[Dict]) -> List[Dict]:
+    """Validate candidate thresholds: per item {item_name, size, [color], threshold}
+    or per product-group/size rule {product_group, size, threshold, [priority]}"""
+    if not isinstance(rules, list) or not rules:
+        raise ValueError("rules must be a non-empty list")
+    parsed = []
+    for i, rule in enumerate(rules):
+        if not isinstance(rule, dict):
+            raise ValueError(f"Rule {i} must be an object")
+        try:
+            threshold = int(rule.get("threshold"))
+        except (TypeError, ValueError):
+            raise ValueError(f"Rule {i} needs an integer threshold")
+        if threshold < 0:
+            raise ValueError(f"Rule {i}: threshold must be non-negative")
+        size = str(rule.get("size") or "").strip()
+        if not size:
+            raise ValueError(f"Rule {i} needs a size")
+        if rule.get("item_name"):
+            parsed.append({"kind": "item", "item_name": str(rule["item_name"]).strip(), "size": size,
+                           "color": str(rule["color"]).strip() if rule.get("color") else None, "threshold": threshold})
+        elif rule.get("product_group"):
+            priority = rule.get("priority")
+            if priority is not None:
+                try:
+                    priority = int(priority)
+                except (TypeError, ValueError):
+                    raise ValueError(f"Rule {i}: priority must be an integer")
+            parsed.append({"kind": "group", "product_group": str(rule["product_group"]).strip(), "size": size,
+                           "threshold": threshold, "priority": priority})
+        else:
+            raise ValueError(f"Rule {i} needs item_name or product_group")
+    return parsed
+
+class ThresholdSimulator:
+    """What-if evaluation of candidate thresholds over the SKU stock history.
+
+    Current and candidate thresholds are resolved once per SKU, then every (SKU, snapshot)
+    stock row in the window is compared against both in one vectorized pass. Nothing is
+    written: persisted overrides and caches are left alone.
+    """
+
+    def __init__(self, timeseries_store, key_items_service):
+        self.timeseries_store = timeseries_store
+        self.key_items_service = key_items_service
+
+    def simulate(self, rules: List[Dict], snapshots: int = 10, limit: int = 100) -> Dict:
+        rules = parse_simulation_rules(rules)
+        if snapshots < 1 or snapshots > SIMULATION_MAX_SNAPSHOTS:
+            raise ValueError(f"snapshots must be between 1 and {SIMULATION_MAX_SNAPSHOTS}")
+        if limit < 0:
+            raise ValueError("limit must be non-negative")
+
+        window = self.timeseries_store.snapshots().tail(snapshots)
+        if window.empty:
+            return {"snapshots": [], "flipped_skus": [], "flipped_total": 0, "rules": rules}
+        panel = self.timeseries_store.stock_panel(snapshot_ids=window["id"].tolist())
+        skus = self.timeseries_store.find_skus()
+        skus = skus[skus["sku_id"].isin(panel["sku_id"].unique())].reset_index(drop=True)
+
+        current = self._current_thresholds(skus)
+        candidate = self._candidate_thresholds(skus, current, rules)
+
+        # Row -> SKU position (skus is ordered by sku_id)
+        sku_pos = np.searchsorted(skus["sku_id"].to_numpy(), panel["sku_id"].to_numpy())
+        stock = panel["stock"].to_numpy()
+        current_alert = stock < current[sku_pos]
+        candidate_alert = stock < candidate[sku_pos]
+
+        snapshot_codes, snapshot_ids = pd.factorize(panel["snapshot_id"])
+        current_counts = np.bincount(snapshot_codes, weights=current_alert, minlength=len(snapshot_ids)).astype(int)
+        candidate_counts = np.bincount(snapshot_codes, weights=candidate_alert, minlength=len(snapshot_ids)).astype(int)
+        counts = {int(s): (int(c), int(n)) for s, c, n in zip(snapshot_ids, current_counts, candidate_counts)}
+        per_snapshot = []
+        for snapshot_id, upload_date in zip(window["id"], window["upload_date"]):
+            current_count, candidate_count = counts.get(int(snapshot_id), (0, 0))
+            per_snapshot.append({
+                "snapshot_id": int(snapshot_id),
+                "upload_date": upload_date.isoformat() if pd.notna(upload_date) else None,
+                "current_alerts": current_count,
+                "simulated_alerts": candidate_count,
+                "delta": candidate_count - current_count,
+            })
+
+        # SKUs whose alert state differs in at least one snapshot
+        flips = current_alert != candidate_alert
+        n = len(skus)
+        raised = np.bincount(sku_pos, weights=candidate_alert & ~current_alert, minlength=n).astype(int)
+        cleared = np.bincount(sku_pos, weights=current_alert & ~candidate_alert, minlength=n).astype(int)
+        flipped = np.flatnonzero(np.bincount(sku_pos, weights=flips, minlength=n) > 0)
+        # Most affected first
+        flipped = flipped[np.argsort(-(raised[flipped] + cleared[flipped]), kind="stable")]
+        flipped_skus = [
+            {
+                "sku_id": int(skus.at[i, "sku_id"]),
+                "item_name": skus.at[i, "item_base"],
+                "item_description": skus.at[i, "item_description"],
+                "color": skus.at[i, "color"],
+                "size": skus.at[i, "size"],
+                "current_threshold": int(current[i]),
+                "simulated_threshold": int(candidate[i]),
+                "snapshots_raised": int(raised[i]),
+                "snapshots_cleared": int(cleared[i]),
+            }
+            for i in flipped[:limit]
+        ]
+        return {
+            "snapshots": per_snapshot,
+            "flipped_skus": flipped_skus,
+            "flipped_total": int(len(flipped)),
+            "rules": rules,
+        }
+
+    def _current_thresholds(self, skus: pd.DataFrame) -> np.ndarray:
+        """Thresholds in force today, one lookup per distinct (item, size, colour, group)"""
+        resolve = self.key_items_service._resolve_row_threshold
+        keys = list(zip(skus["item_base"], skus["size"].fillna(""), skus["color"].fillna(""), skus["product_group_code"]))
+        resolved = {key: resolve(*key) for key in set(keys)}
+        return np.fromiter((resolved[key] for key in keys), dtype=np.int64, count=len(keys))
+
+    def _candidate_group_rules(self, group_rules: List[Dict]) -> List[Dict]:
+        """Live product-group rules with the candidates added; a candidate for an existing
+        (prefix, size) replaces it and keeps its priority unless it sets one"""
+        normalize = self.key_items_service.normalize_rule_size
+        merged = {(r["group_prefix"], normalize(r["size"])): r for r in self.key_items_service.product_group_rules}
+        for rule in group_rules:
+            key = (rule["product_group"], normalize(rule["size"]))
+            priority = rule["priority"] if rule["priority"] is not None else merged.get(key, {}).get("priority", 0)
+            merged[key] = {"group_prefix": rule["product_group"], "size": key[1], "threshold": rule["threshold"],
+                           "priority": priority}
+        return list(merged.values())
+
+    def _candidate_thresholds(self, skus: pd.DataFrame, current: np.ndarray, rules: List[Dict]) -> np.ndarray:
+        """Current thresholds with the candidate rules applied in the same precedence as the live
+        resolver: per-item thresholds always win; group rules only reach SKUs without an override,
+        and compete with the live rules by priority, then longest prefix"""
+        candidate = current.copy()
+        item = skus["item_base"].fillna("").str.upper().to_numpy()
+        color = skus["color"].fillna("").str.upper().to_numpy()
+        size = skus["size"].fillna("").str.upper().to_numpy()
+
+        group_rules = [r for r in rules if r["kind"] == "group"]
+        if group_rules:
+            has_override = np.fromiter(
+                (self.key_items_service._has_custom_threshold(i, s, c)
+                 for i, s, c in zip(skus["item_base"], skus["size"].fillna(""), skus["color"].fillna(""))),
+                dtype=bool, count=len(skus))
+            lookup = self.key_items_service.group_rule_lookup(self._candidate_group_rules(group_rules))
+            group = self.key_items_service.product_group_thresholds(
+                skus["product_group_code"].tolist(), skus["size"].fillna("").tolist(), lookup)
+            # Adding rules never removes a match, so NaN here means no group rule then or now
+            match = ~has_override & ~np.isnan(group)
+            candidate[match] = group[match].astype(np.int64)
+        for rule in (r for r in rules if r["kind"] == "item"):
+            match = (item == rule["item_name"].upper()) & (size == rule["size"].upper())
+            if rule["color"]:
+                match &= color == rule["color"].upper()
+            candidate[match] = rule["threshold"]
+        return candidate
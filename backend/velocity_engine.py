@@ -0,0 +1,178 @@
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from snapshot_store import BoundedCache
+
+VELOCITY_SORT_COLUMNS = ("velocity", "days_of_cover", "trend_slope", "current_stock", "drawdown")
+VELOCITY_COLUMNS = [
+    "sku_id", "item_base", "item_description", "color", "variant_code", "size",
+    "current_stock", "drawdown", "velocity", "days_of_cover", "trend_slope", "snapshots", "first_seen", "last_seen",
+]
+
+def compute_velocity(panel: pd.DataFrame, latest_snapshot_id: int) -> pd.DataFrame:
+    """Per-SKU sell-through metrics from long (sku_id, snapshot_id, upload_date, stock) rows
+    sorted by sku_id then upload_date, in one vectorized pass:
+
+    - drawdown: total stock decrease between consecutive snapshots (restocks are ignored)
+    - velocity: drawdown per day over the span the SKU was observed
+    - days_of_cover: current stock / velocity (None when the SKU isn't selling)
+    - trend_slope: least-squares stock change per day across all its snapshots
+    Only SKUs present in the latest snapshot are returned.
+    """
+    columns = ["sku_id", "current_stock", "drawdown", "velocity", "days_of_cover", "trend_slope",
+               "snapshots", "first_seen", "last_seen"]
+    if panel.empty:
+        return pd.DataFrame(columns=columns)
+
+    codes, sku_ids = pd.factorize(panel["sku_id"].to_numpy(), sort=False)
+    k = len(sku_ids)
+    dates = panel["upload_date"]
+    t = ((dates - dates.min()).dt.total_seconds() / 86400.0).to_numpy()
+    stock = panel["stock"].to_numpy(dtype=np.float64)
+
+    same_sku = codes[1:] == codes[:-1]
+    decrease = np.where(same_sku, np.clip(stock[:-1] - stock[1:], 0, None), 0.0)
+    drawdown = np.bincount(codes[1:], weights=decrease, minlength=k)
+
+    # Group boundaries (rows are contiguous per SKU)
+    starts = np.r_[0, np.flatnonzero(~same_sku) + 1]
+    ends = np.r_[starts[1:] - 1, len(codes) - 1]
+    span = t[ends] - t[starts]
+
+    n = np.bincount(codes, minlength=k).astype(np.float64)
+    sum_t = np.bincount(codes, weights=t, minlength=k)
+    sum_s = np.bincount(codes, weights=stock, minlength=k)
+    sum_tt = np.bincount(codes, weights=t * t, minlength=k)
+    sum_ts = np.bincount(codes, weights=t * stock, minlength=k)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        velocity = np.where(span > 0, drawdown / span, np.nan)
+        denom = n * sum_tt - sum_t * sum_t
+        slope = np.where((n >= 2) & (denom > 1e-9), (n * sum_ts - sum_t * sum_s) / denom, np.nan)
+
+    in_latest = panel["snapshot_id"].to_numpy()[ends] == latest_snapshot_id
+    current = stock[ends]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cover = np.where(current <= 0, 0.0, np.where(velocity > 0, current / velocity, np.nan))
+
+    result = pd.DataFrame({
+        "sku_id": sku_ids.astype(np.int32),
+        "current_stock": current.astype(np.int64),
+        "drawdown": drawdown.astype(np.int64),
+        "velocity": np.round(velocity, 3),
+        "days_of_cover": np.round(cover, 1),
+        "trend_slope": np.round(slope, 3),
+        "snapshots": n.astype(np.int64),
+        "first_seen": dates.to_numpy()[starts],
+        "last_seen": dates.to_numpy()[ends],
+    })
+    return result[in_latest].reset_index(drop=True)
+
+class VelocityEngine:
+    """Batch sell-through velocity / days-of-cover over the SKU stock history.
+
+    Keeps the window's long stock panel in memory; when a new snapshot lands only that
+    snapshot's rows are read from the store (expired snapshots are dropped) before the
+    metrics are recomputed in one vectorized pass. Other window sizes are computed on demand.
+    """
+
+    def __init__(self, timeseries_store, window_days: Optional[int] = None):
+        self.timeseries_store = timeseries_store
+        self.window_days = window_days or int(os.getenv("VELOCITY_WINDOW_DAYS", "90"))
+        self._lock = threading.Lock()
+        self._panel: Optional[pd.DataFrame] = None
+        self._snapshot_ids: Tuple[Tuple[int, object], ...] = ()  # (snapshot id, upload date) in the panel
+        self._result: Optional[pd.DataFrame] = None
+        self._other_windows = BoundedCache(4)  # (window_days, snapshot ids) -> metrics
+
+    def on_snapshot_ingested(self, snapshot_id: int, content_hash: str):
+        self.refresh()
+
+    def _window_snapshots(self, window_days: int) -> pd.DataFrame:
+        snapshots = self.timeseries_store.snapshots()
+        snapshots = snapshots[snapshots["upload_date"].notna()]
+        if snapshots.empty:
+            return snapshots
+        start = snapshots["upload_date"].max() - pd.Timedelta(days=window_days)
+        return snapshots[snapshots["upload_date"] >= start]
+
+    def refresh(self) -> pd.DataFrame:
+        """Metrics for the default window, updated only if the set of snapshots changed"""
+        window = self._window_snapshots(self.window_days)
+        window_ids = tuple(sorted((int(i), d) for i, d in zip(window["id"], window["upload_date"])))
+        with self._lock:
+            if self._result is not None and window_ids == self._snapshot_ids:
+                return self._result
+            if window.empty:
+                self._panel, self._snapshot_ids = None, ()
+                self._result = self._with_attributes(
+                    compute_velocity(pd.DataFrame(columns=["sku_id", "snapshot_id", "upload_date", "stock"]), -1))
+                return self._result
+            # Keep rows of snapshots still in the window (with unchanged dates); load only the rest
+            loaded = set(self._snapshot_ids)
+            keep_ids = [i for i, d in window_ids if (i, d) in loaded]
+            new_ids = [i for i, d in window_ids if (i, d) not in loaded]
+            panel = self._panel
+            if panel is not None:
+                panel = panel[panel["snapshot_id"].isin(keep_ids)]
+            if new_ids:
+                fresh = self.timeseries_store.stock_panel(snapshot_ids=new_ids)
+                panel = fresh if panel is None or panel.empty else pd.concat([panel, fresh], ignore_index=True)
+                panel = panel.sort_values(["sku_id", "upload_date", "snapshot_id"], kind="stable", ignore_index=True)
+            latest_id = self._latest_snapshot_id(window)
+            self._panel, self._snapshot_ids = panel, window_ids
+            self._result = self._with_attributes(compute_velocity(panel, latest_id))
+            print(f"🏃 Velocity refreshed: {len(self._result)} SKUs over {len(window_ids)} snapshots "
+                  f"({len(new_ids)} newly loaded)")
+            return self._result
+
+    def metrics(self, window_days: Optional[int] = None) -> pd.DataFrame:
+        if not window_days or window_days == self.window_days:
+            return self.refresh()
+        window = self._window_snapshots(window_days)
+        cache_key = (window_days, tuple(int(i) for i in window["id"]))
+        cached = self._other_windows.get(cache_key)
+        if cached is not None:
+            return cached
+        if window.empty:
+            result = self._with_attributes(compute_velocity(pd.DataFrame(columns=["sku_id", "snapshot_id", "upload_date", "stock"]), -1))
+        else:
+            panel = self.timeseries_store.stock_panel(snapshot_ids=list(cache_key[1]))
+            result = self._with_attributes(compute_velocity(panel, self._latest_snapshot_id(window)))
+        self._other_windows[cache_key] = result
+        return result
+
+    def page(self, window_days: Optional[int] = None, sort: str = "velocity", order: str = "desc",
+             limit: int = 100, offset: int = 0, item: Optional[str] = None) -> Tuple[List[Dict], int]:
+        """(rows, total) sorted and paged; missing values (e.g. no velocity) always sort last"""
+        if sort not in VELOCITY_SORT_COLUMNS:
+            raise ValueError(f"Invalid sort '{sort}' (expected one of: {', '.join(VELOCITY_SORT_COLUMNS)})")
+        if order not in ("asc", "desc"):
+            raise ValueError("order must be 'asc' or 'desc'")
+        if limit < 1 or offset < 0:
+            raise ValueError("limit must be positive and offset non-negative")
+        result = self.metrics(window_days)
+        if item:
+            result = result[result["item_base"].str.upper() == item.strip().upper()]
+        ordered = result.sort_values(sort, ascending=(order == "asc"), na_position="last", kind="stable")
+        page = ordered.iloc[offset:offset + limit]
+        page = page.assign(
+            first_seen=page["first_seen"].map(lambda d: d.isoformat() if pd.notna(d) else None),
+            last_seen=page["last_seen"].map(lambda d: d.isoformat() if pd.notna(d) else None),
+        )
+        page = page.astype(object).where(page.notna(), None)
+        return page.to_dict("records"), int(len(result))
+
+    @staticmethod
+    def _latest_snapshot_id(window: pd.DataFrame) -> int:
+        latest = window.sort_values(["upload_date", "id"]).iloc[-1]
+        return int(latest["id"])
+
+    def _with_attributes(self, result: pd.DataFrame) -> pd.DataFrame:
+        skus = self.timeseries_store.find_skus()
+        result = result.merge(skus, on="sku_id", how="left")
+        return result[VELOCITY_COLUMNS]
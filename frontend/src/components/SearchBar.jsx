@@ -1,4 +1,4 @@
-import React, { useState } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { API_BASE_URL } from '../config';
 
 const SearchBar = () => {
@@ -6,13 +6,36 @@ const SearchBar = () => {
   const [results, setResults] = useState([]);
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState('');
+  const [suggestions, setSuggestions] = useState([]);
+  // Term of the last search run: no typeahead for it, so the dropdown doesn't reopen over the results
+  const searchedTerm = useRef(null);
 
-  const handleSearch = async () => {
-    if (!searchTerm.trim()) return;
+  // Typeahead: ask the prefix index once typing pauses
+  useEffect(() => {
+    const q = searchTerm.trim();
+    if (!q || searchTerm === searchedTerm.current) { setSuggestions([]); return; }
+    let cancelled = false;
+    const timer = setTimeout(async () => {
+      try {
+        const response = await fetch(`${API_BASE_URL}/search/suggest?q=${encodeURIComponent(q)}&limit=8`);
+        const data = await response.json();
+        if (!cancelled && searchedTerm.current !== searchTerm) setSuggestions(data.suggestions || []);
+      } catch (e) {
+        if (!cancelled) setSuggestions([]);
+      }
+    }, 150);
+    return () => { cancelled = true; clearTimeout(timer); };
+  }, [searchTerm]);
+
+  // scope 'alerts' searches low-stock rows only; 'all' includes variants that are in stock
+  const handleSearch = async (term = searchTerm, scope = 'alerts') => {
+    if (!term.trim()) return;
+    searchedTerm.current = term;
+    setSuggestions([]);
     setLoading(true);
     setError('');
     try {
-      const response = await fetch(`${API_BASE_URL}/search/article/${encodeURIComponent(searchTerm)}`);
+      const response = await fetch(`${API_BASE_URL}/search/article/${encodeURIComponent(term)}?scope=${scope}`);
       const data = await response.json();
       setResults(data.results || []);
     } catch (e) {
@@ -30,13 +53,28 @@ const SearchBar = () => {
             type="text"
             value={searchTerm}
             onChange={(e) => setSearchTerm(e.target.value)}
+            onKeyDown={(e) => { if (e.key === 'Enter') handleSearch(); }}
             placeholder="Search article..."
             className="flex-1 border rounded px-3 py-2"
           />
-          <button onClick={handleSearch} className="px-4 py-2 bg-blue-600 text-white rounded">
+          <button onClick={() => handleSearch()} className="px-4 py-2 bg-blue-600 text-white rounded">
             Search
           </button>
         </div>
+        {suggestions.length > 0 && (
+          <ul className="border rounded mb-4 divide-y">
+            {suggestions.map((s, idx) => (
+              <li
+                key={idx}
+                onClick={() => { setSearchTerm(s.label); handleSearch(s.label, s.alerts > 0 ? 'alerts' : 'all'); }}
+                className="px-3 py-2 cursor-pointer hover:bg-gray-50 flex justify-between text-sm"
+              >
+                <span>{s.label}</span>
+                <span className="text-gray-500">{s.alerts > 0 ? `${s.alerts} low` : `${s.stock} in stock`}</span>
+              </li>
+            ))}
+          </ul>
+        )}
         {loading && <div>Searching...</div>}
         {error && <div className="text-red-600 text-sm">{error}</div>}
         <ul className="mt-4 space-y-2">
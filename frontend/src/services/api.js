@@ -233,6 +233,10 @@ class ApiService {
     return this.makeRequest('/email/status');
   }
 
+  async getEmailJob(jobId) {
+    return this.makeRequest(`/email/jobs/${encodeURIComponent(jobId)}`);
+  }
+
   // Recipients Management
   async getRecipients() {
     return this.makeRequest('/recipients');
@@ -413,6 +417,7 @@ export const getFileAlerts = (filename) => apiService.getFileAlerts(filename);
 export const getFileStats = (filename) => apiService.getFileStats(filename);
 export const searchArticle = (searchTerm) => apiService.searchArticle(searchTerm);
 export const sendEmailAlert = (itemName) => apiService.sendEmailAlert(itemName);
+export const getEmailJob = (jobId) => apiService.getEmailJob(jobId);
 // Individual item email alerts disabled per user request
 // export const sendItemSpecificAlert = (itemName) => apiService.sendItemSpecificAlert(itemName);
 export const getEmailStatus = () => apiService.getEmailStatus();
@@ -85,7 +85,7 @@ def test_alvaro_email_data():
         print("📊 Email Results:")
         print(f"   Success: {result.get('success')}")
         print(f"   Message: {result.get('message')}")
-        print(f"   Real emails sent: {result.get('real_emails_sent', 0)}/{result.get('total_recipients', 0)}")
+        print(f"   Emails queued: {result.get('queued', 0)}/{result.get('total_recipients', 0)} (job {result.get('job_id')})")
         
         if result.get('email_files'):
             print(f"   Backup files created: {len(result.get('email_files', []))}")
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Test the durable email outbox against a local aiosmtpd server
+Idempotent enqueue, bounded async delivery, backoff retries, permanent bounces and lease recovery
+"""
+
+import sys
+import os
+import asyncio
+from datetime import datetime, timedelta
+sys.path.append(os.path.join(os.path.dirname(__file__), 'backend'))
+
+# The outbox persists through the app's SQLAlchemy engine: give it a throwaway database
+from testdb import temp_db, temp_database  # noqa: F401  (temp_db is a pytest fixture)
+from test_smtp_pool import _Inbox, _message, _server, _free_port
+
+class _BouncingInbox(_Inbox):
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith("bounce"):
+            return "550 5.1.1 No such user"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+async def _wait(outbox, job_id, states=("sent", "failed", "partial"), timeout=15.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while asyncio.get_running_loop().time() < deadline:
+        job = outbox.status(job_id)
+        if job["status"] in states:
+            return job
+        await asyncio.sleep(0.05)
+    raise AssertionError(f"job {job_id} stuck: {outbox.status(job_id)}")
+
+async def _scenarios():
+    from email_outbox import EmailOutbox
+    from smtp_pool import SMTPSessionPool
+    from database import get_db
+    from models import OutboxMessage
+
+    inbox = _BouncingInbox()
+    port = _free_port()
+    pool = SMTPSessionPool("127.0.0.1", "alerts", "secret", ports=(port,), timeout=5, max_sessions=2,
+                           connect_backoff=0)
+    outbox = EmailOutbox(pool, concurrency=2, max_attempts=4, retry_base_seconds=0.2, retry_max_seconds=1,
+                         poll_interval=0.2)
+    delivered = []
+    outbox.add_listener(lambda message: delivered.append((message["recipient"], message["status"])))
+
+    # Server down: the job is persisted anyway and retried with backoff
+    recipients = [f"buyer{i}@example.com" for i in range(5)]
+    job = outbox.enqueue("alert", [(r, _message(r)) for r in recipients], idempotency_key="alert:ANDRA")
+    assert job["queued"] == 5 and not job["duplicate"]
+    again = outbox.enqueue("alert", [(r, _message(r)) for r in recipients], idempotency_key="alert:ANDRA")
+    assert again == {"job_id": job["job_id"], "queued": 0, "duplicate": True}
+    assert outbox.status(job["job_id"])["status"] == "queued"
+
+    outbox.start()
+    await asyncio.sleep(0.5)
+    pending = outbox.status(job["job_id"])
+    # A retry may be in flight at this instant, so a message can be 'sending' as well as 'pending'
+    assert not pending["counts"].get("sent") and not pending["counts"].get("failed")
+    assert all(m["attempts"] >= 1 for m in pending["messages"])
+    print("✅ Unreachable server: messages stay queued with backoff")
+
+    controller = _server(inbox, port)
+    try:
+        done = await _wait(outbox, job["job_id"])
+        assert done["status"] == "sent" and done["counts"]["sent"] == 5
+        assert sorted(r for rcpts in (m[1] for m in inbox.messages) for r in rcpts) == sorted(recipients)
+        # Bounded concurrency: never more connections than worker slots
+        assert pool.stats["connects"] <= 2
+        print(f"✅ Job delivered after retries over {pool.stats['connects']} connection(s)")
+
+        # 5xx on a recipient is permanent: failed after one attempt, the rest of the job still goes out
+        job = outbox.enqueue("excel_report", [(r, _message(r)) for r in ("bounce@example.com", "store@example.com")])
+        done = await _wait(outbox, job["job_id"])
+        by_recipient = {m["recipient"]: m for m in done["messages"]}
+        assert done["status"] == "partial"
+        assert by_recipient["bounce@example.com"]["status"] == "failed" and by_recipient["bounce@example.com"]["attempts"] == 1
+        assert by_recipient["store@example.com"]["status"] == "sent"
+        print("✅ Permanent bounce fails fast without blocking the job")
+
+        # A process that died mid-send leaves a 'sending' row; it is redelivered once the lease expires
+        job = outbox.enqueue("alert", [("late@example.com", _message("late@example.com"))])
+        await _wait(outbox, job["job_id"])
+        db = next(get_db())
+        try:
+            db.query(OutboxMessage).filter(OutboxMessage.job_id == job["job_id"]).update({
+                "status": "sending", "sent_at": None, "locked_until": datetime.utcnow() - timedelta(seconds=1)
+            })
+            db.commit()
+        finally:
+            db.close()
+        outbox._wake()
+        done = await _wait(outbox, job["job_id"], states=("sent",))
+        assert done["messages"][0]["attempts"] == 2
+        print("✅ Expired lease is picked up again")
+
+        # ...but not once that was its last attempt: it is failed instead of being claimed forever
+        job = outbox.enqueue("alert", [("final@example.com", _message("final@example.com"))], max_attempts=1)
+        await _wait(outbox, job["job_id"])
+        db = next(get_db())
+        try:
+            db.query(OutboxMessage).filter(OutboxMessage.job_id == job["job_id"]).update({
+                "status": "sending", "sent_at": None, "locked_until": datetime.utcnow() - timedelta(seconds=1)
+            })
+            db.commit()
+        finally:
+            db.close()
+        outbox._wake()
+        done = await _wait(outbox, job["job_id"], states=("failed",))
+        assert done["messages"][0]["attempts"] == 1 and done["messages"][0]["last_error"]
+        print("✅ Expired lease on the final attempt is failed, not retried")
+
+        assert ("store@example.com", "sent") in delivered and ("bounce@example.com", "failed") in delivered
+        assert ("final@example.com", "failed") in delivered
+    finally:
+        await outbox.stop()
+        pool.close()
+        controller.stop()
+
+class _BrokenPool:
+    def session(self):
+        raise RuntimeError("pool is shut down")
+
+def _crash_after_claim():
+    """An error after the claim reschedules the message instead of leaving it 'sending'"""
+    from email_outbox import EmailOutbox
+
+    outbox = EmailOutbox(_BrokenPool(), max_attempts=2, retry_base_seconds=0, retry_max_seconds=0)
+    job = outbox.enqueue("alert", [("crash@example.com", _message("crash@example.com"))])
+    row_id = outbox.status(job["job_id"])["messages"][0]["id"]
+    assert outbox.deliver(row_id) == "pending"
+    message = outbox.status(job["job_id"])["messages"][0]
+    assert message["attempts"] == 1 and "shut down" in message["last_error"]
+    assert outbox.deliver(row_id) == "failed"
+    print("✅ Delivery crash after the claim is retried, then failed")
+
+def test_email_outbox(temp_db):
+    """Queued jobs survive an SMTP outage and are delivered exactly once per idempotency key"""
+    print("🧪 Testing durable email outbox")
+    try:
+        import aiosmtpd  # noqa: F401
+    except ImportError:
+        print("⏭️ aiosmtpd not installed, skipping")
+        return
+    asyncio.run(_scenarios())
+    _crash_after_claim()
+
+if __name__ == "__main__":
+    with temp_database() as url:
+        test_email_outbox(url)
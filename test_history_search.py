@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Test script to verify history search timelines and incremental refresh
+"""
+
+import sys
+import os
+from datetime import datetime
+sys.path.append(os.path.join(os.path.dirname(__file__), 'backend'))
+
+from testdb import temp_db, temp_database  # noqa: F401  (temp_db is a pytest fixture)
+import pandas as pd
+from key_items_service import KeyItemsService
+from sku_timeseries import SkuTimeSeriesStore
+from search_index import HistorySearchService
+
+def _workbook(rows):
+    """rows: (description, variant code, stock)"""
+    return pd.DataFrame({
+        "Item Product Group Code": ["9999"] * len(rows),  # outside every seeded product group rule
+        "Item No_": ["100200"] * len(rows),
+        "Season Code": ["KI00"] * len(rows),
+        "Item Description": [r[0] for r in rows],
+        "Variant Color": ["BLACK"] * len(rows),
+        "Variant Code": [r[1] for r in rows],
+        "Grand Total": [r[2] for r in rows],
+    })
+
+def test_history_search(temp_db):
+    """Timelines follow upload order, first_low_date is the first upload below threshold, refresh is incremental"""
+    service = KeyItemsService()
+    service.default_size_threshold = 10
+    store = SkuTimeSeriesStore(size_fn=service.extract_size_from_variant)
+    history = HistorySearchService(store, service)
+
+    loaded = []
+    stock_panel = store.stock_panel
+    def counting_panel(sku_ids=None, snapshot_ids=None):
+        loaded.append(sorted(snapshot_ids))
+        return stock_panel(sku_ids=sku_ids, snapshot_ids=snapshot_ids)
+    store.stock_panel = counting_panel
+
+    # Ingested out of upload order: the 15 Sept upload lands before the 1 Sept one
+    late = store.ingest("history-late", datetime(2025, 9, 15), _workbook([("ALVARO - JACKET", "990.M", 4)]))
+    early = store.ingest("history-early", datetime(2025, 9, 1), _workbook([("ALVARO - JACKET", "990.M", 25)]))
+    history.refresh()
+    assert loaded == [sorted([early, late])]
+
+    results, total, snapshots = history.search("alvaro")
+    print(f"After two uploads: {results}")
+    assert (total, snapshots) == (1, 2)
+    jacket = results[0]
+    assert [p["snapshot_id"] for p in jacket["history"]] == [early, late]
+    assert [p["below_threshold"] for p in jacket["history"]] == [False, True]
+    assert jacket["first_low_date"] == "2025-09-15T00:00:00"
+    assert (jacket["first_seen"], jacket["latest_stock"], jacket["threshold"]) == ("2025-09-01T00:00:00", 4, 10)
+    print("✅ Timeline in upload order with the first low date")
+
+    # Nothing new: refresh doesn't touch the store
+    history.refresh()
+    assert len(loaded) == 1
+
+    # A middle upload plus a brand-new SKU: only that snapshot's rows are loaded
+    middle = store.ingest("history-middle", datetime(2025, 9, 8), _workbook([
+        ("ALVARO - JACKET", "990.M", 8), ("ALVARO - VEST", "991.S", 30)]))
+    history.refresh()
+    assert loaded[-1] == [middle] and len(loaded) == 2
+
+    results, total, snapshots = history.search("alvaro")
+    by_variant = {r["variant_code"]: r for r in results}
+    assert (total, snapshots) == (2, 3)
+    jacket = by_variant["990.M"]
+    assert [p["stock"] for p in jacket["history"]] == [25, 8, 4]
+    assert jacket["first_low_date"] == "2025-09-08T00:00:00"
+    vest = by_variant["991.S"]
+    assert vest["snapshots_present"] == 1 and vest["first_low_date"] is None
+    print("✅ Incremental refresh adds the new snapshot and SKU")
+
+if __name__ == "__main__":
+    with temp_database() as url:
+        test_history_search(url)
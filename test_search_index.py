@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Test the article search index
+Substring, prefix, item number and fuzzy matching over a small catalogue,
+plus the typeahead prefix index
+"""
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), 'backend'))
+
+import numpy as np
+import pandas as pd
+from search_index import SearchIndex, SuggestIndex, ITEM_NUMBER_EXACT_SCORE
+
+def _catalogue():
+    rows = [
+        # item_name, description, variant code, colour, item number
+        ("ANDRA", "ANDRA - LEATHER JACKET", "990.XS", "BLACK", "101760.0"),
+        ("ANDRA", "ANDRA - LEATHER JACKET", "990.XL", "BLACK", "101760.0"),
+        ("BOWEN", "BOWEN - BOMBER W/KNIT COLLAR", "990.L", "NAVY", "102120"),
+        ("ALVARO", "ALVARO - WOOL COAT", "990.M", "BLACK/BROWN", "103300"),
+        ("DEVINA", "DEVINA - LEATHER BELT W/SQUARE BUCKLE", "953.40", "COGNAC", ""),
+    ]
+    return pd.DataFrame(rows, columns=["item_name", "item_description", "variant_code", "color", "item_number"])
+
+def _ranked(index, query):
+    doc_ids, scores = index.match(query)
+    order = np.lexsort((doc_ids, -scores))
+    return [int(doc_ids[i]) for i in order], scores
+
+def test_search_index():
+    """Every query term must match some field; better field hits rank first"""
+    print("🧪 Testing article search index")
+    index = SearchIndex(_catalogue())
+
+    # Substring over description and name, case-insensitive
+    ids, _ = _ranked(index, "leather")
+    assert sorted(ids) == [0, 1, 4]
+
+    # Name prefix outranks a hit inside the description
+    ids, _ = _ranked(index, "and")
+    assert ids[:2] == [0, 1]
+
+    # Multiple terms are ANDed, short terms are checked against the longer terms' candidates
+    ids, _ = _ranked(index, "black xl")
+    assert ids == [1]
+    ids, _ = _ranked(index, "coat black")
+    assert ids == [3]
+
+    # Exact item number (Excel's '.0' tail is ignored) ranks on top
+    ids, scores = _ranked(index, "101760")
+    assert sorted(ids) == [0, 1] and scores.max() == ITEM_NUMBER_EXACT_SCORE
+
+    # No substring hit: fuzzy fallback on word trigrams
+    ids, scores = _ranked(index, "lether")
+    assert sorted(ids) == [0, 1, 4] and scores.max() < 1
+    ids, _ = _ranked(index, "bomer")
+    assert ids == [2]
+
+    # Nothing close enough
+    ids, _ = _ranked(index, "zzzzqq")
+    assert ids == []
+    ids, _ = _ranked(index, "   ")
+    assert ids == []
+    print("✅ Search index matches and ranks as expected")
+
+def test_suggest_index():
+    """Prefix lookups over styles, item numbers and variants, most severe shortage first"""
+    print("🧪 Testing typeahead suggestions")
+    docs = _catalogue()
+    docs["size"] = ["XS", "XL", "L", "M", "40"]
+    index = SuggestIndex(docs)
+    thresholds = np.array([10, 10, 10, 10, 10])
+    stock = np.array([2, 12, 9, 30, 0])
+    ranks, stats = index.ranks(thresholds, stock)
+
+    labels = lambda prefix, limit=10: [index.entries[i]["label"] for i in index.lookup(prefix, ranks, limit)]
+    # Style first (its shortage covers its variants), then its variants by severity
+    assert labels("andra") == ["ANDRA", "ANDRA BLACK XS", "ANDRA BLACK XL"]
+    # Colour / size keys reach variants of any style; case and extra spaces don't matter
+    assert labels("Black  X") == ["ANDRA BLACK XS", "ANDRA BLACK XL"]
+    assert labels("1017") == ["101760"]
+    # Top-k keeps the best ranked
+    assert labels("a", limit=2) == ["ANDRA", "ANDRA BLACK XS"]
+    assert labels("") == [] and labels("zz") == []
+
+    entry = index.entries[index.lookup("101760", ranks)[0]]
+    assert entry["type"] == "item_number" and entry["item_name"] == "ANDRA"
+    low_count, shortage, total_stock = stats[index.lookup("andra", ranks)[0]]
+    assert (low_count, shortage, total_stock) == (1, 8, 14)
+    print("✅ Suggestions ranked by alert severity")
+
+if __name__ == "__main__":
+    test_search_index()
+    test_suggest_index()
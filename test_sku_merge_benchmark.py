@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Benchmark the snapshot comparison merge: string unique_id keys vs int32 SKU ids (100k rows per side)
+"""
+
+import sys
+import time
+sys.path.append('backend')
+
+import numpy as np
+import pandas as pd
+from comparison_service import assign_sku_ids, merge_snapshot_frames
+
+ROWS = 100_000
+
+def _snapshot(rng, n, offset):
+    """Synthetic KI00 rows shaped like an inventory workbook (plus the columns a raw parse carries)"""
+    ids = np.arange(offset, offset + n)
+    return pd.DataFrame({
+        'Item Product Group Code': rng.choice(['100', '200', '300'], n),
+        'Season Code': 'KI00',
+        'Item Description': [f"ITEM{i // 40} - LEATHER JACKET" for i in ids],
+        'Variant Color': [f"COLOR{(i // 8) % 5}" for i in ids],
+        'Variant Code': [f"990.{i % 8}" for i in ids],
+        'Unit Cost': rng.random(n) * 100,
+        'Selling Price': rng.random(n) * 300,
+        'Grand Total': rng.integers(0, 50, n),
+        **{str(loc): rng.integers(0, 5, n) for loc in (100, 103, 105, 106, 108, 109, 113, 114, 116, 117)},
+    })
+
+def _string_merge(old_df, new_df):
+    """The previous approach: concatenated string keys, every column carried through the merge"""
+    old_df, new_df = old_df.copy(), new_df.copy()
+    for df in (old_df, new_df):
+        df['unique_id'] = df['Item Description'].astype(str) + '|' + df['Variant Color'].astype(str) + '|' + df['Variant Code'].astype(str)
+    return pd.merge(old_df, new_df, on='unique_id', how='outer', suffixes=('_old', '_new'))
+
+def test_sku_merge_benchmark():
+    """Int-key merge must match the string-key merge row for row"""
+    rng = np.random.default_rng(42)
+    # 10% of SKUs dropped and 10% added between snapshots
+    old_df = _snapshot(rng, ROWS, 0)
+    new_df = _snapshot(rng, ROWS, ROWS // 10)
+
+    t0 = time.perf_counter()
+    baseline = _string_merge(old_df, new_df)
+    string_time = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    old_ids, new_ids = assign_sku_ids(old_df, new_df)
+    factorize_time = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    merged = merge_snapshot_frames(old_ids, new_ids)
+    int_time = time.perf_counter() - t0
+
+    print(f"String-key merge:        {string_time * 1000:.0f} ms ({baseline.shape[1]} columns)")
+    print(f"Int-key merge:           {int_time * 1000:.0f} ms ({merged.shape[1]} columns)")
+    print(f"  + one-off id factorize {factorize_time * 1000:.0f} ms (store snapshots already carry ids)")
+
+    assert len(merged) == len(baseline) == ROWS + ROWS // 10
+    assert old_ids['sku_id'].dtype == np.int32
+    assert merged['Grand Total_old'].isna().sum() == baseline['Grand Total_old'].isna().sum() == ROWS // 10
+    assert merged['Grand Total_new'].isna().sum() == ROWS // 10
+    assert merged['Grand Total_old'].sum() == baseline['Grand Total_old'].sum()
+    assert merged['Grand Total_new'].sum() == baseline['Grand Total_new'].sum()
+    print("✅ Int-key merge matches string-key merge")
+
+if __name__ == "__main__":
+    test_sku_merge_benchmark()
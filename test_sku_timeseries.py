@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Test script to verify the SKU stock history store (ingest, frames, snapshots, stock panel)
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+from datetime import datetime
+sys.path.append(os.path.join(os.path.dirname(__file__), 'backend'))
+
+from testdb import temp_db, temp_database  # noqa: F401  (temp_db is a pytest fixture)
+import pandas as pd
+from file_storage_service import compute_file_hash
+from sku_timeseries import SkuTimeSeriesStore
+
+def _workbook(jacket_m, coat_m):
+    return pd.DataFrame({
+        "Item Product Group Code": ["1015", "1015", "1015", "1020", "1015", "1015"],
+        "Item No_": ["A1", "A1", "A1", "A2", "A3", "A4"],
+        "Season Code": ["KI00", "KI00", "KI00", "KI00", "FW24", "KI00"],
+        "Item Description": ["ALVARO - JACKET", "ALVARO - JACKET", "ALVARO - JACKET", "ASHER - COAT", "OTHER - BAG", ""],
+        "Variant Color": ["BLACK", "BLACK", "BLACK", "BROWN", "RED", "BLACK"],
+        "Variant Code": ["990.M", "990.M", "990.L", "991.M", "992.S", "993.M"],
+        "Selling Price": [100, 100, 100, 200, 50, 10],
+        "100": [2, 1, 0, coat_m, 9, 1],
+        "TRUCK": [1, 0, 5, 0, 0, 0],
+        "Grand Total": [3, jacket_m - 3, 5, coat_m, 9, 1],
+    })
+
+def _size(variant_code):
+    return variant_code.split(".")[-1]
+
+def test_sku_timeseries_ingest(temp_db):
+    """Duplicate variant rows are summed, non key items and blank descriptions are skipped, reads round-trip"""
+    store = SkuTimeSeriesStore(size_fn=_size)
+    snapshot_id = store.ingest("ts-1", datetime(2025, 9, 1), _workbook(jacket_m=7, coat_m=4))
+    assert store.ingest("ts-1", datetime(2025, 9, 1), _workbook(jacket_m=99, coat_m=99)) == snapshot_id  # idempotent
+    assert store.has_snapshot("ts-1") and store.snapshot_id_for_hash("ts-1") == snapshot_id
+
+    frame = store.snapshot_frame(snapshot_id).set_index("Variant Code")
+    print(f"Snapshot frame:\n{frame}")
+    assert sorted(frame.index) == ["990.L", "990.M", "991.M"]
+    assert frame.loc["990.M", "Grand Total"] == 7   # two rows of the same variant, 3 + 4
+    assert (frame.loc["991.M", "item_base"], frame.loc["991.M", "size"]) == ("ASHER", "M")
+    assert set(frame["Season Code"]) == {"KI00"}
+
+    located = store.snapshot_frame(snapshot_id, with_locations=True).set_index("Variant Code")
+    assert (located.loc["990.M", "100"], located.loc["990.M", "TRUCK"]) == (3, 1)
+    assert (located.loc["990.L", "100"], located.loc["990.L", "TRUCK"]) == (0, 5)
+    print("✅ Ingest sums duplicate rows and keeps per-location quantities")
+
+def test_sku_timeseries_reads(temp_db):
+    """frame_for_file ingests once with the catalog's upload date; snapshots and the panel are time ordered"""
+    test_dir = tempfile.mkdtemp(prefix="timeseries_test_")
+    catalog_dates = {}
+    store = SkuTimeSeriesStore(size_fn=_size, date_fn=lambda path: catalog_dates.get(os.path.basename(path)))
+    loads = []
+
+    def loader(path):
+        loads.append(path)
+        return _workbook(jacket_m=12, coat_m=1)
+    try:
+        path = os.path.join(test_dir, "inventory_later.xlsx")
+        with open(path, "wb") as f:
+            f.write(os.urandom(64))
+        catalog_dates["inventory_later.xlsx"] = datetime(2025, 9, 8, 9, 30)
+
+        frame = store.frame_for_file(path, loader)
+        assert len(frame) == 3 and len(loads) == 1
+        store.frame_for_file(path, loader)
+        assert len(loads) == 1  # served from the store the second time
+        later_id = store.snapshot_id_for_hash(compute_file_hash(path))
+
+        # Ingested after, but uploaded before: snapshots() follows upload order
+        earlier_id = store.ingest("ts-earlier", datetime(2025, 9, 1), _workbook(jacket_m=7, coat_m=4))
+        snapshots = store.snapshots()
+        print(f"Snapshots:\n{snapshots}")
+        assert snapshots["id"].tolist() == [earlier_id, later_id]
+        assert snapshots["upload_date"].iloc[1] == pd.Timestamp(2025, 9, 8, 9, 30)
+        print("✅ frame_for_file uses the catalog's upload date")
+
+        skus = store.find_skus(item_base="ALVARO")
+        jacket_m = int(skus.loc[skus["variant_code"] == "990.M", "sku_id"].iloc[0])
+        panel = store.stock_panel(sku_ids=skus["sku_id"].tolist())
+        assert panel["sku_id"].is_monotonic_increasing
+        series = panel[panel["sku_id"] == jacket_m]
+        assert series["snapshot_id"].tolist() == [earlier_id, later_id] and series["stock"].tolist() == [7, 12]
+
+        latest = store.stock_panel(snapshot_ids=[later_id])
+        assert set(latest["snapshot_id"]) == {later_id} and len(latest) == 3
+        assert latest.groupby("snapshot_id")["stock"].sum().iloc[0] == 12 + 5 + 1
+        print("✅ Stock panel is sorted by SKU then time")
+    finally:
+        shutil.rmtree(test_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    with temp_database() as url:
+        test_sku_timeseries_ingest(url)
+    with temp_database() as url:
+        test_sku_timeseries_reads(url)
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Test the pooled SMTP sessions against a local aiosmtpd server
+One connect + login per batch, reuse across batches, reconnect after a dropped connection
+"""
+
+import sys
+import os
+import socket
+sys.path.append(os.path.join(os.path.dirname(__file__), 'backend'))
+
+from email.mime.text import MIMEText
+from smtp_pool import SMTPSessionPool
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+class _Inbox:
+    def __init__(self):
+        self.messages = []
+        self.logins = 0
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append((envelope.mail_from, envelope.rcpt_tos))
+        return "250 OK"
+
+    def authenticate(self, server, session, envelope, mechanism, auth_data):
+        from aiosmtpd.smtp import AuthResult
+        self.logins += 1
+        return AuthResult(success=auth_data.login == b"alerts" and auth_data.password == b"secret")
+
+def _message(recipient):
+    msg = MIMEText("Low stock")
+    msg['Subject'] = "Stock alert"
+    msg['From'] = "Danier Stock Alerts <alerts@example.com>"
+    msg['To'] = recipient
+    return msg
+
+def _server(inbox, port):
+    from aiosmtpd.controller import Controller
+    controller = Controller(inbox, hostname="127.0.0.1", port=port,
+                            authenticator=inbox.authenticate, auth_require_tls=False)
+    controller.start()
+    return controller
+
+def test_smtp_pool():
+    """A batch shares one authenticated connection; drops are retried on a fresh one"""
+    print("🧪 Testing SMTP session pool")
+    try:
+        import aiosmtpd  # noqa: F401
+    except ImportError:
+        print("⏭️ aiosmtpd not installed, skipping")
+        return
+
+    inbox = _Inbox()
+    port, dead_port = _free_port(), _free_port()
+    controller = _server(inbox, port)
+    pool = SMTPSessionPool("127.0.0.1", "alerts", "secret", ports=(dead_port, port), timeout=5,
+                           max_sessions=1, idle_timeout=60)
+    try:
+        # First batch: the dead port is tried once, then one connection carries every message
+        with pool.session() as session:
+            assert all(session.send(_message(f"buyer{i}@example.com")) for i in range(5))
+        assert pool.preferred_port == port
+        assert pool.stats["connects"] == 1 and inbox.logins == 1 and len(inbox.messages) == 5
+
+        # Next batch reuses the idle, already logged-in session
+        assert pool.send(_message("store@example.com"))
+        assert pool.stats["connects"] == 1 and inbox.logins == 1 and len(inbox.messages) == 6
+
+        # Server restarts under an idle session: the send reconnects once and goes through
+        controller.stop()
+        controller = _server(inbox, port)
+        assert pool.send(_message("late@example.com"))
+        assert pool.stats["reconnects"] == 1 and pool.stats["connects"] == 2 and inbox.logins == 2
+        assert inbox.messages[-1][1] == ["late@example.com"]
+        print(f"✅ {len(inbox.messages)} messages over {pool.stats['connects']} connections")
+
+        # Nothing listening on any port: fail fast instead of re-dialling per recipient
+        pool.close()
+        controller.stop()
+        controller = None
+        with pool.session() as session:
+            assert not session.send(_message("a@example.com"))
+            assert not session.send(_message("b@example.com"))
+        assert pool.stats["connects"] == 2
+        print("✅ Unreachable server fails fast")
+    finally:
+        pool.close()
+        if controller is not None:
+            controller.stop()
+
+if __name__ == "__main__":
+    test_smtp_pool()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Test script to verify the per-SKU snapshot diff store (ingest precompute, status filters, stale thresholds)
+"""
+
+import sys
+import os
+from datetime import datetime
+sys.path.append(os.path.join(os.path.dirname(__file__), 'backend'))
+
+from testdb import temp_db, temp_database  # noqa: F401  (temp_db is a pytest fixture)
+import pandas as pd
+from database import get_db
+from models import SnapshotDiff
+from key_items_service import KeyItemsService
+from sku_timeseries import SkuTimeSeriesStore
+from snapshot_diff import SnapshotDiffService
+
+def _workbook(rows):
+    """rows: (description, colour, variant code, stock)"""
+    return pd.DataFrame({
+        "Item Product Group Code": ["9999"] * len(rows),  # outside every seeded product group rule
+        "Season Code": ["KI00"] * len(rows),
+        "Item Description": [r[0] for r in rows],
+        "Variant Color": [r[1] for r in rows],
+        "Variant Code": [r[2] for r in rows],
+        "Grand Total": [r[3] for r in rows],
+    })
+
+def _stored_diffs():
+    db = next(get_db())
+    try:
+        return db.query(SnapshotDiff).order_by(SnapshotDiff.id).all()
+    finally:
+        db.close()
+
+def test_snapshot_diff_store(temp_db):
+    """Diffs are stored at ingest, filter by status and are rebuilt once the thresholds change"""
+    service = KeyItemsService()
+    service.default_size_threshold = 10
+    store = SkuTimeSeriesStore(size_fn=service.extract_size_from_variant)
+    diffs = SnapshotDiffService(store, service)
+    store.add_listener(diffs.on_snapshot_ingested)
+
+    old_id = store.ingest("diff-old", datetime(2025, 9, 1), _workbook([
+        ("ALVARO - JACKET", "BLACK", "990.M", 12),   # drops below 10
+        ("ALVARO - JACKET", "BLACK", "990.L", 4),    # recovers
+        ("ASHER - COAT", "BROWN", "991.M", 6),       # low and falling
+        ("ANDRA - BAG", "TAN", "992.S", 20),         # discontinued
+    ]))
+    assert _stored_diffs() == []  # nothing to diff against yet
+    new_id = store.ingest("diff-new", datetime(2025, 9, 8), _workbook([
+        ("ALVARO - JACKET", "BLACK", "990.M", 7),
+        ("ALVARO - JACKET", "BLACK", "990.L", 15),
+        ("ASHER - COAT", "BROWN", "991.M", 3),
+        ("ARLO - BELT", "BLACK", "993.M", 30),       # new
+    ]))
+
+    # The ingest hook stored the newest-vs-previous diff before anyone asked
+    stored = _stored_diffs()
+    assert len(stored) == 1 and (stored[0].old_hash, stored[0].new_hash) == ("diff-old", "diff-new")
+    summary, items = diffs.get_diff(old_id, new_id)
+    print(f"Diff summary: {summary}")
+    assert summary["id"] == stored[0].id
+    assert (summary["sku_count"], summary["changed_count"], summary["new_count"], summary["discontinued_count"]) == (5, 5, 1, 1)
+    assert (summary["newly_below_count"], summary["improved_count"], summary["worsened_count"]) == (1, 1, 1)
+    print("✅ Diff precomputed at ingest")
+
+    def skus(status):
+        return sorted(items.loc[diffs.status_mask(items, status), "variant_code"])
+    assert skus("newly_below") == ["990.M"]
+    assert skus("improved") == ["990.L"]
+    assert skus("worsened") == ["991.M"]
+    assert skus("new") == ["993.M"]
+    assert skus("discontinued") == ["992.S"]
+    assert skus("changed") == ["990.L", "990.M", "991.M", "992.S", "993.M"]
+    print("✅ Status filters pick the right SKUs")
+
+    # Same thresholds: served from disk, not recomputed, and the fingerprint isn't re-read from the DB
+    reads = []
+    persisted = service.persisted_thresholds_fingerprint
+    service.persisted_thresholds_fingerprint = lambda: reads.append(1) or persisted()
+    assert diffs.get_diff(old_id, new_id)[0]["id"] == summary["id"]
+    assert reads == []
+
+    # A new override changes the fingerprint: the stored diff is stale and rebuilt
+    service.set_custom_threshold("ANDRA", "S", "TAN", 25)
+    service.set_custom_threshold("ARLO", "M", "BLACK", 40)
+    rebuilt, items = diffs.get_diff(old_id, new_id)
+    print(f"Rebuilt summary: {rebuilt}")
+    assert rebuilt["thresholds_hash"] != summary["thresholds_hash"]
+    assert rebuilt["previous_low_count"] == summary["previous_low_count"] + 1
+    assert rebuilt["current_low_count"] == summary["current_low_count"] + 1
+    assert rebuilt["newly_below_count"] == 2 and skus("newly_below") == ["990.M", "993.M"]
+    assert len(_stored_diffs()) == 1
+    print("✅ Stale diff recomputed under the new thresholds")
+
+if __name__ == "__main__":
+    with temp_database() as url:
+        test_snapshot_diff_store(url)
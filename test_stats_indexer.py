@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Test script to verify indexed alert counts follow threshold changes
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+sys.path.append(os.path.join(os.path.dirname(__file__), 'backend'))
+
+from testdb import temp_db, temp_database  # noqa: F401  (temp_db is a pytest fixture)
+import pandas as pd
+from database import get_db
+from models import UploadedFile
+from file_storage_service import FileStorageService
+from key_items_service import KeyItemsService
+from stats_indexer import StatsIndexer
+
+def _write_workbook(path):
+    pd.DataFrame({
+        "Item Product Group Code": ["1015", "1015", "1015"],
+        "Item No_": ["A1", "A1", "A2"],
+        "Season Code": ["KI00", "KI00", "KI00"],
+        "Item Description": ["ALVARO - JACKET", "ALVARO - JACKET", "ASHER - COAT"],
+        "Variant Color": ["BLACK", "BLACK", "BROWN"],
+        "Variant Code": ["BLK-M", "BLK-L", "BRN-M"],
+        "Selling Price": [100, 100, 200],
+        "Grand Total": [5, 40, 40],
+    }).to_excel(path, index=False)
+
+def _row(filename):
+    db = next(get_db())
+    try:
+        return db.query(UploadedFile).filter(UploadedFile.stored_filename == filename).first()
+    finally:
+        db.close()
+
+def test_stats_recount_on_threshold_change(temp_db):
+    """A threshold change requeues indexed files and recounts their alerts under the new fingerprint"""
+    test_dir = tempfile.mkdtemp(prefix="stats_indexer_test_")
+    storage = FileStorageService(os.path.join(test_dir, "uploads"))
+    service = KeyItemsService()
+    service.default_size_threshold = 10
+    service._compile_product_group_rules([])
+    indexer = StatsIndexer(service, max_workers=1)
+    service.add_listener(lambda name: name == "thresholds" and indexer.requeue_stale())
+    try:
+        path = os.path.join(storage.upload_dir, "inventory_stats.xlsx")
+        _write_workbook(path)
+        db = next(get_db())
+        try:
+            storage.register_upload(db, path, "Inventory.xlsx")
+            db.commit()
+        finally:
+            db.close()
+
+        indexer._index_file(path)
+        row = _row("inventory_stats.xlsx")
+        print(f"Indexed: {row.low_stock_count} alerts")
+        assert row.low_stock_count == 1 and row.stats_thresholds_hash == service.thresholds_fingerprint()
+
+        # Raising one SKU's threshold turns a second row into an alert
+        size = service.extract_size_from_variant("BRN-M")
+        service.set_custom_threshold("ASHER", size, "BROWN", 50)
+        indexer._queue.join()
+        row = _row("inventory_stats.xlsx")
+        print(f"After threshold change: {row.low_stock_count} alerts")
+        assert row.low_stock_count == 2 and row.total_items == 2
+        assert row.stats_thresholds_hash == service.thresholds_fingerprint()
+        assert indexer.get_stats("inventory_stats.xlsx")["low_stock_count"] == 2
+        print("✅ Alert counts recounted under the new thresholds")
+
+        # Nothing stale left to requeue
+        assert indexer.requeue_stale() == 0
+    finally:
+        shutil.rmtree(test_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    with temp_database() as url:
+        test_stats_recount_on_threshold_change(url)
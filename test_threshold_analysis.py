@@ -8,6 +8,7 @@ import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(__file__), 'backend'))
 
+import pandas as pd
 from threshold_analysis_service import ThresholdAnalysisService
 
 def test_threshold_analysis():
@@ -130,5 +131,58 @@ def test_threshold_analysis():
     
     print("✅ Threshold Analysis System Ready!")
 
+def _inventory(rows):
+    """KI00 rows shaped like a parsed inventory workbook: (description, color, variant, stock)"""
+    return pd.DataFrame({
+        'Item Product Group Code': ['100'] * len(rows),
+        'Season Code': ['KI00'] * len(rows),
+        'Item Description': [r[0] for r in rows],
+        'Variant Color': [r[1] for r in rows],
+        'Variant Code': [r[2] for r in rows],
+        'Grand Total': [r[3] for r in rows],
+    })
+
+def test_threshold_change_merge():
+    """New / improved / worsened items come out of one indicator merge of the low-stock sets"""
+    threshold_service = ThresholdAnalysisService(threshold=10)
+    
+    previous = _inventory([
+        ("ANDRA - LEATHER JACKET", "BLACK", "990.XS", 7),
+        ("ANDRA - LEATHER JACKET", "BLACK", "990.XL", 8),
+        ("BOWEN - BOMBER", "NAVY", "990.L", 15),
+        ("ALVARO - COAT", "BLACK/BROWN", "990.M", 2),
+    ])
+    current = _inventory([
+        ("ANDRA - LEATHER JACKET", "BLACK", "990.XS", 3),
+        ("ANDRA - LEATHER JACKET", "BLACK", "990.XL", 12),
+        ("BOWEN - BOMBER", "NAVY", "990.L", 5),
+        ("ALVARO - COAT", "BLACK/BROWN", "990.M", 2),
+    ])
+    
+    # The description column wins over 'Item Product Group Code' (which also contains "Item")
+    assert threshold_service._detect_item_column(current.columns) == 'Item Description'
+    
+    current_low = threshold_service._low_stock_frame(current)
+    previous_low = threshold_service._low_stock_frame(previous)
+    assert len(current_low) == 3 and len(previous_low) == 3
+    assert set(current_low['item_name']) == {"ANDRA", "BOWEN", "ALVARO"}
+    
+    new_below, improved, worsened = threshold_service._compare_low_stock(current_low, previous_low)
+    print(f"New: {new_below}")
+    print(f"Improved: {improved}")
+    print(f"Worsened: {worsened}")
+    
+    assert [(i['item_name'], i['current_stock'], i['shortage']) for i in new_below] == [("BOWEN", 5, 5)]
+    assert [(i['item_name'], i['size'], i['current_stock']) for i in improved] == [("ANDRA", "990.XL", 8)]
+    assert len(worsened) == 1
+    assert worsened[0]['previous_stock'] == 7 and worsened[0]['current_stock'] == 3 and worsened[0]['stock_decrease'] == 4
+    assert all(isinstance(i['current_stock'], int) for i in new_below + improved + worsened)
+    
+    # Nothing low on either side
+    empty = threshold_service._low_stock_frame(_inventory([("ZED - VEST", "RED", "990.S", 50)]))
+    assert threshold_service._compare_low_stock(empty, empty) == ([], [], [])
+    print("✅ Indicator merge matches the expected threshold changes")
+
 if __name__ == "__main__":
-    test_threshold_analysis() 
\ No newline at end of file
+    test_threshold_analysis()
+    test_threshold_change_merge()
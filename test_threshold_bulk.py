@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Test script to verify bulk threshold edits (wildcard expansion, row cap, one-transaction upsert)
+"""
+
+import sys
+import os
+from datetime import datetime
+sys.path.append(os.path.join(os.path.dirname(__file__), 'backend'))
+
+from testdb import temp_db, temp_database  # noqa: F401  (temp_db is a pytest fixture)
+import pandas as pd
+from database import get_db
+from models import ThresholdOverride, ThresholdHistory
+from key_items_service import KeyItemsService
+from sku_timeseries import SkuTimeSeriesStore
+from threshold_history import expand_bulk_threshold_rows, THRESHOLD_BULK_MAX_ROWS
+
+def _workbook():
+    return pd.DataFrame({
+        "Item Product Group Code": ["1015"] * 4,
+        "Item No_": ["A1", "A1", "A1", "A2"],
+        "Season Code": ["KI00"] * 4,
+        "Item Description": ["ALVARO - JACKET", "ALVARO - JACKET", "ALVARO - JACKET", "ASHER - COAT"],
+        "Variant Color": ["BLACK", "BLACK", "RED", "BROWN"],
+        "Variant Code": ["990.M", "990.L", "991.M", "992.S"],
+        "Grand Total": [5, 8, 2, 4],
+    })
+
+def _overrides(db):
+    return {(r.item_name, r.size, r.color): r.threshold for r in db.query(ThresholdOverride)}
+
+def test_expand_bulk_threshold_rows(temp_db):
+    """Wildcards expand to the item's known variants; the expanded total is capped"""
+    service = KeyItemsService()
+    store = SkuTimeSeriesStore(size_fn=service.extract_size_from_variant)
+    store.ingest("bulk-test", datetime(2025, 9, 1), _workbook())
+
+    concrete, unmatched = expand_bulk_threshold_rows([
+        {"item_name": "ALVARO", "size": "*", "color": "BLACK", "threshold": 6},
+        {"item_name": "ALVARO", "size": "m", "threshold": 3},            # colour omitted = every colour
+        {"item_name": "ASHER", "size": "S", "color": "BROWN", "threshold": 2},
+        {"item_name": "GHOST", "threshold": 1},
+    ], store)
+    print(f"Expanded: {concrete}")
+    assert [(r["size"], r["color"], r["threshold"]) for r in concrete] == [
+        ("L", "BLACK", 6), ("M", "BLACK", 6), ("M", "BLACK", 3), ("M", "RED", 3), ("S", "BROWN", 2)
+    ]
+    assert unmatched == [{"item_name": "GHOST", "size": "*", "color": "*"}]
+
+    for bad in ([], [{"item_name": "", "threshold": 1}], [{"item_name": "ALVARO", "threshold": "x"}],
+                [{"item_name": "ALVARO", "size": "M", "color": "BLACK", "threshold": -1}]):
+        try:
+            expand_bulk_threshold_rows(bad, store)
+            assert False, f"accepted {bad}"
+        except ValueError:
+            pass
+
+    # Exactly at the cap is fine; one more (concrete or expanded) is refused
+    rows = [{"item_name": f"ITEM{i}", "size": "M", "color": "BLACK", "threshold": 1} for i in range(THRESHOLD_BULK_MAX_ROWS)]
+    assert len(expand_bulk_threshold_rows(rows, store)[0]) == THRESHOLD_BULK_MAX_ROWS
+    for extra in ({"item_name": "ONE", "size": "M", "color": "BLACK", "threshold": 1}, {"item_name": "ALVARO", "threshold": 1}):
+        try:
+            expand_bulk_threshold_rows(rows + [extra], store)
+            assert False, "row cap not enforced"
+        except ValueError as e:
+            assert str(THRESHOLD_BULK_MAX_ROWS) in str(e)
+    print("✅ Wildcard expansion and row cap OK")
+
+def test_set_custom_thresholds_bulk(temp_db):
+    """Upserts and history rows land in one transaction; only the touched items' caches are dropped"""
+    service = KeyItemsService()
+    service.set_custom_threshold("ALVARO", "M", "BLACK", 4)
+    service._set_cache(service._get_cache_key("alerts_ALVARO", "latest.xlsx"), ["stale"])
+    service._set_cache(service._get_cache_key("alerts_ASHER", "latest.xlsx"), ["kept"])
+    service._set_cache(service._get_cache_key("key_items_batch", "latest.xlsx"), ["kept"])
+    service._set_cache(service._get_cache_key("all_key_items_with_alerts_v2", "latest.xlsx"), ["stale"])
+
+    result = service.set_custom_thresholds_bulk([
+        {"item_name": "ALVARO", "size": "M", "color": "BLACK", "threshold": 4},   # unchanged
+        {"item_name": "ALVARO", "size": "L", "color": "BLACK", "threshold": 1},
+        {"item_name": "ALVARO", "size": "L", "color": "BLACK", "threshold": 7},   # last row wins
+        {"item_name": "ALVARO", "size": "M", "color": "RED", "threshold": 9},
+    ], note="spring reset")
+    print(f"Bulk result: {result}")
+    assert result == {"created": 2, "updated": 0, "unchanged": 1}
+    assert service.custom_thresholds["ALVARO|L|BLACK"] == 7
+
+    remaining = {key.split(":", 1)[0] for key in service.cache}
+    assert remaining == {"alerts_ASHER", "key_items_batch"}, remaining
+    print("✅ Only the touched items' cached alerts were dropped")
+
+    db = next(get_db())
+    try:
+        assert _overrides(db) == {("ALVARO", "M", "BLACK"): 4, ("ALVARO", "L", "BLACK"): 7, ("ALVARO", "M", "RED"): 9}
+        history = db.query(ThresholdHistory).filter(ThresholdHistory.note == "spring reset") \
+            .order_by(ThresholdHistory.size, ThresholdHistory.color).all()
+        assert [(h.size, h.color, h.old_threshold, h.new_threshold) for h in history] == [
+            ("L", "BLACK", None, 7), ("M", "RED", None, 9)
+        ]
+        assert len({h.changed_at for h in history}) == 1
+
+        # A failing row rolls back the whole batch, including updates made before it
+        try:
+            service.set_custom_thresholds_bulk([
+                {"item_name": "ALVARO", "size": "L", "color": "BLACK", "threshold": 11},
+                {"item_name": "ALVARO", "size": None, "color": "TAN", "threshold": 3},
+            ])
+            assert False, "invalid row accepted"
+        except Exception:
+            pass
+        db.expire_all()
+        assert _overrides(db)[("ALVARO", "L", "BLACK")] == 7
+        assert db.query(ThresholdHistory).filter(ThresholdHistory.new_threshold == 11).count() == 0
+        assert service.custom_thresholds["ALVARO|L|BLACK"] == 7
+        print("✅ Bulk upsert is all or nothing, one history row per change")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    with temp_database() as url:
+        test_expand_bulk_threshold_rows(url)
+    with temp_database() as url:
+        test_set_custom_thresholds_bulk(url)
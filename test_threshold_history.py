@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Test script to verify threshold history compaction and keyset paging
+"""
+
+import sys
+import os
+from datetime import datetime, timedelta
+sys.path.append(os.path.join(os.path.dirname(__file__), 'backend'))
+
+from testdb import temp_db, temp_database  # noqa: F401  (temp_db is a pytest fixture)
+from database import get_db
+from models import ThresholdHistory
+from threshold_history import ThresholdHistoryStore
+
+NOW = datetime(2025, 9, 1, 12, 0, 0)
+
+def _change(item_name, old, new, days_ago, size="M", color="BLACK"):
+    return ThresholdHistory(item_name=item_name, size=size, color=color, old_threshold=old, new_threshold=new,
+                            changed_at=NOW - timedelta(days=days_ago))
+
+def _rows(db, item_name):
+    return db.query(ThresholdHistory).filter(ThresholdHistory.item_name == item_name) \
+        .order_by(ThresholdHistory.changed_at, ThresholdHistory.id).all()
+
+def test_threshold_history_compact(temp_db):
+    """Old changes fold into one summary row per SKU; recent and single rows are left alone"""
+    store = ThresholdHistoryStore(retention_days=30)
+    db = next(get_db())
+    try:
+        db.add_all([
+            _change("ALVARO", 2, 3, 90), _change("ALVARO", 3, 5, 60), _change("ALVARO", 5, 4, 45),
+            _change("ALVARO", 4, 6, 5),   # inside the retention window
+            _change("ASHER", 1, 2, 120),  # the SKU's only old change
+        ])
+        db.commit()
+
+        result = store.compact(db, now=NOW)
+        print(f"First compaction: {result}")
+        assert result["rows_folded"] == 3 and result["summary_rows"] == 1
+
+        alvaro = _rows(db, "ALVARO")
+        summary, recent = alvaro
+        assert len(alvaro) == 2
+        assert (summary.old_threshold, summary.new_threshold, summary.compacted_count) == (2, 4, 3)
+        assert summary.changed_at == NOW - timedelta(days=45) and summary.note.startswith("compacted: 3 changes")
+        assert (recent.new_threshold, recent.compacted_count or 0) == (6, 0)
+
+        asher = _rows(db, "ASHER")
+        assert len(asher) == 1 and (asher[0].compacted_count or 0) == 0 and asher[0].note is None
+        print("✅ Old changes folded, recent and single rows untouched")
+
+        # The recent change ages out later: it folds into the existing summary, which counts for 3
+        result = store.compact(db, now=NOW + timedelta(days=30))
+        print(f"Second compaction: {result}")
+        assert result["rows_folded"] == 2 and result["summary_rows"] == 1
+        alvaro = _rows(db, "ALVARO")
+        assert len(alvaro) == 1
+        assert (alvaro[0].old_threshold, alvaro[0].new_threshold, alvaro[0].compacted_count) == (2, 6, 4)
+
+        # Nothing left to fold
+        assert store.compact(db, now=NOW + timedelta(days=30))["rows_folded"] == 0
+        print("✅ Re-compaction keeps the running change count")
+    finally:
+        db.close()
+
+def test_threshold_history_page(temp_db):
+    """Keyset pages cover every row exactly once, even when changed_at values tie"""
+    store = ThresholdHistoryStore()
+    db = next(get_db())
+    try:
+        # Bulk edits stamp many rows with the same changed_at
+        db.add_all([_change(f"ITEM{i:02d}", i, i + 1, days_ago=i // 4) for i in range(23)])
+        db.commit()
+
+        seen, cursor, pages = [], None, 0
+        while True:
+            rows, cursor = store.page(db, limit=5, cursor=cursor)
+            seen.extend((row.changed_at, row.id) for row in rows)
+            pages += 1
+            if cursor is None:
+                break
+        print(f"Paged {len(seen)} rows in {pages} pages")
+        assert pages == 5 and len(seen) == 23
+        assert len(set(seen)) == 23
+        assert seen == sorted(seen, reverse=True)
+
+        # Filters and bad cursors
+        rows, cursor = store.page(db, item_name="ITEM07")
+        assert [row.item_name for row in rows] == ["ITEM07"] and cursor is None
+        try:
+            store.page(db, cursor="not-a-cursor")
+            assert False, "bad cursor accepted"
+        except ValueError:
+            pass
+        print("✅ Keyset pages have no gaps or duplicates")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    with temp_database() as url:
+        test_threshold_history_compact(url)
+    with temp_database() as url:
+        test_threshold_history_page(url)
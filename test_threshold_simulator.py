@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Test script to verify the what-if threshold simulator resolves candidates like the live thresholds
+"""
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), 'backend'))
+
+from testdb import temp_db, temp_database  # noqa: F401  (temp_db is a pytest fixture)
+import pandas as pd
+from key_items_service import KeyItemsService
+from threshold_simulator import ThresholdSimulator, parse_simulation_rules
+
+def _skus():
+    return pd.DataFrame({
+        "sku_id": [1, 2, 3, 4, 5],
+        "item_base": ["ALVARO", "ALVARO", "ASHER", "ANDRA", "ANDRA"],
+        "item_description": ["ALVARO - JACKET", "ALVARO - JACKET", "ASHER - COAT", "ANDRA - BAG", "ANDRA - BAG"],
+        "color": ["BLACK", "BLACK", "BROWN", "TAN", "TAN"],
+        "size": ["M", "L", "M", "M", "S"],
+        "product_group_code": ["1015", "1015", "1015", "1020", "1020"],
+    })
+
+def test_threshold_simulator_precedence(temp_db):
+    """Overrides beat group rules, item rules beat everything, group rules keep live priority order"""
+    service = KeyItemsService()
+    service.default_size_threshold = 30
+    service._compile_product_group_rules([
+        {"group_prefix": "101", "size": "M", "threshold": 8, "priority": 5},
+        {"group_prefix": "10", "size": "S", "threshold": 4, "priority": 0},
+    ])
+    service.custom_thresholds = {"ASHER|M|BROWN": 12}
+    simulator = ThresholdSimulator(None, service)
+    skus = _skus()
+
+    current = simulator._current_thresholds(skus)
+    print(f"Current thresholds: {current.tolist()}")
+    assert current.tolist() == [8, 30, 12, 30, 4]
+
+    # A broad candidate rule loses to the live higher-priority 101 rule and to the override;
+    # it only reaches the 1020 SKU, which no live rule covered
+    candidate = simulator._candidate_thresholds(skus, current, parse_simulation_rules([
+        {"product_group": "10", "size": "M", "threshold": 20},
+    ]))
+    print(f"Broad group rule: {candidate.tolist()}")
+    assert candidate.tolist() == [8, 30, 12, 20, 4]
+
+    # Replacing the live rule keeps its priority; a higher-priority candidate wins outright
+    candidate = simulator._candidate_thresholds(skus, current, parse_simulation_rules([
+        {"product_group": "101", "size": "M", "threshold": 6},
+    ]))
+    assert candidate.tolist() == [6, 30, 12, 30, 4]
+    candidate = simulator._candidate_thresholds(skus, current, parse_simulation_rules([
+        {"product_group": "10", "size": "M", "threshold": 20, "priority": 9},
+    ]))
+    assert candidate.tolist() == [20, 30, 12, 20, 4]
+    print("✅ Candidate group rules follow priority, longest prefix and overrides")
+
+    # Item rules beat both the override and any group rule
+    candidate = simulator._candidate_thresholds(skus, current, parse_simulation_rules([
+        {"product_group": "10", "size": "M", "threshold": 20, "priority": 9},
+        {"item_name": "asher", "size": "m", "threshold": 2},
+        {"item_name": "ALVARO", "size": "M", "color": "BLACK", "threshold": 1},
+    ]))
+    print(f"With item rules: {candidate.tolist()}")
+    assert candidate.tolist() == [1, 30, 2, 20, 4]
+
+    # Nothing is written back
+    assert service.custom_thresholds == {"ASHER|M|BROWN": 12} and len(service.product_group_rules) == 2
+    print("✅ Item rules win over everything")
+
+if __name__ == "__main__":
+    with temp_database() as url:
+        test_threshold_simulator_precedence(url)
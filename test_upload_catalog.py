@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Test script to verify the upload catalog (registration, boot reconcile, listing)
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+sys.path.append(os.path.join(os.path.dirname(__file__), 'backend'))
+
+from testdb import temp_db, temp_database  # noqa: F401  (temp_db is a pytest fixture)
+from database import get_db
+from file_storage_service import FileStorageService
+
+def _write_file(upload_dir, name, size=128):
+    path = os.path.join(upload_dir, name)
+    with open(path, 'wb') as f:
+        f.write(os.urandom(size))
+    return path
+
+def test_upload_catalog(temp_db):
+    """Register uploads, reconcile against the uploads dir and list newest first"""
+    test_dir = tempfile.mkdtemp(prefix="catalog_test_")
+    upload_dir = os.path.join(test_dir, "uploads")
+    service = FileStorageService(upload_dir)
+    db = next(get_db())
+    try:
+        # Files that were on disk before the catalog existed
+        _write_file(upload_dir, "inventory_20250101_090000.xlsx")
+        _write_file(upload_dir, "inventory_20250102_090000.xlsx")
+        result = service.reconcile_catalog(db)
+        print(f"Reconcile: {result}")
+        assert result["added"] == 2
+
+        # Reconcile is idempotent
+        assert service.reconcile_catalog(db)["added"] == 0
+
+        # A fresh upload becomes the single active file
+        latest = _write_file(upload_dir, "inventory_20250103_090000.xlsx")
+        service.register_upload(db, latest, "Inventory Report.xlsx")
+        db.commit()
+        files = service.list_catalog(db)
+        print(f"Catalog: {[(f.stored_filename, f.is_active) for f in files]}")
+        assert files[0].stored_filename == "inventory_20250103_090000.xlsx"
+        assert sum(1 for f in files if f.is_active) == 1
+        assert service.get_latest_file_path(db) == latest
+
+        # Totals honour the same filters as the listing
+        assert service.catalog_totals(db)[0] == 3
+        assert service.catalog_totals(db, date_from=datetime.utcnow() + timedelta(days=1))[0] == 0
+        assert service.catalog_totals(db, min_alerts=0)[0] == 0  # nothing indexed yet
+
+        # No limit or cursor: the whole listing in one page; with a limit, keyset pages
+        rows, cursor = service.page_catalog(db)
+        assert len(rows) == 3 and cursor is None
+        rows, cursor = service.page_catalog(db, limit=2)
+        assert len(rows) == 2 and cursor is not None
+        rows, cursor = service.page_catalog(db, cursor=cursor)
+        assert len(rows) == 1 and cursor is None
+
+        # Active file removed from disk -> the newest remaining upload is promoted
+        os.remove(latest)
+        fallback = service.resolve_latest_file_path(db)
+        print(f"Fallback after delete: {fallback}")
+        assert fallback is not None and os.path.basename(fallback) != "inventory_20250103_090000.xlsx"
+        assert len(service.list_catalog(db)) == 2
+        print("✅ Upload catalog OK")
+    finally:
+        db.close()
+        shutil.rmtree(test_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    with temp_database() as url:
+        test_upload_catalog(url)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Test script to verify tiered upload retention archives into the stock history before removing raw files
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+sys.path.append(os.path.join(os.path.dirname(__file__), 'backend'))
+
+from testdb import temp_db, temp_database  # noqa: F401  (temp_db is a pytest fixture)
+import pandas as pd
+from database import get_db
+from file_storage_service import FileStorageService, compute_file_hash
+from key_items_service import KeyItemsService
+from sku_timeseries import SkuTimeSeriesStore
+
+def _workbook(stock):
+    return pd.DataFrame({
+        "Item Product Group Code": ["1015", "1015"],
+        "Item No_": ["A1", "A2"],
+        "Season Code": ["KI00", "KI00"],
+        "Item Description": ["ALVARO - JACKET", "ASHER - COAT"],
+        "Variant Color": ["BLACK", "BROWN"],
+        "Variant Code": ["BLK-M", "BRN-L"],
+        "Selling Price": [100, 200],
+        "100": [stock, 1],
+        "Grand Total": [stock, 1],
+    })
+
+def _upload(service, db, name, days_ago, activate=False):
+    path = os.path.join(service.upload_dir, name)
+    with open(path, 'wb') as f:
+        f.write(os.urandom(64))
+    return service.register_upload(db, path, name, activate=activate,
+                                   upload_date=datetime.utcnow() - timedelta(days=days_ago))
+
+def test_upload_retention(temp_db):
+    """Raw files go only once their snapshot reads back; archived uploads stay listed and readable"""
+    test_dir = tempfile.mkdtemp(prefix="retention_test_")
+    service = FileStorageService(os.path.join(test_dir, "uploads"))
+    store = SkuTimeSeriesStore()
+    db = next(get_db())
+    try:
+        cold = _upload(service, db, "inventory_cold.xlsx", days_ago=120)
+        unparseable = _upload(service, db, "inventory_broken.xlsx", days_ago=110)
+        warm = _upload(service, db, "inventory_warm.xlsx", days_ago=30)
+        hot = _upload(service, db, "inventory_hot.xlsx", days_ago=1, activate=True)
+        db.commit()
+        frames = {cold.file_path: _workbook(7), warm.file_path: _workbook(3)}
+
+        summary = service.cleanup_old_files(db, store, frames.get, hot_days=14, keep_days=90)
+        print(f"Retention: {summary}")
+        assert summary["archived"] == 2 and summary["raw_deleted"] == 1 and summary["errors"] == 1
+
+        # Cold upload: raw file gone, row still listed, snapshot served from the stock history
+        assert not os.path.exists(cold.file_path) and cold.raw_deleted_at is not None and cold.is_present
+        listed = [entry.stored_filename for entry in service.list_catalog(db)]
+        raw = [entry.stored_filename for entry in service.list_catalog(db, raw_only=True)]
+        assert "inventory_cold.xlsx" in listed and "inventory_cold.xlsx" not in raw
+        archived_hash = service.archived_hash(db, cold.file_path)
+        assert archived_hash == cold.content_hash
+        frame = store.snapshot_frame(store.snapshot_id_for_hash(archived_hash))
+        assert frame.set_index("Item Description").loc["ALVARO - JACKET", "Grand Total"] == 7
+        print("✅ Cold upload archived, raw file removed, snapshot readable")
+
+        # Warm upload archived but kept; the unparseable one keeps its raw file and is retried next run
+        assert os.path.exists(warm.file_path) and warm.archived_at is not None and warm.raw_deleted_at is None
+        assert service.archived_hash(db, warm.file_path) is None
+        assert os.path.exists(unparseable.file_path) and unparseable.archived_at is None
+        assert hot.archived_at is None
+
+        # A row marked archived whose snapshot never made it into the store keeps its raw file
+        unparseable.content_hash, unparseable.archived_at = "not-in-the-store", datetime.utcnow()
+        db.commit()
+        summary = service.cleanup_old_files(db, store, frames.get, hot_days=14, keep_days=90)
+        assert summary["raw_deleted"] == 0 and summary["errors"] == 1
+        assert os.path.exists(unparseable.file_path) and unparseable.raw_deleted_at is None
+        print("✅ Raw files without a readable snapshot are kept")
+
+        # Readers fall back to the archived snapshot once the raw file is gone
+        key_items = KeyItemsService()
+        key_items.archive_loader = lambda path: store.snapshot_frame(
+            store.snapshot_id_for_hash(service.archived_hash(db, path)), with_locations=True).copy()
+        df = key_items._load_inventory_file(cold.file_path, use_cache=False)
+        assert df is not None and len(df) == 2 and "100" in df.columns
+
+        # Boot reconcile keeps archived rows listed even though their file is missing
+        service.reconcile_catalog(db)
+        db.refresh(cold)
+        assert cold.is_present and compute_file_hash(warm.file_path) == warm.content_hash
+        print("✅ Archived uploads stay readable after reconcile")
+    finally:
+        db.close()
+        shutil.rmtree(test_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    with temp_database() as url:
+        test_upload_retention(url)
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Test script to verify sell-through velocity / days of cover on a small hand-checked stock history
+"""
+
+import sys
+import os
+import math
+from datetime import datetime, timedelta
+sys.path.append(os.path.join(os.path.dirname(__file__), 'backend'))
+
+from testdb import temp_db, temp_database  # noqa: F401  (temp_db is a pytest fixture)
+import pandas as pd
+from sku_timeseries import SkuTimeSeriesStore
+from velocity_engine import VelocityEngine
+
+START = datetime(2025, 9, 1)
+
+# variant code -> stock in snapshots taken on day 0, 10 and 20 (None = missing from that upload)
+HISTORY = {
+    "990.M": (100, 70, 110),    # restocked between day 10 and day 20
+    "991.M": (50, None, 30),    # missing from the middle upload
+    "992.M": (40, 40, 40),      # not selling
+    "993.M": (10, 5, None),     # dropped from the latest upload
+    "994.M": (20, 10, 0),       # sold out
+}
+
+def _workbook(day_index):
+    rows = [(code, stocks[day_index]) for code, stocks in HISTORY.items() if stocks[day_index] is not None]
+    return pd.DataFrame({
+        "Season Code": ["KI00"] * len(rows),
+        "Item Description": [f"ITEM{code[:3]} - JACKET" for code, _ in rows],
+        "Variant Color": ["BLACK"] * len(rows),
+        "Variant Code": [code for code, _ in rows],
+        "Grand Total": [stock for _, stock in rows],
+    })
+
+def _by_variant(result):
+    return result.set_index("variant_code")
+
+def _isnan(value):
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+def test_velocity_engine(temp_db):
+    """Drawdown ignores restocks, gaps and sold-out SKUs are handled, non-sellers get no cover figure"""
+    store = SkuTimeSeriesStore(size_fn=lambda code: code.split(".")[-1])
+    engine = VelocityEngine(store, window_days=90)
+    store.add_listener(engine.on_snapshot_ingested)
+
+    # A single snapshot: nothing to measure a rate over
+    store.ingest("velocity-0", START, _workbook(0))
+    single = _by_variant(engine.refresh())
+    print(f"Single snapshot:\n{single}")
+    assert len(single) == 5 and set(single["snapshots"]) == {1}
+    assert all(_isnan(v) for v in single["velocity"]) and all(_isnan(v) for v in single["trend_slope"])
+    assert all(_isnan(v) for v in single["days_of_cover"])
+    print("✅ Single snapshot has no velocity or cover")
+
+    store.ingest("velocity-1", START + timedelta(days=10), _workbook(1))
+    store.ingest("velocity-2", START + timedelta(days=20), _workbook(2))
+    result = _by_variant(engine.refresh())
+    print(f"Three snapshots:\n{result}")
+    assert sorted(result.index) == ["990.M", "991.M", "992.M", "994.M"]  # 993.M is gone from the latest upload
+
+    # Restock: only the 100 -> 70 fall counts; 30 over 20 days; slope of (0,100) (10,70) (20,110) is +0.5/day
+    restocked = result.loc["990.M"]
+    assert (restocked["current_stock"], restocked["drawdown"], restocked["snapshots"]) == (110, 30, 3)
+    assert restocked["velocity"] == 1.5 and restocked["days_of_cover"] == 73.3 and restocked["trend_slope"] == 0.5
+
+    # Missing from the middle upload: measured across the gap, 20 over 20 days
+    gap = result.loc["991.M"]
+    assert (gap["drawdown"], gap["snapshots"], gap["velocity"], gap["days_of_cover"], gap["trend_slope"]) == (20, 2, 1.0, 30.0, -1.0)
+    assert gap["first_seen"] == pd.Timestamp(START) and gap["last_seen"] == pd.Timestamp(START + timedelta(days=20))
+
+    # Zero sales: velocity 0, so cover is unbounded and reported as missing
+    idle = result.loc["992.M"]
+    assert (idle["drawdown"], idle["velocity"], idle["trend_slope"]) == (0, 0.0, 0.0)
+    assert _isnan(idle["days_of_cover"])
+
+    # Sold out: no cover left at all
+    sold_out = result.loc["994.M"]
+    assert (sold_out["current_stock"], sold_out["velocity"], sold_out["days_of_cover"]) == (0, 1.0, 0.0)
+    print("✅ Restock, gap, zero sales and sold-out SKUs match the hand-checked figures")
+
+    # Paged output: SKUs without a cover figure sort last, and values are JSON friendly
+    rows, total = engine.page(sort="days_of_cover", order="asc")
+    assert total == 4
+    assert [row["variant_code"] for row in rows] == ["994.M", "991.M", "990.M", "992.M"]
+    assert rows[-1]["days_of_cover"] is None and isinstance(rows[0]["first_seen"], str)
+    print("✅ Paging puts SKUs without cover last")
+
+if __name__ == "__main__":
+    with temp_database() as url:
+        test_velocity_engine(url)
@@ -0,0 +1,50 @@
+"""
+Throwaway database for the test scripts
+`with temp_database():` in a script, or the `temp_db` fixture under pytest
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+# Importing `database` builds the shared engine: keep it off the repo's SQLite files
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='danier_tests_'), 'default.db')}")
+
+@contextmanager
+def temp_database():
+    """Point database.engine / SessionLocal at a fresh SQLite file, restoring the shared ones afterwards.
+
+    Modules that did `from database import engine` are repointed too.
+    """
+    import database
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+
+    test_dir = tempfile.mkdtemp(prefix="danier_test_db_")
+    url = f"sqlite:///{os.path.join(test_dir, 'test.db')}"
+    engine = create_engine(url, connect_args={"check_same_thread": False, "timeout": 30})
+    saved = database.engine, database.SessionLocal
+    importers = [m for m in list(sys.modules.values()) if m is not database and getattr(m, "engine", None) is saved[0]]
+    database.engine = engine
+    for module in importers:
+        module.engine = engine
+    database.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    try:
+        database.init_db()
+        yield url
+    finally:
+        database.engine, database.SessionLocal = saved
+        for module in importers:
+            module.engine = saved[0]
+        engine.dispose()
+        shutil.rmtree(test_dir, ignore_errors=True)
+
+@pytest.fixture
+def temp_db():
+    with temp_database() as url:
+        yield url